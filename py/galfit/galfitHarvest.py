@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Collect the GALFIT results of a whole sample into one table."""
+
+from __future__ import (division, print_function)
+
+import os
+import re
+import fnmatch
+import argparse
+import warnings
+import multiprocessing
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.table import Table
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+    parquetOk = True
+except ImportError:
+    parquetOk = False
+
+SEP = '-' * 100
+
+"""
+galfitParser.GalfitResults() opens the whole output file (image, model and
+residual) and splits the strings of every keyword of every component.
+
+The harvester walks a GALFIT output tree, reads only the header of the
+model HDU of each file (fits.getheader() skips the data), and parses the
+keywords with the compiled regular expressions below.  The files are parsed
+by a pool of processes, and all the components of all the fits end up in
+one table: one row per component, sorted by galaxy, model and component.
+
+The parameter flags follow the GALFIT notation:
+    FLAG_FIXED       : [value], the parameter was not fitted
+    FLAG_CONSTRAINED : {value}, the parameter hit a constraint
+    FLAG_BAD         : *value*, the parameter is problematic
+Like GalfitResults(), the error is NaN for the fixed or constrained
+parameters, and -1 for the problematic ones.
+
+When the fit was run by coaddGalfitRunner, the runtime, the number of
+attempts and the number of iterations are read from the log of the run
+(<readin>.log).
+"""
+MODEL_HDU = 2
+FLAG_FIXED = 1
+FLAG_CONSTRAINED = 2
+FLAG_BAD = 4
+
+COMP_RE = re.compile(r'^COMP_(\d+)$')
+PARAM_RE = re.compile(r'^(\d+)_(\w+)$')
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan|inf',
+                       re.IGNORECASE)
+SECTION_RE = re.compile(r'\d+')
+ITER_RE = re.compile(r'Iteration\s*:\s*(\d+)')
+RUNTIME_RE = re.compile(r'^# GALFIT (\w+) in ([\d.]+) sec, attempt (\d+)',
+                        re.MULTILINE)
+FIT_KEYS = [('CHI2NU', 'chi2nu'), ('CHISQ', 'chisq'), ('NDOF', 'ndof'),
+            ('NFREE', 'nfree')]
+INPUT_KEYS = [('INITFILE', 'initfile'), ('DATAIN', 'datain'),
+              ('LOGFILE', 'logfile')]
+
+
+def parseValue(val):
+    """
+    Parse a 'value +/- error' string of the GALFIT header.
+
+    Return:
+        value, error, flag
+    """
+    numbers = NUMBER_RE.findall(val)
+    if not numbers:
+        return np.nan, np.nan, FLAG_BAD
+    value = float(numbers[0])
+    if '[' in val:
+        return value, np.nan, FLAG_FIXED
+    if '{' in val:
+        return value, np.nan, FLAG_CONSTRAINED
+    if '*' in val:
+        return value, -1.0, FLAG_BAD
+    error = float(numbers[1]) if len(numbers) > 1 else np.nan
+    return value, error, 0
+
+
+def parseHeader(header):
+    """
+    Parse the header of a GALFIT model HDU.
+
+    Return:
+        fit   : dict of the fit-level information
+        comps : list of dict, one for each component
+    """
+    comps = {}
+    params = []
+    for key in header.keys():
+        match = COMP_RE.match(key)
+        if match is not None:
+            comps[int(match.group(1))] = {'comp': int(match.group(1)),
+                                          'type': str(header[key]).strip(),
+                                          'good': True}
+            continue
+        match = PARAM_RE.match(key)
+        if match is not None:
+            params.append((int(match.group(1)), match.group(2).lower(),
+                           header[key]))
+    if not comps:
+        raise Exception("### This is not a GALFIT model header!")
+    for (comp, name, val) in params:
+        if comp not in comps:
+            continue
+        value, error, flag = parseValue(str(val))
+        comps[comp][name] = value
+        comps[comp][name + '_err'] = error
+        comps[comp][name + '_flag'] = flag
+        if flag == FLAG_BAD:
+            comps[comp]['good'] = False
+
+    fit = {}
+    for key, name in FIT_KEYS:
+        fit[name] = float(header[key]) if key in header else np.nan
+    for key, name in INPUT_KEYS:
+        fit[name] = str(header[key]).strip() if key in header else ''
+    fit['flags'] = str(header['FLAGS']).strip() if 'FLAGS' in header else ''
+    box = SECTION_RE.findall(str(header.get('FITSECT', '')))
+    box = [int(b) for b in box] if len(box) == 4 else [-1, -1, -1, -1]
+    fit['box_x0'], fit['box_x1'], fit['box_y0'], fit['box_y1'] = box
+    conv = SECTION_RE.findall(str(header.get('CONVBOX', '')))
+    conv = [int(c) for c in conv] if len(conv) == 2 else [-1, -1]
+    fit['convbox_x'], fit['convbox_y'] = conv
+    fit['ncomp'] = len(comps)
+
+    return fit, [comps[comp] for comp in sorted(comps)]
+
+
+def parseRunLog(logFile):
+    """
+    Timing of a run of coaddGalfitRunner, from the log of the run.
+
+    Return:
+        status, runtime, attempts, number of iterations
+    """
+    status, runtime, attempts, nIter = '', np.nan, 0, -1
+    if (logFile is None) or (not os.path.isfile(logFile)):
+        return status, runtime, attempts, nIter
+    with open(logFile, 'r') as logIn:
+        text = logIn.read()
+    runs = RUNTIME_RE.findall(text)
+    if runs:
+        status = runs[-1][0]
+        runtime = float(runs[-1][1])
+        attempts = int(runs[-1][2])
+    iters = ITER_RE.findall(text)
+    if iters:
+        nIter = int(iters[-1])
+
+    return status, runtime, attempts, nIter
+
+
+def modelName(fileName):
+    """Name of the model: the part after _full_, or the file name."""
+    base = os.path.splitext(os.path.basename(fileName))[0]
+    if '_full_' in base:
+        return base.split('_full_')[-1]
+    return base
+
+
+def harvestFile(task):
+    """
+    Parse one GALFIT output file.
+
+    Return:
+        list of rows, one for each component; empty when the file is not
+        a GALFIT model
+    """
+    root, fitsFile = task
+    try:
+        header = fits.getheader(fitsFile, ext=MODEL_HDU)
+        fit, comps = parseHeader(header)
+    except Exception:
+        return []
+
+    relPath = os.path.relpath(fitsFile, root)
+    segs = relPath.split(os.sep)
+    fit['galaxy'] = segs[0] if len(segs) > 1 else ''
+    fit['filter'] = segs[1] if len(segs) > 2 else ''
+    fit['model'] = modelName(fitsFile)
+    fit['file'] = relPath
+    if fit['initfile']:
+        runLog = os.path.join(os.path.dirname(fitsFile),
+                              os.path.basename(fit['initfile']) + '.log')
+    else:
+        runLog = None
+    (fit['status'], fit['runtime'], fit['attempts'],
+     fit['niter']) = parseRunLog(runLog)
+
+    rows = []
+    for comp in comps:
+        row = dict(fit)
+        row.update(comp)
+        rows.append(row)
+    return rows
+
+
+def findModels(root, pattern='*.fits'):
+    """All the files under root that match the pattern."""
+    fitsList = []
+    for dirPath, dirNames, fileNames in os.walk(root):
+        dirNames.sort()
+        for fileName in sorted(fnmatch.filter(fileNames, pattern)):
+            fitsList.append(os.path.join(dirPath, fileName))
+    return fitsList
+
+
+def rowsToTable(rows):
+    """Organize the rows into a table; missing parameters are NaN (flag -1)."""
+    first = ['galaxy', 'filter', 'model', 'comp', 'type', 'good', 'chi2nu',
+             'chisq', 'ndof', 'nfree', 'ncomp', 'flags', 'status',
+             'runtime', 'attempts', 'niter', 'box_x0', 'box_x1', 'box_y0',
+             'box_y1', 'convbox_x', 'convbox_y', 'file', 'initfile',
+             'datain', 'logfile']
+    params = sorted(set(key for row in rows for key in row) - set(first))
+    names = first + params
+    columns = []
+    for name in names:
+        if name in first:
+            columns.append([row[name] for row in rows])
+        elif name.endswith('_flag'):
+            columns.append(np.array([row.get(name, -1)
+                                     for row in rows], dtype=np.int16))
+        else:
+            columns.append(np.array([row.get(name, np.nan)
+                                     for row in rows], dtype=np.float64))
+    table = Table(columns, names=names)
+    if len(table) > 0:
+        table.sort(['galaxy', 'model', 'comp'])
+    table.meta['INDEX'] = 'galaxy,model,comp'
+
+    return table
+
+
+def saveHarvest(table, output):
+    """Save the table as FITS, or Parquet when the name ends with .parquet."""
+    outTemp = output + '.%d.part' % os.getpid()
+    if output.endswith('.parquet'):
+        if not parquetOk:
+            raise Exception("### pyarrow is needed for the Parquet output!")
+        arrow = pyarrow.table(dict((name, np.asarray(table[name]))
+                                   for name in table.colnames))
+        pyarrow.parquet.write_table(arrow, outTemp)
+    else:
+        table.write(outTemp, format='fits', overwrite=True)
+    """ Write to a temporary name first, then rename it """
+    os.rename(outTemp, output)
+
+    return output
+
+
+def galfitHarvest(root, output=None, pattern='*.fits', nProc=1,
+                  verbose=False):
+    """
+    Collect the results of all the GALFIT models under a directory.
+
+    Parameters:
+        root    : top of the output tree, <root>/<galaxy>/<filter>/...
+        output  : FITS (or .parquet) file for the table
+        pattern : file name pattern of the GALFIT models
+        nProc   : number of processes that parse the files
+
+    Return:
+        the table, one row for each component of each model
+    """
+    fitsList = findModels(root, pattern=pattern)
+    tasks = [(root, fitsFile) for fitsFile in fitsList]
+    if verbose:
+        print(SEP)
+        print("###    Find %d files under %s" % (len(fitsList), root))
+
+    if (nProc > 1) and (len(tasks) > 1):
+        pool = multiprocessing.Pool(processes=nProc)
+        try:
+            chunk = max(len(tasks) // (nProc * 4), 1)
+            results = pool.map(harvestFile, tasks, chunksize=chunk)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [harvestFile(task) for task in tasks]
+
+    rows = [row for result in results for row in result]
+    nModel = sum(1 for result in results if result)
+    if not rows:
+        warnings.warn("### Can not find any GALFIT model under %s" % root)
+    table = rowsToTable(rows)
+
+    if output is not None:
+        saveHarvest(table, output)
+    if verbose:
+        print("###    %d GALFIT models, %d components" % (nModel, len(rows)))
+        if output is not None:
+            print("###    Saved to %s" % output)
+        print(SEP)
+
+    return table
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root", help="Top directory of the GALFIT outputs")
+    parser.add_argument("output", help="Output table (.fits or .parquet)")
+    parser.add_argument('-p', '--pattern', dest='pattern',
+                        help='File name pattern of the GALFIT models',
+                        default='*.fits')
+    parser.add_argument('-j', '--njobs', dest='njobs', type=int,
+                        help='Number of processes', default=1)
+    parser.add_argument('-v', '--verbose', dest='verbose',
+                        action="store_true", default=False)
+
+    args = parser.parse_args()
+
+    galfitHarvest(args.root, output=args.output, pattern=args.pattern,
+                  nProc=args.njobs, verbose=args.verbose)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Render GALFIT models in Python."""
+
+from __future__ import (division, print_function)
+
+import os
+import argparse
+
+import numpy as np
+
+from astropy.io import fits
+from scipy.special import gamma, gammaincinv
+from scipy.fftpack import next_fast_len
+
+import galfitHarvest as gHar
+
+SEP = '-' * 100
+
+"""
+The images of the components, the model and the residual only depend on
+the analytic profiles and the PSF, so there is no need to run GALFIT -o3
+(and to read its subcomps.fits) to get them.
+
+The conventions follow GALFIT:
+    * (xc, yc) are 1-indexed pixel coordinates of the whole input image;
+      the model covers the fitting region, which starts at (x0, y0);
+    * PA is the angle of the major axis, from +Y towards -X (Up=0,
+      Left=90); AR is the axis ratio b/a;
+    * the total flux is EXPTIME * 10 ** (-0.4 * (mag - zp));
+    * 'expdisk' uses the scale length rs (Re = 1.678 rs) and 'devauc' is
+      a Sersic profile with n=4;
+    * the sky is sky + dsdx * (x - xcen) + dsdy * (y - ycen), where
+      (xcen, ycen) is the center of the fitting region.
+
+The profiles are integrated over the pixels: every pixel within overRad
+pixels of the center is divided into overSample x overSample sub-pixels.
+Every component is then convolved with the PSF through a real FFT,
+padded to a fast size.  The components are rendered on a region that
+is larger by half of the PSF, so the light just outside the fitting
+region is also spread into it.  The sky is not convolved.
+"""
+PROFILE_TYPES = ['sersic', 'devauc', 'expdisk']
+RE_RS = 1.678
+
+
+def sersicBn(nser):
+    """The b_n of a Sersic profile, from the incomplete gamma function."""
+    return gammaincinv(2.0 * nser, 0.5)
+
+
+def totalFlux(mag, zp=27.0, exptime=1.0):
+    """Total flux of a component from its magnitude."""
+    return exptime * 10.0 ** (-0.4 * (mag - zp))
+
+
+def sersicIe(flux, re, nser, ar):
+    """Surface brightness at Re of a Sersic profile with a total flux."""
+    bn = sersicBn(nser)
+    norm = (2.0 * np.pi * re ** 2 * ar * nser * np.exp(bn) *
+            gamma(2.0 * nser) / bn ** (2.0 * nser))
+    return flux / norm
+
+
+def ellipRadius(xx, yy, xc, yc, ar, pa):
+    """Elliptical radius of the pixels, with the GALFIT definition of PA."""
+    theta = np.deg2rad(pa)
+    dx, dy = xx - xc, yy - yc
+    major = -dx * np.sin(theta) + dy * np.cos(theta)
+    minor = dx * np.cos(theta) + dy * np.sin(theta)
+    return np.sqrt(major ** 2 + (minor / ar) ** 2)
+
+
+def sersicProfile(rr, ie, re, nser):
+    """Surface brightness of a Sersic profile."""
+    bn = sersicBn(nser)
+    return ie * np.exp(-bn * ((rr / re) ** (1.0 / nser) - 1.0))
+
+
+def _param(comp, key, default=np.nan):
+    """Parameter of a GalfitComponent, or of a galfitHarvest dict."""
+    if isinstance(comp, dict):
+        return comp.get(key, default)
+    return getattr(comp, key, default)
+
+
+def componentType(comp):
+    """Type of a component."""
+    if isinstance(comp, dict):
+        return comp['type']
+    return comp.component_type
+
+
+def sersicParams(comp, zp=27.0, exptime=1.0):
+    """
+    Sersic parameters of a sersic/devauc/expdisk component.
+
+    Return:
+        xc, yc, flux, re, nser, ar, pa
+    """
+    compType = componentType(comp)
+    if compType == 'expdisk':
+        re = _param(comp, 'rs') * RE_RS
+        nser = 1.0
+    elif compType == 'devauc':
+        re = _param(comp, 're')
+        nser = 4.0
+    else:
+        re = _param(comp, 're')
+        nser = _param(comp, 'n')
+    return (_param(comp, 'xc'), _param(comp, 'yc'),
+            totalFlux(_param(comp, 'mag'), zp=zp, exptime=exptime),
+            re, nser, _param(comp, 'ar', 1.0), _param(comp, 'pa', 0.0))
+
+
+def renderSersic(shape, xc, yc, flux, re, nser, ar=1.0, pa=0.0,
+                 x0=1, y0=1, overSample=10, overRad=None):
+    """
+    Image of a Sersic profile, integrated over the pixels.
+
+    Parameters:
+        shape      : (ny, nx) of the image
+        x0, y0     : 1-indexed pixel of the first pixel of the image
+        overSample : number of sub-pixels along each axis near the center
+        overRad    : size of the over-sampled region, in pixel; the
+                     default is max(3, Re/2)
+    """
+    ny, nx = shape
+    ie = sersicIe(flux, re, nser, ar)
+    yy, xx = np.mgrid[y0:(y0 + ny), x0:(x0 + nx)].astype(np.float64)
+    model = sersicProfile(ellipRadius(xx, yy, xc, yc, ar, pa), ie, re, nser)
+
+    """ Over-sample the pixels near the center """
+    if overSample > 1:
+        if overRad is None:
+            overRad = max(3.0, re / 2.0)
+        ix0 = max(int(np.floor(xc - overRad)) - x0, 0)
+        ix1 = min(int(np.ceil(xc + overRad)) - x0 + 1, nx)
+        iy0 = max(int(np.floor(yc - overRad)) - y0, 0)
+        iy1 = min(int(np.ceil(yc + overRad)) - y0 + 1, ny)
+        if (ix1 > ix0) and (iy1 > iy0):
+            step = (np.arange(overSample) + 0.5) / overSample - 0.5
+            subY = (np.arange(iy0, iy1)[:, None] + y0 +
+                    step[None, :]).ravel()
+            subX = (np.arange(ix0, ix1)[:, None] + x0 +
+                    step[None, :]).ravel()
+            subYY, subXX = np.meshgrid(subY, subX, indexing='ij')
+            sub = sersicProfile(ellipRadius(subXX, subYY, xc, yc, ar, pa),
+                                ie, re, nser)
+            sub = sub.reshape(iy1 - iy0, overSample, ix1 - ix0, overSample)
+            model[iy0:iy1, ix0:ix1] = sub.mean(axis=(1, 3))
+
+    return model
+
+
+def renderPoint(shape, xc, yc, flux, x0=1, y0=1):
+    """A point source, shared by the four nearest pixels."""
+    ny, nx = shape
+    model = np.zeros(shape, dtype=np.float64)
+    fx, fy = xc - x0, yc - y0
+    ix, iy = int(np.floor(fx)), int(np.floor(fy))
+    wx, wy = fx - ix, fy - iy
+    for (jy, jx, weight) in ((iy, ix, (1 - wx) * (1 - wy)),
+                             (iy, ix + 1, wx * (1 - wy)),
+                             (iy + 1, ix, (1 - wx) * wy),
+                             (iy + 1, ix + 1, wx * wy)):
+        if (0 <= jy < ny) and (0 <= jx < nx):
+            model[jy, jx] += flux * weight
+    return model
+
+
+def renderSky(shape, comp, x0=1, y0=1):
+    """The sky component, with its gradients."""
+    ny, nx = shape
+    yy, xx = np.mgrid[y0:(y0 + ny), x0:(x0 + nx)].astype(np.float64)
+    xcen, ycen = x0 + (nx - 1) / 2.0, y0 + (ny - 1) / 2.0
+    dsdx = _param(comp, 'dsdx', 0.0)
+    dsdy = _param(comp, 'dsdy', 0.0)
+    return (_param(comp, 'sky', 0.0) + dsdx * (xx - xcen) +
+            dsdy * (yy - ycen))
+
+
+def convolvePsf(image, psf):
+    """
+    Convolve an image with the PSF through FFT.
+
+    The PSF is normalized, and its center is the pixel (ny // 2, nx // 2),
+    the same as GALFIT.
+    """
+    psf = np.asarray(psf, dtype=np.float64)
+    psf = psf / np.sum(psf)
+    ny, nx = image.shape
+    py, px = psf.shape
+    fy, fx = next_fast_len(ny + py), next_fast_len(nx + px)
+    conv = np.fft.irfft2(np.fft.rfft2(image, (fy, fx)) *
+                         np.fft.rfft2(psf, (fy, fx)), (fy, fx))
+    cy, cx = py // 2, px // 2
+    return conv[cy:(cy + ny), cx:(cx + nx)]
+
+
+def renderComponent(comp, shape, x0=1, y0=1, zp=27.0, exptime=1.0,
+                    overSample=10, overRad=None):
+    """
+    Image of one component before the PSF convolution.
+
+    Return:
+        image, and whether it should be convolved
+    """
+    compType = componentType(comp)
+    if compType == 'sky':
+        return renderSky(shape, comp, x0=x0, y0=y0), False
+    if compType == 'psf':
+        flux = totalFlux(_param(comp, 'mag'), zp=zp, exptime=exptime)
+        return renderPoint(shape, _param(comp, 'xc'), _param(comp, 'yc'),
+                           flux, x0=x0, y0=y0), True
+    if compType not in PROFILE_TYPES:
+        raise Exception("### Can not render the %s component!" % compType)
+    xc, yc, flux, re, nser, ar, pa = sersicParams(comp, zp=zp,
+                                                  exptime=exptime)
+    return renderSersic(shape, xc, yc, flux, re, nser, ar=ar, pa=pa,
+                        x0=x0, y0=y0, overSample=overSample,
+                        overRad=overRad), True
+
+
+def renderModel(comps, shape, psf=None, x0=1, y0=1, zp=27.0, exptime=1.0,
+                overSample=10, overRad=None):
+    """
+    Model image and the image of each component.
+
+    Parameters:
+        comps  : list of GalfitComponent, or of galfitHarvest dicts
+        shape  : (ny, nx) of the fitting region
+        psf    : PSF array; no convolution if None
+        x0, y0 : 1-indexed pixel of the first pixel of the fitting region
+
+    Return:
+        model, list of the component images
+    """
+    """ The light just outside the region is also spread into it """
+    ny, nx = shape
+    padY, padX = (0, 0) if psf is None else (np.shape(psf)[0] // 2,
+                                             np.shape(psf)[1] // 2)
+    subComps = []
+    for comp in comps:
+        image, convolve = renderComponent(comp, (ny + 2 * padY,
+                                                 nx + 2 * padX),
+                                          x0=(x0 - padX), y0=(y0 - padY),
+                                          zp=zp, exptime=exptime,
+                                          overSample=overSample,
+                                          overRad=overRad)
+        if convolve and (psf is not None):
+            image = convolvePsf(image, psf)
+        subComps.append(image[padY:(padY + ny), padX:(padX + nx)])
+    model = np.sum(subComps, axis=0) if subComps else np.zeros(shape)
+
+    return model, subComps
+
+
+def galfitOutModel(outFile, psf=None, root=None, overSample=10,
+                   overRad=None):
+    """
+    Render the model of a GALFIT output file from its header.
+
+    Parameters:
+        psf  : PSF array or file; the PSF in the header by default
+        root : directory of the files in the header
+
+    Return:
+        model, component images, residual, header of the model HDU
+    """
+    with fits.open(outFile) as hduList:
+        header = hduList[gHar.MODEL_HDU].header
+        imgOri = hduList[1].data.astype(np.float64)
+    fit, comps = gHar.parseHeader(header)
+    if root is None:
+        root = os.path.dirname(outFile)
+    if psf is None:
+        """ The PSF is relative to the working directory of GALFIT """
+        psfName = str(header.get('PSF', 'none')).strip()
+        for psfFile in [psfName, os.path.join(root, psfName)]:
+            if (psfName.lower() not in ['', 'none'] and
+                    os.path.isfile(psfFile)):
+                psf = psfFile
+                break
+    if (psf is not None) and (not isinstance(psf, np.ndarray)):
+        psf = fits.open(psf)[0].data
+    zp = float(header.get('MAGZPT', 27.0))
+    exptime = float(header.get('EXPTIME', 1.0))
+    x0 = fit['box_x0'] if fit['box_x0'] > 0 else 1
+    y0 = fit['box_y0'] if fit['box_y0'] > 0 else 1
+
+    model, subComps = renderModel(comps, imgOri.shape, psf=psf, x0=x0,
+                                  y0=y0, zp=zp, exptime=exptime,
+                                  overSample=overSample, overRad=overRad)
+
+    return model, subComps, (imgOri - model), header
+
+
+def saveSubcomps(outFile, subComps, header=None):
+    """Save the component images as <outFile>_comp<N>.fits."""
+    prefix = os.path.splitext(outFile)[0]
+    compFiles = []
+    for ii, image in enumerate(subComps):
+        compFile = prefix + '_comp' + str(ii + 1) + '.fits'
+        fits.PrimaryHDU(image.astype(np.float32),
+                        header=header).writeto(compFile, overwrite=True)
+        compFiles.append(compFile)
+    return compFiles
+
+
+def compareGalfit(outFile, psf=None, overSample=10, verbose=True):
+    """
+    Compare the rendered model with the model made by GALFIT.
+
+    Return:
+        dict with the flux ratio and the relative differences
+    """
+    model, subComps, residual, header = galfitOutModel(outFile, psf=psf,
+                                                       overSample=overSample)
+    galModel = fits.open(outFile)[gHar.MODEL_HDU].data.astype(np.float64)
+    diff = np.abs(model - galModel)
+    peak = np.nanmax(np.abs(galModel))
+    summary = {'fluxRatio': np.sum(model) / np.sum(galModel),
+               'maxDiff': np.nanmax(diff) / peak,
+               'meanDiff': np.nanmean(diff) / peak}
+    if verbose:
+        print(SEP)
+        print("###    %s" % outFile)
+        print("###    Flux ratio : %10.6f" % summary['fluxRatio'])
+        print("###    Max / mean difference : %10.3e %10.3e (of peak)" %
+              (summary['maxDiff'], summary['meanDiff']))
+        print(SEP)
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outFile", help="GALFIT output model")
+    parser.add_argument('--psf', dest='psf', help='PSF image',
+                        default=None)
+    parser.add_argument('--overSample', dest='overSample', type=int,
+                        help='Over-sampling near the center', default=10)
+    parser.add_argument('--compare', dest='compare', action="store_true",
+                        default=False)
+
+    args = parser.parse_args()
+
+    if args.compare:
+        compareGalfit(args.outFile, psf=args.psf,
+                      overSample=args.overSample)
+    else:
+        model, subComps, residual, header = galfitOutModel(
+            args.outFile, psf=args.psf, overSample=args.overSample)
+        saveSubcomps(args.outFile, subComps, header=header)
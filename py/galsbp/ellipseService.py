@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Keep a pool of warm PyRAF workers for the ELLIPSE runs."""
+
+from __future__ import (division, print_function)
+
+import os
+import time
+import shutil
+import tempfile
+import collections
+import multiprocessing
+
+import numpy as np
+
+import galSBP
+import galWorkspace as gWork
+
+SEP = '-' * 100
+
+"""
+Each worker is a long-lived process that loads PyRAF and the STSDAS,
+TABLES and IMAGES packages once, and locks the IRAF executables used by
+galSBP() (x_isophote.e for ellipse, x_ttools.e for tdump, x_images.e for
+imcopy) in the PyRAF process cache.  PyRAF talks to these executables
+through their stdin/stdout pipes, so they stay warm between the jobs.
+
+Every worker has its own uparm directory, so the parameter files of the
+jobs running at the same time never collide.  The jobs are sent to the
+workers through a pipe; a worker that crashes, or a job that runs longer
+than the timeout, is killed and replaced by a new worker.
+
+Start the service before running any IRAF task in the main process, the
+workers are forked and should not inherit a used process cache.
+"""
+WARM_PACKAGES = ['stsdas', 'analysis', 'isophote', 'tables', 'ttools',
+                 'images', 'imutil']
+WARM_TASKS = ['ellipse', 'tdump', 'imcopy']
+PATH_KEYS = ['mask', 'inEllip']
+
+
+def _warmUp(uparmDir):
+    """Load the IRAF packages, and lock the executables in the cache."""
+    if not galSBP.useIraf:
+        return
+    iraf = galSBP.iraf
+    iraf.set(uparm=uparmDir + '/')
+    for package in WARM_PACKAGES:
+        try:
+            getattr(iraf, package)(_doprint=0)
+        except Exception:
+            pass
+    try:
+        iraf.prcache(*WARM_TASKS)
+    except Exception:
+        pass
+
+
+def singleEllipseRun(task):
+    """
+    Run galSBP() in a private temporary directory.
+
+    Return:
+        (name, (ellipOut, outBin), error, runtime, workspace totals)
+    """
+    name, image, kwargs, workDir = task
+    t0 = time.time()
+    before = dict(gWork.TOTALS)
+    oriDir = os.getcwd()
+    tempDir = tempfile.mkdtemp(prefix='ellip_%s_' % name, dir=workDir)
+    try:
+        os.chdir(tempDir)
+        result = galSBP.galSBP(image, **kwargs)
+        error = None if result[0] is not None else 'ELLIPSE RUN FAILED'
+    except Exception as err:
+        result, error = (None, None), str(err)
+    finally:
+        os.chdir(oriDir)
+        shutil.rmtree(tempDir, ignore_errors=True)
+
+    return (name, result, error, (time.time() - t0),
+            gWork.totalsSince(before))
+
+
+def _workerLoop(conn, uparmDir, workDir):
+    """Receive the jobs from the pipe, and send back the results."""
+    os.environ['uparm'] = uparmDir + '/'
+    _warmUp(uparmDir)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        name, image, kwargs = task
+        conn.send(singleEllipseRun((name, image, kwargs, workDir)))
+    conn.close()
+
+
+class EllipseService(object):
+    """
+    A pool of warm PyRAF workers for galSBP().
+
+    Usage:
+        service = EllipseService(nWorker=4).start()
+        service.submit('stage1', image, stage=1, ...)
+        name, result, error, runtime = service.collect()
+        service.close()
+    """
+
+    def __init__(self, nWorker=2, timeout=1800.0, workDir=None,
+                 pollTime=0.05, verbose=False):
+        """
+        Parameters:
+            nWorker  : number of workers
+            timeout  : maximum run time of one job in seconds
+            workDir  : where to put the uparm and temporary directories
+            pollTime : interval to check the workers in seconds
+        """
+        self.nWorker = int(nWorker)
+        if self.nWorker < 1:
+            raise Exception("### Need at least one ellipse worker!")
+        self.timeout = timeout
+        self.pollTime = pollTime
+        self.verbose = verbose
+        self.workDir = workDir
+        self.rootDir = None
+        self.workers = []
+        self.queue = collections.deque()
+        self.nRecycle = 0
+        self.maxQueue = 0
+        """ name, waiting time, run time, status of the finished jobs """
+        self.history = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        """Start the workers."""
+        if self.rootDir is None:
+            self.rootDir = tempfile.mkdtemp(prefix='ellipse_service_',
+                                            dir=self.workDir)
+        while len(self.workers) < self.nWorker:
+            self.workers.append(self._spawn(len(self.workers)))
+        return self
+
+    def _spawn(self, index):
+        uparmDir = os.path.join(self.rootDir, 'uparm_%d' % index)
+        if not os.path.isdir(uparmDir):
+            os.makedirs(uparmDir)
+        parentConn, childConn = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_workerLoop,
+                                       args=(childConn, uparmDir,
+                                             self.rootDir))
+        proc.daemon = True
+        proc.start()
+        childConn.close()
+        return {'index': index, 'proc': proc, 'conn': parentConn,
+                'job': None, 'start': None}
+
+    def _recycle(self, worker):
+        """Kill a worker, and replace it with a new one."""
+        try:
+            worker['proc'].terminate()
+            worker['proc'].join(5.0)
+            worker['conn'].close()
+        except Exception:
+            pass
+        self.nRecycle += 1
+        self.workers[worker['index']] = self._spawn(worker['index'])
+
+    @property
+    def queueDepth(self):
+        """Number of jobs waiting for a worker."""
+        return len(self.queue)
+
+    @property
+    def nRunning(self):
+        """Number of jobs running right now."""
+        return len([w for w in self.workers if w['job'] is not None])
+
+    def submit(self, name, image, **kwargs):
+        """Put one galSBP() job in the queue."""
+        if not self.workers:
+            self.start()
+        for key in PATH_KEYS:
+            if kwargs.get(key) is not None:
+                kwargs[key] = os.path.abspath(kwargs[key])
+        self.queue.append((name, os.path.abspath(image), kwargs,
+                           time.time()))
+        self.maxQueue = max(self.maxQueue, len(self.queue))
+        self._dispatch()
+        return name
+
+    def _dispatch(self):
+        for worker in self.workers:
+            if not self.queue:
+                break
+            if worker['job'] is None:
+                if not worker['proc'].is_alive():
+                    self._recycle(worker)
+                    worker = self.workers[worker['index']]
+                name, image, kwargs, tQueue = self.queue.popleft()
+                worker['conn'].send((name, image, kwargs))
+                worker['job'] = (name, tQueue)
+                worker['start'] = time.time()
+                if self.verbose:
+                    print("###    Ellipse worker %d <- %s  (queue: %d)" %
+                          (worker['index'], name, len(self.queue)))
+
+    def _finish(self, worker, result, error):
+        name, tQueue = worker['job']
+        runtime = time.time() - worker['start']
+        self.history.append((name, worker['start'] - tQueue, runtime,
+                             'DONE' if error is None else 'FAIL'))
+        worker['job'], worker['start'] = None, None
+        return name, result, error, runtime
+
+    def collect(self, block=True):
+        """
+        Return the next finished job.
+
+        Return:
+            (name, (ellipOut, outBin), error, runtime); None when nothing
+            is running, or when nothing is finished and block=False
+        """
+        while True:
+            self._dispatch()
+            if self.nRunning == 0:
+                return None
+            for worker in list(self.workers):
+                if worker['job'] is None:
+                    continue
+                try:
+                    if worker['conn'].poll():
+                        output = worker['conn'].recv()
+                        gWork.addTotals(output[4])
+                        return self._finish(worker, output[1], output[2])
+                except (EOFError, IOError, OSError):
+                    pass
+                if not worker['proc'].is_alive():
+                    output = self._finish(worker, (None, None),
+                                          '### Ellipse worker crashed')
+                    self._recycle(worker)
+                    return output
+                if (time.time() - worker['start']) > self.timeout:
+                    output = self._finish(worker, (None, None),
+                                          '### Ellipse job timed out ' +
+                                          'after %d sec' % self.timeout)
+                    self._recycle(worker)
+                    return output
+            if not block:
+                return None
+            time.sleep(self.pollTime)
+
+    def run(self, jobs):
+        """
+        Run a list of (name, image, kwargs) jobs and wait for all of them.
+
+        Return:
+            results : dict of {name: (ellipOut, outBin)}
+            errors  : dict of {name: error message}
+        """
+        for name, image, kwargs in jobs:
+            self.submit(name, image, **kwargs)
+        results, errors = {}, {}
+        while True:
+            output = self.collect()
+            if output is None:
+                break
+            name, result, error, runtime = output
+            results[name] = result
+            if error is not None:
+                errors[name] = error
+        return results, errors
+
+    def report(self):
+        """Summary of the queue and the latency of the finished jobs."""
+        wait = np.array([h[1] for h in self.history])
+        runtime = np.array([h[2] for h in self.history])
+        summary = {'nJob': len(self.history),
+                   'nFail': len([h for h in self.history if h[3] != 'DONE']),
+                   'nRecycle': self.nRecycle,
+                   'queueDepth': len(self.queue),
+                   'maxQueue': self.maxQueue,
+                   'medWait': np.median(wait) if wait.size else np.nan,
+                   'maxWait': np.max(wait) if wait.size else np.nan,
+                   'medRun': np.median(runtime) if runtime.size else np.nan,
+                   'maxRun': np.max(runtime) if runtime.size else np.nan}
+        if self.verbose:
+            print(SEP)
+            print("###    Ellipse service: %d jobs, %d failed, %d recycled" %
+                  (summary['nJob'], summary['nFail'], summary['nRecycle']))
+            print("###    Queue depth now / max : %d / %d" %
+                  (summary['queueDepth'], summary['maxQueue']))
+            print("###    Waiting time med / max : %8.2f / %8.2f sec" %
+                  (summary['medWait'], summary['maxWait']))
+            print("###    Run time     med / max : %8.2f / %8.2f sec" %
+                  (summary['medRun'], summary['maxRun']))
+            print(SEP)
+        return summary
+
+    def close(self):
+        """Stop the workers, and remove the uparm directories."""
+        for worker in self.workers:
+            try:
+                worker['conn'].send(None)
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker['proc'].join(10.0)
+            if worker['proc'].is_alive():
+                worker['proc'].terminate()
+        self.workers = []
+        if self.rootDir is not None:
+            shutil.rmtree(self.rootDir, ignore_errors=True)
+            self.rootDir = None
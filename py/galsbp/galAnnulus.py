@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Forced photometry in fixed elliptical annuli."""
+
+from __future__ import (division, print_function)
+
+import numpy as np
+
+import hscStats
+import galIsophote as gIso
+
+"""
+In the force photometry mode (stage 4) the geometry of every isophote is
+fixed, so the profile is just the statistics of the pixels in a set of
+concentric elliptical annuli.  The pixels of each annulus are found only
+once, and the statistics of all the annuli in all the bands are measured
+together with hscStats.sigmaClipBatch() and np.bincount().
+
+Each annulus extends half-way to the neighbouring isophotes, with the
+geometry of its own isophote.  The harmonic
+amplitudes are least-squares fits to the pixels of each annulus.  Isophotes
+that cover less than MIN_PIX pixels are measured along the ellipse with
+bi-linear interpolation instead, same as galIsophote.
+
+The output tables have the same columns as galIsophote.ellipseFit().
+"""
+MIN_PIX = 8
+
+GEOM_DTYPE = [('sma', float), ('x0', float), ('y0', float), ('eps', float),
+              ('pa', float)]
+
+
+def isoGeometry(inEllip):
+    """
+    Geometry of the isophotes in the input table, sorted by sma.
+
+    The centers are 0-indexed, and the PA is the angle of the major axis
+    from the X-axis in radians, same as galIsophote.
+    """
+    isoIn = gIso.readIsoTable(inEllip) if isinstance(inEllip, str) \
+        else inEllip
+    sma = np.asarray(isoIn['sma'], dtype=float)
+    order = np.argsort(sma, kind='mergesort')
+    geom = np.zeros(len(sma), dtype=GEOM_DTYPE)
+    geom['sma'] = sma[order]
+    geom['x0'] = np.asarray(isoIn['x0'], dtype=float)[order] - 1.0
+    geom['y0'] = np.asarray(isoIn['y0'], dtype=float)[order] - 1.0
+    geom['eps'] = np.clip(np.asarray(isoIn['ell'], dtype=float)[order],
+                          0.0, gIso.MAX_EPS)
+    geom['pa'] = np.radians(np.asarray(isoIn['pa'], dtype=float)[order] +
+                            90.0)
+    return geom
+
+
+def annulusEdges(sma):
+    """Boundaries of the annuli, half-way between the isophotes."""
+    if len(sma) == 1:
+        return np.array([max(sma[0] - 0.5, 0.0), sma[0] + 0.5])
+    mid = 0.5 * (sma[1:] + sma[:-1])
+    return np.concatenate(([max(2.0 * sma[0] - mid[0], 0.0)], mid,
+                           [2.0 * sma[-1] - mid[-1]]))
+
+
+def _ellipseBox(shape, geo, rMax):
+    """Pixels in the box around an ellipse, as flat index, x and y."""
+    dimY, dimX = shape
+    xMin = max(int(np.floor(geo['x0'] - rMax - 1.0)), 0)
+    xMax = min(int(np.ceil(geo['x0'] + rMax + 1.0)) + 1, dimX)
+    yMin = max(int(np.floor(geo['y0'] - rMax - 1.0)), 0)
+    yMax = min(int(np.ceil(geo['y0'] + rMax + 1.0)) + 1, dimY)
+    if (xMax <= xMin) or (yMax <= yMin):
+        empty = np.zeros(0, dtype=int)
+        return empty, empty.astype(float), empty.astype(float)
+    yy, xx = np.mgrid[yMin:yMax, xMin:xMax]
+    xx, yy = xx.ravel(), yy.ravel()
+    return (yy * dimX + xx), xx.astype(float), yy.astype(float)
+
+
+def _ellipseCoord(geo, xx, yy):
+    """Elliptical radius and eccentric anomaly in the given geometry."""
+    dx, dy = xx - geo['x0'], yy - geo['y0']
+    cosP, sinP = np.cos(geo['pa']), np.sin(geo['pa'])
+    xr = dx * cosP + dy * sinP
+    yr = (-dx * sinP + dy * cosP) / (1.0 - geo['eps'])
+    return np.hypot(xr, yr), np.arctan2(yr, xr)
+
+
+def annulusPixels(shape, geom, edges):
+    """
+    Pixels of every annulus.
+
+    Annulus i is the area between the ellipses of semi-major axis
+    edges[i] and edges[i + 1], both with the geometry of isophote i.
+    Same as the sectors of ELLIPSE, a pixel is used by two annuli when the
+    geometry changes between them (PA twist, moving center), and by none
+    in the gaps.
+
+    Return:
+        pix : record array with the flat index, annulus and eccentric
+              anomaly of every (pixel, annulus) pair
+    """
+    pixList = []
+    for ii, geo in enumerate(geom):
+        index, xx, yy = _ellipseBox(shape, geo, edges[ii + 1])
+        rEll, angle = _ellipseCoord(geo, xx, yy)
+        inRing = (rEll >= edges[ii]) & (rEll < edges[ii + 1])
+        pixRing = np.zeros(np.sum(inRing), dtype=[('index', int),
+                                                  ('label', int),
+                                                  ('angle', float)])
+        pixRing['index'] = index[inRing]
+        pixRing['label'] = ii
+        pixRing['angle'] = angle[inRing]
+        pixList.append(pixRing)
+    return np.concatenate(pixList)
+
+
+def ellipseFlux(images, geom):
+    """
+    Total flux and number of pixels inside the ellipse and the circle of
+    every isophote, same as galIsophote.isoTotalFlux().
+
+    Return:
+        tfluxE, tfluxC : (nBand, nIso) arrays of the total flux
+        npixE, npixC   : (nBand, nIso) arrays of the number of pixels
+    """
+    shape = images[0][0].shape
+    nBand, nIso = len(images), len(geom)
+    tfluxE, tfluxC = np.zeros((nBand, nIso)), np.zeros((nBand, nIso))
+    npixE = np.zeros((nBand, nIso), dtype=int)
+    npixC = np.zeros((nBand, nIso), dtype=int)
+    for ii, geo in enumerate(geom):
+        index, xx, yy = _ellipseBox(shape, geo, geo['sma'])
+        rEll, _ = _ellipseCoord(geo, xx, yy)
+        inEll = rEll <= geo['sma']
+        inCir = np.hypot(xx - geo['x0'], yy - geo['y0']) <= geo['sma']
+        for jj, (img, valid) in enumerate(images):
+            use = valid.ravel()[index]
+            pixVal = np.where(use, img.ravel()[index], 0.0)
+            tfluxE[jj, ii] = np.sum(pixVal[inEll])
+            tfluxC[jj, ii] = np.sum(pixVal[inCir])
+            npixE[jj, ii] = np.sum(use & inEll)
+            npixC[jj, ii] = np.sum(use & inCir)
+    return tfluxE, tfluxC, npixE, npixC
+
+
+def _groupSum(label, weight, nLabel):
+    return np.bincount(label, weights=weight, minlength=nLabel)
+
+
+def harmonicFit(label, angle, value, order, nLabel, variance):
+    """
+    Least-squares fit of y0 + A sin(nE) + B cos(nE) in every group.
+
+    Return:
+        coeff : (nLabel, 3) array of [y0, A, B]; NaN for bad groups
+        error : (nLabel, 3) array of the 1-sigma errors
+    """
+    sinE, cosE = np.sin(order * angle), np.cos(order * angle)
+    basis = [np.ones_like(angle), sinE, cosE]
+    normal = np.zeros((nLabel, 3, 3))
+    right = np.zeros((nLabel, 3))
+    for ii in range(3):
+        right[:, ii] = _groupSum(label, value * basis[ii], nLabel)
+        for jj in range(ii, 3):
+            normal[:, ii, jj] = _groupSum(label, basis[ii] * basis[jj],
+                                          nLabel)
+            normal[:, jj, ii] = normal[:, ii, jj]
+
+    coeff = np.full((nLabel, 3), np.nan)
+    error = np.full((nLabel, 3), np.nan)
+    use = normal[:, 0, 0] >= MIN_PIX
+    if np.any(use):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            det = np.linalg.det(normal[use])
+            good = np.nonzero(use)[0][np.abs(det) > 1.0E-8]
+        if len(good) > 0:
+            covar = np.linalg.inv(normal[good])
+            coeff[good] = np.einsum('kij,kj->ki', covar, right[good])
+            error[good] = np.sqrt(np.diagonal(covar, axis1=1, axis2=2) *
+                                  variance[good, None])
+    return coeff, error
+
+
+def _smallIsophote(img, valid, geo, sma, par, step):
+    """Measure a small isophote along the ellipse, as galIsophote does."""
+    parSmall = dict(par)
+    parSmall['intMode'], parSmall['linear'] = 'bi-linear', False
+    parSmall['step'] = step
+    geomTuple = (geo['x0'], geo['y0'], geo['eps'], geo['pa'])
+    return gIso.isoMeasure(img, valid, geomTuple, sma, parSmall)
+
+
+def annulusProfileBands(imgList, ellipConfig, inEllip, mskList=None):
+    """
+    Forced photometry of many images with the same isophotes.
+
+    Parameters:
+        imgList     : list of 2-D images with the same shape
+        ellipConfig : configuration from galSBP.defaultEllipse(); the
+                      integration mode, clipping, harmonics and mag0 are
+                      used
+        inEllip     : table of isophotes (or the name of a FITS table)
+        mskList     : None, one mask for all the images, or one mask for
+                      each image; pixels with mask > 0 are not used
+
+    Return:
+        isoList     : list of astropy Tables, one for each image
+    """
+    par = gIso.ellipseConfigPar(ellipConfig)
+    geomAll = isoGeometry(inEllip)
+    geomCen = geomAll[geomAll['sma'] <= 0.0]
+    geom = geomAll[geomAll['sma'] > 0.0]
+    if len(geom) == 0:
+        raise Exception("### No useful isophote in the input table !")
+
+    nBand = len(imgList)
+    if (mskList is None) or (np.ndim(mskList) == 2):
+        mskList = [mskList] * nBand
+    if len(mskList) != nBand:
+        raise Exception("### Need one mask for each image !")
+    images = [gIso.prepareImage(img, msk)
+              for (img, msk) in zip(imgList, mskList)]
+    shape = images[0][0].shape
+    if any(img.shape != shape for (img, _) in images):
+        raise Exception("### All the images should have the same shape !")
+
+    """ Find the pixels of each annulus only once """
+    sma, nIso = geom['sma'], len(geom)
+    edges = annulusEdges(sma)
+    pix = annulusPixels(shape, geom, edges)
+    index, label, angle = pix['index'], pix['label'], pix['angle']
+    nAll = np.bincount(label, minlength=nIso)
+
+    """ Sigma-clipped statistics of all annuli in all bands at once """
+    values = np.concatenate([img.ravel()[index] for (img, _) in images])
+    good = np.concatenate([valid.ravel()[index] for (_, valid) in images])
+    labels = np.concatenate([label + ii * nIso for ii in range(nBand)])
+    labels = np.where(good, labels, -1)
+    nLabel = nIso * nBand
+    stats = hscStats.sigmaClipBatch(values, labels, nLabel=nLabel,
+                                    low=par['lsclip'], upp=par['usclip'],
+                                    maxIter=par['nclip'])
+    if par['nclip'] > 0:
+        kept = (good & (values >= stats['low'][labels]) &
+                (values <= stats['upp'][labels]))
+    else:
+        kept = good
+    keptLab = labels[kept]
+    keptVal = values[kept]
+    keptAng = np.tile(angle, nBand)[kept]
+
+    nUse = stats['nUse']
+    if par['intMode'] == 'median':
+        intens = stats['median']
+    else:
+        intens = stats['mean']
+    rms = stats['std']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        intErr = rms / np.sqrt(nUse)
+
+    """ Gradient from the neighbouring isophotes """
+    intens2 = intens.reshape(nBand, nIso)
+    intErr2 = intErr.reshape(nBand, nIso)
+    if nIso > 1:
+        iOut = np.append(np.arange(1, nIso), nIso - 2)
+        iIn = np.append(np.arange(0, nIso - 1), nIso - 1)
+        dSma = sma[iOut] - sma[iIn]
+        grad = (intens2[:, iOut] - intens2[:, iIn]) / dSma
+        gradErr = np.sqrt(intErr2[:, iOut] ** 2.0 +
+                          intErr2[:, iIn] ** 2.0) / np.abs(dSma)
+    else:
+        grad = np.full((nBand, nIso), np.nan)
+        gradErr = np.full((nBand, nIso), np.nan)
+    grad, gradErr = grad.ravel(), gradErr.ravel()
+
+    """ Harmonic amplitudes, normalized the same way as ELLIPSE """
+    smaAll = np.tile(sma, nBand)
+    epsAll = np.tile(geom['eps'], nBand)
+    paAll = np.tile(geom['pa'], nBand)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        norm = smaAll * np.abs(grad)
+        gradTerm = (gradErr / grad) ** 2.0
+    harm = {}
+    for order in (1, 2, 3, 4):
+        coeff, error = harmonicFit(keptLab, keptAng, keptVal, order, nLabel,
+                                   rms ** 2.0)
+        harm[order] = (coeff, error)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            harm['a%d' % order] = coeff[:, 1] / norm
+            harm['b%d' % order] = coeff[:, 2] / norm
+            harm['a%d_err' % order] = np.sqrt(
+                (error[:, 1] / norm) ** 2.0 +
+                (coeff[:, 1] / norm) ** 2.0 * gradTerm)
+            harm['b%d_err' % order] = np.sqrt(
+                (error[:, 2] / norm) ** 2.0 +
+                (coeff[:, 2] / norm) ** 2.0 * gradTerm)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ea = np.abs(harm[1][1][:, 1] / grad)
+        eb = np.abs(harm[1][1][:, 2] * (1.0 - epsAll) / grad)
+        x0Err = np.sqrt((ea * np.cos(paAll)) ** 2.0 +
+                        (eb * np.sin(paAll)) ** 2.0)
+        y0Err = np.sqrt((ea * np.sin(paAll)) ** 2.0 +
+                        (eb * np.cos(paAll)) ** 2.0)
+        ellErr = np.abs(2.0 * harm[2][1][:, 2] * (1.0 - epsAll) / smaAll /
+                        grad)
+        paErr = np.where(epsAll > 1.0E-6, np.degrees(np.abs(
+            2.0 * harm[2][1][:, 1] * (1.0 - epsAll) / smaAll / grad /
+            ((1.0 - epsAll) ** 2.0 - 1.0))), 0.0)
+
+    """ Total flux inside each ellipse and circle """
+    tfluxE, tfluxC, npixE, npixC = ellipseFlux(images, geom)
+
+    """ Relative step of the isophotes for the small ones """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stepRel = np.append(sma[1:] / sma[:-1] - 1.0, par['step']) \
+            if nIso > 1 else np.array([par['step']])
+    stepRel = np.where(np.isfinite(stepRel) & (stepRel > 0), stepRel,
+                       par['step'])
+
+    isoList = []
+    for ii, (img, valid) in enumerate(images):
+        sl = slice(ii * nIso, (ii + 1) * nIso)
+
+        cols = {'sma': sma, 'rsma': sma ** 0.25,
+                'intens': intens[sl], 'int_err': intErr[sl],
+                'rms': rms[sl], 'pix_var': rms[sl],
+                'ell': geom['eps'], 'ell_err': ellErr[sl],
+                'pa': np.array([gIso.normPA(pa) for pa in
+                                np.degrees(geom['pa']) - 90.0]),
+                'pa_err': paErr[sl],
+                'x0': geom['x0'] + 1.0, 'x0_err': x0Err[sl],
+                'y0': geom['y0'] + 1.0, 'y0_err': y0Err[sl],
+                'grad': grad[sl], 'grad_err': gradErr[sl],
+                'tflux_e': tfluxE[ii], 'tflux_c': tfluxC[ii],
+                'npix_e': npixE[ii], 'npix_c': npixC[ii],
+                'ndata': nUse[sl], 'nflag': nAll - nUse[sl],
+                'niter': np.zeros(nIso, dtype=int),
+                'stop': np.zeros(nIso, dtype=int),
+                'a_big': np.full(nIso, np.nan),
+                'sarea': np.ones(nIso)}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cols['grad_r_err'] = np.abs(gradErr[sl] / grad[sl])
+        for order in (1, 2, 3, 4):
+            for key in ('a%d', 'a%d_err', 'b%d', 'b%d_err'):
+                cols[key % order] = harm[key % order][sl]
+        for col in gIso.ISO_COLUMNS + gIso.HARM_COLUMNS:
+            if col not in cols:
+                cols[col] = np.full(nIso, np.nan)
+
+        rows = []
+        for jj in range(nIso):
+            row = dict((col, cols[col][jj]) for col in cols)
+            if nUse[sl][jj] < MIN_PIX:
+                small = _smallIsophote(img, valid, geom[jj], sma[jj], par,
+                                       stepRel[jj])
+                for col in ('tflux_e', 'tflux_c', 'npix_e', 'npix_c'):
+                    small[col] = row[col]
+                row = small
+            rows.append(row)
+        for geo in geomCen:
+            rows.append(gIso.centralRow(img, valid, (geo['x0'], geo['y0'],
+                                                     geo['eps'],
+                                                     geo['pa'])))
+
+        isoTab = gIso.isoTableFromRows(rows, harmonics=par['harmonics'])
+        isoList.append(gIso.isoMagnitudes(isoTab, par['mag0']))
+
+    return isoList
+
+
+def annulusProfile(imgArr, ellipConfig, inEllip, mskArr=None):
+    """Forced photometry of one image, see annulusProfileBands()."""
+    return annulusProfileBands([imgArr], ellipConfig, inEllip,
+                               mskList=[mskArr])[0]
@@ -0,0 +1,721 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""In-process isophote fitting engine for galSBP."""
+
+from __future__ import (division, print_function)
+
+import os
+import warnings
+
+import numpy as np
+
+# Astropy related
+from astropy.io import fits
+from astropy.table import Table
+
+import stsdasTable as stsTab
+
+"""
+Same algorithm as the STSDAS.ANALYSIS.ISOPHOTE.ELLIPSE task (Jedrzejewski
+1987): the intensity along each trial ellipse is fitted with the first
+and second harmonics, and the largest amplitude is used to correct the
+center, the position angle or the ellipticity until it converges.
+
+The parameters are taken from the configuration of defaultEllipse(), and
+the output columns are the same as the table that readEllipseOut() builds
+from the tdump output of ELLIPSE (before the derived columns), in the
+same units: 1-indexed pixel coordinates, PA in degrees measured from the
+Y-axis, and magnitudes with mag0.
+
+Not implemented: the object locator (olthresh) is not used to recenter
+the first isophote, and the 'wander' limit is ignored (INDEF in galSBP).
+"""
+ISO_COLUMNS = ['sma', 'intens', 'int_err', 'pix_var', 'rms',
+               'ell', 'ell_err', 'pa', 'pa_err',
+               'x0', 'x0_err', 'y0', 'y0_err',
+               'grad', 'grad_err', 'grad_r_err', 'rsma',
+               'mag', 'mag_lerr', 'mag_uerr',
+               'tflux_e', 'tflux_c', 'tmag_e', 'tmag_c',
+               'npix_e', 'npix_c',
+               'a3', 'a3_err', 'b3', 'b3_err',
+               'a4', 'a4_err', 'b4', 'b4_err',
+               'ndata', 'nflag', 'niter', 'stop', 'a_big', 'sarea']
+HARM_COLUMNS = ['a1', 'a1_err', 'b1', 'b1_err',
+                'a2', 'a2_err', 'b2', 'b2_err']
+
+MIN_EPS = 0.05
+MAX_EPS = 0.95
+MAXGERR = 0.5
+MIN_SAMPLE = 16
+SKY_RINGS = 8
+
+
+def _cfgValue(cfg, key):
+    """Read one item from the defaultEllipse() configuration."""
+    value = np.asarray(cfg[key]).ravel()[0]
+    if isinstance(value, bytes):
+        value = value.decode()
+    return value
+
+
+def prepareImage(imgArr, mskArr=None):
+    """
+    Image with the bad pixels set to zero, and the map of useful pixels.
+    """
+    img = np.asarray(imgArr, dtype=float)
+    valid = np.isfinite(img)
+    if mskArr is not None:
+        valid &= ~(np.asarray(mskArr) > 0)
+    return np.where(valid, img, 0.0), valid
+
+
+def ellipseXY(x0, y0, sma, eps, pa, angle):
+    """Pixel positions on an ellipse at the eccentric anomaly angles."""
+    cosE, sinE = np.cos(angle), np.sin(angle)
+    cosP, sinP = np.cos(pa), np.sin(pa)
+    smb = sma * (1.0 - eps)
+    xx = x0 + sma * cosE * cosP - smb * sinE * sinP
+    yy = y0 + sma * cosE * sinP + smb * sinE * cosP
+    return xx, yy
+
+
+def sampleBilinear(img, valid, xx, yy):
+    """
+    Bi-linear interpolation; samples next to a bad pixel are flagged.
+    """
+    dimY, dimX = img.shape
+    ix, iy = np.floor(xx).astype(int), np.floor(yy).astype(int)
+    inside = (ix >= 0) & (iy >= 0) & (ix < dimX - 1) & (iy < dimY - 1)
+    ix, iy = np.clip(ix, 0, dimX - 2), np.clip(iy, 0, dimY - 2)
+    fx, fy = xx - ix, yy - iy
+    good = (inside & valid[iy, ix] & valid[iy, ix + 1] &
+            valid[iy + 1, ix] & valid[iy + 1, ix + 1])
+    value = ((1.0 - fx) * (1.0 - fy) * img[iy, ix] +
+             fx * (1.0 - fy) * img[iy, ix + 1] +
+             (1.0 - fx) * fy * img[iy + 1, ix] +
+             fx * fy * img[iy + 1, ix + 1])
+    return np.where(good, value, np.nan)
+
+
+def sampleIsophote(img, valid, geom, sma, step, linear=False,
+                   intMode='mean'):
+    """
+    Intensities along one ellipse.
+
+    For 'mean' and 'median', each sample is the mean or median of the
+    pixels in an annulus sector of width (step x sma), or step for linear
+    steps.  All sectors are evaluated at once on a regular grid of
+    positions in (radius, angle) with about one position per pixel, so the
+    cost only scales with the area of the annulus.  Bi-linear interpolation
+    is used for 'bi-linear' mode and when the sectors would be smaller than
+    one pixel.
+
+    Return:
+        angle  : eccentric anomaly of the samples
+        value  : intensity of each sample; NaN for flagged samples
+        sarea  : average number of pixels in each sector
+    """
+    x0, y0, eps, pa = geom
+    width = step if linear else (step * sma)
+    nSample = max(int(round(2.0 * np.pi * sma / max(width, 1.0))),
+                  MIN_SAMPLE)
+    angle = (np.arange(nSample) + 0.5) * (2.0 * np.pi / nSample)
+
+    if (intMode == 'bi-linear') or (width < 1.0):
+        xx, yy = ellipseXY(x0, y0, sma, eps, pa, angle)
+        return angle, sampleBilinear(img, valid, xx, yy), 1.0
+
+    nSub = int(np.ceil(width))
+    subR = sma + width * ((np.arange(nSub) + 0.5) / nSub - 0.5)
+    subE = (np.arange(nSub) + 0.5) / nSub * (2.0 * np.pi / nSample)
+    # (nSample, nSub, nSub) grid of positions inside every sector
+    gridE, gridR = np.broadcast_arrays(
+        (angle[:, None, None] - np.pi / nSample) + subE[None, None, :],
+        subR[None, :, None])
+    xx, yy = ellipseXY(x0, y0, gridR, eps, pa, gridE)
+    pixVal = sampleBilinear(img, valid, xx.ravel(), yy.ravel())
+    pixVal = pixVal.reshape(nSample, nSub * nSub)
+
+    # Empty sectors are NaN, i.e. flagged
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if intMode == 'median':
+            value = np.nanmedian(pixVal, axis=1)
+        else:
+            value = np.nanmean(pixVal, axis=1)
+
+    return angle, value, float(nSub * nSub)
+
+
+def clipSample(value, lsclip=3.0, usclip=3.0, nclip=2):
+    """Sigma-clipping of the samples along the ellipse."""
+    good = np.isfinite(value)
+    for _ in range(int(nclip)):
+        if np.sum(good) < 3:
+            break
+        mean, std = np.mean(value[good]), np.std(value[good])
+        newGood = (good & (value >= mean - lsclip * std) &
+                   (value <= mean + usclip * std))
+        if np.sum(newGood) == np.sum(good):
+            break
+        good = newGood
+    return good
+
+
+def fitHarmonics(angle, value, orders=(1, 2)):
+    """
+    Least-squares fit of y0 + sum(A_n sin(nE) + B_n cos(nE)).
+
+    Return:
+        coeff  : [y0, A1, B1, A2, B2, ...]
+        error  : 1-sigma errors of the coefficients
+        resid  : residuals of the fit
+    """
+    columns = [np.ones_like(angle)]
+    for order in orders:
+        columns.append(np.sin(order * angle))
+        columns.append(np.cos(order * angle))
+    design = np.vstack(columns).T
+    coeff, _, rank, _ = np.linalg.lstsq(design, value, rcond=None)
+    if rank < design.shape[1]:
+        raise np.linalg.LinAlgError("Degenerate harmonic fit")
+    resid = value - design.dot(coeff)
+    nDof = max(len(value) - design.shape[1], 1)
+    covar = np.linalg.inv(design.T.dot(design)) * (np.sum(resid ** 2) /
+                                                    nDof)
+    return coeff, np.sqrt(np.diag(covar)), resid
+
+
+def isoGradient(img, valid, geom, sma, step, linear, intMode, mean,
+                rms, ndata, prevGrad=None):
+    """
+    Radial intensity gradient from a second ellipse further out.
+    """
+    width = step if linear else (step * sma)
+    angle, value, _ = sampleIsophote(img, valid, geom, sma + width, step,
+                                     linear=linear, intMode=intMode)
+    good = np.isfinite(value)
+    if np.sum(good) < 3:
+        return np.nan, np.nan
+    grad = (np.mean(value[good]) - mean) / width
+    gradErr = np.sqrt(np.var(value[good]) / np.sum(good) +
+                      rms ** 2.0 / max(ndata, 1)) / width
+    # Same as ELLIPSE, a positive gradient is replaced by the previous one
+    if (grad >= 0.0) and (prevGrad is not None) and (prevGrad < 0.0):
+        grad = prevGrad * 0.8
+    return grad, gradErr
+
+
+def correctGeometry(geom, sma, iBig, harmonic, grad):
+    """
+    Correct the geometry using the largest harmonic amplitude.
+
+    iBig : 0 (A1) and 1 (B1) for the center, 2 (A2) for the position
+           angle, 3 (B2) for the ellipticity
+    """
+    x0, y0, eps, pa = geom
+    if iBig == 0:
+        aux = -harmonic / (1.0 - eps) / grad
+        x0, y0 = x0 - aux * np.sin(pa), y0 + aux * np.cos(pa)
+    elif iBig == 1:
+        aux = -harmonic / grad
+        x0, y0 = x0 + aux * np.cos(pa), y0 + aux * np.sin(pa)
+    elif iBig == 2:
+        corr = (harmonic * 2.0 * (1.0 - eps) / sma / grad /
+                ((1.0 - eps) ** 2.0 - 1.0))
+        pa = (pa + corr) % np.pi
+    else:
+        corr = harmonic * 2.0 * (1.0 - eps) / sma / grad
+        eps = eps - corr
+        # Same as ELLIPSE: a negative ellipticity means that the major
+        # axis is along the minor axis of the trial ellipse
+        if eps < 0.0:
+            eps, pa = -eps, (pa + np.pi / 2.0) % np.pi
+        eps = min(max(eps, MIN_EPS), MAX_EPS)
+    return (x0, y0, eps, pa)
+
+
+def isoMeasure(img, valid, geom, sma, par, niter=0, stop=0, aBig=np.nan,
+               prevGrad=None, sample=None):
+    """
+    Measure one isophote with the given geometry.
+
+    Return:
+        row : dict of the output columns (except the total fluxes)
+    """
+    x0, y0, eps, pa = geom
+    if sample is None:
+        sample = sampleIsophote(img, valid, geom, sma, par['step'],
+                                linear=par['linear'],
+                                intMode=par['intMode'])
+    angle, value, sarea = sample
+    good = clipSample(value, par['lsclip'], par['usclip'], par['nclip'])
+    ndata = int(np.sum(good))
+
+    row = dict((col, np.nan) for col in ISO_COLUMNS + HARM_COLUMNS)
+    row['sma'], row['rsma'] = sma, sma ** 0.25
+    row['x0'], row['y0'] = x0 + 1.0, y0 + 1.0
+    row['ell'] = eps
+    row['pa'] = normPA(np.degrees(pa) - 90.0)
+    row['ndata'], row['nflag'] = ndata, len(value) - ndata
+    row['niter'], row['stop'] = niter, stop
+    row['a_big'], row['sarea'] = aBig, sarea
+    if ndata == 0:
+        return row
+
+    val = value[good]
+    mean, rms = np.mean(val), np.std(val)
+    row['intens'], row['rms'] = mean, rms
+    row['int_err'] = rms / np.sqrt(ndata)
+    row['pix_var'] = rms * np.sqrt(sarea)
+    grad, gradErr = isoGradient(img, valid, geom, sma, par['step'],
+                                par['linear'], par['intMode'], mean, rms,
+                                ndata, prevGrad=prevGrad)
+    row['grad'], row['grad_err'] = grad, gradErr
+    row['grad_r_err'] = np.abs(gradErr / grad) if grad != 0 else np.nan
+
+    # Errors of the geometry and the harmonic deviations
+    if (ndata > 5) and np.isfinite(grad) and (grad != 0):
+        try:
+            coeff, error, _ = fitHarmonics(angle[good], val)
+            ea = np.abs(error[1] / grad)
+            eb = np.abs(error[2] * (1.0 - eps) / grad)
+            row['x0_err'] = np.sqrt((ea * np.cos(pa)) ** 2.0 +
+                                    (eb * np.sin(pa)) ** 2.0)
+            row['y0_err'] = np.sqrt((ea * np.sin(pa)) ** 2.0 +
+                                    (eb * np.cos(pa)) ** 2.0)
+            row['ell_err'] = np.abs(2.0 * error[4] * (1.0 - eps) / sma /
+                                    grad)
+            if eps > 1.0E-6:
+                row['pa_err'] = np.degrees(np.abs(
+                    2.0 * error[3] * (1.0 - eps) / sma / grad /
+                    ((1.0 - eps) ** 2.0 - 1.0)))
+            else:
+                row['pa_err'] = 0.0
+            norm = sma * np.abs(grad)
+            for order in (1, 2, 3, 4):
+                if order > 2:
+                    coeff, error, _ = fitHarmonics(angle[good], val,
+                                                   orders=(order,))
+                    aa, bb, aErr, bErr = (coeff[1], coeff[2],
+                                          error[1], error[2])
+                else:
+                    aa, bb = coeff[2 * order - 1], coeff[2 * order]
+                    aErr, bErr = error[2 * order - 1], error[2 * order]
+                gradTerm = (gradErr / grad) ** 2.0
+                row['a%d' % order] = aa / norm
+                row['b%d' % order] = bb / norm
+                row['a%d_err' % order] = np.sqrt((aErr / norm) ** 2.0 +
+                                                 (aa / norm) ** 2.0 *
+                                                 gradTerm)
+                row['b%d_err' % order] = np.sqrt((bErr / norm) ** 2.0 +
+                                                 (bb / norm) ** 2.0 *
+                                                 gradTerm)
+        except np.linalg.LinAlgError:
+            pass
+
+    return row
+
+
+def normPA(pa):
+    """Normalize the PA in degrees into (-90, 90]."""
+    pa = (pa + 90.0) % 180.0 - 90.0
+    return 90.0 if pa == -90.0 else pa
+
+
+def fitIsophote(img, valid, geom, sma, par, prevGrad=None):
+    """
+    Fit one isophote starting from the input geometry.
+
+    Return:
+        row  : dict of the output columns
+        geom : the new geometry
+    """
+    free = np.array([not par['hcenter'], not par['hcenter'],
+                     not par['hpa'], not par['hellip']])
+    stop, aBig, niter = 2, np.nan, 0
+    lastGood = geom
+    # Last correction of each parameter, to damp the oscillations
+    lastCorr = np.zeros(4)
+    for niter in range(1, par['maxit'] + 1):
+        sample = sampleIsophote(img, valid, geom, sma, par['step'],
+                                linear=par['linear'],
+                                intMode=par['intMode'])
+        angle, value, sarea = sample
+        good = clipSample(value, par['lsclip'], par['usclip'],
+                          par['nclip'])
+        nGood = np.sum(good)
+        if nGood <= 5:
+            stop = 3
+            break
+        if (len(value) - nGood) > (par['fflag'] * len(value)):
+            stop = 1
+            break
+        if not np.any(free):
+            stop = 0
+            break
+        try:
+            coeff, _, resid = fitHarmonics(angle[good], value[good])
+        except np.linalg.LinAlgError:
+            stop = 3
+            break
+        mean, rms = np.mean(value[good]), np.std(value[good])
+        grad, _ = isoGradient(img, valid, geom, sma, par['step'],
+                              par['linear'], par['intMode'], mean, rms,
+                              nGood, prevGrad=prevGrad)
+        if (not np.isfinite(grad)) or (grad >= 0.0):
+            stop = -1
+            break
+
+        harmonic = np.where(free, coeff[1:5], 0.0)
+        iBig = int(np.argmax(np.abs(harmonic)))
+        aBig = harmonic[iBig]
+        lastGood = geom
+        # Converged when the largest amplitude is small compared with the
+        # scatter of the samples
+        if (np.abs(aBig) < (par['conver'] * sarea * np.std(resid))) and \
+                (niter >= par['minit']):
+            stop = 0
+            break
+        # Halve the correction when it changes sign, which happens when
+        # the trial geometry is far from the real one
+        if (lastCorr[iBig] * aBig) < 0.0:
+            aBig *= 0.5
+        lastCorr[iBig] = aBig
+        geom = correctGeometry(geom, sma, iBig, aBig, grad)
+        # Give up if the center moves out of the image
+        if not (0 <= geom[0] < img.shape[1] and 0 <= geom[1] < img.shape[0]):
+            geom = lastGood
+            stop = 3
+            break
+
+    row = isoMeasure(img, valid, geom, sma, par, niter=niter, stop=stop,
+                     aBig=aBig, prevGrad=prevGrad)
+    return row, geom
+
+
+def isoTotalFlux(img, valid, row):
+    """Total flux and number of pixels inside the ellipse and the circle."""
+    x0, y0 = row['x0'] - 1.0, row['y0'] - 1.0
+    sma, eps = row['sma'], row['ell']
+    pa = np.radians(row['pa'] + 90.0)
+    dimY, dimX = img.shape
+    xMin, xMax = max(int(x0 - sma - 1), 0), min(int(x0 + sma + 2), dimX)
+    yMin, yMax = max(int(y0 - sma - 1), 0), min(int(y0 + sma + 2), dimY)
+    if (xMax <= xMin) or (yMax <= yMin):
+        return 0.0, 0.0, 0, 0
+    yy, xx = np.mgrid[yMin:yMax, xMin:xMax]
+    dx, dy = xx - x0, yy - y0
+    use = valid[yMin:yMax, xMin:xMax]
+    sub = img[yMin:yMax, xMin:xMax]
+    inCir = ((dx ** 2.0 + dy ** 2.0) <= sma ** 2.0) & use
+    xr = dx * np.cos(pa) + dy * np.sin(pa)
+    yr = (-dx * np.sin(pa) + dy * np.cos(pa)) / (1.0 - eps)
+    inEll = ((xr ** 2.0 + yr ** 2.0) <= sma ** 2.0) & use
+    return (np.sum(sub[inEll]), np.sum(sub[inCir]),
+            int(np.sum(inEll)), int(np.sum(inCir)))
+
+
+def readIsoTable(inEllip):
+    """
+    Read the geometry of the isophotes from an input table.
+
+    Both the FITS tables written by saveIsoTable() and the STSDAS binary
+    tables written by ELLIPSE are supported.
+    """
+    if not os.path.isfile(inEllip):
+        raise Exception("### Can not find the input ellip file: %s" %
+                        inEllip)
+    try:
+        isoTab = Table.read(inEllip, format='fits')
+    except Exception:
+        try:
+            isoTab = Table(stsTab.readStsdasTable(inEllip))
+        except Exception:
+            raise Exception("### Can not read the input ellip file: %s" %
+                            inEllip)
+    for col in isoTab.colnames:
+        isoTab.rename_column(col, col.lower())
+    if ('ellip' in isoTab.colnames) and ('ell' not in isoTab.colnames):
+        isoTab.rename_column('ellip', 'ell')
+    return isoTab
+
+
+def saveIsoTable(isoTab, outFile):
+    """Save the isophotes as a FITS table, so it can be used as inEllip."""
+    outTemp = outFile + '.%d' % os.getpid()
+    isoTab.write(outTemp, format='fits', overwrite=True)
+    os.rename(outTemp, outFile)
+    return outFile
+
+
+def ellipseConfigPar(ellipConfig):
+    """Convert the defaultEllipse() configuration into a dict."""
+    cfg = ellipConfig[0] if len(np.shape(ellipConfig)) > 0 else ellipConfig
+    par = {}
+    for key in ['x0', 'y0', 'ellip0', 'pa0', 'sma0', 'minsma', 'maxsma',
+                'step', 'conver', 'olthresh', 'mag0', 'usclip', 'lsclip',
+                'fflag']:
+        par[key] = float(_cfgValue(cfg, key))
+    for key in ['minit', 'maxit', 'nclip']:
+        par[key] = int(_cfgValue(cfg, key))
+    for key in ['linear', 'recenter', 'hcenter', 'hellip', 'hpa']:
+        par[key] = bool(_cfgValue(cfg, key))
+    par['intMode'] = str(_cfgValue(cfg, 'integrmode')).lower().strip()
+    if par['intMode'] not in ['mean', 'median', 'bi-linear']:
+        raise Exception(
+            "### Only 'mean', 'median', and 'bi-linear' are available !")
+    par['harmonics'] = str(_cfgValue(cfg, 'harmonics')).strip()
+    return par
+
+
+def isoSnr(intens, ndata, intErr, skyRms=None, skyBkg=0.0):
+    """
+    Signal-to-noise ratio of the mean intensity of the isophotes.
+
+    Parameters:
+        skyRms : RMS of the sky in one pixel; the error of the intensity
+                 is skyRms / sqrt(ndata).  The int_err of the isophotes
+                 is used when it is not available
+        skyBkg : sky level of the image
+    """
+    signal = np.asarray(intens, dtype=float) - skyBkg
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if (skyRms is None) or (not np.isfinite(skyRms)) or (skyRms <= 0):
+            snr = signal / np.asarray(intErr, dtype=float)
+        else:
+            snr = signal * np.sqrt(np.asarray(ndata, dtype=float)) / skyRms
+    return np.where(np.isfinite(snr), snr, 0.0)
+
+
+def snrStopSma(isoTab, skyRms=None, skyBkg=0.0, minSnr=3.0, nLowSnr=3):
+    """
+    Radius where the profile reaches nLowSnr isophotes in a row with
+    S/N < minSnr, same as the stopping criterion of ellipseFit().
+
+    Return:
+        sma of the first of these isophotes, or NaN
+    """
+    sma = np.asarray(isoTab['sma'], dtype=float)
+    order = np.argsort(sma, kind='mergesort')
+    order = order[sma[order] > 0.0]
+    low = isoSnr(np.asarray(isoTab['intens'])[order],
+                 np.asarray(isoTab['ndata'])[order],
+                 np.asarray(isoTab['int_err'])[order],
+                 skyRms=skyRms, skyBkg=skyBkg) < minSnr
+    nLow = 0
+    for ii, flag in enumerate(low):
+        nLow = (nLow + 1) if flag else 0
+        if nLow >= nLowSnr:
+            return sma[order[ii - nLowSnr + 1]]
+    return np.nan
+
+
+def ellipseFit(imgArr, ellipConfig, mskArr=None, inEllip=None,
+               verbose=False, skyRms=None, skyBkg=0.0, minSnr=None,
+               nLowSnr=3):
+    """
+    Run the isophote fitting on an image array.
+
+    Parameters:
+        ellipConfig : configuration from galSBP.defaultEllipse()
+        mskArr      : pixels with mask > 0 are not used
+        inEllip     : table of isophotes for the force photometry mode;
+                      the geometry of each isophote is not changed
+        minSnr      : stop fitting the isophotes outward after nLowSnr
+                      isophotes in a row with S/N < minSnr (see isoSnr());
+                      outside the stopping radius, only the outermost
+                      SKY_RINGS rings up to maxsma are measured with the
+                      geometry frozen, so the background of the outskirt
+                      does not depend on the stopping radius.  These sky
+                      rings have no total flux.  Disabled by default
+        skyRms      : RMS of the sky in one pixel, for the S/N
+        skyBkg      : sky level of the image, for the S/N
+
+    Return:
+        isoTab      : astropy Table with the same columns as the ELLIPSE
+                      output (ISO_COLUMNS, plus HARM_COLUMNS when
+                      harmonics is not 'none'), sorted by sma; when the
+                      fitting stops early, the radius is kept in
+                      isoTab.meta['SMA_STOP'], and the sky rings outside
+                      it have stop = -1
+    """
+    par = ellipseConfigPar(ellipConfig)
+    img, valid = prepareImage(imgArr, mskArr)
+    rows = []
+    """ The sky rings, outside smaSky, have no total flux """
+    smaSky = np.inf
+    """ Number of low S/N isophotes in a row, and the stopping radius """
+    snrTrack = {'nLow': 0, 'smaStop': np.nan}
+
+    def lowSnrStop(row):
+        if (minSnr is None) or (snrTrack['nLow'] >= nLowSnr):
+            return False
+        low = isoSnr(row['intens'], row['ndata'], row['int_err'],
+                     skyRms=skyRms, skyBkg=skyBkg) < minSnr
+        snrTrack['nLow'] = (snrTrack['nLow'] + 1) if low else 0
+        if snrTrack['nLow'] == 1:
+            snrTrack['smaStop'] = row['sma']
+        if snrTrack['nLow'] >= nLowSnr:
+            if verbose:
+                print("###  Low S/N from SMA %8.2f, freeze the geometry" %
+                      snrTrack['smaStop'])
+            return True
+        return False
+
+    if inEllip is not None:
+        """ Force photometry: fixed geometry from the input table """
+        isoIn = readIsoTable(inEllip) if isinstance(inEllip, str) \
+            else inEllip
+        prevGrad = None
+        for isoRow in isoIn[np.argsort(isoIn['sma'], kind='mergesort')]:
+            sma = float(isoRow['sma'])
+            geom = (float(isoRow['x0']) - 1.0, float(isoRow['y0']) - 1.0,
+                    float(isoRow['ell']),
+                    np.radians(float(isoRow['pa']) + 90.0))
+            if sma <= 0.0:
+                rows.append(centralRow(img, valid, geom))
+                continue
+            row = isoMeasure(img, valid, geom, sma, par, niter=0, stop=0,
+                             prevGrad=prevGrad)
+            prevGrad = row['grad'] if np.isfinite(row['grad']) else prevGrad
+            rows.append(row)
+            """ The geometry is fixed already, only keep the radius """
+            lowSnrStop(row)
+    else:
+        """ Start from sma0 and grow outward, then go inward """
+        geom0 = (par['x0'] - 1.0, par['y0'] - 1.0,
+                 min(max(par['ellip0'], MIN_EPS), MAX_EPS),
+                 np.radians(par['pa0'] + 90.0))
+        sma0 = par['sma0']
+        minSma = max(par['minsma'], 0.5)
+
+        row, geomFirst = fitIsophote(img, valid, geom0, sma0, par)
+        rows.append(row)
+        prevGrad = row['grad'] if np.isfinite(row['grad']) else None
+
+        # Outward; the geometry is frozen after two bad gradients in a row,
+        # and the fitting stops after the S/N becomes too low
+        geom, sma, nBad, lowSnr = geomFirst, sma0, 0, False
+        while not lowSnr:
+            sma = (sma + par['step']) if par['linear'] else \
+                (sma * (1.0 + par['step']))
+            if sma > par['maxsma']:
+                break
+            if nBad >= 2:
+                row = isoMeasure(img, valid, geom, sma, par, niter=0,
+                                 stop=-1, prevGrad=prevGrad)
+            else:
+                row, geom = fitIsophote(img, valid, geom, sma, par,
+                                        prevGrad=prevGrad)
+                badGrad = ((not np.isfinite(row['grad_r_err'])) or
+                           (row['grad_r_err'] > MAXGERR) or
+                           (row['grad'] >= 0.0))
+                nBad = (nBad + 1) if badGrad else 0
+            if row['ndata'] == 0:
+                break
+            if np.isfinite(row['grad']) and row['grad'] < 0:
+                prevGrad = row['grad']
+            rows.append(row)
+            if verbose:
+                print("###  SMA %8.2f  INTENS %12.6f  STOP %2d" %
+                      (sma, row['intens'], row['stop']))
+            lowSnr = lowSnrStop(row)
+
+        # Outside the stopping radius, only the outermost SKY_RINGS rings
+        # of the same grid, where the background of the outskirt is
+        if lowSnr:
+            smaSky, smaGrid = sma, []
+            while True:
+                sma = (sma + par['step']) if par['linear'] else \
+                    (sma * (1.0 + par['step']))
+                if sma > par['maxsma']:
+                    break
+                smaGrid.append(sma)
+            for sma in smaGrid[-SKY_RINGS:]:
+                row = isoMeasure(img, valid, geom, sma, par, niter=0,
+                                 stop=-1, prevGrad=prevGrad)
+                if row['ndata'] == 0:
+                    break
+                rows.append(row)
+
+        # Inward from the first isophote
+        geom, sma = geomFirst, sma0
+        while True:
+            sma = (sma - par['step']) if par['linear'] else \
+                (sma / (1.0 + par['step']))
+            if sma < minSma:
+                break
+            row, geom = fitIsophote(img, valid, geom, sma, par)
+            if row['ndata'] > 0:
+                rows.append(row)
+        if par['minsma'] <= 0.0:
+            rows.append(centralRow(img, valid, geom))
+
+    isoTab = isoTableFromRows(rows, harmonics=par['harmonics'])
+    if snrTrack['nLow'] >= nLowSnr:
+        isoTab.meta['SMA_STOP'] = snrTrack['smaStop']
+
+    """ Total flux and magnitudes """
+    for ii, row in enumerate(isoTab):
+        if (row['sma'] <= 0.0) or (row['sma'] > smaSky):
+            continue
+        fluxE, fluxC, npixE, npixC = isoTotalFlux(img, valid, row)
+        isoTab['tflux_e'][ii], isoTab['tflux_c'][ii] = fluxE, fluxC
+        isoTab['npix_e'][ii], isoTab['npix_c'][ii] = npixE, npixC
+    isoMagnitudes(isoTab, par['mag0'])
+
+    return isoTab
+
+
+def isoTableFromRows(rows, harmonics='1 2'):
+    """Build the output table from the dicts of the isophotes."""
+    isoTab = Table(rows=[[row[col] for col in ISO_COLUMNS + HARM_COLUMNS]
+                         for row in rows],
+                   names=(ISO_COLUMNS + HARM_COLUMNS))
+    isoTab.sort('sma')
+    if harmonics == 'none':
+        isoTab.remove_columns(HARM_COLUMNS)
+    for col in ['ndata', 'nflag', 'niter', 'stop', 'npix_e', 'npix_c']:
+        isoTab[col] = np.nan_to_num(isoTab[col]).astype(int)
+    return isoTab
+
+
+def isoMagnitudes(isoTab, mag0):
+    """Fill the magnitude columns, same as ELLIPSE with mag0."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        intens, intErr = isoTab['intens'], isoTab['int_err']
+        isoTab['mag'] = mag0 - 2.5 * np.log10(intens)
+        isoTab['mag_lerr'] = 2.5 * np.log10(1.0 + intErr / intens)
+        isoTab['mag_uerr'] = -2.5 * np.log10(1.0 - intErr / intens)
+        isoTab['tmag_e'] = mag0 - 2.5 * np.log10(isoTab['tflux_e'])
+        isoTab['tmag_c'] = mag0 - 2.5 * np.log10(isoTab['tflux_c'])
+
+    return isoTab
+
+
+def centralRow(img, valid, geom):
+    """The central pixel, same as the first row of the ELLIPSE output."""
+    x0, y0, eps, pa = geom
+    row = dict((col, np.nan) for col in ISO_COLUMNS + HARM_COLUMNS)
+    value = sampleBilinear(img, valid, np.array([x0]), np.array([y0]))[0]
+    row['sma'], row['rsma'] = 0.0, 0.0
+    row['intens'] = value
+    row['x0'], row['y0'] = x0 + 1.0, y0 + 1.0
+    row['ell'], row['pa'] = eps, normPA(np.degrees(pa) - 90.0)
+    row['ndata'] = 1 if np.isfinite(value) else 0
+    row['nflag'] = 1 - row['ndata']
+    row['niter'], row['stop'] = 0, 0
+    row['tflux_e'], row['tflux_c'] = value, value
+    row['npix_e'], row['npix_c'] = 1, 1
+    row['sarea'] = 1.0
+    return row
+
+
+def ellipseImage(image, ellipConfig, mask=None, inEllip=None, hdu=0,
+                 verbose=False):
+    """Run ellipseFit() on FITS files."""
+    imgArr = fits.open(image)[hdu].data
+    mskArr = fits.open(mask)[0].data if mask is not None else None
+    return ellipseFit(imgArr, ellipConfig, mskArr=mskArr, inEllip=inEllip,
+                      verbose=verbose)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Vectorised derived columns of the 1-D surface brightness profiles."""
+
+from __future__ import (division, print_function)
+
+import warnings
+import collections
+
+import numpy as np
+
+"""
+All the functions work along the last axis, so they take either one
+profile (1-D arrays), or a group of profiles stacked into 2-D arrays of
+shape (nProfile, nIsophote).  Profiles of different lengths are padded
+with NaN at the end (see padProfiles()); the padded elements stay NaN in
+the outputs.
+"""
+
+
+def normAngleArr(angle, lower=-90.0, upper=90.0, b=True):
+    """
+    Vectorised version of hscUtils.normAngle().
+
+    Parameters:
+        angle  : array of angles
+        lower  : lower limit of the range
+        upper  : upper limit of the range
+        b      : True, the angle 'bounces' between the two limits;
+                 False, the range is periodic
+    """
+    num = np.array(angle, dtype=float)
+    if not b:
+        if lower >= upper:
+            raise ValueError("Invalid lower and upper limits: (%s, %s)" %
+                             (lower, upper))
+        total = abs(lower) + abs(upper)
+        flag = (num > upper) | (num == lower)
+        num = np.where(flag, lower + np.abs(num + upper) % total, num)
+        flag = (num < lower) | (num == upper)
+        num = np.where(flag, upper - np.abs(num - lower) % total, num)
+        return np.where(num == upper, lower, num) * 1.0
+
+    total = abs(lower) + abs(upper)
+    num = np.where(num < -total,
+                   num + np.ceil(num / (-2.0 * total)) * 2.0 * total, num)
+    num = np.where(num > total,
+                   num - np.floor(num / (2.0 * total)) * 2.0 * total, num)
+    num = np.where(num > upper, total - num, num)
+    num = np.where(num < lower, -total - num, num)
+
+    return num * 1.0
+
+
+def ringArea(sma, ell):
+    """
+    Area in pixels of the elliptical rings between the isophotes.
+
+    The first ring is the full ellipse of the first isophote.
+    """
+    ellArea = np.pi * (np.asarray(sma, dtype=float) ** 2.0 *
+                       (1.0 - np.asarray(ell, dtype=float)))
+    ring = np.empty_like(ellArea)
+    ring[..., 0] = ellArea[..., 0]
+    ring[..., 1:] = ellArea[..., 1:] - ellArea[..., :-1]
+
+    return ring
+
+
+def growthCurve(sma, ell, intens):
+    """
+    Curve of growth from the intensity of the isophotes.
+
+    Same as summing the flux of the rings up to each isophote with
+    np.nansum(), but with one cumulative sum.
+    """
+    isoFlux = ringArea(sma, ell) * np.asarray(intens, dtype=float)
+    cog = np.nancumsum(isoFlux, axis=-1)
+
+    return np.where(np.isfinite(sma), cog, np.nan)
+
+
+def growthCurveMax(sma, cog):
+    """
+    Radius and flux of the maximum of the curve of growth.
+
+    Return:
+        (maxSma, maxFlux); scalars for one profile, arrays for a group
+    """
+    sma = np.asarray(sma, dtype=float)
+    cog = np.asarray(cog, dtype=float)
+    if cog.ndim == 1:
+        indexMax = np.argmax(np.where(np.isfinite(cog), cog, -np.inf))
+        return sma[indexMax], cog[indexMax]
+    indexMax = np.argmax(np.where(np.isfinite(cog), cog, -np.inf), axis=-1)
+    rows = np.arange(cog.shape[0])
+
+    return sma[rows, indexMax], cog[rows, indexMax]
+
+
+def sbpColumns(sma, intens, intErr, bkg=0.0, zp=27.0, pix=1.0,
+               exptime=1.0):
+    """
+    Surface brightness columns of the profiles.
+
+    Parameters:
+        bkg : background level; a scalar, or one value per profile
+
+    Return:
+        list of (name, array), in the order used by readEllipseOut()
+    """
+    sma = np.asarray(sma, dtype=float)
+    intens = np.asarray(intens, dtype=float)
+    intErr = np.asarray(intErr, dtype=float)
+    bkg = np.asarray(bkg, dtype=float)
+    if (bkg.ndim == 1) and (intens.ndim == 2):
+        bkg = bkg[:, np.newaxis]
+    norm = (pix ** 2.0) * exptime
+
+    intensSub = intens - bkg
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sbpOri = zp - 2.5 * np.log10(intens / norm)
+        sbpSub = zp - 2.5 * np.log10(intensSub / norm)
+        """ Not so accurate estimates of surface brightness error """
+        sbpLow = zp - 2.5 * np.log10((intensSub + intErr) / norm)
+    sbpErr = (sbpSub - sbpLow)
+    sbpUpp = (sbpSub + sbpErr)
+
+    return [('sbp_ori', sbpOri),
+            ('sbp_sub', sbpSub),
+            ('sbp', sbpSub.copy()),
+            ('intens_sub', intensSub),
+            ('intens_bkg', sma * 0.0 + bkg),
+            ('sbp_err', sbpErr),
+            ('sbp_low', sbpLow),
+            ('sbp_upp', sbpUpp),
+            ('sma_asec', sma * pix),
+            ('rsma_asec', (sma * pix) ** 0.25)]
+
+
+def derivedColumns(prof, bkg=0.0, zp=27.0, pix=1.0, exptime=1.0,
+                   useTflux=False):
+    """
+    All the derived columns that only depend on the isophotes.
+
+    Parameters:
+        prof : Table, dict or structured array with sma, ell, pa, intens
+               and int_err (and tflux_e when useTflux=True); the columns
+               can be 1-D or 2-D
+
+    Return:
+        list of (name, array): pa_norm, the sbpColumns(), growth_ori and
+        growth_sub
+    """
+    sma = np.asarray(prof['sma'], dtype=float)
+    columns = [('pa_norm', normAngleArr(prof['pa'], lower=-90.0,
+                                        upper=90.0, b=True))]
+    columns += sbpColumns(sma, prof['intens'], prof['int_err'], bkg=bkg,
+                          zp=zp, pix=pix, exptime=exptime)
+    if useTflux:
+        cogOri = np.asarray(prof['tflux_e'], dtype=float)
+    else:
+        cogOri = growthCurve(sma, prof['ell'], prof['intens'])
+    cogSub = growthCurve(sma, prof['ell'], dict(columns)['intens_sub'])
+    columns += [('growth_ori', cogOri), ('growth_sub', cogSub)]
+
+    return columns
+
+
+def _hasColumn(prof, col):
+    try:
+        prof[col]
+    except (KeyError, ValueError, IndexError):
+        return False
+    return True
+
+
+def _perProfile(value, ref):
+    """A scalar, or one value per profile, against the isophotes."""
+    value = np.asarray(value, dtype=float)
+    if (value.ndim == 1) and (np.ndim(ref) == 2):
+        value = value[:, np.newaxis]
+    return value
+
+
+def weightedMean(value, weight, use):
+    """
+    Weighted mean of the selected elements along the last axis.
+
+    Same as hscUtils.numpy_weighted_mean() on value[use]: a NaN value or
+    weight among the selected elements gives NaN.
+    """
+    value = np.asarray(value, dtype=float)
+    weight = np.asarray(weight, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.sum(np.where(use, value * weight, 0.0), axis=-1) /
+                np.sum(np.where(use, weight, 0.0), axis=-1))
+
+
+def avgCenter(prof, outRad):
+    """
+    Intensity-weighted center of the isophotes inside outRad, same as
+    galSBP.ellipseGetAvgCen().
+
+    Parameters:
+        outRad : a scalar, or one value per profile
+    """
+    sma = np.asarray(prof['sma'], dtype=float)
+    use = sma <= _perProfile(outRad, sma)
+    if _hasColumn(prof, 'x0_err') and _hasColumn(prof, 'y0_err'):
+        use &= (np.isfinite(np.asarray(prof['x0_err'], dtype=float)) &
+                np.isfinite(np.asarray(prof['y0_err'], dtype=float)))
+
+    return (weightedMean(prof['x0'], prof['intens'], use),
+            weightedMean(prof['y0'], prof['intens'], use))
+
+
+def avgGeometry(prof, outRad, minSma):
+    """
+    Flux-weighted axis ratio and PA of the isophotes between minSma and
+    outRad, same as galSBP.ellipseGetAvgGeometry().  The weights are the
+    fluxes of the rings (tflux_e), the PA is pa_norm.
+
+    Return:
+        (avgQ, avgPA)
+    """
+    sma = np.asarray(prof['sma'], dtype=float)
+    tfluxE = np.asarray(prof['tflux_e'], dtype=float)
+    ringFlux = np.empty_like(tfluxE)
+    ringFlux[..., 0] = tfluxE[..., 0]
+    ringFlux[..., 1:] = tfluxE[..., 1:] - tfluxE[..., :-1]
+    use = ((sma <= _perProfile(outRad, sma)) &
+           (sma >= _perProfile(minSma, sma)))
+    if _hasColumn(prof, 'ell_err') and _hasColumn(prof, 'pa_err'):
+        use &= (np.isfinite(np.asarray(prof['ell_err'], dtype=float)) &
+                np.isfinite(np.asarray(prof['pa_err'], dtype=float)))
+
+    return (1.0 - weightedMean(prof['ell'], ringFlux, use),
+            weightedMean(prof['pa_norm'], ringFlux, use))
+
+
+def avgColumns(prof, cogSub, galR=None, rFactor=0.2, fRatio1=0.20,
+               fRatio2=0.60):
+    """
+    Average center, axis ratio and PA of the profiles, same as
+    readEllipseOut(): the center inside galR (rFactor x the largest sma by
+    default), the shape between the radii where the background subtracted
+    curve of growth reaches fRatio1 and fRatio2 of its maximum.
+
+    Return:
+        list of (name, value): avg_x0, avg_y0, avg_q and avg_pa; scalars
+        for one profile, 1-D arrays for a group
+    """
+    sma = np.asarray(prof['sma'], dtype=float)
+    cogSub = np.asarray(cogSub, dtype=float)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if galR is None:
+            galR = np.nanmax(sma, axis=-1) * rFactor
+        avgX, avgY = avgCenter(prof, galR)
+        maxFlux = _perProfile(growthCurveMax(sma, cogSub)[1], sma)
+        inside = ((cogSub >= maxFlux * fRatio1) &
+                  (cogSub <= maxFlux * fRatio2))
+        radTemp = np.where(inside, sma, np.nan)
+        avgQ, avgPA = avgGeometry(prof, np.nanmax(radTemp, axis=-1),
+                                  np.nanmin(radTemp, axis=-1))
+
+    return [('avg_x0', avgX), ('avg_y0', avgY), ('avg_q', avgQ),
+            ('avg_pa', avgPA)]
+
+
+def padProfiles(profiles, columns, length=None):
+    """
+    Stack the same columns of many profiles into NaN-padded 2-D arrays.
+
+    Parameters:
+        profiles : list of Table (or dict) of profiles
+        columns  : names of the columns
+        length   : number of isophotes of the output; the longest
+                   profile is used by default
+
+    Return:
+        dict of {column: 2-D array of shape (nProfile, length)}
+    """
+    if length is None:
+        length = max([len(prof[columns[0]]) for prof in profiles] + [0])
+    stack = {}
+    for col in columns:
+        arr = np.full((len(profiles), length), np.nan)
+        for ii, prof in enumerate(profiles):
+            value = np.asarray(prof[col], dtype=float)[:length]
+            arr[ii, :value.shape[0]] = value
+        stack[col] = arr
+
+    return stack
+
+
+def derivedBatch(profiles, bkg=0.0, zp=27.0, pix=1.0, exptime=1.0,
+                 useTflux=False, avgGeom=True, galR=None, rFactor=0.2,
+                 fRatio1=0.20, fRatio2=0.60):
+    """
+    Derived columns for a whole sample of profiles at once.
+
+    Parameters:
+        profiles : list of profiles
+        bkg      : background level; a scalar, or one value per profile
+        avgGeom  : also add the average geometry (avgColumns()); needs
+                   the x0, y0, tflux_e and pa_norm columns
+
+    Return:
+        OrderedDict of {column: array}; the input columns, then the
+        derived ones in the order of derivedColumns() and avgColumns().
+        The average geometry has one value per profile
+    """
+    inCols = ['sma', 'ell', 'pa', 'intens', 'int_err']
+    if useTflux or avgGeom:
+        inCols.append('tflux_e')
+    if avgGeom:
+        inCols += ['x0', 'y0']
+        for col in ['x0_err', 'y0_err', 'ell_err', 'pa_err']:
+            if all(_hasColumn(prof, col) for prof in profiles):
+                inCols.append(col)
+    padded = padProfiles(profiles, inCols)
+    stack = collections.OrderedDict((col, padded[col]) for col in inCols)
+    stack.update(derivedColumns(stack, bkg=bkg, zp=zp, pix=pix,
+                                exptime=exptime, useTflux=useTflux))
+    if avgGeom:
+        stack.update(avgColumns(stack, stack['growth_sub'], galR=galR,
+                                rFactor=rFactor, fRatio1=fRatio1,
+                                fRatio2=fRatio2))
+
+    return stack
@@ -39,10 +39,21 @@ mpl.rc('axes', linewidth=3.5)
 from astropy.io import fits
 from astropy.io import ascii
 from astropy.table import Table, Column
-from pyraf import iraf
+try:
+    from pyraf import iraf
+    useIraf = True
+except ImportError:
+    useIraf = False
 
 # Personal
 import hscUtils as hUtil
+import hscRerun as hRerun
+import galIsophote as gIso
+import galAnnulus as gAnn
+import stsdasTable as stsTab
+import galWorkspace as gWork
+import galProfile as gProf
+import profileStore as pStore
 
 # Color table
 try:
@@ -57,6 +68,10 @@ COM = '#' * 100
 SEP = '-' * 100
 WAR = '!' * 100
 
+# Names of the columns in the binary output of ELLIPSE that are not the
+# upper case of the galIsophote.ISO_COLUMNS
+ELLIP_BIN_NAMES = {'ell': 'ELLIP', 'ell_err': 'ELLIP_ERR'}
+
 
 def randomStr(size=5, chars=string.ascii_uppercase + string.digits):
     """
@@ -147,20 +162,14 @@ def imageMaskNaN(inputImage, inputMask, verbose=False):
     newImage = inputImage.replace('.fits', '_nan.fits')
     if verbose:
         print " ## %s ---> %s " % (inputImage, newImage)
-    if os.path.islink(inputImage):
-        imgOri = os.readlink(inputImage)
-    else:
-        imgOri = inputImage
+    imgOri = hRerun.resolvePath(inputImage)
     if not os.path.isfile(imgOri):
         raise Exception("Can not find the FITS image: %s" % imgOri)
     else:
         imgArr = fits.open(imgOri)[0].data
         imgHead = fits.open(imgOri)[0].header
 
-    if os.path.islink(inputMask):
-        mskOri = os.readlink(inputMask)
-    else:
-        mskOri = inputMask
+    mskOri = hRerun.resolvePath(inputMask)
     if not os.path.isfile(mskOri):
         raise Exception("Can not find the FITS mask: %s" % mskOri)
     else:
@@ -192,7 +201,7 @@ def defaultEllipse(x0, y0, maxsma, ellip0=0.05, pa0=0.0, sma0=6.0, minsma=0.0,
                                            ('sma0', float), ('minsma', float),
                                            ('maxsma', float), ('linear', bool),
                                            ('step', float), ('recenter', bool),
-                                           ('conver', int), ('hcenter', bool),
+                                           ('conver', float), ('hcenter', bool),
                                            ('hellip', bool), ('hpa', bool),
                                            ('minit', int), ('maxit', int),
                                            ('olthresh', float),
@@ -495,11 +504,75 @@ def ellipRemoveIndef(outTabName, replace='NaN'):
     return outTabName
 
 
-def readEllipseOut(outTabName, pix=1.0, zp=27.0, exptime=1.0, bkg=0.0,
-                   harmonics='none', galR=None, minSma=2.0, dPA=75.0,
-                   rFactor=0.2, fRatio1=0.20, fRatio2=0.60, useTflux=False):
+def ellipseBinCheck(outBin, binArr):
     """
-    Read the Ellipse output into a structure.
+    Check the binary output of ELLIPSE against its header.
+
+    Return:
+        None when the table looks right, otherwise what is wrong
+    """
+    columns, size, order = stsTab.readColumnInfo(outBin)
+    nrows, allrows, ncols, maxcols = size[2], size[3], size[4], size[5]
+    colUsed, rowLen, tabType = size[6], size[7], size[8]
+    if len(binArr) != nrows:
+        return "%d rows instead of %d" % (len(binArr), nrows)
+    if len(binArr.dtype.names) != ncols:
+        return "%d columns instead of %d" % (len(binArr.dtype.names), ncols)
+    if [col[0] for col in columns] != list(binArr.dtype.names):
+        return "the names of the columns do not match"
+    """ The columns have to fit in the rows, and the rows in the file """
+    ends = [col[1] + col[2] for col in columns]
+    if ends and (max(ends) > colUsed or colUsed > rowLen):
+        return "the columns do not fit in the rows"
+    dataLen = (rowLen * allrows if tabType == stsTab.TBL_TYPE_ROW
+               else colUsed * allrows)
+    begin = (stsTab.LEN_SIZINFO * 4 + size[1] * stsTab.LEN_PARREC +
+             maxcols * stsTab.LEN_COLSTRUCT)
+    if begin + dataLen * stsTab.SZ_CHAR > os.path.getsize(outBin):
+        return "the file is shorter than the header says"
+    """ The first columns are always the same """
+    names = [col.upper() for col in binArr.dtype.names]
+    expect = [ELLIP_BIN_NAMES.get(col, col.upper())
+              for col in gIso.ISO_COLUMNS]
+    if names[:len(expect)] != expect:
+        return "not the columns of ELLIPSE"
+
+    return None
+
+
+def readEllipseBin(outBin, harmonics='none', verbose=False):
+    """
+    Read the binary output of ELLIPSE directly, without tdump.
+
+    The columns are named by their order, same as readEllipseTab().
+    Return None if the table can not be read, or does not agree with its
+    header (ellipseBinCheck), so tdump is used instead.
+    """
+    try:
+        binArr = stsTab.readStsdasTable(outBin)
+        problem = ellipseBinCheck(outBin, binArr)
+    except Exception as error:
+        problem = str(error)
+    if problem is not None:
+        if verbose:
+            print "###  Can not read %s : %s" % (outBin, problem)
+        return None
+    colNames = list(gIso.ISO_COLUMNS)
+    if harmonics != "none":
+        colNames += gIso.HARM_COLUMNS
+    if len(binArr.dtype.names) < len(colNames):
+        return None
+
+    ellipseOut = Table()
+    for name, colBin in zip(colNames, binArr.dtype.names):
+        ellipseOut.add_column(Column(name=name, data=binArr[colBin]))
+
+    return ellipseOut
+
+
+def readEllipseTab(outTabName, harmonics='none'):
+    """
+    Read the tdump output of ELLIPSE and name the columns.
 
     Parameters:
     """
@@ -556,82 +629,102 @@ def readEllipseOut(outTabName, pix=1.0, zp=27.0, exptime=1.0, bkg=0.0,
         ellipseOut.rename_column('col46', 'a2_err')
         ellipseOut.rename_column('col47', 'b2')
         ellipseOut.rename_column('col48', 'b2_err')
+
+    return ellipseOut
+
+
+def readEllipseOut(outTabName, pix=1.0, zp=27.0, exptime=1.0, bkg=0.0,
+                   harmonics='none', galR=None, minSma=2.0, dPA=75.0,
+                   rFactor=0.2, fRatio1=0.20, fRatio2=0.60, useTflux=False):
+    """
+    Read the Ellipse output into a structure.
+
+    Parameters:
+        outTabName : the tdump output of ELLIPSE, or the Table returned
+                     by galIsophote.ellipseFit()
+    """
+    if isinstance(outTabName, Table):
+        ellipseOut = outTabName
+    else:
+        ellipseOut = readEllipseTab(outTabName, harmonics=harmonics)
     # Normalize the PA
     ellipseOut = correctPositionAngle(ellipseOut, paNorm=False,
                                       dPA=dPA)
-    ellipseOut.add_column(Column(name='pa_norm',
-                          data=np.array([hUtil.normAngle(pa,
-                                        lower=-90, upper=90.0, b=True)
-                                        for pa in ellipseOut['pa']])))
     # Apply a photometric zeropoint to the magnitude
     ellipseOut['mag'] += zp
     ellipseOut['tmag_e'] += zp
     ellipseOut['tmag_c'] += zp
-    # Convert the intensity into surface brightness
-    pixArea = (pix ** 2.0)
-    # Surface brightness
-    # Fixed the negative intensity
-    intensOri = (ellipseOut['intens'])
-    intensSub = (ellipseOut['intens'] - bkg)
-    # intensOri[intensOri <= 0] = np.nan
-    # intensSub[intensSub <= 0] = np.nan
-    # Surface brightness
-    sbpOri = zp - 2.5 * np.log10(intensOri / (pixArea * exptime))
-    sbpSub = zp - 2.5 * np.log10(intensSub / (pixArea * exptime))
-    ellipseOut.add_column(Column(name='sbp_ori', data=sbpOri))
-    ellipseOut.add_column(Column(name='sbp_sub', data=sbpSub))
-    ellipseOut.add_column(Column(name='sbp', data=sbpSub))
-    ellipseOut.add_column(Column(name='intens_sub', data=intensSub))
-    # Also save the background level
-    ellipseOut.add_column(Column(name='intens_bkg', data=(
-                          ellipseOut['sma'] * 0.0 + bkg)))
-    # Not so accurate estimates of surface brightness error
-    sbp_low = zp - 2.5 * np.log10((intensSub + ellipseOut['int_err']) /
-                                  (pixArea * exptime))
-    sbp_err = (sbpSub - sbp_low)
-    sbp_upp = (sbpSub + sbp_err)
-    ellipseOut.add_column(Column(name='sbp_err', data=sbp_err))
-    ellipseOut.add_column(Column(name='sbp_low', data=sbp_low))
-    ellipseOut.add_column(Column(name='sbp_upp', data=sbp_upp))
-    # Convert the unit of radius into arcsecs
-    ellipseOut.add_column(Column(name='sma_asec',
-                                 data=(ellipseOut['sma'] * pix)))
-    ellipseOut.add_column(Column(name='rsma_asec',
-                                 data=(ellipseOut['sma'] * pix) ** 0.25))
-    # Curve of Growth
-    cogOri, maxSma, maxFlux = ellipseGetGrowthCurve(ellipseOut,
-                                                    bkgCor=False,
-                                                    useTflux=useTflux)
-    ellipseOut.add_column(Column(name='growth_ori', data=cogOri))
-
-    cogSub, maxSma, maxFlux = ellipseGetGrowthCurve(ellipseOut,
-                                                    bkgCor=True)
-    ellipseOut.add_column(Column(name='growth_sub', data=cogSub))
-    # Get the average X0, Y0, Q, and PA
-    if galR is None:
-        galR = np.max(ellipseOut['sma']) * rFactor
-    avgX, avgY = ellipseGetAvgCen(ellipseOut, galR, minSma=minSma)
-
     """
-    Try to select a region around R50 to get the average geometry
+    Normalized PA, surface brightness, radius in arcsec, and the curves of
+    growth (galProfile)
+    """
+    for name, value in gProf.derivedColumns(ellipseOut, bkg=bkg, zp=zp,
+                                            pix=pix, exptime=exptime,
+                                            useTflux=useTflux):
+        ellipseOut.add_column(Column(name=name, data=value))
+    """
+    Get the average X0, Y0, Q, and PA; the geometry is averaged in a
+    region around R50
     """
-    radTemp = ellipseOut['sma'][(cogSub >= (maxFlux * fRatio1)) &
-                                (cogSub <= (maxFlux * fRatio2))]
-    avgQ, avgPA = ellipseGetAvgGeometry(ellipseOut, np.nanmax(radTemp),
-                                        minSma=np.nanmin(radTemp))
-    # Save as new column
-    ellipseOut.add_column(Column(name='avg_x0',
-                                 data=(ellipseOut['sma'] * 0.0 + avgX)))
-    ellipseOut.add_column(Column(name='avg_y0',
-                                 data=(ellipseOut['sma'] * 0.0 + avgY)))
-    ellipseOut.add_column(Column(name='avg_q',
-                                 data=(ellipseOut['sma'] * 0.0 + avgQ)))
-    ellipseOut.add_column(Column(name='avg_pa',
-                                 data=(ellipseOut['sma'] * 0.0 + avgPA)))
+    for name, value in gProf.avgColumns(ellipseOut,
+                                        ellipseOut['growth_sub'], galR=galR,
+                                        rFactor=rFactor, fRatio1=fRatio1,
+                                        fRatio2=fRatio2):
+        # Save as new column
+        ellipseOut.add_column(Column(name=name,
+                                     data=(ellipseOut['sma'] * 0.0 + value)))
 
     return ellipseOut
 
 
+def readEllipseOutBatch(outTabList, pix=1.0, zp=27.0, exptime=1.0, bkg=0.0,
+                        harmonics='none', galR=None, minSma=2.0, dPA=75.0,
+                        rFactor=0.2, fRatio1=0.20, fRatio2=0.60,
+                        useTflux=False):
+    """
+    Same as readEllipseOut() for a group of profiles.
+
+    The derived columns of all the profiles are computed together by
+    galProfile.derivedBatch(); only the PA correction is done one profile
+    at a time.
+
+    Parameters:
+        bkg  : a scalar, or one background level per profile
+        galR : a scalar, or one value per profile
+
+    Return:
+        list of the profiles
+    """
+    profiles = []
+    for outTab in outTabList:
+        if isinstance(outTab, Table):
+            ellipseOut = outTab
+        else:
+            ellipseOut = readEllipseTab(outTab, harmonics=harmonics)
+        ellipseOut = correctPositionAngle(ellipseOut, paNorm=False, dPA=dPA)
+        ellipseOut['mag'] += zp
+        ellipseOut['tmag_e'] += zp
+        ellipseOut['tmag_c'] += zp
+        profiles.append(ellipseOut)
+
+    stack = gProf.derivedBatch(profiles, bkg=bkg, zp=zp, pix=pix,
+                               exptime=exptime, useTflux=useTflux,
+                               galR=galR, rFactor=rFactor, fRatio1=fRatio1,
+                               fRatio2=fRatio2)
+    for ii, ellipseOut in enumerate(profiles):
+        nIso = len(ellipseOut)
+        for name, value in stack.items():
+            if name in ellipseOut.colnames:
+                continue
+            if value.ndim == 1:
+                data = ellipseOut['sma'] * 0.0 + value[ii]
+            else:
+                data = value[ii, :nIso]
+            ellipseOut.add_column(Column(name=name, data=data))
+
+    return profiles
+
+
 def ellipseGetGrowthCurve(ellipOut, bkgCor=False, intensArr=None,
                           useTflux=False):
     """
@@ -659,8 +752,7 @@ def ellipseGetGrowthCurve(ellipOut, bkgCor=False, intensArr=None,
             isoFlux = np.append(
                 ellArea[0], [ellArea[1:] - ellArea[:-1]]) * ellipOut['intens']
         # Get the growth Curve
-        curveOfGrowth = np.asarray(map(lambda x: np.nansum(isoFlux[0:x + 1]),
-                                   range(isoFlux.shape[0])))
+        curveOfGrowth = np.nancumsum(isoFlux)
     else:
         curveOfGrowth = ellipOut['tflux_e']
 
@@ -687,71 +779,13 @@ def ellipseGetR50(ellipseRsma, isoGrowthCurve, simple=True):
 
 
 def ellipseGetAvgCen(ellipseOut, outRad, minSma=2.0):
-    """Get the Average X0/Y0."""
-    try:
-        xUse = ellipseOut['x0'][(ellipseOut['sma'] <= outRad) &
-                                (np.isfinite(ellipseOut['x0_err'])) &
-                                (np.isfinite(ellipseOut['y0_err']))]
-        yUse = ellipseOut['y0'][(ellipseOut['sma'] <= outRad) &
-                                (np.isfinite(ellipseOut['x0_err'])) &
-                                (np.isfinite(ellipseOut['y0_err']))]
-        iUse = ellipseOut['intens'][(ellipseOut['sma'] <= outRad) &
-                                    (np.isfinite(ellipseOut['x0_err'])) &
-                                    (np.isfinite(ellipseOut['y0_err']))]
-    except Exception:
-        xUse = ellipseOut['x0'][(ellipseOut['sma'] <= outRad)]
-        yUse = ellipseOut['y0'][(ellipseOut['sma'] <= outRad)]
-        iUse = ellipseOut['intens'][(ellipseOut['sma'] <= outRad)]
-
-    avgCenX = hUtil.numpy_weighted_mean(xUse, weights=iUse)
-    avgCenY = hUtil.numpy_weighted_mean(yUse, weights=iUse)
-
-    return avgCenX, avgCenY
+    """Get the Average X0/Y0 (galProfile.avgCenter)."""
+    return gProf.avgCenter(ellipseOut, outRad)
 
 
 def ellipseGetAvgGeometry(ellipseOut, outRad, minSma=8.0):
-    """Get the Average Q and PA."""
-    tfluxE = ellipseOut['tflux_e']
-    ringFlux = np.append(tfluxE[0], [tfluxE[1:] - tfluxE[:-1]])
-    try:
-        eUse = ellipseOut['ell'][(ellipseOut['sma'] <= outRad) &
-                                 (ellipseOut['sma'] >= minSma) &
-                                 (np.isfinite(ellipseOut['ell_err'])) &
-                                 (np.isfinite(ellipseOut['pa_err']))]
-        pUse = ellipseOut['pa_norm'][(ellipseOut['sma'] <= outRad) &
-                                     (ellipseOut['sma'] >= minSma) &
-                                     (np.isfinite(ellipseOut['ell_err'])) &
-                                     (np.isfinite(ellipseOut['pa_err']))]
-        fUse = ringFlux[(ellipseOut['sma'] <= outRad) &
-                        (ellipseOut['sma'] >= minSma) &
-                        (np.isfinite(ellipseOut['ell_err'])) &
-                        (np.isfinite(ellipseOut['pa_err']))]
-    except Exception:
-        try:
-            eUse = ellipseOut['ell'][(ellipseOut['sma'] <= outRad) &
-                                     (ellipseOut['sma'] >= 3.0) &
-                                     (np.isfinite(ellipseOut['ell_err'])) &
-                                     (np.isfinite(ellipseOut['pa_err']))]
-            pUse = ellipseOut['pa_norm'][(ellipseOut['sma'] <= outRad) &
-                                         (ellipseOut['sma'] >= 0.5) &
-                                         (np.isfinite(ellipseOut['ell_err'])) &
-                                         (np.isfinite(ellipseOut['pa_err']))]
-            fUse = ringFlux[(ellipseOut['sma'] <= outRad) &
-                            (ellipseOut['sma'] >= 0.5) &
-                            (np.isfinite(ellipseOut['ell_err'])) &
-                            (np.isfinite(ellipseOut['pa_err']))]
-        except Exception:
-            eUse = ellipseOut['ell'][(ellipseOut['sma'] <= outRad) &
-                                     (ellipseOut['sma'] >= 2.0)]
-            pUse = ellipseOut['pa_norm'][(ellipseOut['sma'] <= outRad) &
-                                         (ellipseOut['sma'] >= 0.5)]
-            fUse = ringFlux[(ellipseOut['sma'] <= outRad) &
-                            (ellipseOut['sma'] >= 0.5)]
-
-    avgQ = 1.0 - hUtil.numpy_weighted_mean(eUse, weights=fUse)
-    avgPA = hUtil.numpy_weighted_mean(pUse, weights=fUse)
-
-    return avgQ, avgPA
+    """Get the Average Q and PA (galProfile.avgGeometry)."""
+    return gProf.avgGeometry(ellipseOut, outRad, minSma)
 
 
 def ellipseFixNegIntens(ellipseOut):
@@ -801,6 +835,92 @@ def ellipseGetOuterBoundary(ellipseOut, ratio=1.2, margin=0.2, polyOrder=12,
         return None
 
 
+def ellipseUpdateProfile(ellipOut, zp=27.0, pix=1.0, exptime=1.0,
+                         outRatio=1.2, updateIntens=True, useTflux=False,
+                         verbose=False):
+    """
+    Add the columns that depend on the outer boundary of the profile.
+
+    The background of the outskirt is measured outside the outer boundary,
+    and used to update the intensity, the curve of growth, and the total
+    magnitudes (avg_bkg, intens_cor, sbp_cor, growth_cor, rad_outer,
+    mag_tot, mag_tot_ori, mag_tot_sub).
+    """
+    # Get the outer boundary of the isophotes
+    radOuter = ellipseGetOuterBoundary(ellipOut, ratio=outRatio)
+    sma = ellipOut['sma']
+    if radOuter is None:
+        print "XXX  radOuter is NaN, use 0.8 * max(SMA) instead !"
+        radOuter = np.nanmax(sma) * 0.8
+    """
+    Update the Intensity
+    Note that this avgBkg is different with the input bkg value
+    """
+    if updateIntens:
+        indexBkg = np.where(ellipOut['sma'] > radOuter)
+        if indexBkg[0].shape[0] > 0:
+            try:
+                intens1 = ellipOut['intens'][indexBkg]
+                clipArr, clipL, clipU = sigmaclip(intens1, 2.5, 2.0)
+                avgOut = np.nanmedian(clipArr)
+                intens2 = ellipOut['intens_sub'][indexBkg]
+                clipArr, clipL, clipU = sigmaclip(intens2, 2.5, 2.0)
+                avgBkg = np.nanmedian(clipArr)
+                if not np.isfinite(avgBkg):
+                    avgBkg = 0.0
+                    avgOut = 0.0
+            except Exception:
+                avgOut = 0.0
+                avgBkg = 0.0
+        else:
+            avgOut = 0.0
+            avgBkg = 0.0
+    else:
+        avgOut = 0.0
+        avgBkg = 0.0
+    if verbose:
+        print SEP
+        print "###     1-D SBP background value : ", avgOut
+        print "###     Current outer background : ", avgBkg
+        print SEP
+    """ Do not correct this ? """
+    ellipOut.add_column(Column(name='avg_bkg', data=(sma * 0.0 + avgBkg)))
+    intensCor = (ellipOut['intens_sub'] - avgBkg)
+    ellipOut.add_column(Column(name='intens_cor', data=intensCor))
+    sbpCor = zp - 2.5 * np.log10(intensCor / ((pix ** 2.0) * exptime))
+    ellipOut.add_column(Column(name='sbp_cor', data=sbpCor))
+    """ Update the curve of growth """
+    cogCor, mm, ff = ellipseGetGrowthCurve(ellipOut, intensArr=intensCor,
+                                           useTflux=useTflux)
+    ellipOut.add_column(Column(name='growth_cor', data=(cogCor)))
+    """ Update the outer radius """
+    radOuter = ellipseGetOuterBoundary(ellipOut, ratio=outRatio)
+    if not np.isfinite(radOuter):
+        if verbose:
+            print " XXX radOuter is NaN, use 0.80 * max(SMA) !"
+        radOuter = np.nanmax(sma) * 0.80
+    ellipOut.add_column(Column(name='rad_outer', data=(sma*0.0 + radOuter)))
+    """ Update the total magnitude """
+    indexUse = np.where(ellipOut['sma'] <= (radOuter * outRatio))
+    maxIsoFluxO = np.nanmax(ellipOut['growth_ori'][indexUse])
+    maxIsoFluxS = np.nanmax(ellipOut['growth_sub'][indexUse])
+    maxIsoFluxC = np.nanmax(ellipOut['growth_cor'][indexUse])
+
+    magFluxTotC = -2.5 * np.log10(maxIsoFluxC) + zp
+    ellipOut.add_column(
+        Column(name='mag_tot', data=(sma*0.0 + magFluxTotC)))
+
+    magFluxTotO = -2.5 * np.log10(maxIsoFluxO) + zp
+    ellipOut.add_column(
+        Column(name='mag_tot_ori', data=(sma*0.0 + magFluxTotO)))
+
+    magFluxTotS = -2.5 * np.log10(maxIsoFluxS) + zp
+    ellipOut.add_column(
+        Column(name='mag_tot_sub', data=(sma*0.0 + magFluxTotS)))
+
+    return ellipOut
+
+
 def ellipsePlotSummary(ellipOut, image, maxRad=None, mask=None, radMode='rsma',
                        outPng='ellipse_summary.png', zp=27.0, threshold=None,
                        showZoom=False, useZscale=True, pngSize=16,
@@ -1312,7 +1432,8 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
            olthresh=0.5, harmonics='1 2', outerThreshold=None,
            updateIntens=True, psfSma=6.0, suffix='', useZscale=True,
            hdu=0, saveCsv=False, imgType='_imgsub', useTflux=False,
-           isophote=None, xttools=None):
+           isophote=None, xttools=None, engine='iraf', scratch=None,
+           store=None, skyRms=None, minSnr=None, nLowSnr=3):
     """
     Running Ellipse to Extract 1-D profile.
 
@@ -1320,28 +1441,59 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
              2: Center Fixed
              3: All geometry fixd
              4: Force Photometry, must have inEllip
+    engine = 'iraf'   : STSDAS.ANALYSIS.ISOPHOTE.ELLIPSE
+             'native' : galIsophote.ellipseFit() in this process; the
+                        isophotes are saved in a FITS table (*_iso.fits)
+                        instead of the .bin file
+             'annulus': same as 'native', but stage 4 is the photometry
+                        in fixed elliptical annuli (galAnnulus)
+    scratch = directory for a scratch workspace (e.g. /dev/shm); all the
+              files are written there, and only the products (.bin,
+              _iso.fits, .pkl, .png, .csv) are copied back next to the
+              image (galWorkspace)
+    store   = directory of a profile store (profileStore); the profile is
+              appended to the store instead of being saved as a .pkl file
+    minSnr  = stop fitting the isophotes after nLowSnr of them in a row
+              have S/N < minSnr, with the sky RMS of one pixel skyRms
+              (galIsophote.isoSnr); only a few rings of sky are measured
+              outside it.  Only the native engine stops early, the radius
+              is saved in the sma_stop column for all engines, and the
+              retries do not go beyond it
     :returns: TODO
     """
     gc.collect()
     verStr = 'yes' if verbose else 'no'
     """ Minimum starting radius for Ellipsein pixel """
     minIniSma = 10.0
-    pixArea = (pix ** 2.0)
     """ Check input files """
-    if os.path.islink(image):
-        imgOri = os.readlink(image)
-    else:
-        imgOri = image
+    imgOri = hRerun.resolvePath(image)
     if not os.path.isfile(imgOri):
         raise Exception("### Can not find the input image: %s !" % imgOri)
 
+    if engine not in ('iraf', 'native', 'annulus'):
+        raise Exception("### Available engine: iraf, native, annulus")
+    if (engine == 'iraf') and (isophote is None) and (not useIraf):
+        raise Exception("### Can not import pyraf, try engine='native'")
+
     """
     Check if x_isophote.e and x_ttools.e exist if necessary
     """
-    if (not os.path.isfile(isophote)) or (not os.path.isfile(isophote)):
-        raise Exception("Can not find x_isophote.e: %s" % isophote)
-    if (not os.path.isfile(xttools)) or (not os.path.isfile(xttools)):
-        raise Exception("Can not find x_ttools.e: %s" % xttools)
+    if engine == 'iraf':
+        if (isophote is not None) and (not os.path.isfile(isophote)):
+            raise Exception("Can not find x_isophote.e: %s" % isophote)
+        if (xttools is not None) and (not os.path.isfile(xttools)):
+            raise Exception("Can not find x_ttools.e: %s" % xttools)
+
+    """
+    Keep all the files in a scratch workspace if necessary
+    """
+    if scratch is not None:
+        space = gWork.Workspace(os.path.dirname(os.path.abspath(image)),
+                                root=scratch, verbose=verbose).start()
+        outRoot = space.path(image)
+    else:
+        space = None
+        outRoot = image
 
     """
     New approach, save the HDU into a temp fits file
@@ -1351,23 +1503,24 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
     imgHduList = fits.HDUList([imgHdu])
     while True:
         imgTemp = 'temp_' + randomStr() + '.fits'
+        if space is not None:
+            imgTemp = space.path(imgTemp)
         if not os.path.isfile(imgTemp):
             imgHduList.writeto(imgTemp)
             break
 
     """ Conver the .fits mask to .pl file if necessary """
     if mask is not None:
-        if os.path.islink(mask):
-            mskOri = os.readlink(mask)
-        else:
-            mskOri = mask
+        mskOri = hRerun.resolvePath(mask)
         if not os.path.isfile(mskOri):
             try:
                 os.remove(imgTemp)
             except Exception:
                 pass
             raise Exception("### Can not find the input mask: %s !" % mskOri)
-        if plMask:
+        if engine != 'iraf':
+            imageUse = imgTemp
+        elif plMask:
             plFile = maskFits2Pl(imgTemp, mskOri)
             plFile2 = maskFits2Pl(imgTemp, mskOri, replace=True)
             if not os.path.isfile(plFile):
@@ -1477,14 +1630,18 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
         suffix = '_ellip_' + suffix + '_' + str(stage).strip()
     else:
         suffix = '_ellip_' + suffix + str(stage).strip()
-    outBin = image.replace('.fits', suffix + '.bin')
-    outTab = image.replace('.fits', suffix + '.tab')
-    outCdf = image.replace('.fits', suffix + '.cdf')
+    if engine != 'iraf':
+        outBin = outRoot.replace('.fits', suffix + '_iso.fits')
+        mskArr = None if mskOri is None else (fits.open(mskOri))[0].data
+    else:
+        outBin = outRoot.replace('.fits', suffix + '.bin')
+    outTab = outRoot.replace('.fits', suffix + '.tab')
+    outCdf = outRoot.replace('.fits', suffix + '.cdf')
     if isophote is not None:
         outPar = outBin.replace('.bin', '.par')
 
     """ Call the STSDAS.ANALYSIS.ISOPHOTE package """
-    if isophote is None:
+    if (engine == 'iraf') and (isophote is None):
         if verbose:
             print '\n' + SEP
             print "##       Call STSDAS.ANALYSIS.ISOPHOTE() "
@@ -1494,14 +1651,16 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
         iraf.isophote()
 
     """ Start the Ellipse Run """
-    attempts = 0
+    attempts, smaStop = 0, np.nan
     while attempts < maxTry:
         if verbose:
             print '\n' + SEP
             print "##       Start the Ellipse Run: Attempt ", (attempts + 1)
         try:
             """ Config the parameters for ellipse """
-            if isophote is None:
+            if engine != 'iraf':
+                pass
+            elif isophote is None:
                 unlearnEllipse()
                 setupEllipse(ellipCfg)
             else:
@@ -1524,7 +1683,21 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
                 print "###      Origin Image  : %s" % imgOri
                 print "###      Input Image   : %s" % imageUse
                 print "###      Output Binary : %s" % outBin
-            if isophote is None:
+            if engine != 'iraf':
+                if stage == 4:
+                    print "###      Input Table   : %s" % inEllip
+                if (engine == 'annulus') and (stage == 4):
+                    isoTab = gAnn.annulusProfile(data, ellipCfg, inEllip,
+                                                 mskArr=mskArr)
+                else:
+                    isoTab = gIso.ellipseFit(data, ellipCfg, mskArr=mskArr,
+                                             inEllip=inEllip,
+                                             verbose=verbose,
+                                             skyRms=skyRms, skyBkg=bkg,
+                                             minSnr=minSnr,
+                                             nLowSnr=nLowSnr)
+                gIso.saveIsoTable(isoTab, outBin)
+            elif isophote is None:
                 if stage != 4:
                     iraf.ellipse(input=imageUse, output=outBin, verbose=verStr)
                 else:
@@ -1550,108 +1723,58 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
                     os.remove(outTab)
                 if os.path.isfile(outCdf):
                     os.remove(outCdf)
-                if xttools is None:
-                    iraf.unlearn('tdump')
-                    iraf.tdump.columns = ''
-                    iraf.tdump(outBin, datafil=outTab, cdfile=outCdf)
+                if engine != 'iraf':
+                    ellipTab = isoTab
                 else:
-                    tdumpCommand = xttools + ' tdump '
-                    tdumpCommand += ' table=%s ' % outBin.strip()
-                    tdumpCommand += ' datafile=%s ' % outTab.strip()
-                    tdumpCommand += ' cdfile=%s ' % outCdf.strip()
-                    tdumpCommand += ' pfile=STDOUT pwidth=-1 '
-                    tdumpCommand += ' columns="" rows="-" mode="al"'
-                    tdumpOut = os.system(tdumpCommand)
-                    if tdumpOut != 0:
-                        raise Exception("XXX Can not convert the binary tab")
+                    ellipTab = readEllipseBin(outBin, harmonics=harmonics,
+                                              verbose=verbose)
+                # Only use tdump when the binary table can not be read
+                if ellipTab is None:
+                    ellipTab = outTab
+                    if xttools is None:
+                        iraf.unlearn('tdump')
+                        iraf.tdump.columns = ''
+                        iraf.tdump(outBin, datafil=outTab, cdfile=outCdf)
+                    else:
+                        tdumpCommand = xttools + ' tdump '
+                        tdumpCommand += ' table=%s ' % outBin.strip()
+                        tdumpCommand += ' datafile=%s ' % outTab.strip()
+                        tdumpCommand += ' cdfile=%s ' % outCdf.strip()
+                        tdumpCommand += ' pfile=STDOUT pwidth=-1 '
+                        tdumpCommand += ' columns="" rows="-" mode="al"'
+                        tdumpOut = os.system(tdumpCommand)
+                        if tdumpOut != 0:
+                            raise Exception(
+                                "XXX Can not convert the binary tab")
                 # Read in the Ellipse output tab
-                ellipOut = readEllipseOut(outTab, zp=zpPhoto, pix=pix,
+                ellipOut = readEllipseOut(ellipTab, zp=zpPhoto, pix=pix,
                                           exptime=expTime, bkg=bkg,
                                           harmonics=harmonics,
                                           minSma=psfSma, useTflux=useTflux)
-                # Get the outer boundary of the isophotes
-                radOuter = ellipseGetOuterBoundary(ellipOut,
-                                                   ratio=outRatio)
-                sma = ellipOut['sma']
-                if radOuter is None:
-                    print "XXX  radOuter is NaN, use 0.8 * max(SMA) instead !"
-                    radOuter = np.nanmax(sma) * 0.8
-                """
-                Update the Intensity
-                Note that this avgBkg is different with the input bkg value
-                """
-                if updateIntens:
-                    indexBkg = np.where(ellipOut['sma'] > radOuter)
-                    if indexBkg[0].shape[0] > 0:
-                        try:
-                            intens1 = ellipOut['intens'][indexBkg]
-                            clipArr, clipL, clipU = sigmaclip(intens1,
-                                                              2.5, 2.0)
-                            avgOut = np.nanmedian(clipArr)
-                            intens2 = ellipOut['intens_sub'][indexBkg]
-                            clipArr, clipL, clipU = sigmaclip(intens2,
-                                                              2.5, 2.0)
-                            avgBkg = np.nanmedian(clipArr)
-                            if not np.isfinite(avgBkg):
-                                avgBkg = 0.0
-                                avgOut = 0.0
-                        except Exception:
-                            avgOut = 0.0
-                            avgBkg = 0.0
+                # Radius where the S/N of the isophotes becomes too low
+                if minSnr is not None:
+                    if 'SMA_STOP' in ellipOut.meta:
+                        smaStop = ellipOut.meta['SMA_STOP']
                     else:
-                        avgOut = 0.0
-                        avgBkg = 0.0
-                else:
-                    avgOut = 0.0
-                    avgBkg = 0.0
+                        smaStop = gIso.snrStopSma(ellipOut, skyRms=skyRms,
+                                                  skyBkg=bkg, minSnr=minSnr,
+                                                  nLowSnr=nLowSnr)
+                    ellipOut.add_column(
+                        Column(name='sma_stop',
+                               data=(ellipOut['sma'] * 0.0 + smaStop)))
                 if verbose:
                     print SEP
                     print "###     Input background value   : ", bkg
-                    print "###     1-D SBP background value : ", avgOut
-                    print "###     Current outer background : ", avgBkg
-                    print SEP
-                """ Do not correct this ? """
-                ellipOut.add_column(Column(name='avg_bkg',
-                                    data=(sma * 0.0 + avgBkg)))
-                intensCor = (ellipOut['intens_sub'] - avgBkg)
-                ellipOut.add_column(Column(name='intens_cor', data=intensCor))
-                sbpCor = zpPhoto - 2.5 * np.log10(intensCor / (pixArea *
-                                                               expTime))
-                ellipOut.add_column(Column(name='sbp_cor', data=sbpCor))
-                """ Update the curve of growth """
-                cogCor, mm, ff = ellipseGetGrowthCurve(ellipOut,
-                                                       intensArr=intensCor,
-                                                       useTflux=useTflux)
-                ellipOut.add_column(Column(name='growth_cor', data=(cogCor)))
-                """ Update the outer radius """
-                radOuter = ellipseGetOuterBoundary(ellipOut, ratio=outRatio)
-                if not np.isfinite(radOuter):
-                    if verbose:
-                        print " XXX radOuter is NaN, use 0.80 * max(SMA) !"
-                    radOuter = np.nanmax(sma) * 0.80
-                ellipOut.add_column(
-                    Column(name='rad_outer', data=(sma*0.0 + radOuter)))
-                """ Update the total magnitude """
-                indexUse = np.where(ellipOut['sma'] <= (radOuter * outRatio))
-                maxIsoFluxO = np.nanmax(ellipOut['growth_ori'][indexUse])
-                maxIsoFluxS = np.nanmax(ellipOut['growth_sub'][indexUse])
-                maxIsoFluxC = np.nanmax(ellipOut['growth_cor'][indexUse])
-
-                magFluxTotC = -2.5 * np.log10(maxIsoFluxC) + zpPhoto
-                ellipOut.add_column(
-                    Column(name='mag_tot', data=(sma*0.0 + magFluxTotC)))
-
-                magFluxTotO = -2.5 * np.log10(maxIsoFluxO) + zpPhoto
-                ellipOut.add_column(
-                    Column(name='mag_tot_ori', data=(sma*0.0 + magFluxTotO)))
-
-                magFluxTotS = -2.5 * np.log10(maxIsoFluxS) + zpPhoto
-                ellipOut.add_column(
-                    Column(name='mag_tot_sub', data=(sma*0.0 + magFluxTotS)))
+                ellipOut = ellipseUpdateProfile(ellipOut, zp=zpPhoto, pix=pix,
+                                                exptime=expTime,
+                                                outRatio=outRatio,
+                                                updateIntens=updateIntens,
+                                                useTflux=useTflux,
+                                                verbose=verbose)
 
                 """ Save a summary figure """
                 if savePng:
-                    outPng = image.replace('.fits', suffix + '.png')
+                    outPng = outRoot.replace('.fits', suffix + '.png')
                     try:
                         ellipsePlotSummary(ellipOut, imgTemp, maxRad=None,
                                            mask=mskOri, outPng=outPng,
@@ -1664,9 +1787,14 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
 
                 """ Save the results """
                 if saveOut:
-                    outPre = image.replace('.fits', suffix)
+                    outPre = outRoot.replace('.fits', suffix)
                     saveEllipOut(ellipOut, outPre, ellipCfg=ellipCfg,
-                                 verbose=verbose, csv=saveCsv)
+                                 verbose=verbose, csv=saveCsv,
+                                 pkl=(store is None))
+                    if store is not None:
+                        pStore.appendProfile(store,
+                                             image.replace('.fits', suffix),
+                                             ellipOut)
                 gc.collect()
                 break
         except Exception as error:
@@ -1676,6 +1804,9 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
             if verbose:
                 print "###  !!! Make the Ellipse Run A Little Bit Easier !"
             print WAR
+            if np.isfinite(smaStop) and (smaStop < ellipCfg['maxsma']):
+                """ No need to fit the low S/N isophotes again """
+                ellipCfg['maxsma'] = smaStop
             ellipCfg = easierEllipse(ellipCfg, degree=attempts)
             attempts += 1
         gc.collect()
@@ -1685,29 +1816,36 @@ def galSBP(image, mask=None, galX=None, galY=None, inEllip=None,
         print "###  ELLIPSE RUN FAILED AFTER %3d ATTEMPTS!!!" % maxTry
         print WAR
 
-    """
-    Remove the temp files
-    """
-    try:
-        os.remove(imgTemp)
-    except Exception:
-        pass
-    try:
-        os.remove(plFile)
-        os.remove(plFile2)
-    except Exception:
-        pass
-    """
-    Remove some outputs to save space
-    """
-    try:
-        os.remove(outCdf)
-    except Exception:
-        pass
-    try:
-        os.remove(outTab + '_back')
-    except Exception:
-        pass
+    if space is not None:
+        """
+        Copy the products back, and remove the workspace
+        """
+        space.finish()
+        outBin = space.outPath(outBin)
+    else:
+        """
+        Remove the temp files
+        """
+        try:
+            os.remove(imgTemp)
+        except Exception:
+            pass
+        try:
+            os.remove(plFile)
+            os.remove(plFile2)
+        except Exception:
+            pass
+        """
+        Remove some outputs to save space
+        """
+        try:
+            os.remove(outCdf)
+        except Exception:
+            pass
+        try:
+            os.remove(outTab + '_back')
+        except Exception:
+            pass
 
     return ellipOut, outBin
 
@@ -1820,6 +1958,26 @@ if __name__ == '__main__':
     parser.add_argument("--xttools", dest='xttools',
                         help="Location of the x_ttools.e file",
                         default=None)
+    parser.add_argument("--engine", dest='engine',
+                        help="Isophote engine: iraf, native or annulus",
+                        default='iraf',
+                        choices=['iraf', 'native', 'annulus'])
+    parser.add_argument("--scratch", dest='scratch',
+                        help="Scratch directory for the temporary files " +
+                        "(e.g. /dev/shm)",
+                        default=None)
+    parser.add_argument("--store", dest='store',
+                        help="Directory of the profile store",
+                        default=None)
+    parser.add_argument("--minSnr", dest='minSnr', type=float,
+                        help="Stop the isophotes when the S/N is lower",
+                        default=None)
+    parser.add_argument("--nLowSnr", dest='nLowSnr', type=int,
+                        help="Number of low S/N isophotes before stopping",
+                        default=3)
+    parser.add_argument("--skyRms", dest='skyRms', type=float,
+                        help="RMS of the sky in one pixel",
+                        default=None)
 
     args = parser.parse_args()
 
@@ -1862,4 +2020,10 @@ if __name__ == '__main__':
            hdu=args.hdu,
            saveCsv=args.saveCsv,
            isophote=args.isophote,
-           xttools=args.xttools)
+           xttools=args.xttools,
+           engine=args.engine,
+           scratch=args.scratch,
+           store=args.store,
+           skyRms=args.skyRms,
+           minSnr=args.minSnr,
+           nLowSnr=args.nLowSnr)
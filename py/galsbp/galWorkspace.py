@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Scratch workspace in local memory for the intermediate files of ELLIPSE."""
+
+from __future__ import (division, print_function)
+
+import os
+import atexit
+import shutil
+import tempfile
+import warnings
+
+SEP = '-' * 100
+
+"""
+galSBP() writes a lot of short-lived files (temp_*.fits, .pl masks, .par
+files, .tab and .cdf dumps) and deletes most of them right away.  On a
+shared file system (e.g. Lustre) every one of them is a create/unlink on
+the metadata server.
+
+A workspace is a private directory on a local tmpfs (/dev/shm by default)
+for one galSBP() run.  All the files are written there, and only the
+products are copied back into the output directory when the run is
+finished.  Each copy is written to a temporary name first and renamed, so
+the readers never see a partial file.
+
+The name of a workspace carries the PID of its owner.  Workspaces whose
+owner is dead are removed when a new one is started, and the open
+workspaces of a process are removed when it exits.  galSBP() uses one
+workspace at a time, so starting a new workspace also removes the ones
+left open by an earlier run in the same process (e.g. after an error).
+"""
+SCRATCH_ROOT = '/dev/shm'
+PREFIX = 'galsbp_'
+KEEP_SUFFIX = ['.pkl', '.png', '.csv', '.bin', '_iso.fits']
+
+"""
+Files and bytes kept off the output file system by this process; the
+worker processes send their totals back through addTotals()
+"""
+TOTALS = {'nWorkspace': 0, 'nFile': 0, 'nByte': 0,
+          'nCopy': 0, 'nByteCopy': 0}
+_OPEN = []
+
+
+def _pidAlive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == 1
+    return True
+
+
+def cleanStale(root=SCRATCH_ROOT, prefix=PREFIX):
+    """
+    Remove the workspaces left by the processes that are dead.
+
+    Return:
+        number of workspaces removed
+    """
+    nClean = 0
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return 0
+    for name in names:
+        if not name.startswith(prefix):
+            continue
+        try:
+            pid = int(name[len(prefix):].split('_')[0])
+        except ValueError:
+            continue
+        if not _pidAlive(pid):
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+            nClean += 1
+    return nClean
+
+
+def _cleanOpen():
+    for space in list(_OPEN):
+        space.discard()
+
+
+atexit.register(_cleanOpen)
+
+
+class Workspace(object):
+    """
+    Private scratch directory for one run.
+
+    Usage:
+        space = Workspace(outDir, root='/dev/shm').start()
+        outBin = space.path(image.replace('.fits', '.bin'))
+        ...
+        space.finish()
+    """
+
+    def __init__(self, outDir, root=SCRATCH_ROOT, keep=None, verbose=False):
+        """
+        Parameters:
+            outDir : where the products are copied back
+            root   : where to make the workspace; the default temporary
+                     directory is used when it is not available
+            keep   : suffixes of the products, default KEEP_SUFFIX
+        """
+        self.outDir = os.path.abspath(outDir)
+        self.root = root
+        self.keep = list(KEEP_SUFFIX if keep is None else keep)
+        self.verbose = verbose
+        self.dir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, errType, errValue, traceback):
+        if errType is None:
+            self.finish()
+        else:
+            self.discard()
+
+    def start(self):
+        """Make the workspace."""
+        for space in [s for s in _OPEN if s.pid == os.getpid()]:
+            space.discard()
+        root = self.root
+        if (root is None) or (not os.path.isdir(root)) or \
+                (not os.access(root, os.W_OK)):
+            if root is not None:
+                warnings.warn("### Can not use %s as scratch, use %s" %
+                              (root, tempfile.gettempdir()))
+            root = tempfile.gettempdir()
+        cleanStale(root)
+        self.pid = os.getpid()
+        self.dir = tempfile.mkdtemp(prefix='%s%d_' % (PREFIX, self.pid),
+                                    dir=root)
+        _OPEN.append(self)
+        TOTALS['nWorkspace'] += 1
+        return self
+
+    def path(self, name):
+        """Path of a file with the same name inside the workspace."""
+        return os.path.join(self.dir, os.path.basename(name))
+
+    def outPath(self, name):
+        """Path of a file with the same name in the output directory."""
+        return os.path.join(self.outDir, os.path.basename(name))
+
+    def copyOut(self, name, outDir=None):
+        """
+        Copy one file of the workspace to the output directory.
+
+        The copy is written to a hidden file first and renamed, so the
+        readers never see a partial file; the hidden file is removed when
+        the copy fails.
+        """
+        outDir = self.outDir if outDir is None else outDir
+        target = os.path.join(outDir, os.path.basename(name))
+        hidden = os.path.join(outDir, '.%s.%d.part' %
+                              (os.path.basename(name), self.pid))
+        try:
+            shutil.copyfile(self.path(name), hidden)
+            os.rename(hidden, target)
+        except (IOError, OSError):
+            if os.path.isfile(hidden):
+                os.remove(hidden)
+            raise
+        return target
+
+    def finish(self):
+        """
+        Copy the products back, and remove the workspace.
+
+        Return:
+            dict with the number of files and bytes copied back, and kept
+            off the output directory
+        """
+        stats = {'nCopy': 0, 'nByteCopy': 0, 'nFile': 0, 'nByte': 0}
+        if self.dir is None:
+            return stats
+        for name in sorted(os.listdir(self.dir)):
+            fileTemp = os.path.join(self.dir, name)
+            if not os.path.isfile(fileTemp):
+                continue
+            size = os.path.getsize(fileTemp)
+            if any(name.endswith(suffix) for suffix in self.keep):
+                self.copyOut(name)
+                stats['nCopy'] += 1
+                stats['nByteCopy'] += size
+            else:
+                stats['nFile'] += 1
+                stats['nByte'] += size
+        self.discard()
+        for key in stats:
+            TOTALS[key] += stats[key]
+        if self.verbose:
+            print("###    Workspace: %d files (%d bytes) copied back, " %
+                  (stats['nCopy'], stats['nByteCopy']) +
+                  "%d files (%d bytes) kept in scratch" %
+                  (stats['nFile'], stats['nByte']))
+        return stats
+
+    def discard(self):
+        """Remove the workspace without copying anything back."""
+        if self.dir is not None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+        if self in _OPEN:
+            _OPEN.remove(self)
+
+
+def totalsSince(before):
+    """Change of the totals since an earlier copy of TOTALS."""
+    return dict((key, TOTALS[key] - before.get(key, 0)) for key in TOTALS)
+
+
+def addTotals(stats):
+    """Add the totals of a worker process to the ones of this process."""
+    for key in stats:
+        TOTALS[key] += stats[key]
+
+
+def workspaceReport(verbose=True):
+    """Summary of the workspaces used by this process."""
+    if verbose:
+        print(SEP)
+        print("###    Scratch workspaces : %d" % TOTALS['nWorkspace'])
+        print("###    Kept in scratch    : %d files, %.2f MB" %
+              (TOTALS['nFile'], TOTALS['nByte'] / 1048576.0))
+        print("###    Copied back        : %d files, %.2f MB" %
+              (TOTALS['nCopy'], TOTALS['nByteCopy'] / 1048576.0))
+        print(SEP)
+    return dict(TOTALS)
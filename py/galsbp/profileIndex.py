@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Index of the pickled ELLIPSE profiles from one scan of the outputs."""
+
+from __future__ import (division, print_function)
+
+import os
+import time
+import fnmatch
+import warnings
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+
+from astropy.table import Table
+
+import profileStore as pStore
+
+SEP = '-' * 100
+
+"""
+sbpCollect() asks for about 22 profiles of each galaxy.  For each one,
+getEllipProfile() builds the name of the pickle file, checks it with
+os.path.isfile() and loads it; on a shared file system the metadata calls
+cost more than the loading.
+
+The index lists the directories of the profiles once:
+
+    <root>/<galaxy>/<filter>/<rerun>/<prefix>_*_ellip_*.pkl
+
+and keeps the path of each profile under the key of the profile store
+within a sample, (galaxy, filter, rerun, imgType, model).  The key has no
+prefix, so an index only has the profiles of one prefix: samples that
+share the output tree (e.g. redBCG and nonBCG) need their own index.  It
+can be saved as a manifest (a FITS table) and read back, so the scan is
+only done once for a sample, and it can be cut into the subsets used by
+the workers.
+
+The index has the same get() as profileStore.ProfileStore, so it can be
+given to sbpCollect() as the store.  It is complete: a profile that is not
+in the index does not exist, and getEllipProfile() does not look for the
+file.  When a ProfileStore is attached, the profiles are read from the
+store first.
+"""
+PATTERN = '*_ellip_*.pkl'
+MANIFEST = 'sbp_manifest.fits'
+
+
+def _listDir(path):
+    """Names in a directory; empty when it is not a directory."""
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def scanProfiles(root, galaxies=None, rerun='default', pattern=PATTERN,
+                 prefix=None):
+    """
+    Find all the profiles of a sample with one scan of the output tree.
+
+    Parameters:
+        root     : top of the outputs, <root>/<galaxy>/<filter>/<rerun>/
+        galaxies : list of galaxy IDs; all the folders under root if None
+        prefix   : only the profiles with this prefix; all of them if None
+
+    Return:
+        list of dict with the keys of the profile and its path relative
+        to root
+    """
+    if galaxies is None:
+        galaxies = sorted(_listDir(root))
+    if prefix is not None:
+        pattern = prefix + '_' + pattern
+    entries = []
+    for galaxy in galaxies:
+        galaxy = str(galaxy).strip()
+        for filt in sorted(_listDir(os.path.join(root, galaxy))):
+            rerunDir = os.path.join(galaxy, filt, rerun)
+            names = _listDir(os.path.join(root, rerunDir))
+            for name in sorted(fnmatch.filter(names, pattern)):
+                entry = pStore.parseProfileName(name)
+                if not entry['model']:
+                    continue
+                if (prefix is not None) and (entry['prefix'] != prefix):
+                    continue
+                entry['galaxy'], entry['filter'] = galaxy, filt
+                entry['rerun'] = rerun
+                entry['path'] = os.path.join(rerunDir, name)
+                entries.append(entry)
+
+    return entries
+
+
+class ProfileIndex(object):
+    """
+    Where the profiles are.
+
+    Usage:
+        index = ProfileIndex.scan(root, galaxies, rerun='default',
+                                  prefix='redBCG')
+        index.save(os.path.join(root, 'sbp_sum', 'sbp_manifest.fits'))
+        index = ProfileIndex.load(manifest, root)
+        prof = index.get('12345', 'HSC-I', 'default_3', imgType='imgsub')
+    """
+
+    complete = True
+
+    def __init__(self, root, entries, store=None, prefix=None):
+        """
+        Parameters:
+            root    : top of the outputs; the paths are relative to it
+            entries : from scanProfiles()
+            store   : ProfileStore (or its directory) read before the
+                      pickle files
+            prefix  : prefix of the profiles; the entries with another
+                      prefix are left out
+        """
+        self.root = root
+        self.store = store
+        self.prefix = prefix
+        self.entries = {}
+        self.nLoad = 0
+        for entry in entries:
+            if (prefix is not None) and (entry.get('prefix', prefix) !=
+                                         prefix):
+                continue
+            key = tuple(str(entry[col]) for col in pStore.KEY_COLUMNS)
+            self.entries[key] = str(entry['path'])
+
+    @classmethod
+    def scan(cls, root, galaxies=None, rerun='default', pattern=PATTERN,
+             store=None, prefix=None):
+        """Build the index from a scan of the output tree."""
+        return cls(root, scanProfiles(root, galaxies=galaxies, rerun=rerun,
+                                      pattern=pattern, prefix=prefix),
+                   store=store, prefix=prefix)
+
+    @classmethod
+    def load(cls, manifest, root=None, store=None):
+        """
+        Read the index from a manifest; root and prefix are the ones saved
+        in it.
+        """
+        table = Table.read(manifest, format='fits')
+        if root is None:
+            root = str(table.meta.get('ROOT', '.'))
+        prefix = table.meta.get('PREFIX', None)
+        entries = [dict((col, str(row[col]).strip())
+                        for col in pStore.KEY_COLUMNS + ['path'])
+                   for row in table]
+        return cls(root, entries, store=store,
+                   prefix=(str(prefix) if prefix else None))
+
+    def save(self, manifest):
+        """Write the index as a FITS table; return the name of the file."""
+        keys = sorted(self.entries)
+        columns = [np.array([key[ii] for key in keys], dtype=str)
+                   for ii in range(len(pStore.KEY_COLUMNS))]
+        columns.append(np.array([self.entries[key] for key in keys],
+                                dtype=str))
+        if keys:
+            table = Table(columns, names=pStore.KEY_COLUMNS + ['path'])
+        else:
+            table = Table(names=pStore.KEY_COLUMNS + ['path'],
+                          dtype=[str] * (len(pStore.KEY_COLUMNS) + 1))
+        table.meta['ROOT'] = os.path.abspath(self.root)
+        if self.prefix is not None:
+            table.meta['PREFIX'] = self.prefix
+        table.meta['TIME'] = time.time()
+        """ Write to a hidden file first, then rename it """
+        hidden = os.path.join(os.path.dirname(manifest),
+                              '.%s.%d.part' % (os.path.basename(manifest),
+                                               os.getpid()))
+        table.write(hidden, format='fits', overwrite=True)
+        os.rename(hidden, manifest)
+
+        return manifest
+
+    def __len__(self):
+        return len(self.entries)
+
+    def galaxies(self):
+        """IDs of the galaxies in the index."""
+        return sorted(set(key[0] for key in self.entries))
+
+    def subset(self, galaxies, store=None):
+        """
+        A smaller index with only some of the galaxies, for a worker.
+
+        Parameters:
+            store : ProfileStore (or its directory) of the new index; the
+                    one of this index when None
+        """
+        galaxies = set(str(galaxy).strip() for galaxy in galaxies)
+        entries = []
+        for key, path in self.entries.items():
+            if key[0] in galaxies:
+                entry = dict(zip(pStore.KEY_COLUMNS, key))
+                entry['path'] = path
+                entries.append(entry)
+        return ProfileIndex(self.root, entries,
+                            store=(self.store if store is None else store),
+                            prefix=self.prefix)
+
+    def path(self, galaxy, filter, model, imgType='imgsub',
+             rerun='default'):
+        """Full path of a profile, or None."""
+        path = self.entries.get((str(galaxy).strip(), filter, rerun,
+                                 imgType, model))
+        if path is None:
+            return None
+        return os.path.join(self.root, path)
+
+    def get(self, galaxy, filter, model, imgType='imgsub', rerun='default',
+            prefix=None):
+        """
+        One profile, or None.
+
+        Parameters:
+            prefix : only the profile with this prefix; None when it is not
+                     the prefix of the index
+        """
+        if prefix is None:
+            prefix = self.prefix
+        elif (self.prefix is not None) and (prefix != self.prefix):
+            return None
+        if isinstance(self.store, str):
+            """ Open the store in the process that reads it """
+            self.store = pStore.ProfileStore(self.store)
+        if self.store is not None:
+            prof = self.store.get(galaxy, filter, model, imgType=imgType,
+                                  rerun=rerun, prefix=prefix)
+            if prof is not None:
+                return prof
+        path = self.path(galaxy, filter, model, imgType=imgType,
+                         rerun=rerun)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as pkl:
+                prof = pickle.load(pkl)
+        except (IOError, OSError, EOFError) as err:
+            warnings.warn("### Can not read the profile %s : %s" %
+                          (path, str(err)))
+            return None
+        self.nLoad += 1
+
+        return prof
+
+
+def manifestName(sumDir, prefix=None):
+    """Manifest of the index of a prefix: <sumDir>/<prefix>_sbp_manifest."""
+    if prefix is None:
+        return os.path.join(sumDir, MANIFEST)
+    return os.path.join(sumDir, prefix + '_' + MANIFEST)
+
+
+def buildIndex(root, galaxies=None, rerun='default', manifest=None,
+               rescan=True, store=None, prefix=None, verbose=False):
+    """
+    Index of the profiles of a sample, saved to (or read from) a manifest.
+
+    Parameters:
+        manifest : file of the manifest; not saved when None
+        rescan   : scan the output tree even when the manifest exists; the
+                   manifest of another prefix is never used
+        prefix   : prefix of the profiles of the sample
+
+    Return:
+        ProfileIndex
+    """
+    t0 = time.time()
+    index = None
+    if (manifest is not None) and (not rescan) and os.path.isfile(manifest):
+        index = ProfileIndex.load(manifest, root=root, store=store)
+        source = manifest
+        if index.prefix != prefix:
+            warnings.warn("### The manifest %s is for the prefix %s" %
+                          (manifest, index.prefix))
+            index = None
+    if index is None:
+        index = ProfileIndex.scan(root, galaxies=galaxies, rerun=rerun,
+                                  store=store, prefix=prefix)
+        source = root
+        if manifest is not None:
+            index.save(manifest)
+    if verbose:
+        print(SEP)
+        print("###    %d profiles of %d galaxies from %s in %.1f sec" %
+              (len(index), len(index.galaxies()), source, time.time() - t0))
+        print(SEP)
+
+    return index
@@ -0,0 +1,516 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Append-only store of the 1-D profiles from ELLIPSE."""
+
+from __future__ import (division, print_function)
+
+import os
+import re
+import time
+import socket
+import fnmatch
+import warnings
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.table import Table
+
+import galProfile as gProf
+
+SEP = '-' * 100
+
+"""
+A profile store is a directory with FITS files:
+
+    profiles.fits : the merged store; HDU 1 (INDEX) has one row per
+                    profile, HDU 2 (PROFILES) has the isophotes of all the
+                    profiles one after another.  Column 'offset' and
+                    'length' of the index give the rows of each profile.
+    shard_*.fits  : written by one process each; every profile is appended
+                    as a new binary table HDU, with the keys in the header.
+
+Each process only appends to its own shard, so many workers can write at
+the same time without locks.  mergeStore() turns the shards into a new
+profiles.fits, which is memory-mapped by the readers.  When the same key
+is written more than once, the latest one wins.  A column that is missing
+from some of the profiles is NaN for them, or INT_FILL (also the TNULL of
+the column) when it is an integer column.
+
+The key of a profile is (prefix, galaxy, filter, rerun, imgType, model),
+parsed from the usual name of the output:
+
+    <root>/<galaxy>/<filter>/<rerun>/
+        <prefix>_<galaxy>_<filter>_full_<imgType>_ellip_<model>.pkl
+
+so the samples that share the output tree (e.g. redBCG and nonBCG) can
+also share a store.  KEY_COLUMNS is the key within one sample.
+"""
+STORE_FILE = 'profiles.fits'
+SHARD_PREFIX = 'shard_'
+INT_FILL = -2147483647
+KEY_COLUMNS = ['galaxy', 'filter', 'rerun', 'imgType', 'model']
+STORE_KEY_COLUMNS = ['prefix'] + KEY_COLUMNS
+INDEX_COLUMNS = STORE_KEY_COLUMNS + ['name', 'time']
+PROFILE_NAME = re.compile(r'^(?P<prefix>.+)_(?P<galaxy>[^_]+)_' +
+                          r'(?P<filter>[^_]+)_full_' +
+                          r'(?P<imgType>img|imgsub|psf)_ellip_' +
+                          r'(?P<model>.+)$')
+_WRITERS = {}
+
+
+def parseProfileName(path):
+    """
+    Get the key of a profile from the name of its output file.
+
+    Return:
+        dict with galaxy, filter, rerun, imgType, model, name and prefix;
+        the fields that can not be parsed are empty strings
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    key = dict((col, '') for col in INDEX_COLUMNS if col != 'time')
+    key['name'] = name
+    match = PROFILE_NAME.match(name)
+    if match is not None:
+        key.update(match.groupdict())
+        parts = os.path.abspath(path).split(os.sep)
+        """ .../<galaxy>/<filter>/<rerun>/<file> """
+        if (len(parts) >= 4 and parts[-3] == key['filter'] and
+                parts[-4] == key['galaxy']):
+            key['rerun'] = parts[-2]
+
+    return key
+
+
+def _profileArrays(prof):
+    """Plain numerical columns of a profile."""
+    arrays = []
+    for col in prof.colnames:
+        value = np.asarray(prof[col])
+        if value.ndim != 1 or value.dtype.kind not in 'biuf':
+            continue
+        if hasattr(prof[col], 'filled'):
+            value = np.asarray(prof[col].filled(np.nan)
+                               if value.dtype.kind == 'f' else
+                               prof[col].filled(0))
+        arrays.append((col, value))
+
+    return arrays
+
+
+class ProfileWriter(object):
+    """
+    Append the profiles of one process to its own shard.
+
+    Every append() opens the shard, adds one HDU at the end, and closes
+    it, so nothing is lost when the process is killed.
+    """
+
+    def __init__(self, storeDir):
+        if not os.path.isdir(storeDir):
+            try:
+                os.makedirs(storeDir)
+            except OSError:
+                if not os.path.isdir(storeDir):
+                    raise
+        self.storeDir = storeDir
+        self.shard = os.path.join(storeDir, '%s%s_%d_%d.fits' %
+                                  (SHARD_PREFIX, socket.gethostname(),
+                                   os.getpid(), int(time.time())))
+        self.nProfile = 0
+
+    def append(self, prof, key):
+        """
+        Add one profile.
+
+        Parameters:
+            prof : astropy Table of the profile
+            key  : dict with the keys, see parseProfileName()
+        """
+        arrays = _profileArrays(prof)
+        hdu = fits.BinTableHDU(Table([value for _, value in arrays],
+                                     names=[col for col, _ in arrays]),
+                               name='PROFILE')
+        for col in INDEX_COLUMNS:
+            if col == 'time':
+                continue
+            value = str(key.get(col, ''))
+            hdu.header['HIERARCH PS_%s' % col.upper()] = value
+        hdu.header['HIERARCH PS_TIME'] = time.time()
+        if not os.path.isfile(self.shard):
+            fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(self.shard)
+        else:
+            fits.append(self.shard, hdu.data, header=hdu.header)
+        self.nProfile += 1
+
+
+def appendProfile(storeDir, outPre, prof):
+    """
+    Write one profile into the store, using the writer of this process.
+
+    Parameters:
+        outPre : name of the output without extension, used for the key
+    """
+    writer = _WRITERS.get((storeDir, os.getpid()))
+    if writer is None:
+        writer = ProfileWriter(storeDir)
+        _WRITERS[(storeDir, os.getpid())] = writer
+    writer.append(prof, parseProfileName(outPre))
+
+    return writer.shard
+
+
+def _readShard(shardFile):
+    """Read the index and the profiles of a shard."""
+    rows, profiles = [], []
+    try:
+        hduList = fits.open(shardFile, memmap=True)
+    except Exception:
+        warnings.warn("### Can not read the shard: %s" % shardFile)
+        return rows, profiles
+    for hdu in hduList[1:]:
+        try:
+            head, data = hdu.header, hdu.data
+            key = dict((col, str(head.get('PS_%s' % col.upper(), '')))
+                       for col in INDEX_COLUMNS if col != 'time')
+            key['time'] = float(head.get('PS_TIME', 0.0))
+        except Exception:
+            """ The last HDU can be truncated by a crash """
+            break
+        rows.append(key)
+        profiles.append(data)
+
+    return rows, profiles
+
+
+class ProfileStore(object):
+    """
+    Read the profiles of a store.
+
+    Usage:
+        store = ProfileStore(storeDir)
+        prof = store.get('12345', 'HSC-I', 'default_3', imgType='imgsub')
+        index, columns = store.readAll(['sma', 'intens'], filter='HSC-I')
+        store.preload(galaxy=['12345', '12346'], prefix='redBCG')
+    """
+
+    def __init__(self, storeDir, shards=True):
+        """
+        Parameters:
+            shards : also read the profiles not merged yet
+        """
+        self.storeDir = storeDir
+        self.useShards = shards
+        self.reload()
+
+    def reload(self):
+        """Read the index of the store again."""
+        self.index = []
+        self.data = None
+        self._lookup = {}
+        self._latest = {}
+        self._cache = {}
+        self._cacheData = {}
+        self._cacheColumns = []
+        storeFile = os.path.join(self.storeDir, STORE_FILE)
+        if os.path.isfile(storeFile):
+            hduList = fits.open(storeFile, memmap=True)
+            index = hduList['INDEX'].data
+            self.data = hduList['PROFILES'].data
+            for ii in range(len(index)):
+                row = dict((col, str(index[col][ii]).strip())
+                           for col in INDEX_COLUMNS if col != 'time')
+                row['time'] = float(index['time'][ii])
+                row['offset'] = int(index['offset'][ii])
+                row['length'] = int(index['length'][ii])
+                row['source'] = None
+                self._add(row)
+        if self.useShards:
+            for shard in sorted(self.shardFiles()):
+                rows, profiles = _readShard(shard)
+                for row, prof in zip(rows, profiles):
+                    row['source'] = prof
+                    self._add(row)
+
+    def _add(self, row):
+        key = tuple(row[col] for col in STORE_KEY_COLUMNS)
+        old = self._lookup.get(key)
+        if (old is not None) and (old['time'] > row['time']):
+            return
+        if old is not None:
+            self.index.remove(old)
+        self._lookup[key] = row
+        self._lookup[row['name']] = row
+        self.index.append(row)
+        """ The latest profile of any prefix, for get() without a prefix """
+        latest = self._latest.get(key[1:])
+        if (latest is None) or (latest['time'] <= row['time']):
+            self._latest[key[1:]] = row
+
+    def shardFiles(self):
+        """Shards of the store."""
+        if not os.path.isdir(self.storeDir):
+            return []
+        return [os.path.join(self.storeDir, f)
+                for f in os.listdir(self.storeDir)
+                if f.startswith(SHARD_PREFIX) and f.endswith('.fits')]
+
+    def __len__(self):
+        return len(self.index)
+
+    def _profile(self, row, columns=None):
+        cached = self._cache.get(row['name'])
+        if cached is not None:
+            start, length = cached
+            names = columns or self._cacheColumns
+            if all(col in self._cacheData for col in names):
+                return Table([self._cacheData[col][start:start + length]
+                              for col in names], names=names)
+        if row['source'] is not None:
+            data = row['source']
+            names = data.columns.names
+        else:
+            data = self.data[row['offset']:row['offset'] + row['length']]
+            names = self.data.columns.names
+        if columns is None:
+            columns = names
+        return Table([np.asarray(data[col]).astype(
+                      data[col].dtype.newbyteorder('=')) for col in columns],
+                     names=columns)
+
+    def get(self, galaxy, filter, model, imgType='imgsub', rerun='default',
+            prefix=None):
+        """
+        One profile as an astropy Table, or None.
+
+        Parameters:
+            prefix : prefix of the profile; the latest profile of any
+                     prefix when None
+        """
+        key = (str(galaxy), filter, rerun, imgType, model)
+        if prefix is None:
+            row = self._latest.get(key)
+        else:
+            row = self._lookup.get((prefix,) + key)
+        if row is None:
+            return None
+        return self._profile(row)
+
+    def getByName(self, name):
+        """A profile by the name of its output, or None."""
+        row = self._lookup.get(os.path.splitext(os.path.basename(name))[0])
+        if row is None:
+            return None
+        return self._profile(row)
+
+    def select(self, **keys):
+        """
+        Index rows matching the keys; the values can use shell wildcards,
+        or be a list of values.
+        """
+        rows = self.index
+        for col, value in keys.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                values = set(str(val) for val in value)
+                rows = [row for row in rows if row[col] in values]
+            else:
+                rows = [row for row in rows
+                        if fnmatch.fnmatch(row[col], str(value))]
+        return rows
+
+    def readAll(self, columns, **keys):
+        """
+        Read the same columns of many profiles at once.
+
+        When all the selected profiles are in the merged store, the
+        arrays are the memory-mapped columns of the whole store, and the
+        index gives where each profile starts; otherwise the selected
+        profiles are copied one after another.
+
+        Return:
+            index   : Table of the keys, with the 'start' and 'length' of
+                      each profile in the columns
+            arrays  : dict of {column: 1-D array}
+        """
+        rows = self.select(**keys)
+        merged = all(row['source'] is None for row in rows)
+        if merged and (self.data is not None):
+            arrays = dict((col, self.data[col]) for col in columns)
+            starts = [row['offset'] for row in rows]
+        else:
+            pieces = [self._profile(row, columns) for row in rows]
+            starts = np.cumsum([0] + [len(p) for p in pieces])[:-1]
+            arrays = dict((col, np.concatenate(
+                [np.asarray(p[col]) for p in pieces])
+                if pieces else np.zeros(0)) for col in columns)
+        index = Table(rows=[[row[col] for col in INDEX_COLUMNS]
+                            for row in rows],
+                      names=INDEX_COLUMNS) if rows else Table()
+        if rows:
+            index['start'] = starts
+            index['length'] = [row['length'] if row['source'] is None
+                               else len(row['source']) for row in rows]
+
+        return index, arrays
+
+    def _columns(self, rows):
+        """Columns shared by all the rows."""
+        names = None
+        for row in rows:
+            data = row['source'] if row['source'] is not None else self.data
+            names = (list(data.columns.names) if names is None else
+                     [col for col in names if col in data.columns.names])
+        return names or []
+
+    def preload(self, columns=None, **keys):
+        """
+        Read the selected profiles at once (readAll), and keep them in
+        memory for get(); the profiles loaded before are dropped.
+
+        Parameters:
+            columns : columns to load; the ones of all the profiles when
+                      None
+
+        Return:
+            number of the loaded profiles
+        """
+        self._cache, self._cacheData, self._cacheColumns = {}, {}, []
+        rows = self.select(**keys)
+        if not rows:
+            return 0
+        self._cacheColumns = columns or self._columns(rows)
+        index, arrays = self.readAll(self._cacheColumns, **keys)
+        """ Only the rows of the selected profiles are read """
+        take = np.concatenate([np.arange(start, start + length) for
+                               (start, length) in zip(index['start'],
+                                                      index['length'])])
+        for col in self._cacheColumns:
+            data = np.asarray(arrays[col])[take]
+            self._cacheData[col] = data.astype(data.dtype.newbyteorder('='))
+        offsets = np.cumsum([0] + list(index['length']))
+        for ii, name in enumerate(index['name']):
+            self._cache[str(name)] = (int(offsets[ii]),
+                                      int(index['length'][ii]))
+
+        return len(self._cache)
+
+    def stack(self, columns, **keys):
+        """
+        Selected profiles as NaN-padded 2-D arrays (galProfile.padProfiles).
+        """
+        rows = self.select(**keys)
+        profiles = [self._profile(row, columns) for row in rows]
+
+        return rows, gProf.padProfiles(profiles, columns)
+
+
+def _writeStore(storeFile, rows, profiles):
+    """Write the index and the concatenated profiles."""
+    colNames = []
+    for prof in profiles:
+        for col in prof.columns.names:
+            if col not in colNames:
+                colNames.append(col)
+    lengths = [len(prof) for prof in profiles]
+    offsets = np.cumsum([0] + lengths)[:-1]
+    nRow = int(np.sum(lengths)) if lengths else 0
+
+    columns = []
+    for col in colNames:
+        kinds = [prof[col].dtype.kind for prof in profiles
+                 if col in prof.columns.names]
+        if all(kind in 'biu' for kind in kinds):
+            value = np.full(nRow, INT_FILL, dtype='i8')
+        else:
+            value = np.full(nRow, np.nan)
+        for prof, start in zip(profiles, offsets):
+            if col in prof.columns.names:
+                value[start:start + len(prof)] = prof[col]
+        if value.dtype.kind == 'i':
+            columns.append(fits.Column(name=col, array=value, format='K',
+                                       null=INT_FILL))
+        else:
+            columns.append(fits.Column(name=col, array=value, format='D'))
+
+    index = Table()
+    for col in INDEX_COLUMNS:
+        if col == 'time':
+            index[col] = np.array([row[col] for row in rows], dtype=float)
+        else:
+            index[col] = np.array([row[col] for row in rows], dtype=str)
+    index['offset'] = np.array(offsets, dtype=np.int64)
+    index['length'] = np.array(lengths, dtype=np.int64)
+
+    hduIndex = fits.BinTableHDU(index, name='INDEX')
+    hduData = fits.BinTableHDU.from_columns(columns, name='PROFILES')
+    hidden = os.path.join(os.path.dirname(storeFile),
+                          '.%s.%d.part' % (os.path.basename(storeFile),
+                                           os.getpid()))
+    fits.HDUList([fits.PrimaryHDU(), hduIndex, hduData]).writeto(
+        hidden, overwrite=True)
+    os.rename(hidden, storeFile)
+
+
+def mergeStore(storeDir, verbose=False):
+    """
+    Merge the shards into the store file.
+
+    Only run it when no writer is active.  The shards are removed after
+    the new store file is in place.
+
+    Return:
+        number of profiles in the store
+    """
+    store = ProfileStore(storeDir, shards=True)
+    shards = store.shardFiles()
+    rows = sorted(store.index, key=lambda row: row['time'])
+    profiles = []
+    for row in rows:
+        if row['source'] is not None:
+            profiles.append(row['source'])
+        else:
+            profiles.append(store.data[row['offset']:
+                                       row['offset'] + row['length']])
+    _writeStore(os.path.join(storeDir, STORE_FILE), rows, profiles)
+    for shard in shards:
+        os.remove(shard)
+    if verbose:
+        print("###    %d profiles from %d shards in %s" %
+              (len(rows), len(shards), storeDir))
+
+    return len(rows)
+
+
+def importPickles(storeDir, root, pattern='*_ellip_*.pkl', merge=True,
+                  verbose=False):
+    """
+    Import the pickled profiles under a directory into a store.
+
+    Return:
+        number of the imported profiles
+    """
+    nImport = 0
+    for path, dirs, files in os.walk(root):
+        for name in fnmatch.filter(files, pattern):
+            pklFile = os.path.join(path, name)
+            try:
+                with open(pklFile, 'rb') as pkl:
+                    prof = pickle.load(pkl)
+                appendProfile(storeDir, pklFile, prof)
+                nImport += 1
+            except Exception as err:
+                warnings.warn("### Can not import %s : %s" % (pklFile,
+                                                              str(err)))
+    if verbose:
+        print("###    Import %d profiles into %s" % (nImport, storeDir))
+    if merge and nImport > 0:
+        mergeStore(storeDir, verbose=verbose)
+
+    return nImport
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Reader of the STSDAS binary tables written by ELLIPSE."""
+
+from __future__ import (division, print_function)
+
+import os
+
+import numpy as np
+
+"""
+Layout of an STSDAS (ST tables) binary table:
+
+    size record        : LEN_SIZINFO x int32; npar, maxpar, nrows,
+                         allrows, ncols, maxcols, colused, rowlen, type...
+    user parameters    : maxpar x LEN_PARREC bytes
+    column descriptors : maxcols x LEN_COLSTRUCT bytes, i.e. 4 x int32
+                         (number, offset, length, data type), followed by
+                         the name (20 bytes), units (20) and format (8)
+    data               : row-ordered tables, allrows x rowlen x SZ_CHAR
+                         bytes; column-ordered tables, one block of
+                         allrows values for each column
+
+The offsets and lengths are in units of SZ_CHAR.  The table is written in
+the byte order of the machine that made it, so the byte order is decided
+from the size record.  INDEF values are converted into NaN.
+"""
+SZ_CHAR = 2
+LEN_SIZINFO = 12
+LEN_PARREC = 80
+LEN_COLSTRUCT = 64
+
+TBL_TYPE_ROW = 11
+TBL_TYPE_COLUMN = 12
+
+# IRAF data types; text columns have negative data types
+TY_BOOL = 1
+TY_SHORT = 3
+TY_INT = 4
+TY_LONG = 5
+TY_REAL = 6
+TY_DOUBLE = 7
+
+INDEFS = -32767
+INDEFI = -2147483647
+INDEFR = 1.6E38
+INDEFD = 1.6E308
+
+
+def _sizeInfo(buf):
+    """Decode the size record, and find the byte order."""
+    for order in ('<', '>'):
+        size = np.frombuffer(buf[:LEN_SIZINFO * 4],
+                             dtype=order + 'i4').astype(int)
+        npar, maxpar, nrows, allrows, ncols, maxcols = size[:6]
+        if (size[8] in (TBL_TYPE_ROW, TBL_TYPE_COLUMN) and
+                0 <= npar <= maxpar and 0 <= nrows <= allrows and
+                0 <= ncols <= maxcols):
+            return order, size
+    raise Exception("### Not an STSDAS binary table !")
+
+
+def _decodeText(raw):
+    return str(raw.split(b'\x00')[0].decode('ascii', 'replace').strip())
+
+
+def _columnFormat(order, dtype, length):
+    """Numpy format of one column."""
+    nByte = length * SZ_CHAR
+    if dtype < 0:
+        return 'S%d' % nByte
+    if dtype == TY_DOUBLE:
+        return order + 'f8'
+    if dtype == TY_REAL:
+        return order + 'f4'
+    if dtype in (TY_INT, TY_LONG, TY_BOOL):
+        return order + 'i%d' % nByte
+    if dtype == TY_SHORT:
+        return order + 'i2'
+    raise Exception("### Unknown data type in the table: %d" % dtype)
+
+
+def readColumnInfo(tabFile):
+    """
+    Read the column descriptors of an STSDAS binary table.
+
+    Return:
+        columns : list of (name, offset, length, dtype, units)
+        size    : the size record
+        order   : byte order, '<' or '>'
+    """
+    with open(tabFile, 'rb') as tab:
+        head = tab.read(LEN_SIZINFO * 4)
+        order, size = _sizeInfo(head)
+        maxpar, ncols = size[1], size[4]
+        tab.seek(LEN_SIZINFO * 4 + maxpar * LEN_PARREC)
+        raw = tab.read(ncols * LEN_COLSTRUCT)
+
+    columns = []
+    for ii in range(ncols):
+        desc = raw[ii * LEN_COLSTRUCT:(ii + 1) * LEN_COLSTRUCT]
+        number, offset, length, dtype = np.frombuffer(
+            desc[:16], dtype=order + 'i4').astype(int)
+        name = _decodeText(desc[16:36])
+        units = _decodeText(desc[36:56])
+        columns.append((name, offset, length, dtype, units))
+
+    return columns, size, order
+
+
+def readStsdasTable(tabFile, indef=np.nan):
+    """
+    Read an STSDAS binary table into a structured array.
+
+    The file is memory-mapped, and only the used rows are copied.  INDEF
+    values of the real columns are replaced by the indef value, and the
+    integer columns with INDEF values are converted into float.
+
+    Return:
+        data : structured array; the columns keep the order and the names
+               in the table
+    """
+    if not os.path.isfile(tabFile):
+        raise Exception("### Can not find the table: %s" % tabFile)
+    columns, size, order = readColumnInfo(tabFile)
+    maxpar, nrows, allrows, maxcols = size[1], size[2], size[3], size[5]
+    # colused (size[6]) is the space used by the columns, the rows can
+    # have more space allocated
+    rowLen, tabType = size[7], size[8]
+    begin = (LEN_SIZINFO * 4 + maxpar * LEN_PARREC +
+             maxcols * LEN_COLSTRUCT)
+
+    if len(columns) == 0 or nrows == 0:
+        return np.zeros(0, dtype=[(col[0], float) for col in columns])
+
+    mapped = np.memmap(tabFile, dtype=np.uint8, mode='r')
+    fields = []
+    if tabType == TBL_TYPE_ROW:
+        rowType = np.dtype({
+            'names': [col[0] for col in columns],
+            'formats': [_columnFormat(order, col[3], col[2])
+                        for col in columns],
+            'offsets': [col[1] * SZ_CHAR for col in columns],
+            'itemsize': rowLen * SZ_CHAR})
+        nByte = nrows * rowType.itemsize
+        if begin + nByte > len(mapped):
+            raise Exception("### The table is truncated: %s" % tabFile)
+        rows = mapped[begin:begin + nByte].view(rowType)
+        for col in columns:
+            fields.append((col, rows[col[0]]))
+    else:
+        for col in columns:
+            colType = np.dtype(_columnFormat(order, col[3], col[2]))
+            start = begin + col[1] * SZ_CHAR * allrows
+            nByte = nrows * colType.itemsize
+            if start + nByte > len(mapped):
+                raise Exception("### The table is truncated: %s" % tabFile)
+            fields.append((col, mapped[start:start + nByte].view(colType)))
+
+    """ Copy into native byte order, and replace INDEF """
+    outCols = []
+    for (name, _, _, dtype, _), value in fields:
+        if dtype < 0:
+            value = np.char.strip(np.asarray(value))
+        elif dtype in (TY_REAL, TY_DOUBLE):
+            indefVal = INDEFR if dtype == TY_REAL else INDEFD
+            value = np.asarray(value, dtype=float)
+            value = np.where(value >= indefVal * (1.0 - 1.0E-6), indef,
+                             value)
+        elif dtype == TY_BOOL:
+            value = np.asarray(value) != 0
+        else:
+            indefVal = INDEFS if dtype == TY_SHORT else INDEFI
+            value = np.asarray(value).astype(int)
+            if np.any(value == indefVal):
+                value = np.where(value == indefVal, indef,
+                                 value.astype(float))
+        outCols.append((name, value))
+    del mapped
+
+    data = np.zeros(nrows, dtype=[(name, value.dtype)
+                                  for (name, value) in outCols])
+    for name, value in outCols:
+        data[name] = value
+
+    return data
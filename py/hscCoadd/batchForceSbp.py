@@ -12,13 +12,149 @@ import argparse
 
 from astropy.io import fits
 
+import hscRerun as hRerun
+import galWorkspace as gWork
+import ellipseService as eSrv
 import coaddCutoutSbp as cSbp
+import coaddPsfCache as cPsf
+import profileStore as pStore
+import coaddForceBands as cForce
 
 COM = '#' * 100
 SEP = '-' * 100
 WAR = '!' * 100
 
 
+def refEllipse(args, galID, prefix, rerun):
+    """
+    Name of the reference ellipse output.
+
+    Return:
+        inEllipBin, ellipSuffix
+    """
+    refFilter = (args.refFilter).strip().upper()
+    if args.refRerun is not None:
+        refRerun = (args.refRerun).strip()
+    else:
+        refRerun = rerun
+    imgType = 'imgsub' if args.imgSub else 'img'
+    galRefRoot = os.path.join(galID, refFilter, refRerun)
+    galRefPrefix = (prefix + '_' + galID + '_' + refFilter +
+                    '_full_' + imgType + '_ellip_' + refRerun + '_')
+    inEllipPrefix = os.path.join(galRefRoot, galRefPrefix)
+    refModel = (args.refModel).strip()
+    """ Use the FITS table of the native engine when it is available """
+    inEllipBin = inEllipPrefix + refModel + '_iso.fits'
+    if (args.engine == 'iraf') or (not os.path.isfile(inEllipBin)):
+        inEllipBin = inEllipPrefix + refModel + '.bin'
+
+    if len(refModel) > 1:
+        suffix = refModel[:-1]
+        if suffix[-1] == '_':
+            suffix = suffix[:-1]
+        ellipSuffix = rerun + '_' + suffix
+    else:
+        ellipSuffix = rerun
+
+    return inEllipBin, ellipSuffix
+
+
+def runMultiBand(args):
+    """
+    Forced photometry of all the bands of each galaxy in one pass.
+
+    Parameters:
+    """
+    data = fits.open(args.incat)[1].data
+    id = (args.id)
+    rerun = (args.rerun).strip()
+    prefix = (args.prefix).strip()
+    filters = [f.strip().upper() for f in (args.filter).split(',')
+               if f.strip()]
+
+    """ Keep a log """
+    if args.sample is not None:
+        logPre = prefix + '_' + args.sample
+    else:
+        logPre = prefix
+    if args.imgSub:
+        logFile = logPre + '_force_imgsub_multiband.log'
+    else:
+        logFile = logPre + '_force_img_multiband.log'
+    if not os.path.isfile(logFile):
+        os.system('touch ' + logFile)
+
+    if args.verbose:
+        print "## Will deal with %d galaxies in %s ! " % (len(data),
+                                                      ','.join(filters))
+
+    for galaxy in data:
+        galID = str(galaxy[id]).strip()
+        galPrefix = prefix + '_' + galID + '_multiband_full'
+        inEllipBin, ellipSuffix = refEllipse(args, galID, prefix, rerun)
+        if not os.path.isfile(inEllipBin):
+            logging.warning('### Can not find ' +
+                            'INPUT BINARY for : %s' % galPrefix)
+            logging.warning('###     File Name : %s' % inEllipBin)
+            with open(logFile, "a") as logMatch:
+                try:
+                    logFormat = "%25s  %20s  %s  NELL \n"
+                    logMatch.write(logFormat % (galPrefix, inEllipBin,
+                                                args.filter))
+                    fcntl.flock(logMatch, fcntl.LOCK_UN)
+                except IOError:
+                    pass
+            continue
+
+        """ External mask """
+        if args.maskFilter is not None:
+            mskFilter = (args.maskFilter).strip().upper()
+            mskPrefix = prefix + '_' + galID + '_' + mskFilter + '_full'
+            galMsk = os.path.join(galID, mskFilter, rerun,
+                                  mskPrefix + '_mskfin.fits')
+        else:
+            galMsk = None
+
+        try:
+            cForce.coaddForceBands(galID, prefix, filters, inEllipBin,
+                                   rerun=rerun,
+                                   exMask=galMsk,
+                                   imgSub=args.imgSub,
+                                   zp=args.zp,
+                                   pix=args.pix,
+                                   bkgCor=args.bkgCor,
+                                   skyTable=args.skyTable,
+                                   intMode=args.intMode,
+                                   lowClip=args.lowClip,
+                                   uppClip=args.uppClip,
+                                   nClip=args.nClip,
+                                   outRatio=args.outRatio,
+                                   updateIntens=args.updateIntens,
+                                   suffix=ellipSuffix,
+                                   store=args.store,
+                                   verbose=args.verbose)
+            logging.info('### The multi-band SBP is DONE for %s' %
+                         galPrefix)
+            status = 'DONE'
+        except Exception, errMsg:
+            print WAR
+            print str(errMsg)
+            print WAR
+            logging.warning('### The multi-band SBP is FAILED for %s' %
+                            galPrefix)
+            logging.warning('###    Err: %s - %s' % (galPrefix, errMsg))
+            status = 'FAIL'
+        with open(logFile, "a") as logMatch:
+            try:
+                logFormat = "%25s  %20s  %s  %s \n"
+                logMatch.write(logFormat % (galPrefix, ellipSuffix,
+                                            args.filter, status))
+                fcntl.flock(logMatch, fcntl.LOCK_UN)
+            except IOError:
+                pass
+        gc.collect()
+
+
 def run(args):
     """
     Run coaddCutoutSbp in batch mode.
@@ -27,6 +163,8 @@ def run(args):
     """
     gc.collect()
     if os.path.isfile(args.incat):
+        if args.multiBand:
+            return runMultiBand(args)
         data = fits.open(args.incat)[1].data
         id = (args.id)
         rerun = (args.rerun).strip()
@@ -49,6 +187,21 @@ def run(args):
         if args.verbose:
             print "## Will deal with %d galaxies ! " % len(data)
 
+        """ Keep a group of warm PyRAF workers for the whole sample """
+        if ((args.engine == 'iraf') and (args.isophote is None) and
+                (args.njobs > 1)):
+            service = eSrv.EllipseService(nWorker=args.njobs,
+                                          verbose=args.verbose).start()
+        else:
+            service = None
+
+        """ Share the PSF profiles between galaxies and reruns """
+        if args.psfCache is not None:
+            psfCache = cPsf.PsfCache(args.psfCache, tol=args.psfTol,
+                                     verbose=args.verbose)
+        else:
+            psfCache = None
+
         for galaxy in data:
             """ ID and prefix """
             galID = str(galaxy[id]).strip()
@@ -88,16 +241,8 @@ def run(args):
             """
             Set up a rerun
             """
-            galRoot = os.path.join(galRoot, rerun.strip())
-            if not os.path.isdir(galRoot):
-                os.makedirs(galRoot)
-            """ Link the necessary files to the rerun folder """
             fitsList = glob.glob(os.path.join(galRoot, '*.fits'))
-            for fitsFile in fitsList:
-                seg = fitsFile.split('/')
-                link = os.path.join(galRoot, seg[-1])
-                if (not os.path.islink(link)) and (not os.path.isfile(link)):
-                    os.symlink(fitsFile, link)
+            galRoot = hRerun.rerunSetup(galRoot, rerun, fileList=fitsList)
 
             """
             External mask
@@ -146,7 +291,10 @@ def run(args):
             """ The reference model """
             inEllipPrefix = os.path.join(galRefRoot, galRefPrefix)
             refModel = (args.refModel).strip()
-            inEllipBin = inEllipPrefix + refModel + '.bin'
+            if args.engine != 'iraf':
+                inEllipBin = inEllipPrefix + refModel + '_iso.fits'
+            else:
+                inEllipBin = inEllipPrefix + refModel + '.bin'
             if args.verbose:
                 print SEP
                 print "###   INPUT ELLIP BIN : %s" % inEllipBin
@@ -211,7 +359,17 @@ def run(args):
                                     plMask=args.plmask,
                                     imgSub=args.imgSub,
                                     isophote=args.isophote,
-                                    xttools=args.xttools)
+                                    xttools=args.xttools,
+                                    skyTable=args.skyTable,
+                                    rerun=rerun,
+                                    engine=args.engine,
+                                    nProc=args.njobs,
+                                    service=service,
+                                    scratch=args.scratch,
+                                    store=args.store,
+                                    psfCache=psfCache,
+                                    minSnr=args.minSnr,
+                                    nLowSnr=args.nLowSnr)
                 logging.info('### The 1-D SBP is DONE for %s in %s' %
                              (galPrefix, filter))
                 with open(logFile, "a") as logMatch:
@@ -271,7 +429,17 @@ def run(args):
                                                 plMask=args.plmask,
                                                 imgSub=args.imgSub,
                                                 isophote=args.isophote,
-                                                xttools=args.xttools)
+                                                xttools=args.xttools,
+                                                skyTable=args.skyTable,
+                                                rerun=rerun,
+                                                engine=args.engine,
+                                                nProc=args.njobs,
+                                                service=service,
+                                                scratch=args.scratch,
+                                                store=args.store,
+                                                psfCache=psfCache,
+                                                minSnr=args.minSnr,
+                                                nLowSnr=args.nLowSnr)
                             logging.info('### SMALLMASK is DONE for %s' %
                                          galPrefix)
                             with open(logFile, "a") as logMatch:
@@ -356,7 +524,17 @@ def run(args):
                                                 plMask=args.plmask,
                                                 imgSub=args.imgSub,
                                                 isophote=args.isophote,
-                                                xttools=args.xttools)
+                                                xttools=args.xttools,
+                                                skyTable=args.skyTable,
+                                                rerun=rerun,
+                                                engine=args.engine,
+                                                nProc=args.njobs,
+                                                service=service,
+                                                scratch=args.scratch,
+                                                store=args.store,
+                                                psfCache=psfCache,
+                                                minSnr=args.minSnr,
+                                                nLowSnr=args.nLowSnr)
                             logging.info('### LARGEMASK is DONE for %s in %s' %
                                          (galPrefix, filter))
                             with open(logFile, "a") as logMatch:
@@ -421,6 +599,13 @@ def run(args):
                         pass
 
                 gc.collect()
+        if service is not None:
+            service.report()
+            service.close()
+        if psfCache is not None:
+            psfCache.report()
+        if args.scratch is not None:
+            gWork.workspaceReport(verbose=args.verbose)
     else:
         raise Exception("### Can not find the input catalog: %s" % args.incat)
 
@@ -429,7 +614,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("prefix", help="Prefix of the galaxy image files")
     parser.add_argument("incat", help="The input catalog for cutout")
-    parser.add_argument("filter", help="Filter to analysis")
+    parser.add_argument("filter", help="Filter to analysis; a comma " +
+                        "separated list of filters in the multi-band mode")
     parser.add_argument('-r', '--rerun', dest='rerun',
                         help="Name of the rerun", default='default')
     parser.add_argument('-i', '--id', dest='id',
@@ -446,6 +632,11 @@ if __name__ == '__main__':
     parser.add_argument('-rm', '--rModel', dest='refModel',
                         help="Reference ellipse binary output",
                         default='3')
+    parser.add_argument('--multiBand', dest='multiBand',
+                        action="store_true",
+                        help='Measure all the filters in one pass, ' +
+                        'using the same annuli and mask',
+                        default=False)
     parser.add_argument('--multiMask', dest='multiMask',
                         action="store_true",
                         help='Run Force mode using multiple masks',
@@ -468,6 +659,36 @@ if __name__ == '__main__':
     parser.add_argument("--xttools", dest='xttools',
                         help="Location of the x_ttools.e file",
                         default=None)
+    parser.add_argument('--skyTable', dest='skyTable',
+                        help='Sky table for the background correction',
+                        default=None)
+    parser.add_argument("--engine", dest='engine',
+                        help="Isophote engine: iraf, native or annulus",
+                        default='iraf',
+                        choices=['iraf', 'native', 'annulus'])
+    parser.add_argument("--scratch", dest='scratch',
+                        help="Scratch directory for the temporary files " +
+                        "(e.g. /dev/shm)",
+                        default=None)
+    parser.add_argument("--store", dest='store',
+                        help="Directory of the profile store",
+                        default=None)
+    parser.add_argument("--noMerge", dest='merge', action="store_false",
+                        help="Do not merge the profile store at the end; " +
+                        "use it when other batches write to the same store",
+                        default=True)
+    parser.add_argument("--psfCache", dest='psfCache',
+                        help="Directory of the PSF profile cache",
+                        default=None)
+    parser.add_argument("--psfTol", dest='psfTol', type=float,
+                        help="Relative precision of the PSF for the cache",
+                        default=None)
+    parser.add_argument("--minSnr", dest='minSnr', type=float,
+                        help="Stop the isophotes when the S/N is lower",
+                        default=None)
+    parser.add_argument("--nLowSnr", dest='nLowSnr', type=int,
+                        help="Number of low S/N isophotes before stopping",
+                        default=3)
     """ Optional """
     parser.add_argument("--intMode", dest='intMode',
                         help="Method for integration",
@@ -538,3 +759,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     run(args)
+
+    """ One merged store file, memory-mapped by the summary """
+    if (args.store is not None) and args.merge:
+        pStore.mergeStore(args.store, verbose=args.verbose)
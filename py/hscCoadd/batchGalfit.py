@@ -96,6 +96,9 @@ def singleGalfitRun(galaxy, idCol, rerun, prefix, filterUse, logFile):
     else:
         galMsk = None
 
+    """ Iterations and runtime of each model """
+    runLog = logFile.replace('.log', '_runs.log')
+
     print '\n' + SEP
     try:
         result = coaddCutoutGalfitSimple(galPrefix,
@@ -127,7 +130,16 @@ def singleGalfitRun(galaxy, idCol, rerun, prefix, filterUse, logFile):
                                          show=args.show,
                                          imgSub=args.imgSub,
                                          scale1=args.scale1,
-                                         scale2=args.scale2)
+                                         scale2=args.scale2,
+                                         nJobs=args.galfitJobs,
+                                         timeout=args.timeout,
+                                         maxCpu=args.maxCpu,
+                                         maxMem=args.maxMem,
+                                         maxRetry=args.maxRetry,
+                                         warmStart=args.warmStart,
+                                         runLog=runLog,
+                                         autoRegion=args.autoRegion,
+                                         subComp=args.subComp)
         logging.info('### The Galfit Run is DONE for %s in %s' %
                      (galPrefix, filterUse))
         ser1Done, ser1Plot, ser2Done, ser2Plot, ser3Done, ser3Plot = result
@@ -313,6 +325,27 @@ if __name__ == '__main__':
                         type=float, default=0.03)
     parser.add_argument('--scale2', dest='scale2', help='Scale for residual',
                         type=float, default=0.40)
+    parser.add_argument('--galfitJobs', dest='galfitJobs',
+                        help='Number of GALFIT runs at the same time',
+                        type=int, default=1)
+    parser.add_argument('--timeout', dest='timeout',
+                        help='Wall-clock limit of one GALFIT run (sec)',
+                        type=float, default=None)
+    parser.add_argument('--maxCpu', dest='maxCpu',
+                        help='CPU time limit of one GALFIT run (sec)',
+                        type=int, default=None)
+    parser.add_argument('--maxMem', dest='maxMem',
+                        help='Memory limit of one GALFIT run (MB)',
+                        type=float, default=None)
+    parser.add_argument('--maxRetry', dest='maxRetry',
+                        help='Number of restarts after a timeout',
+                        type=int, default=1)
+    parser.add_argument('--warmStart', dest='warmStart',
+                        action="store_true", default=False)
+    parser.add_argument('--autoRegion', dest='autoRegion',
+                        action="store_true", default=False)
+    parser.add_argument('--subComp', dest='subComp',
+                        action="store_true", default=False)
 
     args = parser.parse_args()
 
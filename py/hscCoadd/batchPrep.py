@@ -5,17 +5,236 @@
 from __future__ import (division, print_function)
 
 import os
+import sys
+import time
 import fcntl
 import logging
 import argparse
 import warnings
 
-from astropy.io import fits
+SEP = '-' * 100
+WAR = '!' * 100
+THREAD_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+               'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
 
-import hscUtils as hUtil
-import coaddCutoutPrepare as ccp
 
-WAR = '!' * 100
+def threadsFromArgv(argv):
+    """
+    Number of BLAS/OpenMP threads of each process from the command line:
+    --nthreads, or 1 with --njobs > 1; None for no limit.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-j', '--njobs', type=int, dest='njobs', default=1)
+    parser.add_argument('--nthreads', type=int, dest='nthreads',
+                        default=None)
+    args, _ = parser.parse_known_args(argv)
+    if args.nthreads is not None:
+        return args.nthreads
+    return 1 if args.njobs > 1 else None
+
+
+def setThreadEnv(nThreads):
+    """Limit the BLAS/OpenMP threads of the libraries loaded after this."""
+    if nThreads is None:
+        return
+    for key in THREAD_VARS:
+        os.environ[key] = str(nThreads)
+
+
+if __name__ == '__main__':
+    """
+    The BLAS of NumPy only reads the variables when it is loaded, so they
+    are set before the imports below, and are inherited by the workers
+    """
+    setThreadEnv(threadsFromArgv(sys.argv[1:]))
+
+from astropy.io import fits  # noqa: E402
+
+import hscUtils as hUtil  # noqa: E402
+import hscPool  # noqa: E402
+import coaddCutoutPrepare as ccp  # noqa: E402
+
+workerStarCat = None
+
+
+def writeLog(logFile, galPrefix, rerun, status):
+    """
+    Append the status of one galaxy to the log file.
+
+    Parameters:
+    """
+    with open(logFile, "a") as logMatch:
+        logStr = "%25s  %10s  %4s \n"
+        try:
+            fcntl.flock(logMatch, fcntl.LOCK_EX)
+            logMatch.write(logStr % (galPrefix, rerun, status))
+            fcntl.flock(logMatch, fcntl.LOCK_UN)
+        except IOError:
+            pass
+
+
+def prepConfig(rerun, args):
+    """
+    Parameters of coaddCutoutPrepare for different reruns.
+
+    Parameters:
+    """
+    if rerun == 'default':
+        config = dict(rerun='default',
+                      bSizeH=10.0,
+                      bSizeC=60.0,
+                      thrH=2.5,
+                      thrC=1.5,
+                      galR1=1.6,
+                      galR2=3.1,
+                      galR3=6.5,
+                      growH=2.1,
+                      growW=4.0,
+                      growC=5.0,
+                      sigma=6.0,
+                      sigthr=0.02,
+                      minDetH=4,
+                      minDetC=8,
+                      debThrH=32,
+                      debThrC=64,
+                      debConH=0.0005,
+                      debConC=0.0001,
+                      kernel=4,
+                      central=1,
+                      maskMethod=1,
+                      growMethod=1,
+                      useSigArr=False,
+                      noBkgC=False,
+                      noBkgH=False,
+                      combBad=True,
+                      combDet=True,
+                      multiMask=args.multiMask)
+    elif rerun == 'smallR1':
+        config = dict(rerun='smallR1',
+                      bSizeH=10.0,
+                      bSizeC=40.0,
+                      thrH=2.5,
+                      thrC=1.1,
+                      growH=2.5,
+                      growW=5.5,
+                      growC=7.5,
+                      galR1=1.4,
+                      galR2=2.5,
+                      galR3=4.0,
+                      sigma=9.0,
+                      sigthr=0.01,
+                      kernel=4,
+                      central=1,
+                      maskMethod=1,
+                      growMethod=1,
+                      useSigArr=False,
+                      noBkgC=False,
+                      noBkgH=False,
+                      minDetH=5,
+                      minDetC=8,
+                      debThrH=16,
+                      debThrC=32,
+                      debConH=0.001,
+                      debConC=0.0025,
+                      combBad=True,
+                      combDet=True,
+                      multiMask=False)
+    elif rerun == 'largeR1':
+        config = dict(rerun='largeR1',
+                      bSizeH=10.0,
+                      bSizeC=40.0,
+                      thrH=3.0,
+                      thrC=1.5,
+                      growH=1.5,
+                      growW=3.0,
+                      growC=4.5,
+                      galR1=2.5,
+                      galR2=5.0,
+                      galR3=7.0,
+                      sigma=7.0,
+                      sigthr=0.02,
+                      kernel=4,
+                      central=1,
+                      maskMethod=1,
+                      growMethod=1,
+                      useSigArr=False,
+                      noBkgC=False,
+                      noBkgH=False,
+                      minDetH=5,
+                      minDetC=8,
+                      debThrH=16,
+                      debThrC=32,
+                      debConH=0.001,
+                      debConC=0.0025,
+                      combBad=True,
+                      combDet=True,
+                      multiMask=False)
+    else:
+        config = dict(rerun=rerun,
+                      bSizeH=args.bSizeH,
+                      bSizeC=args.bSizeC,
+                      thrH=args.thrH,
+                      thrC=args.thrC,
+                      growH=args.growH,
+                      growW=args.growW,
+                      growC=args.growC,
+                      kernel=args.kernel,
+                      central=args.central,
+                      maskMethod=args.mask,
+                      growMethod=args.grow,
+                      useSigArr=args.useSigArr,
+                      noBkgC=args.noBkgC,
+                      noBkgH=args.noBkgH,
+                      minDetH=args.minDetH,
+                      minDetC=args.minDetC,
+                      debThrH=args.debThrH,
+                      debThrC=args.debThrC,
+                      debConH=args.debConH,
+                      debConC=args.debConC,
+                      combBad=args.combBad,
+                      combDet=args.combDet,
+                      multiMask=args.multiMask)
+
+    return config
+
+
+def initWorker(starCat=None):
+    """
+    Initialize a worker process.
+
+    The bright star catalog is shared once per worker instead of being
+    sent along with every galaxy.
+    """
+    global workerStarCat
+    workerStarCat = starCat
+
+
+def singlePrepRun(task):
+    """
+    Run coaddCutoutPrepare for a single galaxy.
+
+    Failures are caught here, so that one bad galaxy never stops the
+    whole batch.
+
+    Parameters:
+        task : (galPrefix, galRoot, config, logFile)
+    """
+    galPrefix, galRoot, config, logFile = task
+    rerun = config['rerun']
+    t0 = time.time()
+    try:
+        ccp.coaddCutoutPrepare(galPrefix, root=galRoot,
+                               brightStar=workerStarCat,
+                               **config)
+        status = 'DONE'
+    except Exception as errMsg:
+        warnings.warn('\n### The preparation is failed for %s' % galPrefix)
+        logging.warning('### The preparation is failed for %s' % galPrefix)
+        print(str(errMsg))
+        status = 'FAIL'
+    writeLog(logFile, galPrefix, rerun, status)
+
+    return galPrefix, status, (time.time() - t0)
 
 
 def run(args):
@@ -31,6 +250,7 @@ def run(args):
         rerun = (args.rerun).strip()
         prefix = (args.prefix).strip()
         filt = (args.filter).strip().upper()
+        config = prepConfig(rerun, args)
 
         # Bright star catalog
         if args.brightStar:
@@ -51,218 +271,83 @@ def run(args):
         if args.verbose:
             print("\n## Will deal with %d galaxies ! " % len(data))
 
+        tasks, sizes = [], []
         for galaxy in data:
             # Galaxy ID and prefix
             galID = str(galaxy[idx]).strip()
             galPrefix = prefix + '_' + galID + '_' + filt + '_full'
-            if args.verbose:
-                print("\n## Will Deal with %s now ! " % galID)
 
             # Folder for the data
             galRoot = os.path.join(galID, filt)
             if not os.path.isdir(galRoot):
                 warnings.warn('### Cannot find folder %s' % galRoot)
-                with open(logFile, "a") as logMatch:
-                    logStr = "%25s  %10s  NDIR \n"
-                    try:
-                        logMatch.write(logStr % (galPrefix, rerun))
-                        fcntl.flock(logMatch, fcntl.LOCK_UN)
-                    except IOError:
-                        pass
+                writeLog(logFile, galPrefix, rerun, 'NDIR')
                 continue
 
             # Image
-            galImg = galPrefix + '_img.fits'
-            if not os.path.isfile(os.path.join(galRoot, galImg)):
+            galImg = os.path.join(galRoot, galPrefix + '_img.fits')
+            if not os.path.isfile(galImg):
                 warnings.warn('### Cannot find image %s' % galImg)
-                with open(logFile, "a") as logMatch:
-                    logStr = "%25s  %10s  NIMG \n"
-                    try:
-                        logMatch.write(logStr % (galPrefix, rerun))
-                        fcntl.flock(logMatch, fcntl.LOCK_UN)
-                    except IOError:
-                        pass
+                writeLog(logFile, galPrefix, rerun, 'NIMG')
                 continue
 
-            try:
-                if rerun == 'default':
-                    ccp.coaddCutoutPrepare(
-                        galPrefix,
-                        root=galRoot,
-                        rerun='default',
-                        bSizeH=10.0,
-                        bSizeC=60.0,
-                        thrH=2.5,
-                        thrC=1.5,
-                        galR1=1.6,
-                        galR2=3.1,
-                        galR3=6.5,
-                        growH=2.1,
-                        growW=4.0,
-                        growC=5.0,
-                        sigma=6.0,
-                        sigthr=0.02,
-                        minDetH=4,
-                        minDetC=8,
-                        debThrH=32,
-                        debThrC=64,
-                        debConH=0.0005,
-                        debConC=0.0001,
-                        kernel=4,
-                        central=1,
-                        maskMethod=1,
-                        growMethod=1,
-                        useSigArr=False,
-                        noBkgC=False,
-                        noBkgH=False,
-                        combBad=True,
-                        combDet=True,
-                        brightStar=starCat,
-                        multiMask=args.multiMask)
-                    with open(logFile, "a") as logMatch:
-                        logStr = "%25s  %10s  DONE \n"
-                        try:
-                            logMatch.write(logStr % (galPrefix, rerun))
-                            fcntl.flock(logMatch, fcntl.LOCK_UN)
-                        except IOError:
-                            pass
-                elif rerun == 'smallR1':
-                    ccp.coaddCutoutPrepare(
-                        galPrefix,
-                        root=galRoot,
-                        rerun='smallR1',
-                        bSizeH=10.0,
-                        bSizeC=40.0,
-                        thrH=2.5,
-                        thrC=1.1,
-                        growH=2.5,
-                        growW=5.5,
-                        growC=7.5,
-                        galR1=1.4,
-                        galR2=2.5,
-                        galR3=4.0,
-                        sigma=9.0,
-                        sigthr=0.01,
-                        kernel=4,
-                        central=1,
-                        maskMethod=1,
-                        growMethod=1,
-                        useSigArr=False,
-                        noBkgC=False,
-                        noBkgH=False,
-                        minDetH=5,
-                        minDetC=8,
-                        debThrH=16,
-                        debThrC=32,
-                        debConH=0.001,
-                        debConC=0.0025,
-                        combBad=True,
-                        combDet=True,
-                        brightStar=starCat,
-                        multiMask=False)
-                    with open(logFile, "a") as logMatch:
-                        logStr = "%25s  %10s  DONE \n"
-                        try:
-                            logMatch.write(logStr % (galPrefix, rerun))
-                            fcntl.flock(logMatch, fcntl.LOCK_UN)
-                        except IOError:
-                            pass
-                elif rerun == 'largeR1':
-                    ccp.coaddCutoutPrepare(
-                        galPrefix,
-                        root=galRoot,
-                        rerun='largeR1',
-                        bSizeH=10.0,
-                        bSizeC=40.0,
-                        thrH=3.0,
-                        thrC=1.5,
-                        growH=1.5,
-                        growW=3.0,
-                        growC=4.5,
-                        galR1=2.5,
-                        galR2=5.0,
-                        galR3=7.0,
-                        sigma=7.0,
-                        sigthr=0.02,
-                        kernel=4,
-                        central=1,
-                        maskMethod=1,
-                        growMethod=1,
-                        useSigArr=False,
-                        noBkgC=False,
-                        noBkgH=False,
-                        minDetH=5,
-                        minDetC=8,
-                        debThrH=16,
-                        debThrC=32,
-                        debConH=0.001,
-                        debConC=0.0025,
-                        combBad=True,
-                        combDet=True,
-                        brightStar=starCat,
-                        multiMask=False)
-                    with open(logFile, "a") as logMatch:
-                        logStr = "%25s  %10s  DONE \n"
-                        try:
-                            logMatch.write(logStr % (galPrefix, rerun))
-                            fcntl.flock(logMatch, fcntl.LOCK_UN)
-                        except IOError:
-                            pass
-                else:
-                    ccp.coaddCutoutPrepare(
-                        galPrefix,
-                        root=galRoot,
-                        rerun=rerun,
-                        bSizeH=args.bSizeH,
-                        bSizeC=args.bSizeC,
-                        thrH=args.thrH,
-                        thrC=args.thrC,
-                        growH=args.growH,
-                        growW=args.growW,
-                        growC=args.growC,
-                        kernel=args.kernel,
-                        central=args.central,
-                        maskMethod=args.mask,
-                        growMethod=args.grow,
-                        useSigArr=args.useSigArr,
-                        noBkgC=args.noBkgC,
-                        noBkgH=args.noBkgH,
-                        minDetH=args.minDetH,
-                        minDetC=args.minDetC,
-                        debThrH=args.debThrH,
-                        debThrC=args.debThrC,
-                        debConH=args.debConH,
-                        debConC=args.debConC,
-                        combBad=args.combBad,
-                        combDet=args.combDet,
-                        brightStar=starCat,
-                        multiMask=args.multiMask)
-                    with open(logFile, "a") as logMatch:
-                        logStr = "%25s  %10s  DONE \n"
-                        try:
-                            logMatch.write(logStr % (galPrefix, rerun))
-                            fcntl.flock(logMatch, fcntl.LOCK_UN)
-                        except IOError:
-                            pass
-            except Exception, errMsg:
-                warnings.warn('\n### The preparation is failed for %s in %s' %
-                              (galPrefix, filt))
-                logging.warning('### The preparation is failed for %s in %s' %
-                                (galPrefix, filt))
-                print(str(errMsg))
-                with open(logFile, "a") as logMatch:
-                    logStr = "%25s  %10s  FAIL \n"
-                    try:
-                        logMatch.write(logStr % (galPrefix, rerun))
-                        fcntl.flock(logMatch, fcntl.LOCK_UN)
-                    except IOError:
-                        pass
+            tasks.append((galPrefix, galRoot, config, logFile))
+            sizes.append(os.path.getsize(galImg))
+
+        # Start with the largest cutouts, so they do not become the tail
+        # of the batch
+        if args.sortSize:
+            order = sorted(range(len(tasks)), key=lambda ii: -sizes[ii])
+            tasks = [tasks[ii] for ii in order]
+
+        t0 = time.time()
+        if args.njobs > 1:
+            if args.verbose:
+                print("## Use %d processes with %s thread(s) each" % (
+                      args.njobs, os.environ.get('OMP_NUM_THREADS', 'all')))
+            results = []
+            # A worker that crashes only loses its own galaxy
+            for index, ok, output in hscPool.imapSafe(
+                    singlePrepRun, tasks, nProc=args.njobs,
+                    initializer=initWorker, initargs=(starCat,),
+                    maxTasks=args.maxTasks, timeout=args.timeout):
+                if not ok:
+                    galPrefix = tasks[index][0]
+                    warnings.warn('\n### The preparation is failed ' +
+                                  'for %s' % galPrefix)
+                    print(output)
+                    writeLog(logFile, galPrefix, rerun, 'FAIL')
+                    output = (galPrefix, 'FAIL', 0.0)
+                results.append(output)
+        else:
+            initWorker(starCat)
+            results = []
+            for task in tasks:
+                if args.verbose:
+                    print("\n## Will Deal with %s now ! " % task[0])
+                results.append(singlePrepRun(task))
+        tTotal = time.time() - t0
+
+        # Report the throughput
+        nDone = len([res for res in results if res[1] == 'DONE'])
+        nFail = len(results) - nDone
+        tGal = [res[2] for res in results]
+        print(SEP)
+        print("## %d DONE / %d FAIL in %.1f seconds" % (nDone, nFail, tTotal))
+        if len(results) > 0 and tTotal > 0:
+            print("## Throughput: %.2f galaxies / minute" % (
+                  len(results) * 60.0 / tTotal))
+            print("## Time per galaxy: %.1f (median) / %.1f (max) s" % (
+                  sorted(tGal)[len(tGal) // 2], max(tGal)))
+        print(SEP)
+
+        return results
     else:
         raise Exception("\n### Can not find the input catalog: %s" % args.incat)
 
 
-if __name__ == '__main__':
-
+def buildParser():
+    """Parser of the command line arguments."""
     parser = argparse.ArgumentParser()
     parser.add_argument("prefix",
                         help="Prefix of the galaxy image files")
@@ -286,6 +371,35 @@ if __name__ == '__main__':
         '--multiMask', dest='multiMask', action="store_true", default=False)
     parser.add_argument(
         '--sample', dest='sample', help="Sample name", default=None)
+    parser.add_argument(
+        '-j',
+        '--njobs',
+        type=int,
+        help='Number of processes run at the same time',
+        dest='njobs',
+        default=1)
+    parser.add_argument(
+        '--nthreads',
+        type=int,
+        help='Number of BLAS/OpenMP threads for each process ' +
+             '(default: 1 with --njobs > 1, no limit otherwise)',
+        dest='nthreads',
+        default=None)
+    parser.add_argument(
+        '--maxTasks',
+        type=int,
+        help='Number of galaxies before a worker is restarted',
+        dest='maxTasks',
+        default=None)
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        help='Maximum run time for one galaxy in seconds',
+        dest='timeout',
+        default=None)
+    parser.add_argument(
+        '--noSortSize', dest='sortSize', action="store_false", default=True,
+        help='Do not start with the largest cutouts')
     parser.add_argument(
         '--verbose',
         dest='verbose',
@@ -436,6 +550,8 @@ if __name__ == '__main__':
     parser.add_argument(
         '--brightStar', dest='brightStar', action="store_true", default=False)
 
-    args = parser.parse_args()
+    return parser
+
 
-    run(args)
+if __name__ == '__main__':
+    run(buildParser().parse_args())
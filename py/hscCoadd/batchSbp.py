@@ -12,7 +12,12 @@ import argparse
 
 from astropy.io import fits
 
+import hscRerun as hRerun
+import galWorkspace as gWork
+import ellipseService as eSrv
 import coaddCutoutSbp as cSbp
+import coaddPsfCache as cPsf
+import profileStore as pStore
 
 COM = '#' * 100
 SEP = '-' * 100
@@ -50,6 +55,21 @@ def run(args):
         if args.verbose:
             print "## Will deal with %d galaxies ! " % len(data)
 
+        """ Keep a group of warm PyRAF workers for the whole sample """
+        if ((args.engine == 'iraf') and (args.isophote is None) and
+                (args.njobs > 1)):
+            service = eSrv.EllipseService(nWorker=args.njobs,
+                                          verbose=args.verbose).start()
+        else:
+            service = None
+
+        """ Share the PSF profiles between galaxies and reruns """
+        if args.psfCache is not None:
+            psfCache = cPsf.PsfCache(args.psfCache, tol=args.psfTol,
+                                     verbose=args.verbose)
+        else:
+            psfCache = None
+
         for galaxy in data:
             """ ID and prefix """
             galID = str(galaxy[id]).strip()
@@ -103,15 +123,7 @@ def run(args):
             """
             Set up a rerun
             """
-            galRoot = os.path.join(galRoot, rerun.strip())
-            if not os.path.isdir(galRoot):
-                os.makedirs(galRoot)
-            """ Link the necessary files to the rerun folder """
-            for fitsFile in fitsList:
-                seg = fitsFile.split('/')
-                link = os.path.join(galRoot, seg[-1])
-                if (not os.path.islink(link)) and (not os.path.isfile(link)):
-                    os.symlink(fitsFile, link)
+            galRoot = hRerun.rerunSetup(galRoot, rerun, fileList=fitsList)
 
             """
             External mask
@@ -180,7 +192,17 @@ def run(args):
                                     noMask=args.nomask,
                                     imgSub=args.imgSub,
                                     isophote=args.isophote,
-                                    xttools=args.xttools)
+                                    xttools=args.xttools,
+                                    skyTable=args.skyTable,
+                                    rerun=rerun,
+                                    engine=args.engine,
+                                    nProc=args.njobs,
+                                    service=service,
+                                    scratch=args.scratch,
+                                    store=args.store,
+                                    psfCache=psfCache,
+                                    minSnr=args.minSnr,
+                                    nLowSnr=args.nLowSnr)
                 logging.info('### The 1-D SBP is DONE for %s in %s' %
                              (galPrefix, filter))
                 with open(logFile, "a") as logMatch:
@@ -211,6 +233,13 @@ def run(args):
                     except IOError:
                         pass
             gc.collect()
+        if service is not None:
+            service.report()
+            service.close()
+        if psfCache is not None:
+            psfCache.report()
+        if args.scratch is not None:
+            gWork.workspaceReport(verbose=args.verbose)
     else:
         raise Exception("### Can not find the input catalog: %s" % args.incat)
 
@@ -257,6 +286,36 @@ if __name__ == '__main__':
     parser.add_argument("--xttools", dest='xttools',
                         help="Location of the x_ttools.e file",
                         default=None)
+    parser.add_argument('--skyTable', dest='skyTable',
+                        help='Sky table for the background correction',
+                        default=None)
+    parser.add_argument("--engine", dest='engine',
+                        help="Isophote engine: iraf, native or annulus",
+                        default='iraf',
+                        choices=['iraf', 'native', 'annulus'])
+    parser.add_argument("--scratch", dest='scratch',
+                        help="Scratch directory for the temporary files " +
+                        "(e.g. /dev/shm)",
+                        default=None)
+    parser.add_argument("--store", dest='store',
+                        help="Directory of the profile store",
+                        default=None)
+    parser.add_argument("--noMerge", dest='merge', action="store_false",
+                        help="Do not merge the profile store at the end; " +
+                        "use it when other batches write to the same store",
+                        default=True)
+    parser.add_argument("--psfCache", dest='psfCache',
+                        help="Directory of the PSF profile cache",
+                        default=None)
+    parser.add_argument("--psfTol", dest='psfTol', type=float,
+                        help="Relative precision of the PSF for the cache",
+                        default=None)
+    parser.add_argument("--minSnr", dest='minSnr', type=float,
+                        help="Stop the isophotes when the S/N is lower",
+                        default=None)
+    parser.add_argument("--nLowSnr", dest='nLowSnr', type=int,
+                        help="Number of low S/N isophotes before stopping",
+                        default=3)
     """ Optional """
     parser.add_argument("--intMode", dest='intMode',
                         help="Method for integration",
@@ -324,3 +383,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     run(args)
+
+    """ One merged store file, memory-mapped by the summary """
+    if (args.store is not None) and args.merge:
+        pStore.mergeStore(args.store, verbose=args.verbose)
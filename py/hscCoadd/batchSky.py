@@ -15,7 +15,10 @@ import numpy as np
 
 from astropy.io import fits
 
+import hscRerun as hRerun
 import coaddCutoutSky as ccs
+import coaddSkyTable as cSkyTab
+import coaddSkyConfig as cSkyCfg
 
 COM = '#' * 100
 SEP = '-' * 100
@@ -85,15 +88,7 @@ def run(args):
             """
             Set up a rerun
             """
-            galRoot = os.path.join(galRoot, rerun.strip())
-            if not os.path.isdir(galRoot):
-                os.makedirs(galRoot)
-            """ Link the necessary files to the rerun folder """
-            for fitsFile in fitsList:
-                seg = fitsFile.split('/')
-                link = os.path.join(galRoot, seg[-1])
-                if (not os.path.islink(link)) and (not os.path.isfile(link)):
-                    os.symlink(fitsFile, link)
+            galRoot = hRerun.rerunSetup(galRoot, rerun, fileList=fitsList)
             """
             External mask
             """
@@ -136,8 +131,16 @@ def run(args):
                     bkgSize=args.bkgSize,
                     bkgFilter=args.bkgFilter,
                     saveBkg=args.saveBkg,
-                    nClip=args.nClip)
-                numSkyPix, skyMed, skyAvg, skyStd, skySkw, sbExpt = skyGlobal
+                    nClip=args.nClip,
+                    skyTable=args.skyTable,
+                    saveDat=args.saveDat,
+                    galID=galID,
+                    filter=filter,
+                    rerun=rerun,
+                    patchSky=args.patchSky,
+                    skyRefine=args.skyRefine)
+                numSkyPix, skyMed, skyAvg, skyStd, skySkw, sbExpt = \
+                    skyGlobal[:6]
                 with open(logFile, "a") as logMatch:
                     try:
                         logFormat = "%25s  %5s  %3d  %6d  %7.4f  %7.4f" + \
@@ -167,6 +170,13 @@ def run(args):
                         fcntl.flock(logMatch, fcntl.LOCK_UN)
                     except IOError:
                         pass
+
+        """ Merge the new measurements into the sky table """
+        if args.skyTable is not None:
+            nSky = cSkyTab.skyTableCompact(args.skyTable)
+            if args.verbose:
+                print("\n## %d measurements in the sky table %s" %
+                      (nSky, args.skyTable))
     else:
         raise Exception("### Can not find the input catalog: %s" % args.incat)
 
@@ -210,13 +220,13 @@ if __name__ == '__main__':
         dest='bkgSize',
         help='Background size for SEP',
         type=int,
-        default=60)
+        default=cSkyCfg.BKG_SIZE)
     parser.add_argument(
         '--bkgFilter',
         dest='bkgFilter',
         help='Background filter size for SEP',
         type=int,
-        default=5)
+        default=cSkyCfg.BKG_FILTER)
     parser.add_argument(
         '--rebin',
         dest='rebin',
@@ -247,6 +257,28 @@ if __name__ == '__main__':
         default=2)
     parser.add_argument(
         '--saveBkg', dest='saveBkg', action="store_true", default=False)
+    parser.add_argument(
+        '--skyTable',
+        dest='skyTable',
+        help='Sky table of the whole run',
+        default=None)
+    parser.add_argument(
+        '--noSkyDat',
+        dest='saveDat',
+        help='Do not save the *_sky.dat file of each galaxy',
+        action="store_false",
+        default=True)
+    parser.add_argument(
+        '--patchSky',
+        dest='patchSky',
+        help='Folder of the patch sky maps',
+        default=None)
+    parser.add_argument(
+        '--noSkyRefine',
+        dest='skyRefine',
+        help='Use the patch sky without refinement',
+        action="store_false",
+        default=True)
 
     args = parser.parse_args()
 
@@ -6,6 +6,7 @@ from __future__ import division
 
 import os
 import copy
+import fcntl
 import shutil
 import argparse
 import warnings
@@ -25,6 +26,10 @@ from astropy.io import fits
 # Personal
 import hscUtils as hUtil
 import galfitParser as gPar
+import coaddGalfitRunner as gRun
+import galfitHarvest as gHar
+import galfitModel as gMod
+import coaddGalfitRegion as gReg
 
 # Colors and color maps
 from palettable.colorbrewer.qualitative import Set1_9 as compColor
@@ -62,6 +67,13 @@ COM = '#' * 100
 SEP = '-' * 100
 WAR = '!' * 100
 
+""" The 2-Sersic model from the 1-Sersic one: (flux fraction, Re scale) """
+SPLIT_INNER = (0.4, 0.3)
+SPLIT_OUTER = (0.6, 1.5)
+""" Range of the Sersic index of the inner component; n of the outer one """
+SPLIT_NSER_IN = (1.0, 4.0)
+SPLIT_NSER_OUT = 1.0
+
 
 def galfitAIC(galOut):
     u"""
@@ -150,8 +162,8 @@ def showModels(outFile, galOut, root=None, verbose=True, vertical=False,
         maskFile = os.path.join(root, galOut.input_mask)
         if (os.path.isfile(maskFile)) or os.path.islink(maskFile):
             mskArr = fits.open(maskFile)[0].data
-            imgMsk = mskArr[np.int(galOut.box_x0)-1:np.int(galOut.box_x1),
-                            np.int(galOut.box_y0)-1:np.int(galOut.box_y1)]
+            imgMsk = mskArr[np.int(galOut.box_y0)-1:np.int(galOut.box_y1),
+                            np.int(galOut.box_x0)-1:np.int(galOut.box_x1)]
             resShow = copy.deepcopy(imgRes)
             resShow[imgMsk > 0] = np.nan
         else:
@@ -225,7 +237,7 @@ def showModels(outFile, galOut, root=None, verbose=True, vertical=False,
 
     if showTitle:
         if title is None:
-            title = os.path.basename(outome86!ile)
+            title = os.path.basename(outFile)
         titleStr = ax1.text(0.50, 0.90,
                             r'$\mathrm{%s}$' % title,
                             fontsize=25, transform=ax1.transAxes,
@@ -367,8 +379,19 @@ def log2Readin(outFile, logFile, iniFile, root=None,
 
 
 def generateSubcomp(readFile, root=None, galfit=None, separate=True,
-                    verbose=True, abspath=False):
-    """Run Galfit -o3 to generate the model image of each component."""
+                    verbose=True, abspath=False, engine='galfit',
+                    outFile=None):
+    """
+    Run Galfit -o3 to generate the model image of each component.
+
+    Parameters:
+        engine  : 'native' renders the components of the output model with
+                  galfitModel instead of running GALFIT again
+        outFile : output model to render; <readFile>.fits by default
+    """
+    if engine == 'native':
+        return nativeSubcomp(readFile, root=root, verbose=verbose,
+                             abspath=abspath, outFile=outFile)
     """ Find GALFIT """
     if galfit is None:
         galfit = spawn.find_executable('galfit')
@@ -433,6 +456,41 @@ def generateSubcomp(readFile, root=None, galfit=None, separate=True,
     return
 
 
+def nativeSubcomp(readFile, root=None, verbose=True, abspath=False,
+                  outFile=None):
+    """
+    Render the model image of each component in Python.
+
+    Return:
+        list of the <readFile>_comp<N>.fits files
+    """
+    if abspath:
+        readFile = os.path.abspath(readFile)
+    if outFile is None:
+        outFile = readFile.replace('.in', '.fits')
+    if not os.path.isfile(outFile):
+        print WAR
+        raise Exception('XXX Can not find the GALFIT output: %s', outFile)
+    if verbose:
+        print "### Rendering the components of %s ..." % outFile
+
+    model, subComps, residual, header = gMod.galfitOutModel(outFile,
+                                                            root=root)
+    prefix = os.path.splitext(os.path.basename(readFile))[0]
+    if root is None:
+        root = os.path.dirname(readFile)
+    """ Same order as the subcomps.fits of GALFIT: the data come first """
+    compFiles = gMod.saveSubcomps(os.path.join(root, prefix + '.fits'),
+                                  [residual + model] + subComps,
+                                  header=header)
+    if verbose:
+        for i, compFile in enumerate(compFiles):
+            print " ## Component : %d " % (i + 1)
+            print "  #    Saved to %s " % compFile
+
+    return compFiles
+
+
 def getCenConstrFile(comps, location=None, name=None):
     """Generate simple central constraints file."""
     compArr = []
@@ -471,14 +529,19 @@ def coaddRunGalfit(readFile, root=None, imax=150, galfit=None, updateRead=True,
                    keepLog=True, show=True, expect=None, showZoom=False,
                    zoomSize=None, removePsf=True, verbose=False,
                    abspath=False, deleteAfter=False, savePkl=True,
-                   scale1=0.03, scale2=0.40):
-    """Run GALFIT."""
+                   scale1=0.03, scale2=0.40, runner=None, subComp=False):
+    """
+    Run GALFIT.
+
+    Parameters:
+        runner  : coaddGalfitRunner.GalfitRunner that sets the time and
+                  resource limits of the run; no limit by default
+        subComp : save the image of each component (see galfitPostRun)
+    """
     """ Find GALFIT """
-    if galfit is None:
-        galfit = spawn.find_executable('galfit')
-        if galfit is None:
-            print WAR
-            raise Exception("XXX Can not find the GALFIT executable")
+    if runner is None:
+        runner = gRun.GalfitRunner(galfit=galfit, timeout=None,
+                                   maxRetry=0, verbose=verbose)
 
     """ Check the Read-in File """
     if not os.path.isfile(readFile):
@@ -490,41 +553,77 @@ def coaddRunGalfit(readFile, root=None, imax=150, galfit=None, updateRead=True,
     """ Expected output model """
     if expect is None:
         expect = readFile.replace('.in', '.fits')
-    if os.path.isfile(expect):
-        os.remove(expect)
-
-    """ IMAX string """
-    imaxStr = " -imax %4d" % imax
 
-    """ GALFIT command """
-    galfitCommand = galfit + ' ' + imaxStr + ' ' + readFile
+    """ Excecute the command, the output goes to the log file """
+    job = galfitReadinJob(readFile, root=root, imax=imax, expect=expect,
+                          keepLog=keepLog, abspath=abspath)
     if verbose:
-        print " ## Command : %s" % galfitCommand
+        print " ## Command : %s" % ' '.join(gRun.galfitCommand(runner.galfit,
+                                                                job))
+    result = runner.run([job])[job['name']]
 
-    """ Excecute the command """
-    if (root is not None) and abspath:
-        proc = subprocess.Popen([galfitCommand], cwd=root, shell=True,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-    else:
-        proc = subprocess.Popen([galfitCommand], shell=True,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-    if keepLog:
-        logFile = readFile + '.log'
-        f = open(logFile, 'w')
-        for line in proc.stdout.readlines():
-            f.write(line)
-        f.close()
-    else:
-        for line in proc.stdout.readlines():
-            print line
-        proc.wait()
+    return galfitPostRun(readFile, expect, result=result, root=root,
+                         updateRead=updateRead, show=show,
+                         showZoom=showZoom, zoomSize=zoomSize,
+                         removePsf=removePsf, verbose=verbose,
+                         abspath=abspath, deleteAfter=deleteAfter,
+                         savePkl=savePkl, scale1=scale1, scale2=scale2,
+                         subComp=subComp)
+
+
+def galfitWorkDir(readFile):
+    """Working directory of the GALFIT run of one read-in file."""
+    return os.path.splitext(os.path.abspath(readFile))[0] + '_galfit'
+
+
+def galfitReadinJob(readFile, root=None, imax=150, expect=None,
+                    keepLog=True, abspath=False, workDir=None):
+    """
+    Describe the GALFIT run of a read-in file for the GalfitRunner.
+
+    Parameters:
+        workDir : own working directory of the run (see galfitWorkDir()),
+                  so runs at the same time do not share the galfit.NN and
+                  fit.log files; the read-in file needs absolute paths
+    """
+    if expect is None:
+        expect = readFile.replace('.in', '.fits')
+    logFile = (readFile + '.log') if keepLog else None
+    if workDir is not None:
+        """ GALFIT runs in workDir, so every path has to be absolute """
+        return gRun.galfitJob(readFile, os.path.abspath(readFile),
+                              root=workDir, imax=imax,
+                              expect=os.path.abspath(expect),
+                              logFile=(os.path.abspath(logFile) if keepLog
+                                       else None))
+    """ The working directory is only changed for absolute paths """
+    workDir = root if abspath else None
+
+    return gRun.galfitJob(readFile, readFile, root=workDir, imax=imax,
+                          expect=expect, logFile=logFile)
+
+
+def galfitPostRun(readFile, expect, result=None, root=None, updateRead=True,
+                  show=True, showZoom=False, zoomSize=None, removePsf=True,
+                  verbose=False, abspath=False, deleteAfter=False,
+                  savePkl=True, scale1=0.03, scale2=0.40, workDir=None,
+                  subComp=False):
+    """
+    Check and organize the output of a finished GALFIT run.
 
+    Parameters:
+        workDir : working directory of the run, where its galfit.NN is
+        subComp : save the data and the image of each component as
+                  <readFile>_comp<N>.fits, rendered from the output model
+                  (nativeSubcomp) instead of running GALFIT -o3
+    """
     if not os.path.isfile(expect):
-        done = False
+        done, plotOk = False, False
         print COM
-        print "### GALFIT run failed for : %s" % readFile
+        if (result is not None) and (result['status'] == gRun.TIMEOUT):
+            print "### GALFIT run timed out for : %s" % readFile
+        else:
+            print "### GALFIT run failed for : %s" % readFile
         print COM
     else:
         done = True
@@ -536,6 +635,8 @@ def coaddRunGalfit(readFile, root=None, imax=150, galfit=None, updateRead=True,
         galOut = gPar.GalfitResults(expect)
         galLog = galOut.logfile
         iniFile = galOut.input_initfile
+        if workDir is not None:
+            galLog = os.path.join(workDir, galLog)
 
         """ Update the read in file """
         if updateRead:
@@ -558,6 +659,15 @@ def coaddRunGalfit(readFile, root=None, imax=150, galfit=None, updateRead=True,
             outPkl = expect.replace('.fits', '.pkl')
             hUtil.saveToPickle(expect, outPkl)
 
+        """ Images of the components """
+        if subComp:
+            try:
+                generateSubcomp(readFile, root=root, verbose=verbose,
+                                abspath=abspath, engine='native',
+                                outFile=expect)
+            except Exception as err:
+                print "XXX Can not render the components : %s" % str(err)
+
         """ Visualization of the model """
         if show:
             try:
@@ -657,6 +767,14 @@ def readInputSky(prefix, root=None, rerun='default', rebin='rebin6'):
     return skyMed, skyAvg, skyStd
 
 
+def fitRegion(config):
+    """The fitting region of the config: x0, x1, y0, y1."""
+    names = config.dtype.names
+    x0 = config['x0'] if 'x0' in names else 1
+    y0 = config['y0'] if 'y0' in names else 1
+    return (x0, config['dimx'], y0, config['dimy'])
+
+
 def getInput1Sersic(config, readinFile='cutout_1ser.in', skyGrad=True,
                     useF1=False, useF4=False):
     """
@@ -679,8 +797,8 @@ def getInput1Sersic(config, readinFile='cutout_1ser.in', skyGrad=True,
     f.write('F) %s  # Bad pixel mask\n' % config['mask'][0])
     f.write('G) %s  # File with parameter constraints \n' %
             config['constr'][0])
-    f.write('H)  1  %5d  1  %5d  # Image region to fit\n' %
-            (config['dimx'], config['dimy']))
+    f.write('H) %5d %5d %5d %5d  # Image region to fit\n' %
+            fitRegion(config))
     f.write('I) %5d %5d  # Size of the convolution box\n' % (config['convbox'],
             config['convbox']))
     f.write('J) %6.2f  # Magnitude photometric zeropoint \n' % config['zp'])
@@ -747,9 +865,127 @@ def getInput1Sersic(config, readinFile='cutout_1ser.in', skyGrad=True,
     f.close()
 
 
+def sersicComp(config, dmag=0.0, fre=1.0, nser=None):
+    """
+    Initial guess of one Sersic component from the 1-Sersic config.
+
+    Parameters:
+        dmag : offset of the magnitude
+        fre  : ratio of the effective radius
+        nser : Sersic index; the one in config by default
+    """
+    return {'x': float(config['x']), 'y': float(config['y']),
+            'mag': float(config['mag']) + dmag,
+            're': float(config['re']) * fre,
+            'nser': float(config['nser']) if nser is None else nser,
+            'ba': float(config['ba']), 'pa': float(config['pa'])}
+
+
+def writeSersicComp(f, number, comp, useF1=False, useF4=False):
+    """Write one Sersic component into the readin file."""
+    f.write('# Object number: %d\n' % number)
+    f.write(' 0) sersic    \n')
+    f.write(' 1) %7.1f %7.1f  1 1 \n' % (comp['x'], comp['y']))
+    f.write(' 3) %7.3f     1 \n' % comp['mag'])
+    f.write(' 4) %7.3f     1 \n' % comp['re'])
+    f.write(' 5) %7.3f     1 \n' % comp['nser'])
+    f.write(' 6) 0.0000      0          #     ----- \n')
+    f.write(' 7) 0.0000      0          #     ----- \n')
+    f.write(' 8) 0.0000      0          #     ----- \n')
+    f.write(' 9) %7.3f     1 \n' % comp['ba'])
+    f.write('10) %7.3f     1 \n' % comp['pa'])
+    if useF1:
+        f.write('F1) 0.01 10.00 1 1 ')
+    if useF4:
+        f.write('F4) 0.01 10.00 1 1 ')
+    f.write(' Z) 0                      #  output option ' +
+            '(0 = resid., 1 = Dont subtract) \n')
+
+
+def readGalfitComps(modelFile):
+    """
+    Read the converged components from the header of a GALFIT model.
+
+    Return:
+        sersic components as sersicComp() dicts, sorted by the effective
+        radius; the sky value (None without a sky component)
+    """
+    fit, comps = gHar.parseHeader(fits.getheader(modelFile,
+                                                 ext=gHar.MODEL_HDU))
+    sersics, sky = [], None
+    for comp in comps:
+        if comp['type'] == 'sky':
+            sky = comp.get('sky', None)
+        elif comp['type'] == 'sersic':
+            sersics.append({'x': comp['xc'], 'y': comp['yc'],
+                            'mag': comp['mag'], 're': comp['re'],
+                            'nser': comp['n'], 'ba': comp['ar'],
+                            'pa': comp['pa']})
+    for comp in sersics:
+        if not all(np.isfinite(comp[key]) for key in comp):
+            raise Exception("### Bad parameters in %s" % modelFile)
+    sersics.sort(key=lambda comp: comp['re'])
+
+    return sersics, sky
+
+
+def _scaleComp(comp, frac=1.0, fre=1.0, nser=None):
+    """New component with a fraction of the flux and a scaled radius."""
+    new = dict(comp)
+    new['mag'] = comp['mag'] - 2.5 * np.log10(frac)
+    new['re'] = max(comp['re'] * fre, 1.0)
+    new['ba'] = min(comp['ba'], 0.95)
+    if nser is not None:
+        new['nser'] = nser
+    return new
+
+
+def splitNser(nser):
+    """Sersic index of the inner component of the 2-Sersic model."""
+    return min(max(nser, SPLIT_NSER_IN[0]), SPLIT_NSER_IN[1])
+
+
+def warmStart2Sersic(comps1):
+    """
+    Initial guesses of the 2-Sersic model from the converged 1-Sersic model.
+
+    The Sersic component is split into an inner component with 40% of the
+    flux, 0.3 Re and the same Sersic index (limited to 1-4), and an outer
+    component with 60% of the flux, 1.5 Re and n=1.  Both keep the
+    converged center, axis ratio and position angle.
+    """
+    comp = comps1[0]
+    inner = _scaleComp(comp, frac=SPLIT_INNER[0], fre=SPLIT_INNER[1],
+                       nser=splitNser(comp['nser']))
+    outer = _scaleComp(comp, frac=SPLIT_OUTER[0], fre=SPLIT_OUTER[1],
+                       nser=SPLIT_NSER_OUT)
+    return [inner, outer]
+
+
+def warmStart3Sersic(comps2):
+    """
+    Initial guesses of the 3-Sersic model from the converged 2-Sersic model.
+
+    The inner component is kept; the outer component is split into a
+    middle one with half of the flux, 0.6 Re and the same Sersic index, and
+    an envelope with the other half, 1.6 Re and n=0.5.
+    """
+    inner, outer = comps2[0], comps2[-1]
+    middle = _scaleComp(outer, frac=0.5, fre=0.6)
+    envelope = _scaleComp(outer, frac=0.5, fre=1.6, nser=0.5)
+    return [_scaleComp(inner), middle, envelope]
+
+
 def getInput2Sersic(config, readinFile='cutout_2ser.in', constr=False,
-                    skyGrad=True, useF1=False, useF4=False, constrCen=True):
-    """Generate the readin file for 2 Sersic GALFIT fitting."""
+                    skyGrad=True, useF1=False, useF4=False, constrCen=True,
+                    comps=None):
+    """
+    Generate the readin file for 2 Sersic GALFIT fitting.
+
+    Parameters:
+        comps : list of two sersicComp() dicts as the initial guesses;
+                the default rules are based on the 1-Sersic config
+    """
     f = open(readinFile, 'w')
 
     loc = os.path.dirname(readinFile)
@@ -766,8 +1002,8 @@ def getInput2Sersic(config, readinFile='cutout_2ser.in', constr=False,
             'relative to data \n')
     f.write('F) %s  # Bad pixel mask\n' % config['mask'][0])
     if config['constr'][0] == 'None' and constrCen:
-        f.write('G) 2comp.cons  # File with parameter constraints \n')
-        constrFile = os.path.join(loc, '2comp.cons')
+        constrFile = os.path.abspath(os.path.join(loc, '2comp.cons'))
+        f.write('G) %s  # File with parameter constraints \n' % constrFile)
         if not os.path.isfile(constrFile):
             print SEP
             print "### Generate constraint file"
@@ -777,8 +1013,8 @@ def getInput2Sersic(config, readinFile='cutout_2ser.in', constr=False,
     else:
         f.write('G) %s  # File with parameter constraints \n' %
                 config['constr'][0])
-    f.write('H)  1  %5d  1  %5d  # Image region to fit\n' %
-            (config['dimx'], config['dimy']))
+    f.write('H) %5d %5d %5d %5d  # Image region to fit\n' %
+            fitRegion(config))
     f.write('I) %5d %5d  # Size of the convolution box\n' %
             (config['convbox'], config['convbox']))
     f.write('J) %6.2f  # Magnitude photometric zeropoint \n' % config['zp'])
@@ -809,41 +1045,11 @@ def getInput2Sersic(config, readinFile='cutout_2ser.in', constr=False,
             '----------------------\n')
     f.write('\n')
 
-    f.write('# Object number: 1\n')
-    f.write(' 0) sersic    \n')
-    f.write(' 1) %7.1f %7.1f  1 1 \n' % (config['x'], config['y']))
-    f.write(' 3) %7.3f     1 \n' % (config['mag']+0.6))
-    f.write(' 4) %7.3f     1 \n' % (config['re']*0.25))
-    f.write(' 5) %7.3f     1 \n' % config['nser'])
-    f.write(' 6) 0.0000      0          #     ----- \n')
-    f.write(' 7) 0.0000      0          #     ----- \n')
-    f.write(' 8) 0.0000      0          #     ----- \n')
-    f.write(' 9) %7.3f     1 \n' % config['ba'])
-    f.write('10) %7.3f     1 \n' % config['pa'])
-    if useF1:
-        f.write('F1) 0.01 10.00 1 1 ')
-    if useF4:
-        f.write('F4) 0.01 10.00 1 1 ')
-    f.write(' Z) 0                      #  output option ' +
-            '(0 = resid., 1 = Dont subtract) \n')
-
-    f.write('# Object number: 2\n')
-    f.write(' 0) sersic    \n')
-    f.write(' 1) %7.1f %7.1f  1 1 \n' % (config['x'], config['y']))
-    f.write(' 3) %7.3f     1 \n' % (config['mag']+0.8))
-    f.write(' 4) %7.3f     1 \n' % (config['re']*1.2))
-    f.write(' 5) 0.9    1 \n')
-    f.write(' 6) 0.0000      0          #     ----- \n')
-    f.write(' 7) 0.0000      0          #     ----- \n')
-    f.write(' 8) 0.0000      0          #     ----- \n')
-    f.write(' 9) %7.3f     1 \n' % config['ba'])
-    f.write('10) %7.3f     1 \n' % config['pa'])
-    if useF1:
-        f.write('F1) 0.01 10.00 1 1 ')
-    if useF4:
-        f.write('F4) 0.01 10.00 1 1 ')
-    f.write(' Z) 0                      #  output option ' +
-            '(0 = resid., 1 = Dont subtract) \n')
+    if comps is None:
+        comps = [sersicComp(config, dmag=0.6, fre=0.25),
+                 sersicComp(config, dmag=0.8, fre=1.2, nser=0.9)]
+    for ii, comp in enumerate(comps):
+        writeSersicComp(f, ii + 1, comp, useF1=useF1, useF4=useF4)
     f.write('\n')
 
     if config['usesky'] == 1:
@@ -867,8 +1073,14 @@ def getInput2Sersic(config, readinFile='cutout_2ser.in', constr=False,
 
 def getInput3Sersic(config, readinFile='cutout_3ser.in', constr=False,
                     skyGrad=True, useF1=False, useF4=False,
-                    constrCen=True):
-    """Generate the readin file for 3 Sersic GALFIT fitting."""
+                    constrCen=True, comps=None):
+    """
+    Generate the readin file for 3 Sersic GALFIT fitting.
+
+    Parameters:
+        comps : list of three sersicComp() dicts as the initial guesses;
+                the default rules are based on the 1-Sersic config
+    """
     f = open(readinFile, 'w')
 
     loc = os.path.dirname(readinFile)
@@ -885,8 +1097,8 @@ def getInput3Sersic(config, readinFile='cutout_3ser.in', constr=False,
             'relative to data \n')
     f.write('F) %s  # Bad pixel mask\n' % config['mask'][0])
     if config['constr'][0] == 'None' and constrCen:
-        f.write('G) 3comp.cons  # File with parameter constraints \n')
-        constrFile = os.path.join(loc, '3comp.cons')
+        constrFile = os.path.abspath(os.path.join(loc, '3comp.cons'))
+        f.write('G) %s  # File with parameter constraints \n' % constrFile)
         if not os.path.isfile(constrFile):
             print SEP
             print " ## Generate comstraint file"
@@ -896,8 +1108,8 @@ def getInput3Sersic(config, readinFile='cutout_3ser.in', constr=False,
     else:
         f.write('G) %s  # File with parameter constraints \n' %
                 config['constr'][0])
-    f.write('H)  1  %5d  1  %5d  # Image region to fit\n' %
-            (config['dimx'], config['dimy']))
+    f.write('H) %5d %5d %5d %5d  # Image region to fit\n' %
+            fitRegion(config))
     f.write('I) %5d %5d  # Size of the convolution box\n' %
             (config['convbox'], config['convbox']))
     f.write('J) %6.2f  # Magnitude photometric zeropoint \n' % config['zp'])
@@ -928,60 +1140,12 @@ def getInput3Sersic(config, readinFile='cutout_3ser.in', constr=False,
             '----------------------\n')
 
     f.write('\n')
-    f.write('# Object number: 1\n')
-    f.write(' 0) sersic    \n')
-    f.write(' 1) %7.1f %7.1f  1 1 \n' % (config['x'], config['y']))
-    f.write(' 3) %7.3f     1 \n' % (config['mag']+1.2))
-    f.write(' 4) %7.3f     1 \n' % (config['re']*0.25))
-    f.write(' 5) %7.3f     1 \n' % config['nser'])
-    f.write(' 6) 0.0000      0          #     ----- \n')
-    f.write(' 7) 0.0000      0          #     ----- \n')
-    f.write(' 8) 0.0000      0          #     ----- \n')
-    f.write(' 9) %7.3f     1 \n' % config['ba'])
-    f.write('10) %7.3f     1 \n' % config['pa'])
-    if useF1:
-        f.write('F1) 0.01 10.00 1 1 ')
-    if useF4:
-        f.write('F4) 0.01 10.00 1 1 ')
-    f.write(' Z) 0                      #  output option ' +
-            '(0 = resid., 1 = Dont subtract) \n')
-
-    f.write('# Object number: 2\n')
-    f.write(' 0) sersic    \n')
-    f.write(' 1) %7.1f %7.1f  1 1 \n' % (config['x'], config['y']))
-    f.write(' 3) %7.3f     1 \n' % (config['mag']+0.9))
-    f.write(' 4) %7.3f     1 \n' % (config['re']*0.9))
-    f.write(' 5) 0.9    1 \n')
-    f.write(' 6) 0.0000      0          #     ----- \n')
-    f.write(' 7) 0.0000      0          #     ----- \n')
-    f.write(' 8) 0.0000      0          #     ----- \n')
-    f.write(' 9) %7.3f     1 \n' % config['ba'])
-    f.write('10) %7.3f     1 \n' % config['pa'])
-    if useF1:
-        f.write('F1) 0.01 10.00 1 1 ')
-    if useF4:
-        f.write('F4) 0.01 10.00 1 1 ')
-    f.write(' Z) 0                      #  output option ' +
-            '(0 = resid., 1 = Dont subtract) \n')
-    f.write('\n')
-
-    f.write('# Object number: 3\n')
-    f.write(' 0) sersic    \n')
-    f.write(' 1) %7.1f %7.1f  1 1 \n' % (config['x'], config['y']))
-    f.write(' 3) %7.3f     1 \n' % (config['mag']+0.7))
-    f.write(' 4) %7.3f     1 \n' % (config['re']*1.3))
-    f.write(' 5) 0.5    1 \n')
-    f.write(' 6) 0.0000      0          #     ----- \n')
-    f.write(' 7) 0.0000      0          #     ----- \n')
-    f.write(' 8) 0.0000      0          #     ----- \n')
-    f.write(' 9) %7.3f     1 \n' % config['ba'])
-    f.write('10) %7.3f     1 \n' % config['pa'])
-    if useF1:
-        f.write('F1) 0.01 10.00 1 1 ')
-    if useF4:
-        f.write('F4) 0.01 10.00 1 1 ')
-    f.write(' Z) 0                      #  output option ' +
-            '(0 = resid., 1 = Dont subtract) \n')
+    if comps is None:
+        comps = [sersicComp(config, dmag=1.2, fre=0.25),
+                 sersicComp(config, dmag=0.9, fre=0.9, nser=0.9),
+                 sersicComp(config, dmag=0.7, fre=1.3, nser=0.5)]
+    for ii, comp in enumerate(comps):
+        writeSersicComp(f, ii + 1, comp, useF1=useF1, useF4=useF4)
     f.write('\n')
 
     if config['usesky'] == 1:
@@ -1002,6 +1166,37 @@ def getInput3Sersic(config, readinFile='cutout_3ser.in', constr=False,
     f.close()
 
 
+def galfitRunReport(prefix, models, jobs, runResults, start, runLog=None,
+                    verbose=True):
+    """Print and keep the iterations and runtime of the GALFIT runs."""
+    logStr = "%25s %5s %5s %8s %5d %10.2f \n"
+    lines = []
+    if verbose:
+        print SEP
+        print "###  Model  Start    Status   Iter   Runtime"
+    for (name, readFile, runIt, noRun) in models:
+        if name not in jobs:
+            continue
+        result = runResults[jobs[name]['name']]
+        nIter = gHar.parseRunLog(jobs[name]['logFile'])[3]
+        lines.append(logStr % (prefix, name, start[name], result['status'],
+                               nIter, result['runtime']))
+        if verbose:
+            print "###  %5s  %5s  %8s  %5d  %8.2f sec" % (
+                name, start[name], result['status'], nIter,
+                result['runtime'])
+    if verbose:
+        print SEP
+    if runLog is not None:
+        with open(runLog, 'a') as logRun:
+            fcntl.flock(logRun, fcntl.LOCK_EX)
+            for line in lines:
+                logRun.write(line)
+            fcntl.flock(logRun, fcntl.LOCK_UN)
+
+    return lines
+
+
 def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
                             pix=0.168, useBkg=True,
                             zp=27.0, usePsf=True, galX0=None, galY0=None,
@@ -1016,11 +1211,28 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
                             deleteAfter=False, maskType='mskfin',
                             externalMask=None, abspath=False,
                             show=True, imgSub=False,
-                            scale1=0.03, scale2=0.40):
+                            scale1=0.03, scale2=0.40, nJobs=1,
+                            timeout=None, maxCpu=None, maxMem=None,
+                            maxRetry=1, runner=None, warmStart=False,
+                            runLog=None, autoRegion=False, subComp=False):
     """
     Run 1-Sersic fitting on HSC cutout image.
 
     Parameters:
+        nJobs    : number of GALFIT runs at the same time
+        timeout  : wall-clock limit of each GALFIT run, in seconds
+        maxCpu   : CPU time limit of each GALFIT run, in seconds
+        maxMem   : memory limit of each GALFIT run, in MB
+        maxRetry : how many times a GALFIT run is restarted after a timeout
+        runner   : coaddGalfitRunner.GalfitRunner to use; the above
+                   parameters are ignored when it is given
+        warmStart: run the models one after another; the 2-Sersic model
+                   starts from the converged 1-Sersic model, and the
+                   3-Sersic model from the 2-Sersic one
+        runLog   : file that keeps the iterations and runtime of each model
+        autoRegion: only fit the region around the galaxy, and size the
+                   convolution box with the R90 of the galaxy and the PSF
+        subComp  : save the image of each component of the models
     """
     if verbose:
         print SEP
@@ -1049,6 +1261,7 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
     dimX, dimY = imgArr.shape
 
     """ Clean the large image file """
+    regionMsk = mskArr if autoRegion else None
     del imgArr
     del mskArr
 
@@ -1143,6 +1356,28 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
     convbox = convbox if convbox >= 600 else 600
     convbox = convbox if convbox <= int(dimX*0.9) else int(dimX*0.9)
 
+    """ 0i. Fit only the region around the galaxy """
+    if autoRegion:
+        if 'GAL_R90' in mskHead:
+            galR90 = mskHead['GAL_R90']
+        else:
+            galR90 = galR50 * 2.5
+        if usePsf:
+            psfHead = fits.getheader(psfFile)
+            psfShape = (psfHead['NAXIS2'], psfHead['NAXIS1'])
+        else:
+            psfShape = None
+        plan = gReg.planFitRegion((dimX, dimY), galX, galY, galR90, q=galQ,
+                                  pa=galPA, psfShape=psfShape,
+                                  mskArr=regionMsk, oldConv=convbox,
+                                  verbose=verbose)
+        convbox = plan['convbox']
+        regX0, regX1, regY0, regY1 = (plan['x0'], plan['x1'],
+                                      plan['y0'], plan['y1'])
+    else:
+        regX0, regX1, regY0, regY1 = 1, dimX, 1, dimY
+    del regionMsk
+
     if verbose:
         print SEP
         print " ## Image : ", imgFile
@@ -1160,12 +1395,13 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
     galfitConfig = np.recarray((1,), dtype=[('x', float), ('y', float),
                                ('ba', float), ('pa', float), ('mag', float),
                                ('re', float), ('nser', float), ('bkg', float),
-                               ('image', 'a120'), ('psf', 'a120'),
-                               ('mask', 'a120'), ('constr', 'a50'),
-                               ('sig', 'a120'), ('pix', float),
+                               ('image', 'a400'), ('psf', 'a400'),
+                               ('mask', 'a400'), ('constr', 'a400'),
+                               ('sig', 'a400'), ('pix', float),
                                ('zp', float), ('convbox', int),
                                ('usesky', int), ('dimx', int),
-                               ('dimy', int), ('output', 'a120')])
+                               ('dimy', int), ('x0', int), ('y0', int),
+                               ('output', 'a400')])
     if useBkg:
         galfitConfig['usesky'] = 1
     else:
@@ -1179,20 +1415,23 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
     galfitConfig['re'] = galR50
     galfitConfig['nser'] = galSer
     galfitConfig['bkg'] = bkg
-    galfitConfig['image'] = imgFile
-    galfitConfig['psf'] = psfFile
-    galfitConfig['sig'] = sigFile
-    galfitConfig['mask'] = mskFile
+    """ Every model runs in its own directory, so the paths are absolute """
+    galfitConfig['image'] = os.path.abspath(imgFile)
+    galfitConfig['psf'] = os.path.abspath(psfFile) if psfFile else ''
+    galfitConfig['sig'] = os.path.abspath(sigFile) if sigFile else ''
+    galfitConfig['mask'] = os.path.abspath(mskFile)
     galfitConfig['pix'] = pix
     galfitConfig['zp'] = zp
     galfitConfig['convbox'] = convbox
-    galfitConfig['dimx'] = dimX
-    galfitConfig['dimy'] = dimY
-    galfitConfig['output'] = outFile
+    galfitConfig['dimx'] = regX1
+    galfitConfig['dimy'] = regY1
+    galfitConfig['x0'] = regX0
+    galfitConfig['y0'] = regY0
+    galfitConfig['output'] = os.path.abspath(outFile)
     if constrFile is None:
         galfitConfig['constr'] = 'None'
     else:
-        galfitConfig['constr'] = constrFile
+        galfitConfig['constr'] = os.path.abspath(constrFile)
 
     """ Directory for the output model """
     if root is not None:
@@ -1203,23 +1442,9 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
     """ 1a. Generate the Read-in File for 1Ser model"""
     getInput1Sersic(galfitConfig, readinFile=inFile, skyGrad=skyGrad,
                     useF1=useF1, useF4=useF4)
-    """ 1b. Execute the GALFIT run """
-    if run1:
-        done1, plot1 = coaddRunGalfit(inFile, root=modRoot, imax=imax,
-                                      zoomSize=int(dimX/2.5),
-                                      deleteAfter=deleteAfter,
-                                      show=show,
-                                      scale1=scale1, scale2=scale2)
-        if done1:
-            ser1Done = 'DONE'
-        else:
-            ser1Done = 'FAIL'
-        if plot1:
-            ser1Plot = 'DONE'
-        else:
-            ser1Plot = 'FAIL'
-    else:
-        ser1Done, ser1Plot = 'NRUN', 'NRUN'
+    """ 1b. The GALFIT run """
+    models = [('1ser', inFile, run1, 'NRUN')]
+    configs = {}
 
     """ Optional: 2-Sersic Model """
     if ser2Comp:
@@ -1230,26 +1455,11 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
         """ 2c. Config """
         config2Ser = copy.deepcopy(galfitConfig)
         config2Ser['output'] = outFile2
+        configs['2ser'] = config2Ser
         getInput2Sersic(config2Ser, readinFile=inFile2, skyGrad=skyGrad,
                         useF1=useF1, useF4=useF4, constrCen=constrCen)
-        """ 2d. Execute the GALFIT run """
-        if run2:
-            done2, plot2 = coaddRunGalfit(inFile2, root=modRoot, imax=imax,
-                                          zoomSize=int(dimX/2.5),
-                                          deleteAfter=deleteAfter, show=show,
-                                          scale1=scale1, scale2=scale2)
-            if done2:
-                ser2Done = 'DONE'
-            else:
-                ser2Done = 'FAIL'
-            if plot2:
-                ser2Plot = 'DONE'
-            else:
-                ser2Plot = 'FAIL'
-        else:
-            ser2Done, ser2Plot = 'NUSE', 'NUSE'
-    else:
-        ser2Done, ser2Plot = 'NUSE', 'NUSE'
+        """ 2d. The GALFIT run """
+        models.append(('2ser', inFile2, run2, 'NUSE'))
 
     """ Optional: 3-Sersic Model """
     if ser3Comp:
@@ -1260,26 +1470,82 @@ def coaddCutoutGalfitSimple(prefix, root=None, rerun='default',
         """ 3c. Config """
         config3Ser = copy.deepcopy(galfitConfig)
         config3Ser['output'] = outFile3
+        configs['3ser'] = config3Ser
         getInput3Sersic(config3Ser, readinFile=inFile3, skyGrad=skyGrad,
                         useF1=useF1, useF4=useF4, constrCen=constrCen)
-        """ 3d. Execute the GALFIT run """
-        if run3:
-            done3, plot3 = coaddRunGalfit(inFile3, root=modRoot, imax=imax,
-                                          zoomSize=int(dimX/2.5),
-                                          deleteAfter=deleteAfter, show=show,
-                                          scale1=scale1, scale2=scale2)
-            if done3:
-                ser3Done = 'DONE'
-            else:
-                ser3Done = 'FAIL'
-            if plot3:
-                ser3Plot = 'DONE'
-            else:
-                ser3Plot = 'FAIL'
-        else:
-            ser3Done, ser3Plot = 'NUSE', 'NUSE'
-    else:
-        ser3Done, ser3Plot = 'NUSE', 'NUSE'
+        """ 3d. The GALFIT run """
+        models.append(('3ser', inFile3, run3, 'NUSE'))
+
+    """ Execute the GALFIT runs, nJobs of them at the same time """
+    jobs = dict((name, galfitReadinJob(readFile, root=modRoot, imax=imax,
+                                       workDir=galfitWorkDir(readFile)))
+                for (name, readFile, runIt, noRun) in models if runIt)
+    if jobs and (runner is None):
+        runner = gRun.GalfitRunner(nJobs=nJobs, timeout=timeout,
+                                   maxCpu=maxCpu, maxMem=maxMem,
+                                   maxRetry=maxRetry, verbose=verbose)
+    start = dict((name, 'COLD') for name in jobs)
+    if jobs and (not warmStart):
+        runResults = runner.run([jobs[model[0]] for model in models
+                                 if model[0] in jobs])
+    elif jobs:
+        """ One model after another, each starts from the previous one """
+        runResults = {}
+        warmComps = {}
+        for (name, readFile, runIt, noRun) in models:
+            if (name != '1ser') and (warmComps.get('1ser') is not None):
+                comps1, sky = warmComps['1ser']
+                if warmComps.get('2ser') is not None:
+                    comps2, sky = warmComps['2ser']
+                else:
+                    comps2 = warmStart2Sersic(comps1)
+                config = copy.deepcopy(configs[name])
+                if sky is not None:
+                    config['bkg'] = sky
+                if name == '2ser':
+                    getInput2Sersic(config, readinFile=readFile,
+                                    skyGrad=skyGrad, useF1=useF1,
+                                    useF4=useF4, constrCen=constrCen,
+                                    comps=comps2)
+                else:
+                    getInput3Sersic(config, readinFile=readFile,
+                                    skyGrad=skyGrad, useF1=useF1,
+                                    useF4=useF4, constrCen=constrCen,
+                                    comps=warmStart3Sersic(comps2))
+                if runIt:
+                    start[name] = 'WARM'
+            if runIt:
+                runResults.update(runner.run([jobs[name]]))
+            """ The converged model, or the one from an earlier run """
+            expect = readFile.replace('.in', '.fits')
+            if os.path.isfile(expect):
+                try:
+                    warmComps[name] = readGalfitComps(expect)
+                except Exception as errMsg:
+                    warnings.warn(str(errMsg))
+
+    """ Iterations and runtime of each model """
+    if jobs:
+        galfitRunReport(prefix, models, jobs, runResults, start,
+                        runLog=runLog, verbose=verbose)
+
+    status = {'2ser': ('NUSE', 'NUSE'), '3ser': ('NUSE', 'NUSE')}
+    for (name, readFile, runIt, noRun) in models:
+        if not runIt:
+            status[name] = (noRun, noRun)
+            continue
+        job = jobs[name]
+        done, plot = galfitPostRun(readFile, job['expect'],
+                                   result=runResults[job['name']],
+                                   root=modRoot, zoomSize=int(dimX/2.5),
+                                   deleteAfter=deleteAfter, show=show,
+                                   scale1=scale1, scale2=scale2,
+                                   workDir=job['root'], subComp=subComp)
+        status[name] = ('DONE' if done else 'FAIL',
+                        'DONE' if plot else 'FAIL')
+    ser1Done, ser1Plot = status['1ser']
+    ser2Done, ser2Plot = status['2ser']
+    ser3Done, ser3Plot = status['3ser']
 
     return ser1Done, ser1Plot, ser2Done, ser2Plot, ser3Done, ser3Plot
 
@@ -1374,6 +1640,30 @@ if __name__ == '__main__':
                         type=float, default=0.03)
     parser.add_argument('--scale2', dest='scale2', help='Scale for residual',
                         type=float, default=0.40)
+    parser.add_argument('--galfitJobs', dest='nJobs',
+                        help='Number of GALFIT runs at the same time',
+                        type=int, default=1)
+    parser.add_argument('--timeout', dest='timeout',
+                        help='Wall-clock limit of one GALFIT run (sec)',
+                        type=float, default=None)
+    parser.add_argument('--maxCpu', dest='maxCpu',
+                        help='CPU time limit of one GALFIT run (sec)',
+                        type=int, default=None)
+    parser.add_argument('--maxMem', dest='maxMem',
+                        help='Memory limit of one GALFIT run (MB)',
+                        type=float, default=None)
+    parser.add_argument('--maxRetry', dest='maxRetry',
+                        help='Number of restarts after a timeout',
+                        type=int, default=1)
+    parser.add_argument('--warmStart', dest='warmStart',
+                        action="store_true", default=False)
+    parser.add_argument('--runLog', dest='runLog',
+                        help='Log of the iterations and runtime',
+                        default=None)
+    parser.add_argument('--autoRegion', dest='autoRegion',
+                        action="store_true", default=False)
+    parser.add_argument('--subComp', dest='subComp',
+                        action="store_true", default=False)
 
     args = parser.parse_args()
 
@@ -1396,4 +1686,10 @@ if __name__ == '__main__':
                             externalMask=args.externalMask,
                             abspath=args.abspath, show=args.show,
                             imgSub=args.imgSub,
-                            scale1=args.scale1, scale2=args.scale2)
+                            scale1=args.scale1, scale2=args.scale2,
+                            nJobs=args.nJobs, timeout=args.timeout,
+                            maxCpu=args.maxCpu, maxMem=args.maxMem,
+                            maxRetry=args.maxRetry,
+                            warmStart=args.warmStart, runLog=args.runLog,
+                            autoRegion=args.autoRegion,
+                            subComp=args.subComp)
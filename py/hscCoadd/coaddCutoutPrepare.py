@@ -6,7 +6,6 @@ from __future__ import (division, print_function)
 
 import os
 import copy
-import glob
 import argparse
 
 import numpy as np
@@ -25,7 +24,9 @@ import sep
 
 # Personal
 import hscUtils as hUtil
+import hscRerun as hRerun
 import ds9Reg2Mask as reg2Mask
+import coaddDetectTree as cdt
 
 # Matplotlib related
 import matplotlib as mpl
@@ -979,9 +980,7 @@ def readCutoutImage(prefix, root=None, variance=False):
         sigFile = os.path.join(root, sigFile)
 
     # Image Data
-    if os.path.islink(imgFile):
-        imgOri = os.readlink(imgFile)
-        imgFile = imgOri
+    imgFile = hRerun.resolvePath(imgFile)
 
     if os.path.isfile(imgFile):
         imgHdu = fits.open(imgFile)
@@ -993,9 +992,7 @@ def readCutoutImage(prefix, root=None, variance=False):
     imgHead = imgHdu[0].header
 
     # Bad mask
-    if os.path.islink(mskFile):
-        mskOri = os.readlink(mskFile)
-        mskFile = mskOri
+    mskFile = hRerun.resolvePath(mskFile)
     if os.path.isfile(mskFile):
         mskArr = fits.open(mskFile)[0].data
     else:
@@ -1003,9 +1000,7 @@ def readCutoutImage(prefix, root=None, variance=False):
         mskArr = None
 
     # Optional detection plane
-    if os.path.islink(detFile):
-        detOri = os.readlink(detFile)
-        detFile = detOri
+    detFile = hRerun.resolvePath(detFile)
     if os.path.isfile(detFile):
         detArr = fits.open(detFile)[0].data
     else:
@@ -1013,9 +1008,7 @@ def readCutoutImage(prefix, root=None, variance=False):
         detArr = None
 
     # Optional sigma plane
-    if os.path.islink(sigFile):
-        sigOri = os.readlink(sigFile)
-        sigFile = sigOri
+    sigFile = hRerun.resolvePath(sigFile)
     if os.path.isfile(sigFile):
         sigArr = fits.open(sigFile)[0].data
     else:
@@ -1122,7 +1115,9 @@ def coaddCutoutPrepare(prefix,
                        sigthr=0.02,
                        showAll=False,
                        brightStar=None,
-                       multiMask=False):
+                       multiMask=False,
+                       detTree=False,
+                       treeLevels=None):
     # Prepare SEP
     sep.set_extract_pixstack(500000)
 
@@ -1157,18 +1152,8 @@ def coaddCutoutPrepare(prefix,
         print(SEP)
         print("\n### DEAL WITH IMAGE : %s" % (prefix + '_img.fits'))
 
-    # Set up a rerun
-    rerunDir = os.path.join(root, rerun.strip())
-    if not os.path.isdir(rerunDir):
-        os.makedirs(rerunDir)
-
-    # Link the necessary files to the rerun folder
-    fitsList = glob.glob(root + '*.fits')
-    for fitsFile in fitsList:
-        seg = fitsFile.split('/')
-        link = os.path.join(rerunDir, seg[-1])
-        if (not os.path.islink(link)) and (not os.path.isfile(link)):
-            os.symlink(fitsFile, link)
+    # Set up a rerun that inherits the input files
+    rerunDir = hRerun.rerunSetup(root, rerun)
 
     # DETECTION and BAD array is optional
     detFound, badFound = (detArr is not None), (mskArr is not None)
@@ -1246,65 +1231,105 @@ def coaddCutoutPrepare(prefix,
         errArr, filter_type = None, 'conv'
         detThrC, detThrH = thrC * bkgC.globalrms, thrH * bkgH.globalrms
 
-    # Cold Detection Run
-    try:
-        objC, segC = sep.extract(imgSubC, detThrC, minarea=minDetC,
-                                 deblend_nthresh=debThrC,
-                                 deblend_cont=debConC,
-                                 filter_kernel=convKerC,
-                                 filter_type=filter_type,
-                                 err=errArr,
-                                 segmentation_map=True)
-    except Exception:
-        # Try it once more
-        print("### Failed the first time, try it again...")
-        objC, segC = sep.extract(imgSubC, (detThrC, + 2),
-                                 minarea=minDetC,
-                                 deblend_nthresh=(debThrC * 2),
-                                 deblend_cont=(debConC / 2),
-                                 filter_kernel=convKerC,
-                                 filter_type=filter_type,
-                                 err=errArr,
-                                 segmentation_map=True)
-    if verbose:
-        print("### A. COLD DETECTION: %d objects" % len(objC['x']))
+    if detTree:
+        # The Cold, intermediate, and Hot levels are linked into a tree, so
+        # the catalogs can be merged without matching.  The Hot level keeps
+        # its own background and convolution kernel.
+        if detThrH <= detThrC:
+            raise Exception("### thrH should be higher than thrC for detTree")
+        treeMid = []
+        if treeLevels is not None:
+            for thrLevel in sorted(treeLevels):
+                thrLevel = (thrLevel if errArr is not None
+                            else thrLevel * bkgC.globalrms)
+                if detThrC < thrLevel < detThrH:
+                    treeMid.append(thrLevel)
+        nMid = len(treeMid)
+        objTree, segTree = cdt.detectTree(
+            [imgSubC] * (nMid + 1) + [imgSubH],
+            [detThrC] + treeMid + [detThrH],
+            minarea=[minDetC] + [minDetH] * (nMid + 1),
+            err=errArr, filter_type=filter_type,
+            filter_kernel=[convKerC] * (nMid + 1) + [getConvKernel(2)],
+            deblend_nthresh=[debThrC] + [debThrH] * (nMid + 1),
+            deblend_cont=[debConC] + [debConH] * (nMid + 1))
+        objC, segC = objTree[0], segTree[0]
+        objH, segH = objTree[-1], segTree[-1]
+        if verbose:
+            print("### A. COLD DETECTION: %d objects" % len(objC['x']))
+            print("### B.  HOT DETECTION: %d objects" % len(objH['x']))
+        objC = sepValidObjects(objC)
+        objH = sepValidObjects(objH)
 
-    # Clean the objects
-    objC = sepValidObjects(objC)
+        prefixC = os.path.join(rerunDir, (prefix + '_' + suffix + 'objC'))
+        if showAll:
+            saveSEPObjects(objC, prefix=prefixC, color='Blue', csv=False,
+                           pkl=False, reg=True)
+            for level, objLevel in enumerate(objTree[1:-1]):
+                prefixL = os.path.join(rerunDir, (prefix + '_' + suffix +
+                                                  'objL%d' % (level + 1)))
+                saveSEPObjects(sepValidObjects(objLevel), prefix=prefixL,
+                               color='Cyan', csv=False, pkl=False, reg=True)
+    else:
+        # Cold Detection Run
+        try:
+            objC, segC = sep.extract(imgSubC, detThrC, minarea=minDetC,
+                                     deblend_nthresh=debThrC,
+                                     deblend_cont=debConC,
+                                     filter_kernel=convKerC,
+                                     filter_type=filter_type,
+                                     err=errArr,
+                                     segmentation_map=True)
+        except Exception:
+            # Try it once more
+            print("### Failed the first time, try it again...")
+            objC, segC = sep.extract(imgSubC, (detThrC, + 2),
+                                     minarea=minDetC,
+                                     deblend_nthresh=(debThrC * 2),
+                                     deblend_cont=(debConC / 2),
+                                     filter_kernel=convKerC,
+                                     filter_type=filter_type,
+                                     err=errArr,
+                                     segmentation_map=True)
+        if verbose:
+            print("### A. COLD DETECTION: %d objects" % len(objC['x']))
 
-    # Save objects list to different format of files
-    prefixC = os.path.join(rerunDir, (prefix + '_' + suffix + 'objC'))
-    if showAll:
-        saveSEPObjects(objC, prefix=prefixC, color='Blue', csv=False,
-                       pkl=False, reg=True)
+        # Clean the objects
+        objC = sepValidObjects(objC)
 
-    # Hot Detection Run
-    # Convolution kernel for hot run
-    convKerH = getConvKernel(2)
-    try:
-        objH, segH = sep.extract(imgSubH, detThrH, minarea=minDetH,
-                                 deblend_nthresh=debThrH,
-                                 deblend_cont=debConH,
-                                 filter_kernel=convKerH,
-                                 filter_type=filter_type,
-                                 err=errArr,
-                                 segmentation_map=True)
-    except Exception:
-        # Try it once more
-        print("### Failed the first time, try it again...")
-        objH, segH = sep.extract(imgSubH, (detThrH, + 2),
-                                 minarea=minDetH,
-                                 deblend_nthresh=(debThrH * 2),
-                                 deblend_cont=(debConH / 2),
-                                 filter_kernel=convKerH,
-                                 filter_type=filter_type,
-                                 err=errArr,
-                                 segmentation_map=True)
-    if verbose:
-        print("### B.  HOT DETECTION: %d objects" % len(objH['x']))
+        # Save objects list to different format of files
+        prefixC = os.path.join(rerunDir, (prefix + '_' + suffix + 'objC'))
+        if showAll:
+            saveSEPObjects(objC, prefix=prefixC, color='Blue', csv=False,
+                           pkl=False, reg=True)
+
+        # Hot Detection Run
+        # Convolution kernel for hot run
+        convKerH = getConvKernel(2)
+        try:
+            objH, segH = sep.extract(imgSubH, detThrH, minarea=minDetH,
+                                     deblend_nthresh=debThrH,
+                                     deblend_cont=debConH,
+                                     filter_kernel=convKerH,
+                                     filter_type=filter_type,
+                                     err=errArr,
+                                     segmentation_map=True)
+        except Exception:
+            # Try it once more
+            print("### Failed the first time, try it again...")
+            objH, segH = sep.extract(imgSubH, (detThrH, + 2),
+                                     minarea=minDetH,
+                                     deblend_nthresh=(debThrH * 2),
+                                     deblend_cont=(debConH / 2),
+                                     filter_kernel=convKerH,
+                                     filter_type=filter_type,
+                                     err=errArr,
+                                     segmentation_map=True)
+        if verbose:
+            print("### B.  HOT DETECTION: %d objects" % len(objH['x']))
 
-    # Clean the objects
-    objH = sepValidObjects(objH)
+        # Clean the objects
+        objH = sepValidObjects(objH)
 
     # Deal with the very elongated HOT object
     flagEll = (objH['b'] / objH['a']) < 0.5
@@ -1407,8 +1432,11 @@ def coaddCutoutPrepare(prefix,
     """
     3. Merge the objects from Cold and Hot runs together
     """
-    objComb, objHnew, objCnew = combObjCat(
-        objC, objH, keepH=True, cenDistC=cenDistC, tol=tol)
+    if detTree:
+        objComb, objHnew, objCnew = cdt.combTreeCat(objC, objH, keepH=True)
+    else:
+        objComb, objHnew, objCnew = combObjCat(
+            objC, objH, keepH=True, cenDistC=cenDistC, tol=tol)
 
     # Also save the combined object lists
     prefixComb = os.path.join(rerunDir, (prefix + '_' + suffix + 'objComb'))
@@ -2215,6 +2243,14 @@ if __name__ == '__main__':
         default=0.01)
     parser.add_argument(
         '--multiMask', dest='multiMask', action="store_true", default=False)
+    parser.add_argument(
+        '--detTree', dest='detTree', action="store_true", default=False,
+        help='Link the Cold/Hot detections into a tree, and merge them ' +
+        'through the links instead of matching the centers')
+    parser.add_argument(
+        '--treeLevels', dest='treeLevels', nargs='+', type=float,
+        default=None,
+        help='Extra detection thresholds between thrC and thrH for detTree')
     parser.add_argument(
         '--noBkgC', dest='noBkgC', action="store_true", default=False)
     parser.add_argument(
@@ -2278,4 +2314,6 @@ if __name__ == '__main__':
         regKeep=args.regKeep,
         showAll=args.showAll,
         brightStar=args.brightStar,
-        multiMask=args.multiMask)
+        multiMask=args.multiMask,
+        detTree=args.detTree,
+        treeLevels=args.treeLevels)
@@ -16,7 +16,11 @@ from astropy.io import fits
 
 # Personal
 import hscUtils as hUtil
+import hscRerun as hRerun
 import galSBP
+import coaddSkyTable as cSkyTab
+from coaddEllipseRunner import ellipseJob, runEllipseJobs
+from coaddPsfCache import PsfCache
 
 # Matplotlib related
 import matplotlib as mpl
@@ -70,21 +74,15 @@ def readSbpInput(prefix, root=None, exMask=None, imgSub=True):
     else:
         mskFile = exMask
     """ Input Image """
-    if imgSub and (not os.path.isfile(imgFile)):
+    if imgSub and (not hRerun.pathExists(imgFile)):
         # Fall back to original image
         warnings.warn("# Can not find the background subtracted image!")
         imgFile = os.path.join(root, (prefix + '_img.fits'))
 
-    if os.path.islink(imgFile):
-        imgOri = os.readlink(imgFile)
-    else:
-        imgOri = imgFile
+    imgOri = hRerun.resolvePath(imgFile)
 
     """ Mask Image """
-    if os.path.islink(mskFile):
-        mskOri = os.readlink(mskFile)
-    else:
-        mskOri = mskFile
+    mskOri = hRerun.resolvePath(mskFile)
     if not os.path.isfile(imgOri):
         raise Exception("### Cannot find the input image : %s !" % imgOri)
     if not os.path.isfile(mskOri):
@@ -112,8 +110,7 @@ def readPsfInput(prefix, root=None):
     if root is not None:
         psfFile = os.path.join(root, psfFile)
 
-    if os.path.islink(psfFile):
-        psfOri = os.readlink(psfFile)
+    psfOri = hRerun.resolvePath(psfFile)
 
     if not os.path.isfile(psfOri):
         raise Exception("### Can not find the input psf image : %s !" % psfOri)
@@ -126,12 +123,25 @@ def readPsfInput(prefix, root=None):
     return psfFile, psfDimX, psfDimY
 
 
-def readInputSky(prefix, root=None, rebin='rebin6'):
+def readInputSky(prefix, root=None, rebin='rebin6', skyTable=None,
+                 rerun=None):
     """
     Read in the Input Sky Result.
 
     Parameters:
+        skyTable : sky table of the run; the *_sky.dat file is only used
+                   when the cutout can not be found in the table
+        rerun    : rerun of the sky measurement in the sky table
     """
+    if skyTable is not None:
+        skyOut, found = cSkyTab.skyLookup(skyTable, prefix=prefix,
+                                          rebin=int(rebin.replace('rebin',
+                                                                  '')),
+                                          rerun=rerun)
+        if found[0]:
+            return skyOut['skyMed'][0], skyOut['skyAvg'][0], \
+                skyOut['skyStd'][0]
+
     skyFile = prefix + '_' + rebin + '_sky.dat'
     if root is not None:
         skyFile = os.path.join(root, skyFile)
@@ -148,6 +158,35 @@ def readInputSky(prefix, root=None, rebin='rebin6'):
     return skyMed, skyAvg, skyStd
 
 
+def readSkyRms(prefix, root=None, rebin='rebin6', skyTable=None,
+               rerun=None):
+    """
+    Read the sky RMS of one pixel (SKYRMS) of the Input Sky Result.
+
+    The older sky results do not have it; the StD of the rebinned image
+    can not be used instead, as it depends on the rebinning method and on
+    the correlation of the noise.
+    """
+    if skyTable is not None:
+        skyOut, found = cSkyTab.skyLookup(skyTable, prefix=prefix,
+                                          rebin=int(rebin.replace('rebin',
+                                                                  '')),
+                                          rerun=rerun)
+        if found[0] and np.isfinite(skyOut['skyRms'][0]):
+            return skyOut['skyRms'][0]
+
+    skyFile = prefix + '_' + rebin + '_sky.dat'
+    if root is not None:
+        skyFile = os.path.join(root, skyFile)
+
+    if os.path.isfile(skyFile):
+        for line in open(skyFile, 'r').readlines():
+            if line.startswith('SKYRMS:'):
+                return float(line.split(':')[1].strip())
+
+    raise Exception("### Can not find the sky RMS of %s !" % prefix)
+
+
 def imgSameSize(img1, img2):
     """Check whether images have the same size."""
     dimX1, dimY1 = img1.shape
@@ -728,11 +767,21 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
                    nClip=2, fracBad=0.5, minIt=20, maxIt=150, outRatio=1.2,
                    exMask=None, suffix='', plMask=False, noMask=False,
                    multiEllipse=False, imgSub=False,
-                   isophote=None, xttools=None):
+                   isophote=None, xttools=None, skyTable=None,
+                   engine='iraf', nProc=1, service=None,
+                   scratch=None, store=None, psfCache=None, minSnr=None,
+                   nLowSnr=3, rerun=None):
     """
     Generate 1-D SBP Plot.
 
     Parameters:
+        rerun    : name of the rerun, to find the sky in the sky table
+        psfCache : PsfCache (or its directory); the profile of a PSF image
+                   that was already measured is reused
+        minSnr   : stage 3 stops fitting the isophotes after nLowSnr
+                   isophotes in a row with S/N < minSnr; the sky RMS of one
+                   pixel is the SKYRMS of the coaddCutoutSky output.  The
+                   multiEllipse runs only go out to this radius
     """
     if verbose:
         print(SEP)
@@ -749,8 +798,15 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
         else:
             if not os.path.isfile(xttools):
                 raise Exception("# Can not find x_ttools.e: %s" % xttools)
-    else:
+    elif engine == 'iraf':
         print("###    Will use PyRAF for everything !")
+        """
+        PyRAF keeps the task parameters in one shared uparm directory, only
+        the workers of an EllipseService can run at the same time
+        """
+        if (nProc > 1) and (service is None):
+            print("###    PyRAF ELLIPSE runs can not be parallel, nProc=1 !")
+            nProc = 1
 
     """ 0. Organize Input Data """
     # Read in the input image, mask, psf, and their headers
@@ -771,15 +827,8 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
     del imgArr
     del mskArr
 
-    if os.path.islink(imgFile):
-        imgOri = os.readlink(imgFile)
-    else:
-        imgOri = imgFile
-
-    if os.path.islink(mskFile):
-        mskOri = os.readlink(mskFile)
-    else:
-        mskOri = mskFile
+    imgOri = hRerun.resolvePath(imgFile)
+    mskOri = hRerun.resolvePath(mskFile)
 
     if noMask:
         mskFile = None
@@ -795,13 +844,25 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
     """ 0b. Background """
     if bkgCor:
         try:
-            skyMed, skyAvg, skyStd = readInputSky(prefix, root=root)
+            skyMed, skyAvg, skyStd = readInputSky(prefix, root=root,
+                                                  skyTable=skyTable,
+                                                  rerun=rerun)
             bkg = skyMed
         except Exception:
             bkg = 0.00
     else:
         bkg = 0.00
 
+    """ 0c. Sky RMS of one pixel, for the S/N of the isophotes """
+    skyRms = None
+    if minSnr is not None:
+        try:
+            skyRms = readSkyRms(prefix, root=root, rebin='rebin6',
+                                skyTable=skyTable, rerun=rerun)
+        except Exception:
+            print("###    Can not find the sky RMS, use the errors of " +
+                  "the isophotes for the S/N")
+
     """ 1. Prepare the Input for SBP """
     if (galX0 is None) or (galY0 is None):
         galX, galY = mskHead['GAL_CENX'], mskHead['GAL_CENY']
@@ -837,179 +898,323 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
         raise Exception("### The central region is masked out : %s" % imgFile)
     else:
         """ Ellipse run for the PSF """
+        jobs = []
         if psf:
-            if verbose:
-                print("\n###    Ellipse Run on PSF ")
             psfFile = prefix + '_psf.fits'
             if root is not None:
                 psfFile = os.path.join(root, psfFile)
-            if os.path.islink(psfFile):
-                psfOri = os.readlink(psfFile)
-            else:
-                psfOri = psfFile
+            psfOri = hRerun.resolvePath(psfFile)
 
             if not os.path.isfile(psfOri):
                 raise Exception("### Can not find the \
                                 PSF image: %s !" % psfFile)
-            psfRes = galSBP.galSBP(psfFile, iniSma=5.0,
-                                   pix=pix,
-                                   galQ=0.95,
-                                   galPA=0.0,
-                                   stage=3,
-                                   zpPhoto=zp,
-                                   recenter=psfRecenter,
-                                   outerThreshold=1e-6,
-                                   useZscale=False,
-                                   savePng=False,
-                                   bkg=0.0,
-                                   updateIntens=False,
-                                   imgType=imgType,
-                                   isophote=isophote,
-                                   xttools=xttools)
-            psfOut, psfBin = psfRes
+            psfKwargs = dict(iniSma=5.0,
+                             pix=pix,
+                             galQ=0.95,
+                             galPA=0.0,
+                             stage=3,
+                             zpPhoto=zp,
+                             recenter=psfRecenter,
+                             outerThreshold=1e-6,
+                             useZscale=False,
+                             savePng=False,
+                             bkg=0.0,
+                             updateIntens=False,
+                             imgType=imgType,
+                             isophote=isophote,
+                             xttools=xttools,
+                             engine=engine,
+                             scratch=scratch,
+                             store=store)
+            """ Reuse the profile of the same PSF image if possible """
+            if psfCache is not None:
+                if not isinstance(psfCache, PsfCache):
+                    psfCache = PsfCache(psfCache)
+                psfKey = psfCache.key(psfFile, **psfKwargs)
+                psfOut = psfCache.get(psfKey)
+            else:
+                psfOut = None
+            if psfOut is not None:
+                if verbose:
+                    print("###    Reuse the cached PSF profile: %s" % psfKey)
+                psfCache.reuse(psfOut, psfFile.replace('.fits', '_ellip_3'),
+                               store=store, key=psfKey)
+            else:
+                jobs.append(ellipseJob('psf', psfFile, **psfKwargs))
         else:
             psfOut = None
 
         """ Ellipse run for the galaxy """
         if inEllip is None:
             iniSma = (galR50 * 2.0)
-            """#        Start with Stage 1 """
-            if verbose:
-                print("\n###    Ellipse Run on Image %s- Stage 1 " % imgFile)
-            if isophote is None:
-                galSBP.unlearnEllipse()
-            ellRes1 = galSBP.galSBP(imgFile,
-                                    mask=mskFile,
-                                    galX=galX,
-                                    galY=galY,
-                                    maxSma=maxR,
-                                    iniSma=iniSma,
-                                    maxTry=maxTry,
-                                    galR=galR50,
-                                    ellipStep=step,
-                                    pix=pix,
-                                    bkg=bkg,
-                                    galQ=galQ,
-                                    galPA=galPA,
-                                    stage=1,
-                                    zpPhoto=zp,
-                                    updateIntens=updateIntens,
-                                    olthresh=olthresh,
-                                    lowClip=lowClip,
-                                    uppClip=uppClip,
-                                    nClip=nClip,
-                                    fracBad=fracBad,
-                                    intMode=intMode,
-                                    minIt=minIt,
-                                    maxIt=maxIt,
-                                    plMask=plMask,
-                                    suffix=suffix,
-                                    imgType=imgType,
-                                    isophote=isophote,
-                                    xttools=xttools)
-            ellOut1, ellBin1 = ellRes1
-
-            if ellOut1 is None:
-                raise Exception("!!!!! ELLIPSE RUN FAILED AT STAGE 1 !!!!")
-            if (galX0 is None) or (galY0 is None):
-                galX0 = ellOut1['avg_x0'][0]
-                galY0 = ellOut1['avg_y0'][0]
-
-            if checkCenter:
-                if (np.abs(galX0 -
-                           mskHead['NAXIS1']/2.0) >= 20.0) or \
-                   (np.abs(galX0 -
-                           mskHead['NAXIS1']/2.0) >= 20.0):
-                    raise Exception("The Center is Off !")
-
-            """ # Start with Stage 2 """
-            if verbose:
-                print("\n###    Ellipse Run on Image %s- Stage 2 " % imgFile)
-            ellRes2 = galSBP.galSBP(imgFile, mask=mskFile,
-                                    galX=galX0,
-                                    galY=galY0,
-                                    maxSma=maxR,
-                                    iniSma=iniSma,
-                                    galR=galR50,
-                                    ellipStep=step,
-                                    maxTry=maxTry,
-                                    pix=pix,
-                                    bkg=bkg,
-                                    galQ=galQ,
-                                    galPA=galPA,
-                                    stage=2,
-                                    zpPhoto=zp,
-                                    updateIntens=updateIntens,
-                                    olthresh=olthresh,
-                                    lowClip=lowClip,
-                                    uppClip=uppClip,
-                                    nClip=nClip,
-                                    fracBad=fracBad,
-                                    intMode=intMode,
-                                    minIt=minIt,
-                                    maxIt=maxIt,
-                                    plMask=plMask,
-                                    suffix=suffix,
-                                    imgType=imgType,
-                                    isophote=isophote,
-                                    xttools=xttools)
-            ellOut2, ellBin2 = ellRes2
-
-            if ellOut2 is None:
-                raise Exception("!!!!! ELLIPSE RUN FAILED AT STAGE 2 !!!!")
-
-            if (galQ0 is None) or (galPA0 is None):
-                if (ellOut2['avg_q'][0] <= 0.95):
-                    galQ0 = ellOut2['avg_q'][0]
-                else:
-                    galQ0 = galQ
-
-                if np.isfinite(ellOut2['avg_pa'][0]):
-                    galPA0 = hUtil.normAngle(ellOut2['avg_pa'][0],
-                                             lower=-90.0,
-                                             upper=90.0,
-                                             b=True)
-                else:
-                    galPA0 = galPA
+            """
+            The geometry is passed from one stage to the next one through
+            the setup functions of the jobs
+            """
+            geom = {'galX0': galX0, 'galY0': galY0,
+                    'galQ0': galQ0, 'galPA0': galPA0}
+
+            def setupStage1(results, kwargs):
+                if (isophote is None) and (engine == 'iraf'):
+                    galSBP.unlearnEllipse()
+
+            def setupStage2(results, kwargs):
+                ellOut1 = results['stage1'][0]
+                if (geom['galX0'] is None) or (geom['galY0'] is None):
+                    geom['galX0'] = ellOut1['avg_x0'][0]
+                    geom['galY0'] = ellOut1['avg_y0'][0]
+
+                if checkCenter:
+                    if (np.abs(geom['galX0'] -
+                               mskHead['NAXIS1']/2.0) >= 20.0) or \
+                       (np.abs(geom['galX0'] -
+                               mskHead['NAXIS1']/2.0) >= 20.0):
+                        raise Exception("The Center is Off !")
+                kwargs.update(galX=geom['galX0'], galY=geom['galY0'])
+
+            def setupStage3(results, kwargs):
+                ellOut2 = results['stage2'][0]
+                if (geom['galQ0'] is None) or (geom['galPA0'] is None):
+                    if (ellOut2['avg_q'][0] <= 0.95):
+                        geom['galQ0'] = ellOut2['avg_q'][0]
+                    else:
+                        geom['galQ0'] = galQ
+
+                    if np.isfinite(ellOut2['avg_pa'][0]):
+                        geom['galPA0'] = hUtil.normAngle(
+                            ellOut2['avg_pa'][0], lower=-90.0, upper=90.0,
+                            b=True)
+                    else:
+                        geom['galPA0'] = galPA
+                kwargs.update(galX=geom['galX0'], galY=geom['galY0'],
+                              galQ=geom['galQ0'], galPA=geom['galPA0'])
+
+            def setupForced(results, kwargs):
+                kwargs['inEllip'] = results['stage3'][1]
+
+            def setupMulti(results, kwargs):
+                ellOut3 = results['stage3'][0]
+                maxSma = np.nanmax(ellOut3['sma'])
+                """ Do not fit the low S/N isophotes of stage 3 again """
+                if 'sma_stop' in ellOut3.colnames:
+                    smaStop = ellOut3['sma_stop'][0]
+                    if np.isfinite(smaStop) and (smaStop < maxSma):
+                        maxSma = smaStop
+                kwargs.update(galX=geom['galX0'], galY=geom['galY0'],
+                              galQ=geom['galQ0'], galPA=geom['galPA0'],
+                              maxSma=maxSma)
+
+            """#        Stage 1 """
+            jobs.append(ellipseJob('stage1', imgFile, setup=setupStage1,
+                                   mask=mskFile,
+                                   galX=galX,
+                                   galY=galY,
+                                   maxSma=maxR,
+                                   iniSma=iniSma,
+                                   maxTry=maxTry,
+                                   galR=galR50,
+                                   ellipStep=step,
+                                   pix=pix,
+                                   bkg=bkg,
+                                   galQ=galQ,
+                                   galPA=galPA,
+                                   stage=1,
+                                   zpPhoto=zp,
+                                   updateIntens=updateIntens,
+                                   olthresh=olthresh,
+                                   lowClip=lowClip,
+                                   uppClip=uppClip,
+                                   nClip=nClip,
+                                   fracBad=fracBad,
+                                   intMode=intMode,
+                                   minIt=minIt,
+                                   maxIt=maxIt,
+                                   plMask=plMask,
+                                   suffix=suffix,
+                                   imgType=imgType,
+                                   isophote=isophote,
+                                   xttools=xttools,
+                                   engine=engine,
+                                   scratch=scratch,
+                                   store=store))
+
+            """ # Stage 2 """
+            jobs.append(ellipseJob('stage2', imgFile, after=['stage1'],
+                                   setup=setupStage2,
+                                   mask=mskFile,
+                                   maxSma=maxR,
+                                   iniSma=iniSma,
+                                   galR=galR50,
+                                   ellipStep=step,
+                                   maxTry=maxTry,
+                                   pix=pix,
+                                   bkg=bkg,
+                                   galQ=galQ,
+                                   galPA=galPA,
+                                   stage=2,
+                                   zpPhoto=zp,
+                                   updateIntens=updateIntens,
+                                   olthresh=olthresh,
+                                   lowClip=lowClip,
+                                   uppClip=uppClip,
+                                   nClip=nClip,
+                                   fracBad=fracBad,
+                                   intMode=intMode,
+                                   minIt=minIt,
+                                   maxIt=maxIt,
+                                   plMask=plMask,
+                                   suffix=suffix,
+                                   imgType=imgType,
+                                   isophote=isophote,
+                                   xttools=xttools,
+                                   engine=engine,
+                                   scratch=scratch,
+                                   store=store))
+
+            """ # Stage 3 """
+            jobs.append(ellipseJob('stage3', imgFile, after=['stage2'],
+                                   setup=setupStage3,
+                                   mask=mskFile,
+                                   maxSma=maxR,
+                                   iniSma=iniSma,
+                                   galR=galR50,
+                                   ellipStep=step,
+                                   maxTry=maxTry,
+                                   pix=pix,
+                                   bkg=bkg,
+                                   stage=3,
+                                   zpPhoto=zp,
+                                   updateIntens=updateIntens,
+                                   olthresh=olthresh,
+                                   lowClip=lowClip,
+                                   uppClip=uppClip,
+                                   nClip=nClip,
+                                   fracBad=fracBad,
+                                   intMode=intMode,
+                                   plMask=plMask,
+                                   suffix=suffix,
+                                   imgType=imgType,
+                                   isophote=isophote,
+                                   xttools=xttools,
+                                   engine=engine,
+                                   scratch=scratch,
+                                   store=store,
+                                   skyRms=skyRms,
+                                   minSnr=minSnr,
+                                   nLowSnr=nLowSnr))
 
-            """ # Start with Stage 3 """
-            if verbose:
-                print("\n###    Ellipse Run on Image %s- Stage 3 " % imgFile)
-            ellRes3 = galSBP.galSBP(imgFile, mask=mskFile,
-                                    galX=galX0,
-                                    galY=galY0,
-                                    maxSma=maxR,
-                                    iniSma=iniSma,
-                                    galR=galR50,
-                                    ellipStep=step,
-                                    maxTry=maxTry,
-                                    pix=pix,
-                                    bkg=bkg,
-                                    galQ=galQ0,
-                                    galPA=galPA0,
-                                    stage=3,
-                                    zpPhoto=zp,
-                                    updateIntens=updateIntens,
-                                    olthresh=olthresh,
-                                    lowClip=lowClip,
-                                    uppClip=uppClip,
-                                    nClip=nClip,
-                                    fracBad=fracBad,
-                                    intMode=intMode,
-                                    plMask=plMask,
-                                    suffix=suffix,
-                                    imgType=imgType,
-                                    isophote=isophote,
-                                    xttools=xttools)
-            ellOut3, ellBin3 = ellRes3
-
-            if ellOut3 is None:
-                raise Exception("!!!!! ELLIPSE RUN FAILED AT STAGE 3 !!!!")
-            else:
+            if multiEllipse:
                 """
-                Should update the maxR
+                Run Ellipse using different mask and configuration
+
+                This is mainly to test the robustness of the 1-D SBP.
+                All of them only depend on the Stage 3 run, so they run
+                at the same time.
                 """
-                maxR = np.nanmax(ellOut3['sma'])
+                if not noMask:
+                    """ 1. Small Mask """
+                    jobs.append(ellipseJob('multi1', imgFile,
+                                           after=['stage3'],
+                                           setup=setupForced,
+                                           mask=mskFile.replace('mskfin',
+                                                                'msksmall'),
+                                           ellipStep=step,
+                                           stage=4,
+                                           zpPhoto=zp,
+                                           pix=pix,
+                                           bkg=bkg,
+                                           maxTry=1,
+                                           updateIntens=updateIntens,
+                                           suffix='multi1',
+                                           imgType=imgType,
+                                           isophote=isophote,
+                                           xttools=xttools,
+                                           engine=engine,
+                                           scratch=scratch,
+                                           store=store))
+
+                    """ 2. Large Mask """
+                    jobs.append(ellipseJob('multi2', imgFile,
+                                           after=['stage3'],
+                                           setup=setupForced,
+                                           mask=mskFile.replace('mskfin',
+                                                                'msklarge'),
+                                           ellipStep=step,
+                                           stage=4,
+                                           zpPhoto=zp,
+                                           pix=pix,
+                                           bkg=bkg,
+                                           maxTry=1,
+                                           updateIntens=updateIntens,
+                                           suffix='multi2',
+                                           imgType=imgType,
+                                           isophote=isophote,
+                                           xttools=xttools,
+                                           engine=engine,
+                                           scratch=scratch,
+                                           store=store))
+
+                """ 3. Strick clipping """
+                """ 4. Larger step size """
+                """ 5. Use Mean instead of Median """
+                multiPar = [('multi3', {'lowClip': 2.2, 'uppClip': 2.2,
+                                        'nClip': 3, 'fracBad': 0.5}),
+                            ('multi4', {'ellipStep': 0.24}),
+                            ('multi5', {'intMode': 'mean'})]
+                for multiName, multiConf in multiPar:
+                    multiKwargs = dict(mask=mskFile,
+                                       iniSma=iniSma,
+                                       galR=galR50,
+                                       ellipStep=step,
+                                       maxTry=maxTry,
+                                       pix=pix,
+                                       bkg=bkg,
+                                       zpPhoto=zp,
+                                       updateIntens=updateIntens,
+                                       olthresh=olthresh,
+                                       stage=3,
+                                       lowClip=lowClip,
+                                       uppClip=uppClip,
+                                       nClip=nClip,
+                                       fracBad=fracBad,
+                                       intMode=intMode,
+                                       plMask=plMask,
+                                       suffix=multiName,
+                                       imgType=imgType,
+                                       isophote=isophote,
+                                       xttools=xttools,
+                                       engine=engine,
+                                       scratch=scratch,
+                                       store=store)
+                    multiKwargs.update(multiConf)
+                    jobs.append(ellipseJob(multiName, imgFile,
+                                           after=['stage3'],
+                                           setup=setupMulti,
+                                           **multiKwargs))
+
+            if verbose:
+                print("\n###    Ellipse Run on Image %s " % imgFile)
+            results, errors = runEllipseJobs(jobs, nProc=nProc,
+                                             verbose=verbose,
+                                             service=service)
+            if 'psf' in results:
+                psfOut = results['psf'][0]
+                if psfCache is not None:
+                    psfCache.put(psfKey, psfOut, outBin=results['psf'][1])
+
+            for ii, stage in enumerate(['stage1', 'stage2', 'stage3']):
+                if results[stage][0] is None:
+                    if verbose:
+                        print("###    %s" % errors.get(stage))
+                    raise Exception("!!!!! ELLIPSE RUN FAILED AT " +
+                                    "STAGE %d !!!!" % (ii + 1))
+            ellOut1 = results['stage1'][0]
+            ellOut2 = results['stage2'][0]
+            ellOut3 = results['stage3'][0]
+            """
+            Should update the maxR
+            """
+            maxR = np.nanmax(ellOut3['sma'])
 
             if plot:
                 if suffix[-1] != '_':
@@ -1032,159 +1237,11 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
                     print("XXX    Can not make summary plot: %s" % sumPng)
 
             if multiEllipse:
-                """
-                Run Ellipse using different mask and configuration
-
-                This is mainly to test the robustness of the 1-D SBP
-                """
-
-                """ 1. Small Mask """
-                if not noMask:
-                    mskSmall = mskFile.replace('mskfin', 'msksmall')
-                    inputSmall = ellBin3
-                    suffixSmall = 'multi1'
-                    if verbose:
-                        print("\n###    Force Ellipse Run with Small Mask ")
-                        print("###    Mask / Input : %s / %s" % (mskSmall,
-                                                                 inputSmall))
-                    smallOut = galSBP.galSBP(imgFile, mask=mskSmall,
-                                             ellipStep=step,
-                                             stage=4,
-                                             zpPhoto=zp,
-                                             pix=pix,
-                                             bkg=bkg,
-                                             maxTry=1,
-                                             updateIntens=updateIntens,
-                                             inEllip=inputSmall,
-                                             suffix=suffixSmall,
-                                             imgType=imgType,
-                                             isophote=isophote,
-                                             xttools=xttools)
-                    smallEll, smallBin = smallOut
-                else:
-                    smallEll = None
-
-                """ 2. Large Mask """
-                if not noMask:
-                    mskLarge = mskFile.replace('mskfin', 'msklarge')
-                    inputLarge = ellBin3
-                    suffixLarge = 'multi2'
-                    if verbose:
-                        print("\n###    Force Ellipse Run with Large Mask ")
-                        print("###    Mask / Input : %s / %s" % (mskLarge,
-                                                                 inputLarge))
-                    largeOut = galSBP.galSBP(imgFile, mask=mskLarge,
-                                             ellipStep=step,
-                                             stage=4,
-                                             zpPhoto=zp,
-                                             pix=pix,
-                                             bkg=bkg,
-                                             maxTry=1,
-                                             updateIntens=updateIntens,
-                                             inEllip=inputLarge,
-                                             suffix=suffixLarge,
-                                             imgType=imgType,
-                                             isophote=isophote,
-                                             xttools=xttools)
-                    largeEll, largeBin = largeOut
-                else:
-                    largeEll = None
-
-                """ 3. Strick clipping """
-                suffixMulti3 = 'multi3'
-                if verbose:
-                    print("\n###    Ellipse Run wit Strick Pixel Clipping ")
-                resMulti3 = galSBP.galSBP(imgFile, mask=mskFile,
-                                          galX=galX0,
-                                          galY=galY0,
-                                          maxSma=maxR,
-                                          iniSma=iniSma,
-                                          galR=galR50,
-                                          ellipStep=step,
-                                          maxTry=maxTry,
-                                          pix=pix,
-                                          bkg=bkg,
-                                          galQ=galQ0,
-                                          galPA=galPA0,
-                                          zpPhoto=zp,
-                                          updateIntens=updateIntens,
-                                          olthresh=olthresh,
-                                          stage=3,
-                                          lowClip=2.2,
-                                          uppClip=2.2,
-                                          nClip=3,
-                                          fracBad=0.5,
-                                          intMode=intMode,
-                                          plMask=plMask,
-                                          suffix=suffixMulti3,
-                                          imgType=imgType,
-                                          isophote=isophote,
-                                          xttools=xttools)
-                ellMulti3, binMulti3 = resMulti3
-
-                """ 4. Larger step size """
-                suffixMulti4 = 'multi4'
-                if verbose:
-                    print("\n###    Ellipse Run wit Strick Pixel Clipping ")
-                resMulti4 = galSBP.galSBP(imgFile, mask=mskFile,
-                                          galX=galX0,
-                                          galY=galY0,
-                                          maxSma=maxR,
-                                          iniSma=iniSma,
-                                          galR=galR50,
-                                          ellipStep=0.24,
-                                          maxTry=maxTry,
-                                          pix=pix,
-                                          bkg=bkg,
-                                          galQ=galQ0,
-                                          galPA=galPA0,
-                                          zpPhoto=zp,
-                                          updateIntens=updateIntens,
-                                          olthresh=olthresh,
-                                          stage=3,
-                                          lowClip=lowClip,
-                                          uppClip=uppClip,
-                                          nClip=nClip,
-                                          fracBad=fracBad,
-                                          intMode=intMode,
-                                          plMask=plMask,
-                                          suffix=suffixMulti4,
-                                          imgType=imgType,
-                                          isophote=isophote,
-                                          xttools=xttools)
-                ellMulti4, binMulti4 = resMulti4
-
-                """ 5. Use Mean instead of Median """
-                suffixMulti5 = 'multi5'
-                if verbose:
-                    print("\n###    Ellipse Run with Median integration mode ")
-                resMulti5 = galSBP.galSBP(imgFile, mask=mskFile,
-                                          galX=galX0,
-                                          galY=galY0,
-                                          maxSma=maxR,
-                                          iniSma=iniSma,
-                                          galR=galR50,
-                                          ellipStep=step,
-                                          maxTry=maxTry,
-                                          pix=pix,
-                                          bkg=bkg,
-                                          galQ=galQ0,
-                                          galPA=galPA0,
-                                          zpPhoto=zp,
-                                          updateIntens=updateIntens,
-                                          olthresh=olthresh,
-                                          stage=3,
-                                          lowClip=lowClip,
-                                          uppClip=uppClip,
-                                          nClip=nClip,
-                                          fracBad=fracBad,
-                                          intMode='mean',
-                                          plMask=plMask,
-                                          suffix=suffixMulti5,
-                                          imgType=imgType,
-                                          isophote=isophote,
-                                          xttools=xttools)
-                ellMulti5, binMulti5 = resMulti5
+                smallEll = results.get('multi1', (None, None))[0]
+                largeEll = results.get('multi2', (None, None))[0]
+                ellMulti3 = results['multi3'][0]
+                ellMulti4 = results['multi4'][0]
+                ellMulti5 = results['multi5'][0]
 
                 """ """
                 ellStack = [ellOut3, smallEll, largeEll,
@@ -1210,23 +1267,38 @@ def coaddCutoutSbp(prefix, root=None, verbose=True, psf=True, inEllip=None,
             if verbose:
                 print("\n###    Ellipse Run on " +
                       "Image %s - Forced Photometry " % imgFile)
-            ellOut4 = galSBP.galSBP(imgFile, mask=mskFile,
-                                    galX=galX,
-                                    galY=galY,
-                                    inEllip=inEllip,
-                                    pix=pix,
-                                    bkg=bkg,
-                                    stage=4,
-                                    zpPhoto=zp,
-                                    maxTry=1,
-                                    updateIntens=updateIntens,
-                                    intMode=intMode,
-                                    plMask=plMask,
-                                    suffix=suffix,
-                                    imgType=imgType,
-                                    isophote=isophote,
-                                    xttools=xttools)
-            if ellOut4 is None:
+            jobs.append(ellipseJob('forced', imgFile,
+                                   mask=mskFile,
+                                   galX=galX,
+                                   galY=galY,
+                                   inEllip=inEllip,
+                                   pix=pix,
+                                   bkg=bkg,
+                                   stage=4,
+                                   zpPhoto=zp,
+                                   maxTry=1,
+                                   updateIntens=updateIntens,
+                                   intMode=intMode,
+                                   plMask=plMask,
+                                   suffix=suffix,
+                                   imgType=imgType,
+                                   isophote=isophote,
+                                   xttools=xttools,
+                                   engine=engine,
+                                   scratch=scratch,
+                                   store=store,
+                                   skyRms=skyRms,
+                                   minSnr=minSnr,
+                                   nLowSnr=nLowSnr))
+            results, errors = runEllipseJobs(jobs, nProc=nProc,
+                                             verbose=verbose,
+                                             service=service)
+            if ('psf' in results) and (psfCache is not None):
+                psfCache.put(psfKey, results['psf'][0],
+                             outBin=results['psf'][1])
+            if results['forced'][0] is None:
+                if verbose:
+                    print("###    %s" % errors.get('forced'))
                 raise Exception("!!!!! FORCED ELLIPSE RUN FAILED !!!!")
 
             gc.collect()
@@ -1334,6 +1406,35 @@ if __name__ == '__main__':
     parser.add_argument("--xttools", dest='xttools',
                         help="Location of the x_ttools.e file",
                         default=None)
+    parser.add_argument('--skyTable', dest='skyTable',
+                        help='Sky table for the background correction',
+                        default=None)
+    parser.add_argument('--rerun', dest='rerun',
+                        help='Rerun of the sky in the sky table',
+                        default=None)
+    parser.add_argument("--engine", dest='engine',
+                        help="Isophote engine: iraf, native or annulus",
+                        default='iraf',
+                        choices=['iraf', 'native', 'annulus'])
+    parser.add_argument("--scratch", dest='scratch',
+                        help="Scratch directory for the temporary files " +
+                        "(e.g. /dev/shm)",
+                        default=None)
+    parser.add_argument("--store", dest='store',
+                        help="Directory of the profile store",
+                        default=None)
+    parser.add_argument("--psfCache", dest='psfCache',
+                        help="Directory of the PSF profile cache",
+                        default=None)
+    parser.add_argument("--minSnr", dest='minSnr', type=float,
+                        help="Stop the isophotes when the S/N is lower",
+                        default=None)
+    parser.add_argument("--nLowSnr", dest='nLowSnr', type=int,
+                        help="Number of low S/N isophotes before stopping",
+                        default=3)
+    parser.add_argument('-j', '--njobs', type=int,
+                        help='Number of ELLIPSE runs at the same time',
+                        dest='njobs', default=1)
 
     args = parser.parse_args()
 
@@ -1371,4 +1472,13 @@ if __name__ == '__main__':
                    multiEllipse=args.multiEllipse,
                    imgSub=args.imgSub,
                    isophote=args.isophote,
-                   xttools=args.xttools)
+                   xttools=args.xttools,
+                   skyTable=args.skyTable,
+                   rerun=args.rerun,
+                   engine=args.engine,
+                   nProc=args.njobs,
+                   scratch=args.scratch,
+                   store=args.store,
+                   psfCache=args.psfCache,
+                   minSnr=args.minSnr,
+                   nLowSnr=args.nLowSnr)
@@ -39,6 +39,9 @@ plt.ioff()
 # Personal
 # import galSBP
 import hscUtils as hUtil
+import hscPool
+import profileStore as pStore
+import profileIndex as pIdx
 
 """
 Absolute magnitude of the Sun in HSC filters
@@ -68,6 +71,23 @@ Common radius array
 RSMA_COMMON = np.arange(0.4, 4.2, 0.01)
 EMPTY = (RSMA_COMMON * np.nan)
 """
+Summary columns of the catalog
+"""
+SUM_COLUMNS = ['lum_max', 'lum_150', 'lum_120', 'lum_100', 'lum_75',
+               'lum_50', 'lum_25', 'lum_10', 'lum_5', 'lum_15', 'lum_30',
+               'lum_40', 'lum_60', 'r20_max', 'r50_max', 'r80_max',
+               'r90_max', 'r20_120', 'r50_120', 'r80_120', 'r90_120',
+               'r20_100', 'r50_100', 'r80_100', 'r90_100', 'c82_max',
+               'c82_120', 'c82_100']
+"""
+Number of shards of the catalog for each worker process
+"""
+SHARD_PER_PROC = 4
+"""
+Profile store of a worker process
+"""
+_workerStore = None
+"""
 For output
 """
 COM = '#' * 100
@@ -383,11 +403,15 @@ def findProfile(pattern, loc, verbose=False):
 
 def getEllipProfile(galid, base, prefix, model, psf=False,
                     filter='HSC-I', rerun='default',
-                    verbose=False, imgSub=True):
+                    verbose=False, imgSub=True, store=None):
     """
     Find and load the Ellipse output.
 
     Parameters:
+        store  : ProfileStore; the profile is read from the store first,
+                 and from the pickle file when it is not in the store.
+                 A profileIndex.ProfileIndex is complete: the pickle file
+                 is not looked for when the profile is not in the index
     """
     galid = str(galid).strip()
     location = os.path.join(base, galid, filter, rerun)
@@ -397,6 +421,15 @@ def getEllipProfile(galid, base, prefix, model, psf=False,
         ellType = 'imgsub'
     else:
         ellType = 'img'
+    if store is not None:
+        ellProf = store.get(galid, filter, model, imgType=ellType,
+                            rerun=rerun, prefix=prefix)
+        if (ellProf is not None) or getattr(store, 'complete', False):
+            if (ellProf is None) and verbose:
+                print(WAR)
+                print('!!! Can not find the Ellipse profile ! %s %s %s' %
+                      (galid, filter, model))
+            return ellProf
     """Ellipse result file name"""
     ellFile = (prefix + '_' + str(galid) + '_' + filter +
                '_full_' + ellType + '_ellip_' + model + '.pkl')
@@ -414,7 +447,7 @@ def getEllipProfile(galid, base, prefix, model, psf=False,
 
 def geomExtract(loc, galID, redshift, filter,
                 prefix, rerun, model, imgSub=True,
-                verbose=False, interp=True):
+                verbose=False, interp=True, store=None):
     """
     Return geometric information.
 
@@ -422,7 +455,8 @@ def geomExtract(loc, galID, redshift, filter,
     """
     prof = getEllipProfile(galID, loc, prefix, model,
                            filter=filter, rerun=rerun,
-                           verbose=verbose, imgSub=imgSub)
+                           verbose=verbose, imgSub=imgSub,
+                           store=store)
     if prof is not None:
         """ Get physical pixel scale and distant module """
         scale = hUtil.cosmoScale(redshift)
@@ -460,7 +494,7 @@ def sbpExtract(loc, galID, redshift, filter,
                prefix, rerun, model,
                zp=27.0, extinction=0.0, imgSub=True,
                amag_sun=None, m2l=None, psf=False,
-               origin=False, verbose=False, interp=True):
+               origin=False, verbose=False, interp=True, store=None):
     """
     Return important SBP information.
 
@@ -469,7 +503,8 @@ def sbpExtract(loc, galID, redshift, filter,
     prof = getEllipProfile(galID, loc, prefix, model,
                            filter=filter, rerun=rerun,
                            verbose=verbose, psf=psf,
-                           imgSub=imgSub)
+                           imgSub=imgSub,
+                           store=store)
     if prof is not None:
         ell = correctProf(prof, redshift,
                           extinction=extinction,
@@ -491,7 +526,7 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                m2l_g=None, m2l_r=None, m2l_i=None,
                m2l_z=None, m2l_y=None, imgSub=True,
                verbose=False, save=True, interp=True,
-               sumFolder='sbp_sum', sample=None):
+               sumFolder='sbp_sum', sample=None, store=None):
     """
     Collect profiles from the cutout folder.
 
@@ -526,7 +561,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                          prefix, rerun, 'default_3',
                          extinction=a_i, m2l=m2l_i,
                          amag_sun=SUN_I, verbose=verbose,
-                         interp=interp, imgSub=imgSub)
+                         interp=interp, imgSub=imgSub,
+                         store=store)
 
     if refEllI is not None:
         """ Reference profile in I-band """
@@ -545,7 +581,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
         refGeomI = geomExtract(loc, galID, redshift, 'HSC-I',
                                prefix, rerun, 'default_2',
                                verbose=verbose, interp=interp,
-                               imgSub=imgSub)
+                               imgSub=imgSub,
+                               store=store)
         if refGeomI is not None:
             r, ell, ellErr, pa, paErr = refGeomI
             isGeom = True
@@ -564,7 +601,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                           'HSC-I', prefix, rerun, '3',
                           m2l=m2l_i, extinction=0.0,
                           amag_sun=SUN_I, verbose=verbose,
-                          interp=interp, psf=True)
+                          interp=interp, psf=True,
+                          store=store)
         if psfI is not None:
             r, psfMuI, temp1, temp2 = psfI
             isPsfI = True
@@ -583,7 +621,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-I', prefix, rerun, 'multi1_4',
                            m2l=m2l_i, extinction=a_i,
                            amag_sun=SUN_I, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellI2 is not None:
             r, muI2, lumI2, errI2 = ellI2
             isMuI2 = True
@@ -602,7 +641,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-I', prefix, rerun, 'multi2_4',
                            m2l=m2l_i, extinction=a_i,
                            amag_sun=SUN_I, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellI3 is not None:
             r, muI3, lumI3, errI3 = ellI3
             isMuI3 = True
@@ -639,7 +679,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-I', prefix, rerun, 'multi3_3',
                            m2l=m2l_i, extinction=a_i,
                            amag_sun=SUN_I, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellI4 is not None:
             r, muI4, lumI4, errI4 = ellI4
             isMuI4 = True
@@ -658,7 +699,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-I', prefix, rerun, 'multi4_3',
                            m2l=m2l_i, extinction=a_i,
                            amag_sun=SUN_I, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellI5 is not None:
             r, muI5, lumI5, errI5 = ellI5
             isMuI5 = True
@@ -677,7 +719,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-I', prefix, rerun, 'multi5_3',
                            m2l=m2l_i, extinction=a_i,
                            amag_sun=SUN_I, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellI6 is not None:
             r, muI6, lumI6, errI6 = ellI6
             isMuI6 = True
@@ -696,7 +739,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-G', prefix, rerun, 'default_4',
                            m2l=m2l_g, extinction=a_g,
                            amag_sun=SUN_G, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellG1 is not None:
             r, muG1, lumG1, errG1 = ellG1
             isMuG1 = True
@@ -715,7 +759,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                           'HSC-G', prefix, rerun, '3',
                           m2l=m2l_g, extinction=0.0,
                           amag_sun=SUN_G, verbose=verbose,
-                          interp=interp, psf=True)
+                          interp=interp, psf=True,
+                          store=store)
         if psfG is not None:
             r, psfMuG, temp1, temp2 = psfG
             isPsfG = True
@@ -734,7 +779,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-G', prefix, rerun, 'default_msksmall_4',
                            m2l=m2l_g, extinction=a_g,
                            amag_sun=SUN_G, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellG2 is not None:
             r, muG2, lumG2, errG2 = ellG2
             isMuG2 = True
@@ -753,7 +799,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-G', prefix, rerun, 'default_msklarge_4',
                            m2l=m2l_g, extinction=a_g,
                            amag_sun=SUN_G, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellG3 is not None:
             r, muG3, lumG3, errG3 = ellG3
             isMuG3 = True
@@ -772,7 +819,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-R', prefix, rerun, 'default_4',
                            m2l=m2l_r, extinction=a_r,
                            amag_sun=SUN_R, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellR1 is not None:
             r, muR1, lumR1, errR1 = ellR1
             isMuR1 = True
@@ -791,7 +839,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                           'HSC-R', prefix, rerun, '3',
                           m2l=m2l_r, extinction=0.0,
                           amag_sun=SUN_R, verbose=verbose,
-                          interp=interp, psf=True)
+                          interp=interp, psf=True,
+                          store=store)
         if psfR is not None:
             r, psfMuR, temp1, temp2 = psfR
             isPsfR = True
@@ -810,7 +859,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-R', prefix, rerun, 'default_msksmall_4',
                            m2l=m2l_r, extinction=a_r,
                            amag_sun=SUN_R, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellR2 is not None:
             r, muR2, lumR2, errR2 = ellR2
             isMuR2 = True
@@ -829,7 +879,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-R', prefix, rerun, 'default_msklarge_4',
                            m2l=m2l_r, extinction=a_r,
                            amag_sun=SUN_R, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellR3 is not None:
             r, muR3, lumR3, errR3 = ellR3
             isMuR3 = True
@@ -848,7 +899,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-Z', prefix, rerun, 'default_4',
                            m2l=m2l_z, extinction=a_z,
                            amag_sun=SUN_Z, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellZ1 is not None:
             r, muZ1, lumZ1, errZ1 = ellZ1
             isMuZ1 = True
@@ -867,7 +919,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                           'HSC-Z', prefix, rerun, '3',
                           m2l=m2l_z, extinction=0.0,
                           amag_sun=SUN_Z, verbose=verbose,
-                          interp=interp, psf=True)
+                          interp=interp, psf=True,
+                          store=store)
         if psfZ is not None:
             r, psfMuZ, temp1, temp2 = psfZ
             isPsfZ = True
@@ -886,7 +939,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-Z', prefix, rerun, 'default_msksmall_4',
                            m2l=m2l_z, extinction=a_z,
                            amag_sun=SUN_Z, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellZ2 is not None:
             r, muZ2, lumZ2, errZ2 = ellZ2
             isMuZ2 = True
@@ -905,7 +959,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-Z', prefix, rerun, 'default_msklarge_4',
                            m2l=m2l_z, extinction=a_z,
                            amag_sun=SUN_Z, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellZ3 is not None:
             r, muZ3, lumZ3, errZ3 = ellZ3
             isMuZ3 = True
@@ -924,7 +979,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-Y', prefix, rerun, 'default_4',
                            m2l=m2l_y, extinction=a_y,
                            amag_sun=SUN_Y, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellY1 is not None:
             r, muY1, lumY1, errY1 = ellY1
             isMuY1 = True
@@ -943,7 +999,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                           'HSC-Y', prefix, rerun, '3',
                           m2l=m2l_y, extinction=0.0,
                           amag_sun=SUN_Y, verbose=verbose,
-                          interp=interp, psf=True)
+                          interp=interp, psf=True,
+                          store=store)
         if psfY is not None:
             r, psfMuY, temp1, temp2 = psfY
             isPsfY = True
@@ -962,7 +1019,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-Y', prefix, rerun, 'default_msksmall_4',
                            m2l=m2l_y, extinction=a_y,
                            amag_sun=SUN_Y, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellY2 is not None:
             r, muY2, lumY2, errY2 = ellY2
             isMuY2 = True
@@ -981,7 +1039,8 @@ def sbpCollect(loc, prefix, galID, redshift, rerun='default',
                            'HSC-Y', prefix, rerun, 'default_msklarge_4',
                            m2l=m2l_y, extinction=a_y,
                            amag_sun=SUN_Y, verbose=verbose,
-                           interp=interp, imgSub=imgSub)
+                           interp=interp, imgSub=imgSub,
+                           store=store)
         if ellY3 is not None:
             r, muY3, lumY3, errY3 = ellY3
             isMuY3 = True
@@ -1175,6 +1234,308 @@ def correctProf(ellProf, redshift, extinction=0.0, zp=27.0,
         return smaKpc_common, abs_sbp_interp, abs_mag_interp, err_sbp_interp
 
 
+def sbpSummaryGalaxy(galaxy, prefix, loc, sumDir, rerun='default',
+                     sbpRef='lumI1', sumFolder='sbp_sum', suffix=None,
+                     sample=None, imgSub=False, plot=True, verbose=False,
+                     store=None):
+    """
+    Summarize the profiles of one galaxy.
+
+    Parameters:
+        galaxy : dict with the ID, redshift, extinction (a_g ... a_y) and
+                 log(M/L) (logm2l_g ... logm2l_y) of the galaxy
+        loc    : location of the data
+        sumDir : folder for the summary table of the galaxy
+
+    Return:
+        galTab : summary table of the galaxy; None without useful data
+        sumCat : file of the summary table
+        values : dict of the summary columns (SUM_COLUMNS) of the catalog
+    """
+    galStr = str(galaxy['id']).strip()
+    galZ = galaxy['z']
+
+    """Summary table"""
+    if sample is None:
+        sumCat = galStr + '_sbpsum'
+    else:
+        sumCat = str(sample).strip() + '_' + galStr + '_sbpsum'
+    if imgSub:
+        sumCat += '_imgsub'
+    else:
+        sumCat += '_img'
+    if suffix is None:
+        sumCat = sumCat + '.fits'
+    else:
+        sumCat = sumCat + '_' + str(suffix).strip() + '.fits'
+
+    sumCat = os.path.join(sumDir, sumCat)
+    if plot:
+        sumPng = sumCat.replace('.fits', '.png')
+
+    values = dict((col, -9999.0) for col in SUM_COLUMNS)
+
+    """
+    Get the collection of SBP results
+
+    Right now, don't automatically convert into mass profile
+    """
+    galTab = sbpCollect(loc, prefix, galStr, galZ,
+                        a_g=galaxy['a_g'],
+                        a_r=galaxy['a_r'],
+                        a_i=galaxy['a_i'],
+                        a_z=galaxy['a_z'],
+                        a_y=galaxy['a_y'],
+                        verbose=verbose, save=False,
+                        sumFolder=sumFolder,
+                        sample=sample,
+                        suffix=suffix,
+                        imgSub=imgSub,
+                        rerun=rerun,
+                        store=store)
+
+    if galTab is not None:
+        """Radius KPc"""
+        rKpc = galTab['rKpc']
+        """Maximum luminosity from certain model"""
+        lumRef = galTab[sbpRef]
+        """Get the 1-D interpolation function"""
+        radInterp = interp1d(rKpc, lumRef)
+        """Maximum intergrated 1-d luminosity"""
+        lumMax = np.nanmax(lumRef).astype(np.float32)
+        if not np.isfinite(lumMax):
+            lumMax = radInterp(150.0)
+        """Out to 150 Kpc"""
+        lum150 = np.nanmax(lumRef[rKpc <= 150.0]).astype(np.float32)
+        lum150i = radInterp(150.0)
+        lum150 = lum150 if (lum150 >= lum150i) else lum150i
+        """Out to 120 Kpc"""
+        lum120 = np.nanmax(lumRef[rKpc <= 120.0]).astype(np.float32)
+        lum120i = radInterp(120.0)
+        lum120 = lum120 if (lum120 >= lum120i) else lum120i
+        """Out to 100 Kpc"""
+        lum100 = np.nanmax(lumRef[rKpc <= 100.0]).astype(np.float32)
+        lum100i = radInterp(100.0)
+        lum100 = lum100 if (lum100 >= lum100i) else lum100i
+        """Out to 75 Kpc"""
+        lum75 = np.nanmax(lumRef[rKpc <= 75.0]).astype(np.float32)
+        lum75i = radInterp(75.0)
+        lum75 = lum75 if (lum75 >= lum75i) else lum75i
+        """Out to 60 Kpc"""
+        lum60 = np.nanmax(lumRef[rKpc <= 60.0]).astype(np.float32)
+        lum60i = radInterp(60.0)
+        lum60 = lum60 if (lum60 >= lum60i) else lum60i
+        """Out to 50 Kpc"""
+        lum50 = np.nanmax(lumRef[rKpc <= 50.0]).astype(np.float32)
+        lum50i = radInterp(50.0)
+        lum50 = lum50 if (lum50 >= lum50i) else lum50i
+        """Out to 40 Kpc"""
+        lum40 = np.nanmax(lumRef[rKpc <= 40.0]).astype(np.float32)
+        lum40i = radInterp(40.0)
+        lum40 = lum40 if (lum40 >= lum40i) else lum40i
+        """Out to 30 Kpc"""
+        lum30 = np.nanmax(lumRef[rKpc <= 30.0]).astype(np.float32)
+        lum30i = radInterp(30.0)
+        lum30 = lum30 if (lum30 >= lum30i) else lum30i
+        """Out to 25 Kpc"""
+        lum25 = np.nanmax(lumRef[rKpc <= 25.0]).astype(np.float32)
+        lum25i = radInterp(25.0)
+        lum25 = lum25 if (lum25 >= lum25i) else lum25i
+        """Out to 15 Kpc"""
+        lum15 = np.nanmax(lumRef[rKpc <= 15.0]).astype(np.float32)
+        lum15i = radInterp(15.0)
+        lum15 = lum15 if (lum15 >= lum15i) else lum15i
+        """Out to 10 Kpc"""
+        lum10 = np.nanmax(lumRef[rKpc <= 10.0]).astype(np.float32)
+        lum10i = radInterp(10.0)
+        lum10 = lum10 if (lum10 >= lum10i) else lum10i
+        """Out to 5 Kpc"""
+        lum5 = np.nanmax(lumRef[rKpc <= 5.0]).astype(np.float32)
+        lum5i = radInterp(5.0)
+        lum5 = lum5 if (lum5 >= lum5i) else lum5i
+
+        if not np.isfinite(lum120):
+            if verbose:
+                print(WAR)
+                print("## Problematic SBP for %s !" % galStr)
+            lumMax = -9999.0
+            lum150 = -9999.0
+            lum120 = -9999.0
+            lum100 = -9999.0
+            lum75 = -9999.0
+            lum60 = -9999.0
+            lum50 = -9999.0
+            lum40 = -9999.0
+            lum30 = -9999.0
+            lum25 = -9999.0
+            lum15 = -9999.0
+            lum10 = -9999.0
+            lum5 = -9999.0
+
+        galTab.meta['LUM_MAX'] = float(lumMax)
+        galTab.meta['LUM_150'] = float(lum150)
+        galTab.meta['LUM_120'] = float(lum120)
+        galTab.meta['LUM_100'] = float(lum100)
+        galTab.meta['LUM_75'] = float(lum75)
+        galTab.meta['LUM_60'] = float(lum60)
+        galTab.meta['LUM_50'] = float(lum50)
+        galTab.meta['LUM_40'] = float(lum40)
+        galTab.meta['LUM_30'] = float(lum30)
+        galTab.meta['LUM_25'] = float(lum25)
+        galTab.meta['LUM_15'] = float(lum15)
+        galTab.meta['LUM_10'] = float(lum10)
+        galTab.meta['LUM_5'] = float(lum5)
+
+        """M2L"""
+        galTab.meta['LOGM2L_G'] = galaxy['logm2l_g']
+        galTab.meta['LOGM2L_R'] = galaxy['logm2l_r']
+        galTab.meta['LOGM2L_I'] = galaxy['logm2l_i']
+        galTab.meta['LOGM2L_Z'] = galaxy['logm2l_z']
+        galTab.meta['LOGM2L_Y'] = galaxy['logm2l_y']
+
+        """Save the result of the individual galaxy"""
+        galTab.write(sumCat, format='fits', overwrite=True)
+
+        """Update the sample summary table"""
+        values['lum_max'] = lumMax
+        values['lum_150'] = lum150
+        values['lum_120'] = lum120
+        values['lum_100'] = lum100
+        values['lum_75'] = lum75
+        values['lum_60'] = lum60
+        values['lum_50'] = lum50
+        values['lum_40'] = lum40
+        values['lum_30'] = lum30
+        values['lum_25'] = lum25
+        values['lum_15'] = lum15
+        values['lum_10'] = lum10
+        values['lum_5'] = lum5
+
+        """Get the R20, R50, R80 and R90"""
+        if np.isfinite(lumMax):
+            try:
+                fracMax = (10.0 ** lumRef) / (10.0 ** lumMax)
+                fracInterp1 = interp1d(fracMax, rKpc)
+                values['r20_max'] = fracInterp1(0.20)
+                values['r50_max'] = fracInterp1(0.50)
+                values['r80_max'] = fracInterp1(0.80)
+                values['r90_max'] = fracInterp1(0.80)
+                values['c82_max'] = (values['r80_max'] /
+                                         values['r20_max'])
+            except Exception:
+                values['r20_max'] = -9999.0
+                values['r50_max'] = -9999.0
+                values['r80_max'] = -9999.0
+                values['r90_max'] = -9999.0
+                values['c82_max'] = -9999.0
+        else:
+            values['r20_max'] = -9999.0
+            values['r50_max'] = -9999.0
+            values['r80_max'] = -9999.0
+            values['r90_max'] = -9999.0
+            values['c82_max'] = -9999.0
+
+        if np.isfinite(lum120):
+            try:
+                frac120 = (10.0 ** lumRef) / (10.0 ** lum120)
+                fracInterp2 = interp1d(frac120, rKpc)
+                values['r20_120'] = fracInterp2(0.20)
+                values['r50_120'] = fracInterp2(0.50)
+                values['r80_120'] = fracInterp2(0.80)
+                values['r90_120'] = fracInterp2(0.80)
+                values['c82_120'] = (values['r80_120'] /
+                                         values['r20_120'])
+            except Exception:
+                values['r20_120'] = -9999.0
+                values['r50_120'] = -9999.0
+                values['r80_120'] = -9999.0
+                values['r90_120'] = -9999.0
+                values['c82_120'] = -9999.0
+        else:
+            values['r20_120'] = -9999.0
+            values['r50_120'] = -9999.0
+            values['r80_120'] = -9999.0
+            values['r90_120'] = -9999.0
+            values['c82_120'] = -9999.0
+
+        if np.isfinite(lum100):
+            try:
+                frac100 = (10.0 ** lumRef) / (10.0 ** lum100)
+                fracInterp3 = interp1d(frac100, rKpc)
+                values['r20_100'] = fracInterp3(0.20)
+                values['r50_100'] = fracInterp3(0.50)
+                values['r80_100'] = fracInterp3(0.80)
+                values['r90_100'] = fracInterp3(0.80)
+                values['c82_100'] = (values['r80_100'] /
+                                         values['r20_100'])
+            except Exception:
+                values['r20_100'] = -9999.0
+                values['r50_100'] = -9999.0
+                values['r80_100'] = -9999.0
+                values['r90_100'] = -9999.0
+                values['c82_100'] = -9999.0
+        else:
+            values['r20_100'] = -9999.0
+            values['r50_100'] = -9999.0
+            values['r80_100'] = -9999.0
+            values['r90_100'] = -9999.0
+            values['c82_100'] = -9999.0
+
+        """Extra meta information"""
+        galTab.meta['R20_MAX'] = float(values['r20_max'])
+        galTab.meta['R50_MAX'] = float(values['r50_max'])
+        galTab.meta['R80_MAX'] = float(values['r80_max'])
+        galTab.meta['R90_MAX'] = float(values['r90_max'])
+        galTab.meta['C82_MAX'] = float(values['c82_max'])
+
+        galTab.meta['R20_120'] = float(values['r20_120'])
+        galTab.meta['R50_120'] = float(values['r50_120'])
+        galTab.meta['R80_120'] = float(values['r80_120'])
+        galTab.meta['R90_120'] = float(values['r90_120'])
+        galTab.meta['C82_120'] = float(values['c82_120'])
+
+        galTab.meta['R20_100'] = float(values['r20_100'])
+        galTab.meta['R50_100'] = float(values['r50_100'])
+        galTab.meta['R80_100'] = float(values['r80_100'])
+        galTab.meta['R90_100'] = float(values['r90_100'])
+        galTab.meta['C82_100'] = float(values['c82_100'])
+
+        if plot:
+            sbpCompare(galTab, sumPng)
+    else:
+        warnings.warn('### NO USEFUL DATA FOR %s' % galStr)
+
+    return galTab, sumCat, values
+
+
+def _initSummaryWorker(storeDir=None):
+    """Open the profile store once in each worker process."""
+    global _workerStore
+    if storeDir is not None:
+        _workerStore = pStore.ProfileStore(storeDir)
+    else:
+        _workerStore = None
+
+
+def _summaryShard(task):
+    """Summarize one shard of the catalog in a worker process."""
+    shard, kwargs = task
+    if _workerStore is not None:
+        """All the profiles of the shard are read at once"""
+        _workerStore.preload(galaxy=[info['id'] for (ii, info) in shard],
+                             prefix=kwargs['prefix'], rerun=kwargs['rerun'])
+    if isinstance(kwargs.get('store'), pIdx.ProfileIndex):
+        kwargs['store'].store = _workerStore
+    else:
+        kwargs['store'] = _workerStore
+    results = []
+    for ii, galaxy in shard:
+        galTab, sumCat, values = sbpSummaryGalaxy(galaxy, **kwargs)
+        results.append((ii, galTab, sumCat, values))
+
+    return results
+
+
 def coaddCutoutSbpSummary(inCat, prefix, root=None, idCol='ID', zCol='Z',
                           logmCol='MSTAR', logmErrCol='MSTAR_ERR',
                           raCol='RA', decCol='DEC',
@@ -1185,16 +1546,28 @@ def coaddCutoutSbpSummary(inCat, prefix, root=None, idCol='ID', zCol='Z',
                           ymagCol='zmag_cmodel', refFilter='HSC-I',
                           verbose=False, interp=True, sbpRef='lumI1',
                           sumFolder='sbp_sum', suffix=None, sample=None,
-                          plot=True, imgSub=False):
+                          plot=True, imgSub=False, store=None, nProc=1,
+                          useIndex=True, manifest=None, rescan=True):
     """
     Summarize the Ellipse results.
 
     Parameters:
         incat      :   Start with an input catalog
         root       :   Location of the data
+        store      :   Directory of the profile store (or a ProfileStore)
+        nProc      :   Number of worker processes; the catalog is cut into
+                       shards, and the results are merged in the order of
+                       the catalog
+        useIndex   :   Find all the profiles with one scan of the data,
+                       instead of looking for each file
+        manifest   :   File of the profile index; default is
+                       <sumFolder>/<prefix>_sbp_manifest.fits
+        rescan     :   Scan the data again even if the manifest exists
     """
     if not os.path.isfile(inCat):
         raise Exception("## Can not find the input catalog : %s !" % inCat)
+    if isinstance(store, str):
+        store = pStore.ProfileStore(store)
 
     """Name of the output catalog."""
     if suffix is None:
@@ -1378,291 +1751,100 @@ def coaddCutoutSbpSummary(inCat, prefix, root=None, idCol='ID', zCol='Z',
                         col16, col17, col18, col19, col20, col21, col22,
                         col23, col24, col25, col26, col27, col28])
 
-    """Start a ProgressBar"""
-    sbpSum = []
-    sbpList = []
-    with ProgressBar(len(outTab)) as bar:
-        if verbose:
-            print("\n###    Dealing with %d galaxies" % len(outTab))
-
-        """Go through the catalog to search for data"""
-        for (ii, galaxy) in enumerate(outTab):
-            """ID of the galaxy"""
-            galID = galaxy[idCol]
-            galStr = str(galID).strip()
-            galZ = galaxy[zCol]
-            """Data Dir"""
-            if root is None:
-                loc = '.'
-                sumDir = sumFolder
-            else:
-                loc = root
-                sumDir = os.path.join(root, sumFolder)
-
-            try:
-                os.mkdir(sumDir)
-            except OSError:
-                pass
-
-            """Summary table"""
-            if sample is None:
-                sumCat = galStr + '_sbpsum'
-            else:
-                sumCat = str(sample).strip() + '_' + galStr + '_sbpsum'
-            if imgSub:
-                sumCat += '_imgsub'
-            else:
-                sumCat += '_img'
-            if suffix is None:
-                sumCat = sumCat + '.fits'
+    """Data Dir"""
+    if root is None:
+        loc = '.'
+        sumDir = sumFolder
+    else:
+        loc = root
+        sumDir = os.path.join(root, sumFolder)
+    try:
+        os.mkdir(sumDir)
+    except OSError:
+        pass
+
+    """Find all the profiles with one scan of the output tree"""
+    galList = [str(galID).strip() for galID in outTab[idCol]]
+    if useIndex:
+        if manifest is None:
+            manifest = pIdx.manifestName(sumDir, prefix=prefix)
+        index = pIdx.buildIndex(loc, galaxies=galList, rerun=rerun,
+                                manifest=manifest, rescan=rescan,
+                                store=store, prefix=prefix,
+                                verbose=verbose)
+    else:
+        index = None
+    """The workers open the profile store by themselves, once each"""
+    storeDir = store.storeDir if store is not None else None
+
+    """The information of each galaxy used by the summary"""
+    tasks = []
+    for (ii, galaxy) in enumerate(outTab):
+        info = {'id': galList[ii], 'z': galaxy[zCol],
+                'a_g': galaxy[agCol], 'a_r': galaxy[arCol],
+                'a_i': galaxy[aiCol], 'a_z': galaxy[azCol],
+                'a_y': galaxy[ayCol]}
+        for band in ['g', 'r', 'i', 'z', 'y']:
+            info['logm2l_' + band] = galaxy['logm2l_' + band]
+        tasks.append((ii, info))
+    kwargs = {'prefix': prefix, 'loc': loc, 'sumDir': sumDir,
+              'rerun': rerun, 'sbpRef': sbpRef, 'sumFolder': sumFolder,
+              'suffix': suffix, 'sample': sample, 'imgSub': imgSub,
+              'plot': plot, 'verbose': verbose}
+    if verbose:
+        print("\n###    Dealing with %d galaxies" % len(outTab))
+
+    results = []
+    if (nProc > 1) and (len(tasks) > 1):
+        """Shards of the catalog, each with its part of the index"""
+        nShard = min(nProc * SHARD_PER_PROC, len(tasks))
+        shards = [tasks[jj::nShard] for jj in range(nShard)]
+        jobs = []
+        for shard in shards:
+            shardArgs = dict(kwargs)
+            if index is not None:
+                shardArgs['store'] = index.subset([info['id'] for
+                                                   (ii, info) in shard])
+                shardArgs['store'].store = None
             else:
-                sumCat = sumCat + '_' + str(suffix).strip() + '.fits'
-
-            sumCat = os.path.join(sumDir, sumCat)
-            if plot:
-                sumPng = sumCat.replace('.fits', '.png')
-
-            """
-            Get the collection of SBP results
-
-            Right now, don't automatically convert into mass profile
-            """
-            galTab = sbpCollect(loc, prefix, galStr, galZ,
-                                a_g=galaxy[agCol],
-                                a_r=galaxy[arCol],
-                                a_i=galaxy[aiCol],
-                                a_z=galaxy[azCol],
-                                a_y=galaxy[ayCol],
-                                verbose=verbose, save=False,
-                                sumFolder=sumFolder,
-                                sample=sample,
-                                suffix=suffix,
-                                imgSub=imgSub)
-
-            if galTab is not None:
-                """Radius KPc"""
-                rKpc = galTab['rKpc']
-                """Maximum luminosity from certain model"""
-                lumRef = galTab[sbpRef]
-                """Get the 1-D interpolation function"""
-                radInterp = interp1d(rKpc, lumRef)
-                """Maximum intergrated 1-d luminosity"""
-                lumMax = np.nanmax(lumRef).astype(np.float32)
-                if not np.isfinite(lumMax):
-                    lumMax = radInterp(150.0)
-                """Out to 150 Kpc"""
-                lum150 = np.nanmax(lumRef[rKpc <= 150.0]).astype(np.float32)
-                lum150i = radInterp(150.0)
-                lum150 = lum150 if (lum150 >= lum150i) else lum150i
-                """Out to 120 Kpc"""
-                lum120 = np.nanmax(lumRef[rKpc <= 120.0]).astype(np.float32)
-                lum120i = radInterp(120.0)
-                lum120 = lum120 if (lum120 >= lum120i) else lum120i
-                """Out to 100 Kpc"""
-                lum100 = np.nanmax(lumRef[rKpc <= 100.0]).astype(np.float32)
-                lum100i = radInterp(100.0)
-                lum100 = lum100 if (lum100 >= lum100i) else lum100i
-                """Out to 75 Kpc"""
-                lum75 = np.nanmax(lumRef[rKpc <= 75.0]).astype(np.float32)
-                lum75i = radInterp(75.0)
-                lum75 = lum75 if (lum75 >= lum75i) else lum75i
-                """Out to 60 Kpc"""
-                lum60 = np.nanmax(lumRef[rKpc <= 60.0]).astype(np.float32)
-                lum60i = radInterp(60.0)
-                lum60 = lum60 if (lum60 >= lum60i) else lum60i
-                """Out to 50 Kpc"""
-                lum50 = np.nanmax(lumRef[rKpc <= 50.0]).astype(np.float32)
-                lum50i = radInterp(50.0)
-                lum50 = lum50 if (lum50 >= lum50i) else lum50i
-                """Out to 40 Kpc"""
-                lum40 = np.nanmax(lumRef[rKpc <= 40.0]).astype(np.float32)
-                lum40i = radInterp(40.0)
-                lum40 = lum40 if (lum40 >= lum40i) else lum40i
-                """Out to 30 Kpc"""
-                lum30 = np.nanmax(lumRef[rKpc <= 30.0]).astype(np.float32)
-                lum30i = radInterp(30.0)
-                lum30 = lum30 if (lum30 >= lum30i) else lum30i
-                """Out to 25 Kpc"""
-                lum25 = np.nanmax(lumRef[rKpc <= 25.0]).astype(np.float32)
-                lum25i = radInterp(25.0)
-                lum25 = lum25 if (lum25 >= lum25i) else lum25i
-                """Out to 15 Kpc"""
-                lum15 = np.nanmax(lumRef[rKpc <= 15.0]).astype(np.float32)
-                lum15i = radInterp(15.0)
-                lum15 = lum15 if (lum15 >= lum15i) else lum15i
-                """Out to 10 Kpc"""
-                lum10 = np.nanmax(lumRef[rKpc <= 10.0]).astype(np.float32)
-                lum10i = radInterp(10.0)
-                lum10 = lum10 if (lum10 >= lum10i) else lum10i
-                """Out to 5 Kpc"""
-                lum5 = np.nanmax(lumRef[rKpc <= 5.0]).astype(np.float32)
-                lum5i = radInterp(5.0)
-                lum5 = lum5 if (lum5 >= lum5i) else lum5i
-
-                if not np.isfinite(lum120):
-                    if verbose:
-                        print(WAR)
-                        print("## Problematic SBP for %s !" % galStr)
-                    lumMax = -9999.0
-                    lum150 = -9999.0
-                    lum120 = -9999.0
-                    lum100 = -9999.0
-                    lum75 = -9999.0
-                    lum60 = -9999.0
-                    lum50 = -9999.0
-                    lum40 = -9999.0
-                    lum30 = -9999.0
-                    lum25 = -9999.0
-                    lum15 = -9999.0
-                    lum10 = -9999.0
-                    lum5 = -9999.0
-
-                galTab.meta['LUM_MAX'] = float(lumMax)
-                galTab.meta['LUM_150'] = float(lum150)
-                galTab.meta['LUM_120'] = float(lum120)
-                galTab.meta['LUM_100'] = float(lum100)
-                galTab.meta['LUM_75'] = float(lum75)
-                galTab.meta['LUM_60'] = float(lum60)
-                galTab.meta['LUM_50'] = float(lum50)
-                galTab.meta['LUM_40'] = float(lum40)
-                galTab.meta['LUM_30'] = float(lum30)
-                galTab.meta['LUM_25'] = float(lum25)
-                galTab.meta['LUM_15'] = float(lum15)
-                galTab.meta['LUM_10'] = float(lum10)
-                galTab.meta['LUM_5'] = float(lum5)
-
-                """M2L"""
-                galTab.meta['LOGM2L_G'] = galaxy['logm2l_g']
-                galTab.meta['LOGM2L_R'] = galaxy['logm2l_r']
-                galTab.meta['LOGM2L_I'] = galaxy['logm2l_i']
-                galTab.meta['LOGM2L_Z'] = galaxy['logm2l_z']
-                galTab.meta['LOGM2L_Y'] = galaxy['logm2l_y']
-
-                """Save the result of the individual galaxy"""
-                galTab.write(sumCat, format='fits', overwrite=True)
-
-                """Update the sample summary table"""
-                outTab['lum_max'][ii] = lumMax
-                outTab['lum_150'][ii] = lum150
-                outTab['lum_120'][ii] = lum120
-                outTab['lum_100'][ii] = lum100
-                outTab['lum_75'][ii] = lum75
-                outTab['lum_60'][ii] = lum60
-                outTab['lum_50'][ii] = lum50
-                outTab['lum_40'][ii] = lum40
-                outTab['lum_30'][ii] = lum30
-                outTab['lum_25'][ii] = lum25
-                outTab['lum_15'][ii] = lum15
-                outTab['lum_10'][ii] = lum10
-                outTab['lum_5'][ii] = lum5
-
-                """Get the R20, R50, R80 and R90"""
-                if np.isfinite(lumMax):
-                    try:
-                        fracMax = (10.0 ** lumRef) / (10.0 ** lumMax)
-                        fracInterp1 = interp1d(fracMax, rKpc)
-                        outTab['r20_max'][ii] = fracInterp1(0.20)
-                        outTab['r50_max'][ii] = fracInterp1(0.50)
-                        outTab['r80_max'][ii] = fracInterp1(0.80)
-                        outTab['r90_max'][ii] = fracInterp1(0.80)
-                        outTab['c82_max'][ii] = (outTab['r80_max'][ii] /
-                                                 outTab['r20_max'][ii])
-                    except Exception:
-                        outTab['r20_max'][ii] = -9999.0
-                        outTab['r50_max'][ii] = -9999.0
-                        outTab['r80_max'][ii] = -9999.0
-                        outTab['r90_max'][ii] = -9999.0
-                        outTab['c82_max'][ii] = -9999.0
-                else:
-                    outTab['r20_max'][ii] = -9999.0
-                    outTab['r50_max'][ii] = -9999.0
-                    outTab['r80_max'][ii] = -9999.0
-                    outTab['r90_max'][ii] = -9999.0
-                    outTab['c82_max'][ii] = -9999.0
-
-                if np.isfinite(lum120):
-                    try:
-                        frac120 = (10.0 ** lumRef) / (10.0 ** lum120)
-                        fracInterp2 = interp1d(frac120, rKpc)
-                        outTab['r20_120'][ii] = fracInterp2(0.20)
-                        outTab['r50_120'][ii] = fracInterp2(0.50)
-                        outTab['r80_120'][ii] = fracInterp2(0.80)
-                        outTab['r90_120'][ii] = fracInterp2(0.80)
-                        outTab['c82_120'][ii] = (outTab['r80_120'][ii] /
-                                                 outTab['r20_120'][ii])
-                    except Exception:
-                        outTab['r20_120'][ii] = -9999.0
-                        outTab['r50_120'][ii] = -9999.0
-                        outTab['r80_120'][ii] = -9999.0
-                        outTab['r90_120'][ii] = -9999.0
-                        outTab['c82_120'][ii] = -9999.0
-                else:
-                    outTab['r20_120'][ii] = -9999.0
-                    outTab['r50_120'][ii] = -9999.0
-                    outTab['r80_120'][ii] = -9999.0
-                    outTab['r90_120'][ii] = -9999.0
-                    outTab['c82_120'][ii] = -9999.0
-
-                if np.isfinite(lum100):
-                    try:
-                        frac100 = (10.0 ** lumRef) / (10.0 ** lum100)
-                        fracInterp3 = interp1d(frac100, rKpc)
-                        outTab['r20_100'][ii] = fracInterp3(0.20)
-                        outTab['r50_100'][ii] = fracInterp3(0.50)
-                        outTab['r80_100'][ii] = fracInterp3(0.80)
-                        outTab['r90_100'][ii] = fracInterp3(0.80)
-                        outTab['c82_100'][ii] = (outTab['r80_100'][ii] /
-                                                 outTab['r20_100'][ii])
-                    except Exception:
-                        outTab['r20_100'][ii] = -9999.0
-                        outTab['r50_100'][ii] = -9999.0
-                        outTab['r80_100'][ii] = -9999.0
-                        outTab['r90_100'][ii] = -9999.0
-                        outTab['c82_100'][ii] = -9999.0
+                shardArgs['store'] = None
+            jobs.append((shard, shardArgs))
+        """A shard that fails or kills its worker does not stop the run"""
+        with ProgressBar(len(jobs)) as bar:
+            for (jj, ok, partial) in hscPool.imapSafe(
+                    _summaryShard, jobs, nProc=nProc,
+                    initializer=_initSummaryWorker, initargs=(storeDir,)):
+                if ok:
+                    results += partial
                 else:
-                    outTab['r20_100'][ii] = -9999.0
-                    outTab['r50_100'][ii] = -9999.0
-                    outTab['r80_100'][ii] = -9999.0
-                    outTab['r90_100'][ii] = -9999.0
-                    outTab['c82_100'][ii] = -9999.0
-
-                """Extra meta information"""
-                galTab.meta['R20_MAX'] = outTab['r20_max'][ii]
-                galTab.meta['R50_MAX'] = outTab['r50_max'][ii]
-                galTab.meta['R80_MAX'] = outTab['r80_max'][ii]
-                galTab.meta['R90_MAX'] = outTab['r90_max'][ii]
-                galTab.meta['C82_MAX'] = outTab['c82_max'][ii]
-
-                galTab.meta['R20_120'] = outTab['r20_120'][ii]
-                galTab.meta['R50_120'] = outTab['r50_120'][ii]
-                galTab.meta['R80_120'] = outTab['r80_120'][ii]
-                galTab.meta['R90_120'] = outTab['r90_120'][ii]
-                galTab.meta['C82_120'] = outTab['c82_120'][ii]
-
-                galTab.meta['R20_100'] = outTab['r20_100'][ii]
-                galTab.meta['R50_100'] = outTab['r50_100'][ii]
-                galTab.meta['R80_100'] = outTab['r80_100'][ii]
-                galTab.meta['R90_100'] = outTab['r90_100'][ii]
-                galTab.meta['C82_100'] = outTab['c82_100'][ii]
-
-                """"""
-                sbpSum.append(galTab)
-                sbpList.append(sumCat)
-
-                if plot:
-                    sbpCompare(galTab, sumPng)
-            else:
-                """"""
-                sbpSum.append(None)
-                sbpList.append('None')
-                """"""
-                warnings.warn('### NO USEFUL DATA FOR %s' % galStr)
-
-            """Update the progress bar"""
-            bar.update()
+                    warnings.warn('### Shard %d failed : %s' % (jj,
+                                                                partial))
+                    results += [(ii, None, None, None)
+                                for (ii, info) in jobs[jj][0]]
+                bar.update()
+    else:
+        kwargs['store'] = index if index is not None else store
+        with ProgressBar(len(tasks)) as bar:
+            for (ii, info) in tasks:
+                galTab, sumCat, values = sbpSummaryGalaxy(info, **kwargs)
+                results.append((ii, galTab, sumCat, values))
+                bar.update()
+
+    """Merge the results in the order of the catalog"""
+    results.sort(key=lambda result: result[0])
+    sbpSum = []
+    sbpList = []
+    for (ii, galTab, sumCat, values) in results:
+        if galTab is not None:
+            for col in SUM_COLUMNS:
+                outTab[col][ii] = values[col]
+            sbpList.append(sumCat)
+        else:
+            sbpList.append('None')
+        sbpSum.append(galTab)
 
-        """Save a Pickle file of the results"""
-        hUtil.saveToPickle(sbpSum, outPkl)
+    """Save a Pickle file of the results"""
+    hUtil.saveToPickle(sbpSum, outPkl)
 
     """Save the output catalog"""
     if verbose:
@@ -1723,6 +1905,21 @@ if __name__ == '__main__':
     parser.add_argument('--imgSub', dest='imgSub',
                         action="store_true",
                         default=False)
+    parser.add_argument('--store', dest='store',
+                        help='Directory of the profile store',
+                        default=None)
+    parser.add_argument('-j', '--nproc', dest='nProc', type=int,
+                        help='Number of worker processes',
+                        default=1)
+    parser.add_argument('--noIndex', dest='useIndex',
+                        action="store_false",
+                        default=True)
+    parser.add_argument('--manifest', dest='manifest',
+                        help='File of the profile index',
+                        default=None)
+    parser.add_argument('--noRescan', dest='rescan',
+                        action="store_false",
+                        default=True)
 
     args = parser.parse_args()
 
@@ -1741,4 +1938,9 @@ if __name__ == '__main__':
                           suffix=args.suffix,
                           sample=args.sample,
                           plot=args.plot,
-                          imgSub=args.imgSub)
+                          imgSub=args.imgSub,
+                          store=args.store,
+                          nProc=args.nProc,
+                          useIndex=args.useIndex,
+                          manifest=args.manifest,
+                          rescan=args.rescan)
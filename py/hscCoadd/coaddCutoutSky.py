@@ -10,8 +10,7 @@ import warnings
 import argparse
 
 import numpy as np
-import scipy
-from scipy.stats import sigmaclip
+import scipy.stats
 
 # Astropy
 from astropy.io import fits
@@ -26,7 +25,12 @@ import sep
 
 # Personal
 import hscUtils as hUtil
+import hscStats as hStats
+import hscRerun as hRerun
 import coaddCutoutPrepare as cdPrep
+import coaddSkyTable as cSkyTab
+import coaddPatchSky as cPatchSky
+import coaddSkyConfig as cSkyCfg
 
 # Matplotlib related
 import matplotlib as mpl
@@ -68,12 +72,8 @@ def readCutout(prefix, root=None, exMask=None, verbose=False):
     if verbose:
         print("###    Mask Used : %s" % mskFile)
 
-    if os.path.islink(imgFile):
-        imgOri = os.readlink(imgFile)
-        imgFile = imgOri
-    if os.path.islink(mskFile):
-        mskOri = os.readlink(mskFile)
-        mskFile = mskOri
+    imgFile = hRerun.resolvePath(imgFile)
+    mskFile = hRerun.resolvePath(mskFile)
 
     if (not os.path.isfile(imgFile)) or (not os.path.isfile(mskFile)):
         print(imgFile, mskFile)
@@ -194,8 +194,8 @@ def getSEPSky(imgArr,
               suffix='imgsub',
               verbose=True,
               visual=True,
-              bkgSize=40,
-              bkgFilter=5,
+              bkgSize=cSkyCfg.BKG_SIZE,
+              bkgFilter=cSkyCfg.BKG_FILTER,
               saveBkg=False,
               nClip=2):
     """
@@ -265,14 +265,16 @@ def getSEPSky(imgArr,
     pixSky1 = imgBin[mskBin == 0].flatten()
     pixSky1 = pixSky1[np.isfinite(pixSky1)]
     try:
-        pixSky1, low1, upp1 = sigmaclip(pixSky1, low=skyClip, high=skyClip)
+        _, pixSky1 = hStats.sigmaClipStats(pixSky1, low=skyClip,
+                                           upp=skyClip, returnData=True)
     except Exception:
         warnings.warn("\nSigma clip fails for imgBin")
 
     pixSky2 = subBin[mskBin == 0].flatten()
     pixSky2 = pixSky2[np.isfinite(pixSky2)]
     try:
-        pixSky2, low2, upp2 = sigmaclip(pixSky2, low=skyClip, high=skyClip)
+        _, pixSky2 = hStats.sigmaClipStats(pixSky2, low=skyClip,
+                                           upp=skyClip, returnData=True)
     except Exception:
         warnings.warn("Sigma clip fails for mskBin")
 
@@ -283,46 +285,69 @@ def getSEPSky(imgArr,
     return imgSub
 
 
-def getGlobalSky(imgArr,
-                 mskAll,
-                 skyClip=3,
-                 zp=27.0,
-                 pix=0.168,
-                 rebin=4,
-                 prefix='coadd_sky',
-                 suffix='global_',
-                 verbose=True,
-                 visual=True,
-                 nClip=2):
+def pixelSkyStats(imgArr, mskAll, skyClip=3):
     """
-    Estimate the Global Sky.
+    Sigma-clipped statistics of the unmasked pixels of the unbinned image.
 
-    Estimating the global sky background level by using the mean
-    of a rebined image
-
-    This could also be used to estimate the expect surface brightness
-    limit of the image
+    The 'std' is the sky RMS of one pixel, which is used for the S/N of
+    the isophotes; it does not depend on the binning method.
 
+    Return:
+        statsPix, pixNoMsk
     """
-    # Estimate the global background level
-    dimX, dimY = imgArr.shape
-
-    # Pixel values of all pixels that are not masked out (before rebinned)
     pixels = imgArr[mskAll == 0].flatten()
     pixels = pixels[np.isfinite(pixels)]
     try:
-        pixNoMsk, low3, upp3 = sigmaclip(pixels, low=skyClip, high=skyClip)
+        return hStats.sigmaClipStats(pixels, low=skyClip, upp=skyClip,
+                                     returnData=True)
     except Exception:
         warnings.warn("\n### sigmaclip failed for original image!")
-        pixNoMsk = pixels
-        del pixels
+        return hStats.sigmaClipStats(pixels, maxIter=0), pixels
+
+
+def measureGlobalSky(imgArr,
+                     mskAll,
+                     skyClip=3,
+                     rebin=4,
+                     prefix='coadd_sky',
+                     binMethod='block',
+                     skyPrior=None,
+                     visual=True):
+    """
+    Sigma-clipped statistics of the unmasked pixels of the rebinned image.
+
+    When the sky from the patch sky map (skyPrior) is available, the
+    clipping boundaries are taken from it and only one pass is needed.
+
+    skyStd (and skySkw) always describe the individual pixels: the
+    nearest-pixel congrid only samples the image, but the block mean
+    reduces the scatter by about the binning factor, so with
+    binMethod='block' they are measured on the unbinned pixels instead.
+    skyRms is the scatter of all the unbinned pixels (pixelSkyStats()).
+
+    Return:
+        numSkyPix, skyMed, skyAvg, skyStd, skySkw, skyRms, pixNoMskBin,
+        pixNoMsk
+    """
+    # Estimate the global background level
+    dimX, dimY = imgArr.shape
+
+    # Pixel values of all pixels that are not masked out (before rebinned)
+    # They are used in the histogram, and for the scatter of the pixels
+    statsPix, pixNoMsk = pixelSkyStats(imgArr, mskAll, skyClip=skyClip)
 
     try:
         # Rebin image
-        dimBinX = int((dimX - 1) / rebin)
-        dimBinY = int((dimY - 1) / rebin)
-        imgBin = hUtil.congrid(imgArr, (dimBinX, dimBinY), method='nearest')
-        mskBin = hUtil.congrid(mskAll, (dimBinX, dimBinY), method='neighbour')
+        if binMethod == 'block':
+            imgBin, mskBin = hUtil.rebinImage(imgArr, rebin, mask=mskAll,
+                                              func='mean', minFrac=0.5)
+        else:
+            dimBinX = int((dimX - 1) / rebin)
+            dimBinY = int((dimY - 1) / rebin)
+            imgBin = hUtil.congrid(imgArr, (dimBinX, dimBinY),
+                                   method='nearest')
+            mskBin = hUtil.congrid(mskAll, (dimBinX, dimBinY),
+                                   method='neighbour')
     except Exception:
         warnings.warn('### congrid failed!')
         print("\n###    Image rebin is failed for this galaxy !!!")
@@ -333,22 +358,98 @@ def getGlobalSky(imgArr,
     pixels = imgBin[mskBin == 0].flatten()
     pixels = pixels[np.isfinite(pixels)]
     try:
-        pixNoMskBin, low4, upp4 = sigmaclip(pixels, low=skyClip, high=skyClip)
+        if skyPrior is not None:
+            # Only one pass within the boundaries from the patch sky
+            inPrior = ((pixels >= (skyPrior['skyMed'] -
+                                   skyClip * skyPrior['skyStd'])) &
+                       (pixels <= (skyPrior['skyMed'] +
+                                   skyClip * skyPrior['skyStd'])))
+            statsBin, pixNoMskBin = hStats.sigmaClipStats(pixels[inPrior],
+                                                          maxIter=0,
+                                                          returnData=True)
+        else:
+            statsBin, pixNoMskBin = hStats.sigmaClipStats(pixels,
+                                                          low=skyClip,
+                                                          upp=skyClip,
+                                                          returnData=True)
     except Exception:
         warnings.warn("### sigmaclip failed for binned image!")
         pixNoMskBin = pixels
+        statsBin = hStats.sigmaClipStats(pixels, maxIter=0)
 
     numSkyPix = len(pixNoMskBin)
     # Get the basic statistics of the global sky
-    skyAvg, skyStd = np.nanmean(pixNoMskBin), np.nanstd(pixNoMskBin)
+    skyAvg, skyStd = statsBin['mean'], statsBin['std']
     if not np.isfinite(skyAvg) or not np.isfinite(skyStd):
         warnings.warn("\n###    No useful global skyAvg / Std for %s" % prefix)
-    skyMed = np.nanmedian(pixNoMskBin)
+    skyMed = statsBin['median']
     if not np.isfinite(skyMed):
         warnings.warn("\n###    No useful global skyMed for %s" % prefix)
         skyMed = skyAvg if np.isfinite(skyAvg) else 0.00
 
     skySkw = scipy.stats.skew(pixNoMskBin)
+    if binMethod == 'block' and (statsPix is not None) and (
+            imgBin is not imgArr):
+        skyStd = statsPix['std']
+        skySkw = scipy.stats.skew(pixNoMsk)
+
+    return (numSkyPix, skyMed, skyAvg, skyStd, skySkw, statsPix['std'],
+            pixNoMskBin, pixNoMsk)
+
+
+def getGlobalSky(imgArr,
+                 mskAll,
+                 skyClip=3,
+                 zp=27.0,
+                 pix=0.168,
+                 rebin=4,
+                 prefix='coadd_sky',
+                 suffix='global_',
+                 verbose=True,
+                 visual=True,
+                 nClip=2,
+                 binMethod='block',
+                 saveDat=True,
+                 skyPrior=None,
+                 skyRefine=True):
+    """
+    Estimate the Global Sky.
+
+    Estimating the global sky background level by using the mean
+    of a rebined image
+
+    This could also be used to estimate the expect surface brightness
+    limit of the image
+
+    binMethod = 'block'   : average the unmasked pixels in rebin x rebin
+                            blocks; congrid is only used when rebin is
+                            not an integer
+                'congrid' : the original nearest-pixel congrid rebinning
+                With both methods, SKYSTD and SKYSKW are the scatter and
+                skewness of the individual sky pixels; SKYRMS is the
+                scatter of all the unbinned sky pixels, also when the
+                patch sky is used directly
+    saveDat   : save the summary in a *_sky.dat file; can be turned off
+                when the result is kept in a sky table
+    skyPrior  : global sky sampled from the patch sky map
+    skyRefine : refine the patch sky using the pixels of this cutout;
+                otherwise the patch sky is used directly
+    """
+    if (skyPrior is not None) and (not skyRefine):
+        # Use the sky from the patch sky map directly
+        numSkyPix = skyPrior['nSkyPix']
+        skyMed, skyAvg = skyPrior['skyMed'], skyPrior['skyAvg']
+        skyStd, skySkw = skyPrior['skyStd'], np.nan
+        pixNoMsk, pixNoMskBin = None, None
+        skyRms = pixelSkyStats(imgArr, mskAll, skyClip=skyClip)[0]['std']
+    else:
+        skyOut = measureGlobalSky(imgArr, mskAll, skyClip=skyClip,
+                                  rebin=rebin, prefix=prefix,
+                                  binMethod=binMethod, skyPrior=skyPrior,
+                                  visual=visual)
+        numSkyPix, skyMed, skyAvg, skyStd, skySkw, skyRms = skyOut[:6]
+        pixNoMskBin, pixNoMsk = skyOut[6:]
+
     sbExpt = cdPrep.getSbpValue(3.0 * skyStd, pix * rebin, pix * rebin, zp=zp)
 
     if not np.isfinite(sbExpt):
@@ -359,7 +460,7 @@ def getGlobalSky(imgArr,
                                                           skyStd, skySkw,
                                                           sbExpt))
 
-    if visual:
+    if visual and (pixNoMskBin is not None):
         skyPNG = prefix + '_' + suffix + 'skyhist.png'
         showSkyHist(
             pixNoMskBin,
@@ -372,19 +473,21 @@ def getGlobalSky(imgArr,
             skySkw=skySkw)
 
     """Save a txt file summary"""
-    skyTxt = prefix + '_' + suffix + 'sky.dat'
-    text_file = open(skyTxt, "w")
-    text_file.write("IMAGE: %s \n" % prefix)
-    text_file.write("REBIN: %3d \n" % rebin)
-    text_file.write("NSKYPIX: %10d \n" % numSkyPix)
-    text_file.write("SKYMED: %10.6f \n" % skyMed)
-    text_file.write("SKYAVG: %10.6f \n" % skyAvg)
-    text_file.write("SKYSTD: %10.6f \n" % skyStd)
-    text_file.write("SKYSKW: %10.6f \n" % skySkw)
-    text_file.write("SBEXPT: %10.6f \n" % sbExpt)
-    text_file.close()
-
-    return numSkyPix, skyMed, skyAvg, skyStd, skySkw, sbExpt
+    if saveDat:
+        skyTxt = prefix + '_' + suffix + 'sky.dat'
+        text_file = open(skyTxt, "w")
+        text_file.write("IMAGE: %s \n" % prefix)
+        text_file.write("REBIN: %3d \n" % rebin)
+        text_file.write("NSKYPIX: %10d \n" % numSkyPix)
+        text_file.write("SKYMED: %10.6f \n" % skyMed)
+        text_file.write("SKYAVG: %10.6f \n" % skyAvg)
+        text_file.write("SKYSTD: %10.6f \n" % skyStd)
+        text_file.write("SKYSKW: %10.6f \n" % skySkw)
+        text_file.write("SBEXPT: %10.6f \n" % sbExpt)
+        text_file.write("SKYRMS: %10.6f \n" % skyRms)
+        text_file.close()
+
+    return numSkyPix, skyMed, skyAvg, skyStd, skySkw, sbExpt, skyRms
 
 
 def coaddCutoutSky(prefix,
@@ -396,14 +499,28 @@ def coaddCutoutSky(prefix,
                    rebin=6,
                    visual=True,
                    exMask=None,
-                   bkgSize=40,
-                   bkgFilter=5,
+                   bkgSize=cSkyCfg.BKG_SIZE,
+                   bkgFilter=cSkyCfg.BKG_FILTER,
                    saveBkg=False,
-                   nClip=2):
+                   nClip=2,
+                   binMethod='block',
+                   skyTable=None,
+                   saveDat=True,
+                   galID=None,
+                   filter=None,
+                   rerun=None,
+                   patchSky=None,
+                   skyRefine=True):
     """
     Estimate the Sky Background for Coadd Image.
 
     Parameters:
+        skyTable : sky table of the run; the global sky is appended to it
+        galID, filter, rerun : identify the cutout in the sky table
+        patchSky  : folder of the patch sky maps from coaddPatchSky; the
+                    global sky is sampled from the maps of the patches
+                    that overlap with the cutout
+        skyRefine : refine the patch sky with the pixels of the cutout
     """
     # 0. Get necessary information
     # Read the input cutout image
@@ -437,6 +554,25 @@ def coaddCutoutSky(prefix,
         nClip=nClip)
 
     # 2. Global Background Estimation
+    skyPrior = None
+    if patchSky is not None:
+        if filter is None:
+            warnings.warn("### Need the filter to find the patch sky map")
+            skyList = []
+        else:
+            skyList = cPatchSky.cutoutPatchList(imgHead, filter,
+                                                skyDir=patchSky, rebin=rebin)
+        if len(skyList) > 0:
+            skyPrior = cPatchSky.samplePatchSky(skyList, imgHead,
+                                                imgArr.shape,
+                                                bkgSize=bkgSize,
+                                                bkgFilter=bkgFilter)
+        if skyPrior is None:
+            warnings.warn("### No useful patch sky for %s" % prefix)
+        elif verbose:
+            print("###    Patch sky: %8.5f +/- %8.5f from %d boxes" %
+                  (skyPrior['skyMed'], skyPrior['skyErr'],
+                   skyPrior['nBox']))
     suffixGlob = 'rebin' + str(rebin).strip() + '_'
     skyGlobal = getGlobalSky(
         imgSub,
@@ -449,7 +585,15 @@ def coaddCutoutSky(prefix,
         suffix=suffixGlob,
         visual=visual,
         verbose=verbose,
-        nClip=nClip)
+        nClip=nClip,
+        binMethod=binMethod,
+        saveDat=saveDat,
+        skyPrior=skyPrior,
+        skyRefine=skyRefine)
+
+    if skyTable is not None:
+        cSkyTab.skyTableAppend(skyTable, prefix, skyGlobal, rebin=rebin,
+                               galID=galID, filter=filter, rerun=rerun)
 
     return skyGlobal
 
@@ -483,13 +627,13 @@ if __name__ == '__main__':
         dest='bkgSize',
         help='Background size for SEP',
         type=int,
-        default=60)
+        default=cSkyCfg.BKG_SIZE)
     parser.add_argument(
         '--bkgFilter',
         dest='bkgFilter',
         help='Background filter size for SEP',
         type=int,
-        default=5)
+        default=cSkyCfg.BKG_FILTER)
     parser.add_argument(
         '--pix',
         dest='pix',
@@ -514,6 +658,36 @@ if __name__ == '__main__':
         default=2)
     parser.add_argument(
         '--saveBkg', dest='saveBkg', action="store_true", default=False)
+    parser.add_argument(
+        '--binMethod',
+        dest='binMethod',
+        help='Method to rebin the image for global sky',
+        default='block',
+        choices=['block', 'congrid'])
+    parser.add_argument(
+        '--skyTable',
+        dest='skyTable',
+        help='Sky table to keep the global sky',
+        default=None)
+    parser.add_argument(
+        '--noSkyDat',
+        dest='saveDat',
+        help='Do not save the *_sky.dat file',
+        action="store_false",
+        default=True)
+    parser.add_argument(
+        '-f', '--filter', dest='filter', help="Filter", default=None)
+    parser.add_argument(
+        '--patchSky',
+        dest='patchSky',
+        help='Folder of the patch sky maps',
+        default=None)
+    parser.add_argument(
+        '--noSkyRefine',
+        dest='skyRefine',
+        help='Use the patch sky without refinement',
+        action="store_false",
+        default=True)
 
     args = parser.parse_args()
 
@@ -530,4 +704,10 @@ if __name__ == '__main__':
         bkgSize=args.bkgSize,
         bkgFilter=args.bkgFilter,
         saveBkg=args.saveBkg,
-        nClip=args.nClip)
+        nClip=args.nClip,
+        binMethod=args.binMethod,
+        skyTable=args.skyTable,
+        saveDat=args.saveDat,
+        filter=args.filter,
+        patchSky=args.patchSky,
+        skyRefine=args.skyRefine)
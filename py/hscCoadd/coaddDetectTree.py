@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Nested, multi-threshold object detection for HSC cutouts."""
+
+from __future__ import (division, print_function)
+
+import numpy as np
+
+from numpy.lib import recfunctions
+
+# SEP
+import sep
+
+"""
+Each threshold level is detected by sep.extract(), so the thresholding,
+the labelling, and the deblending are done by the C code of SEP, and every
+level can have its own background-subtracted image and filter kernel
+(e.g. the Cold and Hot runs of coaddCutoutPrepare).  The catalogs are the
+ones from sep.extract(), with a few extra fields that link the levels into
+a tree:
+    level  : index of the threshold level, in ascending order
+    id     : index of the object in the catalog of its own level
+    parent : id of the object of the previous (lower) level whose
+             segment has the filtered peak of this object; -1 when the
+             peak is not in any segment, and for the lowest level
+    root   : id of the ancestor in the catalog of the lowest level; -1
+             when there is none
+
+The links are kept by the cleaning of the catalogs (e.g. sepValidObjects),
+so the catalogs of the levels can be merged without any cross-matching
+(combTreeCat).
+"""
+TREE_FIELDS = [('level', int), ('id', int), ('parent', int), ('root', int)]
+
+
+def _perLevel(value, nLevel):
+    """One value for every level: a list or tuple is already per level."""
+    if isinstance(value, (list, tuple)):
+        if len(value) != nLevel:
+            raise Exception("### Need one value for each of the %d levels" %
+                            nLevel)
+        return list(value)
+    return [value] * nLevel
+
+
+def detectTree(img,
+               thresholds,
+               minarea=5,
+               err=None,
+               filter_kernel=None,
+               filter_type='matched',
+               deblend_nthresh=32,
+               deblend_cont=0.005,
+               verbose=False):
+    """
+    Name: detectTree.
+
+    Detect objects at a series of thresholds, and link each object to the
+    one of the lower level it belongs to.
+
+    Parameters:
+        img        : background-subtracted image; or a list with the image
+                     of each level
+        thresholds : list of detection thresholds; in unit of the err array
+                     if it is provided, otherwise in unit of the image
+        minarea, filter_kernel, deblend_nthresh, deblend_cont :
+                     parameters of sep.extract(); single values or lists
+                     with the value of each level
+
+    Return:
+        objList : catalogs of objects at each level, in ascending order
+                  of the thresholds
+        segList : segmentation maps of each level; the value of each pixel
+                  is (id + 1) of the object in the catalog
+    """
+    thrArr = np.asarray(thresholds, dtype=float)
+    nLevel = len(thrArr)
+    order = np.argsort(thrArr, kind='mergesort')
+    imgArr, kernels, areas, debThr, debCon = [
+        [values[ii] for ii in order] for values in
+        [_perLevel(img, nLevel), _perLevel(filter_kernel, nLevel),
+         _perLevel(minarea, nLevel), _perLevel(deblend_nthresh, nLevel),
+         _perLevel(deblend_cont, nLevel)]]
+
+    objList, segList = [], []
+    for ii, thresh in enumerate(thrArr[order]):
+        objs, seg = sep.extract(imgArr[ii], thresh, err=err,
+                                minarea=areas[ii],
+                                filter_kernel=kernels[ii],
+                                filter_type=filter_type,
+                                deblend_nthresh=debThr[ii],
+                                deblend_cont=debCon[ii],
+                                segmentation_map=True)
+        nObj = len(objs)
+        objs = recfunctions.append_fields(
+            objs, [name for name, _ in TREE_FIELDS],
+            [np.full(nObj, ii, dtype=int), np.arange(nObj),
+             np.full(nObj, -1, dtype=int), np.full(nObj, -1, dtype=int)],
+            dtypes=[dtype for _, dtype in TREE_FIELDS], usemask=False)
+
+        if ii == 0:
+            objs['root'] = objs['id']
+        elif nObj > 0:
+            # The segment of the lower level under the filtered peak
+            objs['parent'] = segList[-1][objs['ycpeak'], objs['xcpeak']] - 1
+            # The extra element takes care of the objects without parent
+            rootPrev = np.append(objList[-1]['root'], -1)
+            objs['root'] = rootPrev[objs['parent']]
+
+        objList.append(objs)
+        segList.append(seg)
+        if verbose:
+            print("###    Threshold %6.2f : %d objects" % (thresh, nObj))
+
+    return objList, segList
+
+
+def combTreeCat(objCold, objHot, keepH=True):
+    """
+    Merge the Cold and Hot catalogs from the same detection tree.
+
+    Instead of the matching of the centers in combObjCat(), the Hot
+    objects replace the Cold object they come from (their root): a Cold
+    object is only kept when none of the Hot objects is inside it, and a
+    Hot object is new when it is not inside any of the Cold objects.  Both
+    catalogs can be cleaned (e.g. by sepValidObjects) before the merge.
+
+    Return:
+        objComb, objHnew, objCnew : same as combObjCat()
+    """
+    hasChild = np.in1d(objCold['id'], objHot['root'])
+    objCnew = objCold[~hasChild]
+    objHnew = objHot[~np.in1d(objHot['root'], objCold['id'])]
+
+    if keepH:
+        objComb = np.concatenate((objHot, objCnew))
+    else:
+        objComb = np.concatenate((objCold, objHnew))
+
+    return objComb, objHnew, objCnew
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Run the ELLIPSE configurations of one galaxy concurrently."""
+
+from __future__ import (division, print_function)
+
+import os
+import multiprocessing
+
+import ellipseService as eService
+
+SEP = '-' * 100
+
+"""
+Each job is one galSBP() call.  A job starts as soon as all the jobs in its
+'after' list are finished, so the independent configurations run at the
+same time in a process pool.
+
+Every job runs in its own temporary directory, so the temp_*.fits images,
+.pl masks and other intermediate files of different jobs never collide.
+With nProc > 1 the jobs run on the workers of an
+ellipseService.EllipseService, so a worker that crashes or a job that
+runs longer than the timeout is reported as a failed job.
+The input image, mask and inEllip table are turned into absolute paths and
+only read by the jobs; the outputs are still written next to the image.
+"""
+PATH_KEYS = ['mask', 'inEllip']
+
+
+def ellipseJob(name, image, after=None, setup=None, **kwargs):
+    """
+    Describe one galSBP() run.
+
+    Parameters:
+        name   : unique name of the job
+        image  : input image of galSBP()
+        after  : names of the jobs that have to finish first
+        setup  : function(results, kwargs), called in the main process
+                 right before the job starts; it can update the kwargs
+                 using the results of the finished jobs, or raise an
+                 Exception to skip the job
+        kwargs : the other parameters of galSBP()
+    """
+    return {'name': name, 'image': image,
+            'after': list(after) if after is not None else [],
+            'setup': setup, 'kwargs': kwargs}
+
+
+"""
+Run galSBP() in a private temporary directory; shared with the workers of
+the ellipse service
+"""
+singleEllipseRun = eService.singleEllipseRun
+
+
+def _prepareJob(job, results, workDir):
+    """Run the setup of a job, and turn the file names into absolute paths."""
+    kwargs = dict(job['kwargs'])
+    if job['setup'] is not None:
+        job['setup'](results, kwargs)
+    for key in PATH_KEYS:
+        if kwargs.get(key) is not None:
+            kwargs[key] = os.path.abspath(kwargs[key])
+    return (job['name'], os.path.abspath(job['image']), kwargs, workDir)
+
+
+def runEllipseJobs(jobs, nProc=1, workDir=None, verbose=False,
+                   service=None, timeout=1800.0):
+    """
+    Run a group of galSBP() jobs following their dependencies.
+
+    A job is skipped when one of the jobs it depends on fails.  With
+    nProc=1 (or inside a daemon worker) the jobs run one by one in the
+    order of the list.  When an ellipseService.EllipseService is given,
+    the jobs run on its warm workers instead, and nProc is ignored;
+    otherwise a service with nProc workers is started for this group.
+
+    Parameters:
+        timeout : maximum run time of one job in seconds, for the service
+                  started here
+
+    Return:
+        results : dict of {name: (ellipOut, outBin)}; (None, None) for
+                  the failed or skipped jobs
+        errors  : dict of {name: error message} for these jobs
+    """
+    names = [job['name'] for job in jobs]
+    if len(set(names)) != len(names):
+        raise Exception("### The names of the ellipse jobs are not unique!")
+    for job in jobs:
+        for dep in job['after']:
+            if dep not in names:
+                raise Exception("### Unknown ellipse job: %s" % dep)
+
+    if multiprocessing.current_process().daemon:
+        nProc = 1
+    results, errors, runtime = {}, {}, {}
+    pending = list(jobs)
+    if (service is None) and (nProc > 1):
+        ownService = eService.EllipseService(nWorker=nProc, timeout=timeout,
+                                             workDir=workDir).start()
+        service = ownService
+    else:
+        ownService = None
+
+    def _finish(output):
+        name, result, error, tJob = output[:4]
+        results[name], runtime[name] = result, tJob
+        if error is not None:
+            errors[name] = error
+
+    try:
+        nRunning = 0
+        while pending or nRunning:
+            ready = [job for job in pending
+                     if all(dep in results for dep in job['after'])]
+            if (not ready) and (nRunning == 0):
+                raise Exception("### Circular dependency between the " +
+                                "ellipse jobs: %s" %
+                                ', '.join(job['name'] for job in pending))
+            for job in ready:
+                pending.remove(job)
+                failed = [dep for dep in job['after']
+                          if results[dep][0] is None]
+                if failed:
+                    results[job['name']] = (None, None)
+                    errors[job['name']] = ('### Skipped, %s failed' %
+                                           ', '.join(failed))
+                    continue
+                try:
+                    task = _prepareJob(job, results, workDir)
+                except Exception as err:
+                    results[job['name']] = (None, None)
+                    errors[job['name']] = str(err)
+                    continue
+                if verbose:
+                    print("###    Start the ellipse job: %s" % job['name'])
+                if service is not None:
+                    service.submit(task[0], task[1], **task[2])
+                    nRunning += 1
+                else:
+                    _finish(singleEllipseRun(task))
+            if nRunning > 0:
+                _finish(service.collect())
+                nRunning -= 1
+    finally:
+        if ownService is not None:
+            ownService.close()
+
+    if verbose:
+        print(SEP)
+        for name in names:
+            status = 'FAIL' if name in errors else 'DONE'
+            print("###    %-12s  %s  %8.1f sec" % (name, status,
+                                                  runtime.get(name, 0.0)))
+        print(SEP)
+
+    return results, errors
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Forced photometry of all the bands of one galaxy in a single pass."""
+
+from __future__ import (division, print_function)
+
+import os
+import warnings
+import collections
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.table import Table
+
+import hscRerun as hRerun
+import galSBP
+import galAnnulus as gAnn
+import galIsophote as gIso
+import profileStore as pStore
+import coaddCutoutSbp as cSbp
+
+SEP = '-' * 100
+
+"""
+The forced photometry mode of batchForceSbp runs coaddCutoutSbp() once for
+every band: each run reads the reference ellipse output and the mask
+again, and measures one image.
+
+Here the reference geometry and the mask are read only once, the images of
+all the bands are stacked into a (band, y, x) cube, and the profiles of all
+the bands are measured on the same annuli by
+galAnnulus.annulusProfileBands().  The same mask is used for all the bands
+(the union of the masks of the bands, or an external mask), so the colors
+are measured on exactly the same pixels.
+
+The profile of each band is saved as a .pkl file with the usual name in
+<root>/<galID>/<filter>/<rerun>/, so coaddCutoutSbpSummary can read it as
+any other profile, and all the profiles are also saved in one FITS file
+with one extension per band (EXTNAME is the filter).  With a profile store,
+the profiles are appended to the store instead.
+"""
+
+
+def bandModel(suffix, stage=4):
+    """Name of the model, same as the suffix used by galSBP()."""
+    if suffix == '':
+        return str(stage)
+    elif suffix[-1] != '_':
+        return suffix + '_' + str(stage)
+    else:
+        return suffix + str(stage)
+
+
+def readBandImage(prefix, root, imgSub=False):
+    """
+    Read the image of one band.
+
+    Return:
+        imgFile, imgArr
+    """
+    if imgSub:
+        imgFile = os.path.join(root, prefix + '_imgsub.fits')
+        if not hRerun.pathExists(imgFile):
+            warnings.warn("# Can not find the background subtracted image!")
+            imgFile = os.path.join(root, prefix + '_img.fits')
+    else:
+        imgFile = os.path.join(root, prefix + '_img.fits')
+    imgOri = hRerun.resolvePath(imgFile)
+    if not os.path.isfile(imgOri):
+        raise Exception("### Cannot find the input image : %s !" % imgOri)
+
+    return imgFile, fits.open(imgOri)[0].data
+
+
+def readBandMask(mskFile):
+    """Read a mask; return None when it can not be found."""
+    if mskFile is None:
+        return None
+    mskOri = hRerun.resolvePath(mskFile)
+    if not os.path.isfile(mskOri):
+        return None
+
+    return fits.open(mskOri)[0].data
+
+
+def saveForceBands(ellipOuts, outFile, header=None):
+    """
+    Save the profiles of all the bands into one FITS file.
+
+    Parameters:
+        ellipOuts : dict of {filter: profile}
+        header    : dict of keywords for the primary header
+    """
+    priHdu = fits.PrimaryHDU()
+    if header is not None:
+        for key in header:
+            priHdu.header[key] = header[key]
+    priHdu.header['BANDS'] = ','.join(ellipOuts.keys())
+    hduList = [priHdu]
+    for band in ellipOuts:
+        hdu = fits.table_to_hdu(Table(ellipOuts[band]))
+        hdu.name = band
+        hduList.append(hdu)
+    """ Write to a temporary name first, then rename it """
+    outTemp = outFile + '.%d.part' % os.getpid()
+    fits.HDUList(hduList).writeto(outTemp, overwrite=True)
+    os.rename(outTemp, outFile)
+
+    return outFile
+
+
+def readForceBands(outFile):
+    """
+    Read the profiles written by saveForceBands().
+
+    Return:
+        OrderedDict of {filter: Table}
+    """
+    ellipOuts = collections.OrderedDict()
+    with fits.open(outFile) as hduList:
+        for hdu in hduList[1:]:
+            ellipOuts[hdu.name] = Table(hdu.data)
+
+    return ellipOuts
+
+
+def coaddForceBands(galID, prefix, filters, inEllip, root='.',
+                    rerun='default', exMask=None, imgSub=False,
+                    zp=27.0, pix=0.168, exptime=1.0, bkgCor=False,
+                    skyTable=None, intMode='mean', lowClip=3.0,
+                    uppClip=3.0, nClip=2, step=0.12, harmonics='1 2',
+                    outRatio=1.2, updateIntens=True, psfSma=6.0,
+                    useTflux=False, suffix='', store=None, verbose=False):
+    """
+    Forced photometry of many bands with the same isophotes and mask.
+
+    Parameters:
+        galID    : ID of the galaxy; the data are in <root>/<galID>/<filter>
+        prefix   : prefix of the dataset
+        filters  : list of filters
+        inEllip  : reference ellipse output (_iso.fits or .bin)
+        exMask   : external mask for all the bands; the union of the
+                   _mskfin.fits masks of the bands is used by default
+        store    : directory of a profile store; the profile of each band
+                   is appended to the store instead of the .pkl and FITS
+                   files
+
+    Return:
+        ellipOuts : OrderedDict of {filter: profile}
+        outFile   : the FITS file, or the profile store
+    """
+    galID = str(galID).strip()
+    imgType = '_imgsub' if imgSub else '_img'
+    model = bandModel(suffix, stage=4)
+
+    """ Reference geometry, only read once """
+    isoRef = gIso.readIsoTable(inEllip)
+    if verbose:
+        print(SEP)
+        print("###    Reference Ellipse : %s" % inEllip)
+        print("###    Number of isophotes : %d" % len(isoRef))
+
+    """ Images of all the bands """
+    bands, images, bkgs, mskFiles, outPres = [], [], [], [], []
+    for band in filters:
+        band = band.strip().upper()
+        bandPrefix = prefix + '_' + galID + '_' + band + '_full'
+        bandRoot = os.path.join(root, galID, band)
+        if not os.path.isdir(bandRoot):
+            warnings.warn("### Can not find the folder: %s" % bandRoot)
+            continue
+        rerunDir = hRerun.rerunSetup(bandRoot, rerun)
+        try:
+            imgFile, imgArr = readBandImage(bandPrefix, rerunDir,
+                                            imgSub=imgSub)
+        except Exception as err:
+            warnings.warn(str(err))
+            continue
+        if images and (imgArr.shape != images[0].shape):
+            warnings.warn("### %s has a different shape, skip it" % imgFile)
+            continue
+        bkg = 0.0
+        if bkgCor:
+            try:
+                bkg = cSbp.readInputSky(bandPrefix, root=rerunDir,
+                                        skyTable=skyTable, rerun=rerun)[0]
+            except Exception:
+                bkg = 0.0
+        bands.append(band)
+        images.append(np.asarray(imgArr, dtype=float))
+        bkgs.append(bkg)
+        mskFiles.append(os.path.join(rerunDir, bandPrefix + '_mskfin.fits'))
+        outPres.append(os.path.join(rerunDir, bandPrefix + imgType +
+                                    '_ellip_' + model))
+        if verbose:
+            print("###    %s : %s  (bkg=%10.6f)" % (band, imgFile, bkg))
+    if not bands:
+        raise Exception("### Can not find any image for %s !" % galID)
+    cube = np.stack(images)
+    del images
+
+    """ The same mask for all the bands, only read once """
+    if exMask is not None:
+        mskArr = readBandMask(exMask)
+        if mskArr is None:
+            raise Exception("### Can not find the input mask : %s !" %
+                            exMask)
+    else:
+        mskArr = None
+        for mskFile in mskFiles:
+            mskBand = readBandMask(mskFile)
+            if mskBand is None:
+                warnings.warn("### Can not find the mask : %s" % mskFile)
+            elif mskBand.shape != cube.shape[1:]:
+                warnings.warn("### %s has a different shape" % mskFile)
+            elif mskArr is None:
+                mskArr = (mskBand > 0)
+            else:
+                mskArr |= (mskBand > 0)
+    if mskArr is not None:
+        mskArr = mskArr.astype(np.int16)
+
+    """ Measure all the bands on the same annuli """
+    sma = np.asarray(isoRef['sma'], dtype=float)
+    ellipCfg = galSBP.defaultEllipse(float(isoRef['x0'][-1]),
+                                     float(isoRef['y0'][-1]),
+                                     float(np.nanmax(sma)),
+                                     step=step, mag0=zp, integrmode=intMode,
+                                     usclip=uppClip, lsclip=lowClip,
+                                     nclip=nClip, harmonics=harmonics)
+    isoList = gAnn.annulusProfileBands(cube, ellipCfg, isoRef,
+                                       mskList=mskArr)
+
+    """ Derived columns of all the bands together """
+    ellipList = galSBP.readEllipseOutBatch(isoList, zp=zp, pix=pix,
+                                           exptime=exptime,
+                                           bkg=np.asarray(bkgs),
+                                           harmonics=harmonics,
+                                           minSma=psfSma, useTflux=useTflux)
+    ellipOuts = collections.OrderedDict()
+    for band, ellipOut in zip(bands, ellipList):
+        ellipOuts[band] = galSBP.ellipseUpdateProfile(
+            ellipOut, zp=zp, pix=pix, exptime=exptime, outRatio=outRatio,
+            updateIntens=updateIntens, useTflux=useTflux, verbose=verbose)
+
+    """ Save all the profiles together """
+    if store is not None:
+        for band, outPre in zip(bands, outPres):
+            pStore.appendProfile(store, outPre, ellipOuts[band])
+        outFile = store
+    else:
+        for band, outPre in zip(bands, outPres):
+            galSBP.saveEllipOut(ellipOuts[band], outPre, verbose=verbose)
+        outFile = os.path.join(root, galID, prefix + '_' + galID +
+                               '_multiband_full' + imgType + '_ellip_' +
+                               model + '.fits')
+        header = {'GALID': galID, 'INELLIP': os.path.basename(inEllip),
+                  'MASK': 'UNION' if exMask is None else
+                  os.path.basename(exMask)}
+        for ii, band in enumerate(bands):
+            header['BKG%d' % ii] = bkgs[ii]
+        saveForceBands(ellipOuts, outFile, header=header)
+    if verbose:
+        print("###    %d bands saved to %s" % (len(bands), outFile))
+        print(SEP)
+
+    return ellipOuts, outFile
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Choose the fitting region and convolution box of GALFIT."""
+
+from __future__ import (division, print_function)
+
+import numpy as np
+
+SEP = '-' * 100
+
+"""
+coaddCutoutGalfitSimple() used to fit the whole cutout, with a
+convolution box of 32 * R50 (at least 600 pixels).  On a 1000-2500 pixel
+cutout most of the time goes into the FFT of empty sky.
+
+The planner keeps the smallest region that still contains:
+    * the ellipse of nR90 * R90 around the galaxy (the axis ratio is not
+      allowed to go below minQ, to leave some margin);
+    * half of the PSF on each side, so the model at the edge sees the
+      light that is convolved into the region;
+    * at least minSky unmasked pixels outside the ellipse for the sky; the
+      region grows by 10% steps until there are enough of them.
+The sizes are rounded up to FFT friendly numbers (only factors of 2, 3, 5
+and 7, which are fast for FFTW), and the convolution box covers
+convR90 * R90 plus the PSF.
+
+The expected speedup is reported as the ratio of the number of pixels, and
+as the ratio of the N log N costs of the old and new convolution boxes.
+"""
+FFT_PRIMES = (2, 3, 5, 7)
+
+
+def fftSize(size):
+    """The smallest number >= size with only factors of 2, 3, 5 and 7."""
+    size = max(int(np.ceil(size)), 1)
+    while True:
+        rest = size
+        for prime in FFT_PRIMES:
+            while rest % prime == 0:
+                rest //= prime
+        if rest == 1:
+            return size
+        size += 1
+
+
+def fftCost(size):
+    """Relative cost of the 2-D FFT of a size x size box."""
+    npix = float(size) ** 2
+    return npix * np.log2(max(npix, 2.0))
+
+
+def ellipseExtent(rad, q, pa):
+    """
+    Half width and half height of an ellipse.
+
+    The PA follows GALFIT: the major axis goes from +Y towards -X.
+    """
+    theta = np.deg2rad(pa)
+    major, minor = rad, rad * q
+    halfX = np.sqrt((major * np.sin(theta)) ** 2 +
+                    (minor * np.cos(theta)) ** 2)
+    halfY = np.sqrt((major * np.cos(theta)) ** 2 +
+                    (minor * np.sin(theta)) ** 2)
+    return halfX, halfY
+
+
+def _boxAround(center, half, size):
+    """1-indexed [lower, upper] of a box with a FFT friendly size."""
+    width = min(fftSize(2.0 * half + 1.0), size)
+    lower = int(np.round(center - (width - 1) / 2.0))
+    lower = min(max(lower, 1), size - width + 1)
+    return lower, lower + width - 1
+
+
+def _skyPixels(mskArr, box, xc, yc, rad, q, pa):
+    """Number of unmasked pixels in the box and outside the ellipse."""
+    x0, x1, y0, y1 = box
+    yy, xx = np.mgrid[y0:(y1 + 1), x0:(x1 + 1)]
+    theta = np.deg2rad(pa)
+    dx, dy = xx - xc, yy - yc
+    major = -dx * np.sin(theta) + dy * np.cos(theta)
+    minor = dx * np.cos(theta) + dy * np.sin(theta)
+    outside = (major ** 2 + (minor / q) ** 2) > rad ** 2
+    if mskArr is not None:
+        outside &= (mskArr[(y0 - 1):y1, (x0 - 1):x1] == 0)
+    return int(np.sum(outside))
+
+
+def oldConvbox(r50, dimX):
+    """The convolution box used by coaddCutoutGalfitSimple() before."""
+    convbox = int(r50 * 32.0)
+    convbox = convbox if convbox >= 600 else 600
+    convbox = convbox if convbox <= int(dimX * 0.9) else int(dimX * 0.9)
+    return convbox
+
+
+def planFitRegion(shape, xc, yc, r90, q=1.0, pa=0.0, psfShape=None,
+                  mskArr=None, nR90=2.5, convR90=1.5, minQ=0.5,
+                  minSky=5000, oldConv=None, verbose=False):
+    """
+    Plan the fitting region (H) and convolution box (I) of GALFIT.
+
+    Parameters:
+        shape    : (ny, nx) of the cutout
+        xc, yc   : 1-indexed center of the galaxy
+        r90      : R90 of the galaxy, in pixel
+        psfShape : (ny, nx) of the PSF image
+        mskArr   : mask of the cutout; non-zero pixels are masked
+        nR90     : the region covers the ellipse of nR90 * R90
+        convR90  : the convolution box covers convR90 * R90
+        minSky   : minimum number of unmasked sky pixels in the region
+        oldConv  : the old convolution box, for the speedup
+
+    Return:
+        dict with x0, x1, y0, y1 (1-indexed, inclusive), convbox, and the
+        pixel and FFT ratios
+    """
+    ny, nx = shape
+    q = max(min(q, 1.0), minQ)
+    psfHalf = 0.0 if psfShape is None else max(psfShape) / 2.0
+    rad = nR90 * r90
+
+    halfX, halfY = ellipseExtent(rad, q, pa)
+    grow = 1.0
+    while True:
+        x0, x1 = _boxAround(xc, halfX * grow + psfHalf, nx)
+        y0, y1 = _boxAround(yc, halfY * grow + psfHalf, ny)
+        box = (x0, x1, y0, y1)
+        full = ((x1 - x0 + 1) >= nx) and ((y1 - y0 + 1) >= ny)
+        if full or (_skyPixels(mskArr, box, xc, yc, rad, q, pa) >= minSky):
+            break
+        grow *= 1.1
+
+    width, height = (x1 - x0 + 1), (y1 - y0 + 1)
+    convbox = fftSize(2.0 * convR90 * r90 + 2.0 * psfHalf)
+    convbox = min(convbox, max(width, height))
+    if oldConv is None:
+        oldConv = max(nx, ny)
+    plan = {'x0': x0, 'x1': x1, 'y0': y0, 'y1': y1, 'convbox': convbox,
+            'pixRatio': (nx * ny) / float(width * height),
+            'fftRatio': fftCost(oldConv) / fftCost(convbox),
+            'grow': grow}
+    if verbose:
+        print(SEP)
+        print("###    Fitting region : [%d:%d, %d:%d]  (%d x %d of %d x %d)"
+              % (x0, x1, y0, y1, width, height, nx, ny))
+        print("###    Convolution box : %d  (was %d)" % (convbox, oldConv))
+        print("###    Expected speedup : %6.1fx pixels, %6.1fx FFT" %
+              (plan['pixRatio'], plan['fftRatio']))
+        print(SEP)
+
+    return plan
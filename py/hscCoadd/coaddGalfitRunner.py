@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Run GALFIT concurrently with time and resource limits."""
+
+from __future__ import (division, print_function)
+
+import os
+import time
+import signal
+import subprocess
+import collections
+from distutils import spawn
+
+try:
+    import resource
+    resourceOk = True
+except ImportError:
+    resourceOk = False
+
+SEP = '-' * 100
+
+"""
+coaddRunGalfit() used to start GALFIT through the shell and wait on
+proc.stdout.readlines(): the whole output was kept in memory, and a fit
+that never converges could block the PBS slot for hours.
+
+Here every fit is a separate process without a shell:
+    * stdout and stderr are streamed to the log file of the fit;
+    * RLIMIT_CPU (seconds) and RLIMIT_AS (MB) are set in the child, so a
+      runaway fit is stopped by the kernel;
+    * a fit that runs longer than the wall-clock timeout is killed with
+      its process group, and scheduled again at the end of the queue
+      with fewer iterations (imax * retryImax), up to maxRetry times;
+    * up to nJobs fits run at the same time.
+
+GALFIT writes its galfit.NN and fit.log files in the working directory of
+the fit.  Fits that run at the same time in the same directory would pick
+the same galfit.NN and mix their fit.log, so each job can have its own
+working directory (root); it is created when needed.  The file names in
+the read-in file are relative to it, so use absolute paths in this case.
+The log of a retry is appended to the log of the first attempt.
+"""
+DONE = 'DONE'
+FAIL = 'FAIL'
+TIMEOUT = 'TIMEOUT'
+RUNTIME_LINE = '# GALFIT %s in %.2f sec, attempt %d, imax %s\n'
+
+
+def findGalfit(galfit=None):
+    """Path to the GALFIT executable."""
+    if galfit is None:
+        galfit = spawn.find_executable('galfit')
+        if galfit is None:
+            raise Exception("XXX Can not find the GALFIT executable")
+    return galfit
+
+
+def galfitJob(name, readFile, root=None, imax=150, expect=None,
+              logFile=None, options=None):
+    """
+    Describe one GALFIT run.
+
+    Parameters:
+        name     : unique name of the job
+        readFile : GALFIT read-in file
+        root     : working directory of GALFIT; the current directory
+                   if None
+        expect   : expected output model; replace .in with .fits by default
+        logFile  : where the output of GALFIT goes; stdout if None
+        options  : list of extra command line options, e.g. ['-o3']
+    """
+    if expect is None:
+        expect = readFile.replace('.in', '.fits')
+    return {'name': name, 'readFile': readFile, 'root': root,
+            'imax': int(imax) if imax is not None else None,
+            'expect': expect, 'logFile': logFile,
+            'options': list(options) if options is not None else [],
+            'attempt': 0}
+
+
+def galfitCommand(galfit, job):
+    """Command line of a GALFIT job, without a shell."""
+    command = [galfit] + job['options']
+    if job['imax'] is not None:
+        command += ['-imax', str(job['imax'])]
+    return command + [job['readFile']]
+
+
+def _limitResources(maxCpu=None, maxMem=None):
+    """Return the function that sets the limits in the child process."""
+    def _setLimits():
+        """ New process group, so GALFIT can be killed with its children """
+        os.setsid()
+        if not resourceOk:
+            return
+        if maxCpu is not None:
+            """ SIGXCPU at maxCpu, SIGKILL a few seconds later """
+            resource.setrlimit(resource.RLIMIT_CPU,
+                               (int(maxCpu), int(maxCpu) + 5))
+        if maxMem is not None:
+            memLimit = int(maxMem * 1024 * 1024)
+            resource.setrlimit(resource.RLIMIT_AS, (memLimit, memLimit))
+    return _setLimits
+
+
+def _killGroup(proc, grace=5.0):
+    """Terminate a process and its group; kill it if it does not stop."""
+    for sig, wait in ((signal.SIGTERM, grace), (signal.SIGKILL, None)):
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError:
+            return proc.poll()
+        t0 = time.time()
+        while proc.poll() is None:
+            if (wait is not None) and (time.time() - t0) > wait:
+                break
+            time.sleep(0.05)
+        if proc.returncode is not None:
+            return proc.returncode
+    return proc.wait()
+
+
+class GalfitRunner(object):
+    """
+    Run a group of GALFIT jobs.
+
+    Usage:
+        runner = GalfitRunner(nJobs=4, timeout=1800, maxMem=4000)
+        jobs = [galfitJob('1ser', '..._1ser.in', logFile='..._1ser.in.log'),
+                galfitJob('2ser', '..._2ser.in', logFile='..._2ser.in.log')]
+        results = runner.run(jobs)
+        runner.report()
+    """
+
+    def __init__(self, nJobs=1, timeout=None, maxCpu=None, maxMem=None,
+                 maxRetry=1, retryImax=0.5, galfit=None, pollTime=0.2,
+                 verbose=False):
+        """
+        Parameters:
+            nJobs     : number of fits running at the same time
+            timeout   : wall-clock limit of one fit, in seconds
+            maxCpu    : CPU time limit of one fit, in seconds
+            maxMem    : address space limit of one fit, in MB
+            maxRetry  : how many times a fit is scheduled again after a
+                        timeout
+            retryImax : the retry uses imax * retryImax iterations
+            galfit    : path to the GALFIT executable
+        """
+        self.nJobs = max(int(nJobs), 1)
+        self.timeout = timeout
+        self.maxCpu = maxCpu
+        self.maxMem = maxMem
+        self.maxRetry = int(maxRetry)
+        self.retryImax = retryImax
+        self.galfit = findGalfit(galfit)
+        self.pollTime = pollTime
+        self.verbose = verbose
+        self.results = collections.OrderedDict()
+
+    def _start(self, job):
+        """Start one GALFIT process."""
+        job['attempt'] += 1
+        if os.path.isfile(job['expect']):
+            os.remove(job['expect'])
+        if (job['root'] is not None) and (not os.path.isdir(job['root'])):
+            os.makedirs(job['root'])
+        if job['logFile'] is not None:
+            """ Keep the output of the earlier attempts """
+            logOut = open(job['logFile'], 'w' if job['attempt'] == 1
+                          else 'a')
+        else:
+            logOut = None
+        try:
+            proc = subprocess.Popen(galfitCommand(self.galfit, job),
+                                    cwd=job['root'], stdout=logOut,
+                                    stderr=subprocess.STDOUT,
+                                    preexec_fn=_limitResources(self.maxCpu,
+                                                               self.maxMem))
+        finally:
+            """ The child keeps its own copy of the file """
+            if logOut is not None:
+                logOut.close()
+        if self.verbose:
+            print("###    Start GALFIT job %s (attempt %d, imax=%s)" %
+                  (job['name'], job['attempt'], job['imax']))
+        return proc, time.time()
+
+    def _finish(self, job, status, returnCode, tStart):
+        """Keep the result of a job."""
+        runtime = time.time() - tStart
+        if (job['attempt'] > 1) and (job['name'] in self.results):
+            runtime += self.results[job['name']]['runtime']
+        self.results[job['name']] = {'status': status,
+                                     'returncode': returnCode,
+                                     'runtime': runtime,
+                                     'attempts': job['attempt'],
+                                     'imax': job['imax'],
+                                     'expect': job['expect'],
+                                     'log': job['logFile']}
+        """ Leave the timing in the log, for galfitHarvest """
+        if job['logFile'] is not None:
+            with open(job['logFile'], 'a') as logOut:
+                logOut.write('\n' + RUNTIME_LINE %
+                             (status, runtime, job['attempt'], job['imax']))
+        if self.verbose:
+            print("###    GALFIT job %s : %s (%.1f sec)" %
+                  (job['name'], status, runtime))
+
+    def run(self, jobs):
+        """
+        Run the jobs, at most nJobs at the same time.
+
+        Return:
+            OrderedDict of {name: result}; the status of the result is
+            DONE when the expected model is there, TIMEOUT when the last
+            attempt was killed, and FAIL otherwise
+        """
+        names = [job['name'] for job in jobs]
+        if len(set(names)) != len(names):
+            raise Exception("### The names of the GALFIT jobs are not " +
+                            "unique!")
+        pending = collections.deque(jobs)
+        running = []
+        try:
+            while pending or running:
+                while pending and (len(running) < self.nJobs):
+                    job = pending.popleft()
+                    proc, tStart = self._start(job)
+                    running.append((job, proc, tStart))
+                time.sleep(self.pollTime)
+                for item in list(running):
+                    job, proc, tStart = item
+                    returnCode = proc.poll()
+                    overTime = ((self.timeout is not None) and
+                                (time.time() - tStart) > self.timeout)
+                    if (returnCode is None) and (not overTime):
+                        continue
+                    running.remove(item)
+                    if returnCode is None:
+                        returnCode = _killGroup(proc)
+                        self._finish(job, TIMEOUT, returnCode, tStart)
+                        if job['attempt'] <= self.maxRetry:
+                            """ Reschedule with fewer iterations """
+                            if job['imax'] is not None:
+                                job['imax'] = max(int(job['imax'] *
+                                                      self.retryImax), 1)
+                            pending.append(job)
+                    elif os.path.isfile(job['expect']):
+                        self._finish(job, DONE, returnCode, tStart)
+                    else:
+                        self._finish(job, FAIL, returnCode, tStart)
+        finally:
+            """ Do not leave any GALFIT behind """
+            for job, proc, tStart in running:
+                _killGroup(proc, grace=1.0)
+
+        return collections.OrderedDict((name, self.results[name])
+                                       for name in names)
+
+    def runOne(self, readFile, **kwargs):
+        """Run a single GALFIT job; return its result."""
+        job = galfitJob(os.path.basename(readFile), readFile, **kwargs)
+        return self.run([job])[job['name']]
+
+    def report(self):
+        """Summary of the finished jobs."""
+        summary = {DONE: 0, FAIL: 0, TIMEOUT: 0}
+        for result in self.results.values():
+            summary[result['status']] += 1
+        summary['nRetry'] = sum(result['attempts'] - 1
+                                for result in self.results.values())
+        summary['runtime'] = sum(result['runtime']
+                                 for result in self.results.values())
+        if self.verbose:
+            print(SEP)
+            for name, result in self.results.items():
+                print("###    %-30s  %-7s  %2d  %8.1f sec" %
+                      (name, result['status'], result['attempts'],
+                       result['runtime']))
+            print("###    DONE: %d  FAIL: %d  TIMEOUT: %d  RETRY: %d" %
+                  (summary[DONE], summary[FAIL], summary[TIMEOUT],
+                   summary['nRetry']))
+            print(SEP)
+        return summary
@@ -26,6 +26,7 @@ from astropy.io import fits
 # Personal
 import coaddColourImage as cdColor
 import hscUtils as hUtil
+import coaddSkyConfig as cSkyCfg
 
 # Matplotlib
 import matplotlib as mpl
@@ -300,32 +301,14 @@ def getCoaddBadMsk(calExp, no_bright_object=False):
     mskImg = calExp.getMaskedImage().getMask()
 
     badMsk = copy.deepcopy(mskImg)
-    # Clear the "DETECTED" plane
-    badMsk.removeAndClearMaskPlane('DETECTED', True)
-
-    try:
-        # Clear the "DETECTED_NEGATIVE" plane
-        badMsk.removeAndClearMaskPlane('DETECTED_NEGATIVE', True)
-    except Exception:
-        pass
-
-    # try:
-    #     # Clear the "CLIPPED" plane
-    #     badMsk.removeAndClearMaskPlane('CLIPPED', True)
-    # except Exception:
-    #     pass
-
-    try:
-        # Clear the "CROSSTALK" plane
-        badMsk.removeAndClearMaskPlane('CROSSTALK', True)
-    except Exception:
-        pass
-
-    try:
-        # Clear the "NOT_DEBLENDED" plane
-        badMsk.removeAndClearMaskPlane('NOT_DEBLENDED', True)
-    except Exception:
-        pass
+    # Clear the planes that are not bad pixels: DETECTED,
+    # DETECTED_NEGATIVE, CROSSTALK, NOT_DEBLENDED; the list is shared with
+    # the patch sky maps
+    for plane in cSkyCfg.BAD_SKIP_PLANES:
+        try:
+            badMsk.removeAndClearMaskPlane(plane, True)
+        except Exception:
+            pass
 
     if no_bright_object:
         try:
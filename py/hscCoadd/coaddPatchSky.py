@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Patch-level global sky model shared by the HSC cutouts."""
+
+from __future__ import (division, print_function)
+
+import os
+import fcntl
+import argparse
+import warnings
+
+import numpy as np
+
+# Astropy
+from astropy.io import fits
+from astropy import wcs
+
+# SEP
+import sep
+
+# Personal
+import hscUtils as hUtil
+import hscStats as hStats
+import coaddSkyConfig as cSkyCfg
+
+"""
+Galaxies in the same (tract, patch, filter) share nearly the same sky, so
+the masked and heavily binned sky statistics are measured once on the whole
+patch and saved as a small map:
+
+    patchSky_<filter>_<tract>_<patch>_rebin<N>.fits
+
+Every pixel of the map is a box of (boxSize x boxSize) binned pixels, and
+the extensions SKYMED, SKYAVG, SKYSTD and NPIX keep the sigma-clipped
+statistics of each box.  The statistics are measured on the image binned
+by the same factor as getGlobalSky(), after removing the same SEP
+background model, so they can be used in place of the per-cutout values.
+The background settings and the mask planes come from coaddSkyConfig,
+same as the cutouts, and are recorded in the header of the map.
+"""
+
+PATCH_LAYERS = ['SKYMED', 'SKYAVG', 'SKYSTD', 'NPIX']
+
+# Patch sky maps that have been read in this process: {skyFile: patchSky}
+_patchSkyCache = {}
+
+
+def patchSkyName(tract, patch, filt, skyDir='.', rebin=6):
+    """Name of the sky map of one patch."""
+    skyName = 'patchSky_%s_%s_%s_rebin%d.fits' % (filt.strip().upper(),
+                                                   str(tract).strip(),
+                                                   str(patch).strip(),
+                                                   rebin)
+    return os.path.join(skyDir, skyName)
+
+
+def patchMaskBits(mskHead, planes=None, noBrightObject=False):
+    """
+    Bit mask of the mask planes, using the MP_* keywords.
+
+    By default, the planes that are masked in the final mask of the
+    cutouts (see coaddSkyConfig.skyMaskPlanes).
+    """
+    if planes is None:
+        allPlanes = [key[3:] for key in mskHead.keys()
+                     if key.startswith('MP_')]
+        planes = cSkyCfg.skyMaskPlanes(allPlanes,
+                                       noBrightObject=noBrightObject)
+    bitMask = 0
+    for plane in planes:
+        key = 'MP_' + plane
+        if key in mskHead:
+            bitMask |= (1 << int(mskHead[key]))
+    return bitMask
+
+
+def readPatch(patchFile, planes=None, noBrightObject=False):
+    """
+    Read the image and mask of a coadd patch.
+
+    The patch is the FITS file of a deepCoadd (or deepCoadd_calexp)
+    exposure: image, mask and variance in the 1st, 2nd and 3rd HDUs.
+
+    Return:
+        imgArr, mskArr, imgHead
+    """
+    if not os.path.isfile(patchFile):
+        raise Exception("### Can not find the patch image: %s" % patchFile)
+    patchHdu = fits.open(patchFile)
+    imgArr = patchHdu[1].data.astype(float)
+    imgHead = patchHdu[1].header
+    bitMask = patchMaskBits(patchHdu[2].header, planes=planes,
+                            noBrightObject=noBrightObject)
+    mskArr = ((patchHdu[2].data & bitMask) > 0).astype('uint8')
+    patchHdu.close()
+
+    return imgArr, mskArr, imgHead
+
+
+def patchSkyMap(imgArr, mskArr, rebin=6, boxSize=16, skyClip=3.0,
+                minFrac=0.5, bkgSize=cSkyCfg.BKG_SIZE,
+                bkgFilter=cSkyCfg.BKG_FILTER):
+    """
+    Sigma-clipped sky statistics in boxes of a binned patch image.
+
+    Parameters:
+        rebin    : binning factor, same as the one used by getGlobalSky()
+        boxSize  : size of each box in unit of binned pixels
+        bkgSize  : mesh size of the SEP background removed before the
+                   statistics; None to keep the original image
+
+    Return:
+        skyMap   : structured array of (nBoxY, nBoxX) with the fields of
+                   hscStats.CLIP_DTYPE
+    """
+    imgUse = np.array(imgArr, dtype=float)
+    if bkgSize is not None:
+        sepBkg = sep.Background(imgUse, mask=(mskArr > 0), bw=bkgSize,
+                                bh=bkgSize, fw=bkgFilter, fh=bkgFilter)
+        imgUse = imgUse - sepBkg.back()
+
+    imgBin, mskBin = hUtil.rebinImage(imgUse, rebin, mask=mskArr,
+                                      func='mean', minFrac=minFrac)
+    dimY, dimX = imgBin.shape
+    nBoxY, nBoxX = -(-dimY // boxSize), -(-dimX // boxSize)
+    yy, xx = np.indices(imgBin.shape)
+    labels = (yy // boxSize) * nBoxX + (xx // boxSize)
+    labels[(mskBin > 0) | ~np.isfinite(imgBin)] = -1
+
+    skyMap = hStats.sigmaClipBatch(imgBin, labels, nLabel=(nBoxY * nBoxX),
+                                   low=skyClip, upp=skyClip)
+
+    return skyMap.reshape(nBoxY, nBoxX)
+
+
+def savePatchSky(skyMap, imgHead, skyFile, tract=None, patch=None,
+                 filt=None, rebin=6, boxSize=16, bkgSize=cSkyCfg.BKG_SIZE,
+                 bkgFilter=cSkyCfg.BKG_FILTER):
+    """Save the sky map together with the WCS of the patch."""
+    skyHead = wcs.WCS(imgHead).to_header()
+    skyHead.set('TRACT', str(tract), 'Tract of the patch')
+    skyHead.set('PATCH', str(patch), 'Patch ID')
+    skyHead.set('FILTER', str(filt), 'Filter')
+    skyHead.set('REBIN', rebin, 'Binning factor of the image')
+    skyHead.set('BOXSIZE', boxSize, 'Size of the sky box in binned pixels')
+    skyHead.set('BKGSIZE', -1 if bkgSize is None else bkgSize,
+                'Mesh size of the SEP background; -1 for none')
+    skyHead.set('BKGFILT', bkgFilter, 'Filter size of the SEP background')
+    skyHead.set('PATCHNX', imgHead['NAXIS1'], 'Width of the patch')
+    skyHead.set('PATCHNY', imgHead['NAXIS2'], 'Height of the patch')
+
+    hduList = [fits.PrimaryHDU(header=skyHead)]
+    for layer, field in zip(PATCH_LAYERS, ['median', 'mean', 'std', 'nUse']):
+        hduList.append(fits.ImageHDU(np.asarray(skyMap[field]),
+                                     name=layer))
+    skyTemp = skyFile + '.%d' % os.getpid()
+    fits.HDUList(hduList).writeto(skyTemp, overwrite=True)
+    os.rename(skyTemp, skyFile)
+
+    return skyFile
+
+
+def coaddPatchSky(patchFile, tract, patch, filt, skyDir='.', rebin=6,
+                  boxSize=16, skyClip=3.0, minFrac=0.5,
+                  bkgSize=cSkyCfg.BKG_SIZE, bkgFilter=cSkyCfg.BKG_FILTER,
+                  noBrightObject=False, overwrite=False, verbose=True):
+    """
+    Build the sky map of one patch, only if it does not exist yet.
+
+    A lock file makes sure that concurrent workers do not measure the
+    same patch twice.
+
+    Return:
+        skyFile : name of the patch sky map
+    """
+    skyFile = patchSkyName(tract, patch, filt, skyDir=skyDir, rebin=rebin)
+    if os.path.isfile(skyFile) and (not overwrite):
+        return skyFile
+
+    with open(skyFile + '.lock', 'a') as skyLock:
+        fcntl.flock(skyLock, fcntl.LOCK_EX)
+        try:
+            # Another worker may have finished it while we wait
+            if os.path.isfile(skyFile) and (not overwrite):
+                return skyFile
+            if verbose:
+                print("###    Patch sky for %s - %s - %s" % (tract, patch,
+                                                            filt))
+            imgArr, mskArr, imgHead = readPatch(
+                patchFile, noBrightObject=noBrightObject)
+            skyMap = patchSkyMap(imgArr, mskArr, rebin=rebin,
+                                 boxSize=boxSize, skyClip=skyClip,
+                                 minFrac=minFrac, bkgSize=bkgSize,
+                                 bkgFilter=bkgFilter)
+            savePatchSky(skyMap, imgHead, skyFile, tract=tract, patch=patch,
+                         filt=filt, rebin=rebin, boxSize=boxSize,
+                         bkgSize=bkgSize, bkgFilter=bkgFilter)
+        finally:
+            fcntl.flock(skyLock, fcntl.LOCK_UN)
+    _patchSkyCache.pop(skyFile, None)
+
+    return skyFile
+
+
+def readPatchSky(skyFile):
+    """Read a patch sky map."""
+    if skyFile in _patchSkyCache:
+        return _patchSkyCache[skyFile]
+
+    skyHdu = fits.open(skyFile)
+    patchSky = {'head': skyHdu[0].header}
+    for layer in PATCH_LAYERS:
+        patchSky[layer] = skyHdu[layer].data.astype(float)
+    skyHdu.close()
+    _patchSkyCache[skyFile] = patchSky
+
+    return patchSky
+
+
+def cutoutPatchList(imgHead, filt, skyDir='.', rebin=6):
+    """
+    Sky maps of all the patches that overlap with a cutout.
+
+    The (tract, patch) pairs are read from the TRACTn / PATCHn keywords
+    written by coaddImageCutout.
+    """
+    skyList = []
+    for ii in range(100):
+        tractKey, patchKey = 'TRACT%d' % ii, 'PATCH%d' % ii
+        if (tractKey not in imgHead) or (patchKey not in imgHead):
+            break
+        skyFile = patchSkyName(imgHead[tractKey], imgHead[patchKey], filt,
+                               skyDir=skyDir, rebin=rebin)
+        if os.path.isfile(skyFile) and (skyFile not in skyList):
+            skyList.append(skyFile)
+
+    return skyList
+
+
+def samplePatchSky(skyList, imgHead, imgShape, minBox=4,
+                   bkgSize=cSkyCfg.BKG_SIZE, bkgFilter=cSkyCfg.BKG_FILTER):
+    """
+    Global sky of a cutout from the sky maps of its patches.
+
+    All the sky boxes with their centers inside the cutout are used.
+    The maps made with a different SEP background from the one of the
+    cutout (bkgSize, bkgFilter) are skipped.
+
+    Return:
+        skyPrior : dict with nSkyPix, skyMed, skyAvg, skyStd and skyErr
+                   (uncertainty of the sky level from the scatter between
+                   boxes), or None if there are not enough useful boxes
+    """
+    dimY, dimX = imgShape
+    wcsCut = wcs.WCS(imgHead)
+    boxMed, boxAvg, boxStd, boxNum = [], [], [], []
+    for skyFile in skyList:
+        patchSky = readPatchSky(skyFile)
+        skyHead = patchSky['head']
+        if ((skyHead.get('BKGSIZE', -1) != (-1 if bkgSize is None
+                                             else bkgSize)) or
+                (skyHead.get('BKGFILT', bkgFilter) != bkgFilter)):
+            warnings.warn("### %s has a different SEP background " % skyFile +
+                          "from the cutout, skip it")
+            continue
+        step = skyHead['REBIN'] * skyHead['BOXSIZE']
+        nBoxY, nBoxX = patchSky['NPIX'].shape
+        boxY, boxX = np.indices((nBoxY, nBoxX))
+        boxRa, boxDec = wcs.WCS(skyHead).all_pix2world(
+            ((boxX + 0.5) * step - 0.5).ravel(),
+            ((boxY + 0.5) * step - 0.5).ravel(), 0)
+        cutX, cutY = wcsCut.all_world2pix(boxRa, boxDec, 0)
+        inside = ((cutX >= 0) & (cutX <= (dimX - 1)) &
+                  (cutY >= 0) & (cutY <= (dimY - 1)) &
+                  (patchSky['NPIX'].ravel() > 0) &
+                  np.isfinite(patchSky['SKYMED'].ravel()))
+        boxMed.append(patchSky['SKYMED'].ravel()[inside])
+        boxAvg.append(patchSky['SKYAVG'].ravel()[inside])
+        boxStd.append(patchSky['SKYSTD'].ravel()[inside])
+        boxNum.append(patchSky['NPIX'].ravel()[inside])
+
+    if len(boxNum) == 0:
+        return None
+    boxMed, boxAvg = np.concatenate(boxMed), np.concatenate(boxAvg)
+    boxStd, boxNum = np.concatenate(boxStd), np.concatenate(boxNum)
+    nBox = len(boxNum)
+    if nBox < minBox:
+        warnings.warn("### Only %d useful sky boxes for the cutout" % nBox)
+        return None
+
+    # Pooled statistics of all the pixels in the boxes
+    numSkyPix = np.sum(boxNum)
+    skyAvg = np.sum(boxAvg * boxNum) / numSkyPix
+    skyStd = np.sqrt(np.sum(boxNum * (boxStd ** 2.0 +
+                                      (boxAvg - skyAvg) ** 2.0)) / numSkyPix)
+    skyMed = np.median(boxMed)
+    skyErr = np.std(boxMed) / np.sqrt(nBox)
+
+    return {'nSkyPix': int(numSkyPix), 'skyMed': skyMed, 'skyAvg': skyAvg,
+            'skyStd': skyStd, 'skyErr': skyErr, 'nBox': nBox}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("patchFile", help="FITS file of the coadd patch")
+    parser.add_argument("tract", help="Tract ID")
+    parser.add_argument("patch", help="Patch ID, e.g. 3,4")
+    parser.add_argument(
+        '-f', '--filter', dest='filter', help="Filter", default='HSC-I')
+    parser.add_argument(
+        '-o', '--skyDir', dest='skyDir', help="Folder for the sky maps",
+        default='.')
+    parser.add_argument(
+        '--rebin',
+        dest='rebin',
+        help='Rebin the image by N x N pixels',
+        type=int,
+        default=6)
+    parser.add_argument(
+        '--boxSize',
+        dest='boxSize',
+        help='Size of the sky box in binned pixels',
+        type=int,
+        default=16)
+    parser.add_argument(
+        '--skyclip',
+        dest='skyClip',
+        help='Sigma for pixel clipping',
+        type=float,
+        default=3.0)
+    parser.add_argument(
+        '--bkgSize',
+        dest='bkgSize',
+        help='Background size for SEP',
+        type=int,
+        default=cSkyCfg.BKG_SIZE)
+    parser.add_argument(
+        '--bkgFilter',
+        dest='bkgFilter',
+        help='Background filter size for SEP',
+        type=int,
+        default=cSkyCfg.BKG_FILTER)
+    parser.add_argument(
+        '-nb', '--noBrightStar', action="store_true",
+        dest='no_bright_object', default=False,
+        help='Same as the --noBrightStar option of the cutouts')
+    parser.add_argument(
+        '--overwrite', dest='overwrite', action="store_true", default=False)
+
+    args = parser.parse_args()
+
+    coaddPatchSky(args.patchFile, args.tract, args.patch, args.filter,
+                  skyDir=args.skyDir, rebin=args.rebin,
+                  boxSize=args.boxSize, skyClip=args.skyClip,
+                  bkgSize=args.bkgSize, bkgFilter=args.bkgFilter,
+                  noBrightObject=args.no_bright_object,
+                  overwrite=args.overwrite)
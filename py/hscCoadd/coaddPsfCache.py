@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Reuse the 1-D profiles of identical PSF images."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import hashlib
+import warnings
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+
+from astropy.io import fits
+
+import hscRerun as hRerun
+import galSBP
+import profileStore as pStore
+
+SEP = '-' * 100
+
+"""
+Many galaxies in the same patch share the same CoaddPsf, and the reruns of
+one galaxy never change its PSF, but coaddCutoutSbp() fits the _psf.fits
+image every time.
+
+The cache keys a PSF profile by a hash of the PSF array and of the galSBP()
+parameters of the PSF run.  With a tolerance, the PSF is normalized by its
+peak and rounded to that relative precision before the hash, so PSF images
+that only differ by numerical noise share the same profile.
+
+The profiles are kept in memory, and in <cacheDir>/psf_<key>.pkl, so the
+cache can be shared by different processes and runs.  The isophote table of
+the run (.bin, or _iso.fits for the python engine) is kept next to it, and
+is copied to the usual output name when the profile is reused, same as the
+products of a real PSF run.
+"""
+IGNORE_KEYS = ['scratch', 'store', 'isophote', 'xttools', 'verbose']
+BIN_SUFFIXES = ['.bin', '_iso.fits']
+
+
+def binSuffix(outBin):
+    """Suffix of an isophote table: .bin or _iso.fits."""
+    for suffix in BIN_SUFFIXES:
+        if outBin.endswith(suffix):
+            return suffix
+    return os.path.splitext(outBin)[1]
+
+
+def _copyFile(inFile, outFile):
+    """Copy to a temporary name first, then rename it."""
+    outTemp = outFile + '.%d' % os.getpid()
+    shutil.copyfile(inFile, outTemp)
+    os.rename(outTemp, outFile)
+
+
+def psfHash(psfArr, tol=None):
+    """
+    Content hash of a PSF array.
+
+    Parameters:
+        tol : relative precision; the PSF is divided by its peak and
+              rounded to this precision first
+    """
+    psfArr = np.asarray(psfArr, dtype=np.float64)
+    scale = ''
+    if tol is not None:
+        peak = np.nanmax(np.abs(psfArr))
+        if peak > 0:
+            psfArr = np.round(psfArr / (peak * tol)).astype(np.int64)
+            """ The peak itself, with the same relative precision """
+            scale = str(int(np.round(np.log(peak) / tol)))
+    psfArr = np.ascontiguousarray(np.nan_to_num(psfArr))
+    sha = hashlib.sha1((str(psfArr.shape) + scale).encode('ascii'))
+    sha.update(psfArr.tobytes())
+    return sha.hexdigest()
+
+
+class PsfCache(object):
+    """
+    Cache of the PSF profiles.
+
+    Usage:
+        cache = PsfCache('psf_cache', tol=1e-4)
+        key = cache.key(psfFile, **kwargs)
+        psfOut = cache.get(key)
+        if psfOut is None:
+            psfOut, psfBin = galSBP.galSBP(psfFile, **kwargs)
+            cache.put(key, psfOut, outBin=psfBin)
+        else:
+            cache.reuse(psfOut, outPre, key=key)
+        cache.report()
+    """
+
+    def __init__(self, cacheDir=None, tol=None, verbose=False):
+        """
+        Parameters:
+            cacheDir : where to keep the profiles; only in memory if None
+            tol      : relative precision of the PSF for the hash
+        """
+        self.cacheDir = cacheDir
+        self.tol = tol
+        self.verbose = verbose
+        self.profiles = {}
+        self.binFiles = {}
+        self.nHit = 0
+        self.nDiskHit = 0
+        self.nMiss = 0
+        if (cacheDir is not None) and (not os.path.isdir(cacheDir)):
+            os.makedirs(cacheDir)
+
+    def key(self, psfFile, **kwargs):
+        """Key of a PSF image and the parameters of its galSBP() run."""
+        psfArr = fits.open(hRerun.resolvePath(psfFile))[0].data
+        config = sorted((k, repr(v)) for (k, v) in kwargs.items()
+                        if k not in IGNORE_KEYS)
+        sha = hashlib.sha1(psfHash(psfArr, tol=self.tol).encode('ascii'))
+        sha.update(repr(config).encode('ascii'))
+        return sha.hexdigest()
+
+    def _cacheFile(self, key):
+        return os.path.join(self.cacheDir, 'psf_%s.pkl' % key)
+
+    def _cacheBin(self, key, binSuffix):
+        return os.path.join(self.cacheDir, 'psf_%s%s' % (key, binSuffix))
+
+    def get(self, key):
+        """Return the cached profile, or None."""
+        if key in self.profiles:
+            self.nHit += 1
+            return self.profiles[key]
+        if self.cacheDir is not None:
+            cacheFile = self._cacheFile(key)
+            if os.path.isfile(cacheFile):
+                try:
+                    with open(cacheFile, 'rb') as pklIn:
+                        psfOut = pickle.load(pklIn)
+                    self.profiles[key] = psfOut
+                    self.nHit += 1
+                    self.nDiskHit += 1
+                    return psfOut
+                except Exception:
+                    warnings.warn("### Can not read the PSF cache: %s" %
+                                  cacheFile)
+        self.nMiss += 1
+        return None
+
+    def put(self, key, psfOut, outBin=None):
+        """
+        Keep a new profile.
+
+        Parameters:
+            outBin : isophote table of the PSF run, kept with the profile
+        """
+        if psfOut is None:
+            return
+        self.profiles[key] = psfOut
+        hasBin = (outBin is not None) and os.path.isfile(outBin)
+        if hasBin:
+            self.binFiles[key] = outBin
+        if self.cacheDir is not None:
+            """ Write to a temporary name first, then rename it """
+            cacheFile = self._cacheFile(key)
+            cacheTemp = cacheFile + '.%d' % os.getpid()
+            with open(cacheTemp, 'wb') as pklOut:
+                pickle.dump(psfOut, pklOut, protocol=2)
+            os.rename(cacheTemp, cacheFile)
+            if hasBin:
+                cacheBin = self._cacheBin(key, binSuffix(outBin))
+                _copyFile(outBin, cacheBin)
+                self.binFiles[key] = cacheBin
+
+    def binFile(self, key):
+        """Return the cached isophote table of a profile, or None."""
+        outBin = self.binFiles.get(key)
+        if (outBin is not None) and os.path.isfile(outBin):
+            return outBin
+        if self.cacheDir is not None:
+            for suffix in BIN_SUFFIXES:
+                cacheBin = self._cacheBin(key, suffix)
+                if os.path.isfile(cacheBin):
+                    self.binFiles[key] = cacheBin
+                    return cacheBin
+        return None
+
+    def reuse(self, psfOut, outPre, store=None, key=None):
+        """
+        Save a cached profile as the output of the PSF run of a galaxy.
+
+        Parameters:
+            outPre : output name without extension, same as galSBP()
+            store  : directory of a profile store
+            key    : key of the profile; its isophote table is copied to
+                     outPre + .bin (or _iso.fits)
+
+        Return:
+            outBin : the isophote table of the galaxy, or None
+        """
+        if store is not None:
+            pStore.appendProfile(store, outPre, psfOut)
+        else:
+            galSBP.saveEllipOut(psfOut, outPre, verbose=False)
+        cacheBin = None if key is None else self.binFile(key)
+        if cacheBin is None:
+            if key is not None:
+                warnings.warn("### No isophote table for the cached PSF: %s"
+                              % key)
+            return None
+        outBin = outPre + binSuffix(cacheBin)
+        if os.path.abspath(outBin) != os.path.abspath(cacheBin):
+            _copyFile(cacheBin, outBin)
+        return outBin
+
+    def report(self):
+        """Summary of the hits and misses."""
+        nCall = self.nHit + self.nMiss
+        summary = {'nHit': self.nHit, 'nDiskHit': self.nDiskHit,
+                   'nMiss': self.nMiss, 'nPsf': len(self.profiles),
+                   'hitRate': (self.nHit / nCall) if nCall else np.nan}
+        if self.verbose:
+            print(SEP)
+            print("###    PSF cache: %d hits (%d from disk), %d misses" %
+                  (self.nHit, self.nDiskHit, self.nMiss))
+            print("###    Hit rate: %5.1f%%  Unique PSF profiles: %d" %
+                  (summary['hitRate'] * 100.0, summary['nPsf']))
+            print(SEP)
+        return summary
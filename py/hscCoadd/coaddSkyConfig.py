@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Settings shared by the sky of the cutouts and of the coadd patches."""
+
+from __future__ import (division, print_function)
+
+"""
+The patch sky maps (coaddPatchSky) stand in for the global sky of the
+cutouts (coaddCutoutSky), so both have to remove the same SEP background
+and mask the same pixels.
+
+SEP background of the sky measurement:
+    BKG_SIZE   : mesh size in pixels; same as the default of batchSky
+    BKG_FILTER : size of the median filter in meshes
+
+Mask planes of the hscPipe coadds:
+    BAD_SKIP_PLANES : planes that are cleared from the BAD mask of the
+                      cutouts (getCoaddBadMsk in coaddImageCutout); every
+                      other plane is a bad pixel
+    OBJ_PLANES      : planes that mark the objects; the final mask of the
+                      cutouts (_mskall) adds the DETECTED plane on top of
+                      the SEP objects
+"""
+BKG_SIZE = 60
+BKG_FILTER = 5
+
+BAD_SKIP_PLANES = ['DETECTED', 'DETECTED_NEGATIVE', 'CROSSTALK',
+                   'NOT_DEBLENDED']
+OBJ_PLANES = ['DETECTED']
+
+
+def skyMaskPlanes(planes, noBrightObject=False):
+    """
+    Mask planes that are excluded from the sky, from the list of planes.
+
+    Same as the bad planes of the cutouts plus the object planes.
+
+    Parameters:
+        planes         : names of all the mask planes of the coadd
+        noBrightObject : BRIGHT_OBJECT is not a bad plane, same as the
+                         --noBrightStar option of the cutouts
+    """
+    skip = list(BAD_SKIP_PLANES)
+    if noBrightObject:
+        skip.append('BRIGHT_OBJECT')
+    return [plane for plane in planes
+            if (plane not in skip) or (plane in OBJ_PLANES)]
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Survey-scale table of the global sky background of HSC cutouts."""
+
+from __future__ import (division, print_function)
+
+import os
+import fcntl
+import warnings
+
+import numpy as np
+
+# Astropy
+from astropy.io import fits
+
+"""
+One sky table is kept for each run, instead of one *_sky.dat file for each
+galaxy in each band:
+
+    <skyTable>.fits          : compacted FITS binary table
+    <skyTable>.fits.journal  : new measurements appended by the workers
+
+Workers only append one text line to the journal under an exclusive lock,
+so many of them can write to the same table at the same time.  The journal
+is merged into the FITS table by skyTableCompact().  When the same
+(prefix, rerun, rebin) is measured more than once, the latest result is
+kept.
+
+skyRms is the sky RMS of one pixel; it is NaN for the measurements made
+before it was added to the table.
+"""
+SKY_DTYPE = [('prefix', 'S80'), ('galID', 'S40'), ('filter', 'S10'),
+             ('rerun', 'S40'), ('rebin', int), ('nSkyPix', int),
+             ('skyMed', float), ('skyAvg', float), ('skyStd', float),
+             ('skySkw', float), ('sbExpt', float), ('skyRms', float)]
+
+JOURNAL = '.journal'
+
+# Tables that have been read in this process: {path: (stamp, table)}
+_skyTableCache = {}
+
+
+def _journalName(tabFile):
+    return tabFile + JOURNAL
+
+
+def _fileStamp(fileName):
+    if not os.path.isfile(fileName):
+        return None
+    stat = os.stat(fileName)
+    return (stat.st_mtime, stat.st_size)
+
+
+def skyTableAppend(tabFile, prefix, skyGlobal, rebin=6, galID=None,
+                   filter=None, rerun=None):
+    """
+    Append the global sky of one cutout to the sky table.
+
+    Parameters:
+        tabFile   : name of the sky table of this run
+        prefix    : prefix of the cutout image
+        skyGlobal : output of getGlobalSky(), i.e. (numSkyPix, skyMed,
+                    skyAvg, skyStd, skySkw, sbExpt, skyRms); skyRms can
+                    be left out
+    """
+    numSkyPix, skyMed, skyAvg, skyStd, skySkw, sbExpt = skyGlobal[:6]
+    skyRms = skyGlobal[6] if len(skyGlobal) > 6 else np.nan
+    galID = prefix if galID is None else galID
+    filter = '-' if filter is None else filter
+    rerun = '-' if rerun is None else rerun
+
+    line = "%s %s %s %s %d %d %.8e %.8e %.8e %.8e %.8e %.8e\n" % (
+        os.path.basename(str(prefix).strip()), str(galID).strip(),
+        str(filter).strip(), str(rerun).strip(), int(rebin),
+        int(numSkyPix), skyMed, skyAvg, skyStd, skySkw, sbExpt, skyRms)
+    with open(_journalName(tabFile), 'a') as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        try:
+            journal.write(line)
+            journal.flush()
+        finally:
+            fcntl.flock(journal, fcntl.LOCK_UN)
+
+
+def _readJournal(journal):
+    """Parse the lines of an open journal."""
+    nCol = len(SKY_DTYPE)
+    rows = [tuple((line.split() + ['nan'] * nCol)[:nCol])
+            for line in journal if line.strip()]
+    if len(rows) == 0:
+        return np.zeros(0, dtype=SKY_DTYPE)
+    return np.array(rows, dtype=SKY_DTYPE)
+
+
+def _readTable(tabFile):
+    """Read the compacted FITS table."""
+    if not os.path.isfile(tabFile):
+        return np.zeros(0, dtype=SKY_DTYPE)
+    data = np.array(fits.getdata(tabFile, 1))
+    skyTab = np.zeros(len(data), dtype=SKY_DTYPE)
+    skyTab['skyRms'] = np.nan
+    for col in data.dtype.names:
+        if col in skyTab.dtype.names:
+            skyTab[col] = data[col]
+    return skyTab
+
+
+def _skyKey(prefix, rerun, rebin):
+    """Unique key of one measurement."""
+    key = np.char.add(np.asarray(prefix, dtype='S80'), b':')
+    key = np.char.add(np.char.add(key, np.asarray(rerun, dtype='S40')), b':')
+    return np.char.add(key, np.asarray(rebin).astype('S8'))
+
+
+def _mergeRows(skyTab):
+    """Keep the latest measurement of each key and sort by the key."""
+    if len(skyTab) == 0:
+        return skyTab
+    keys = _skyKey(skyTab['prefix'], skyTab['rerun'], skyTab['rebin'])
+    # np.unique returns the first occurrence, so search the reversed array
+    _, index = np.unique(keys[::-1], return_index=True)
+    return skyTab[::-1][index]
+
+
+def skyTableRead(tabFile, useCache=True):
+    """
+    Read the sky table, including the measurements still in the journal.
+
+    Return:
+        skyTab : structured array sorted by (prefix, rerun, rebin)
+    """
+    journalFile = _journalName(tabFile)
+    stamp = (_fileStamp(tabFile), _fileStamp(journalFile))
+    if useCache and (tabFile in _skyTableCache):
+        oldStamp, skyTab = _skyTableCache[tabFile]
+        if oldStamp == stamp:
+            return skyTab
+
+    if os.path.isfile(journalFile):
+        with open(journalFile, 'r') as journal:
+            # Shared lock, so that the table is not compacted in between
+            fcntl.flock(journal, fcntl.LOCK_SH)
+            try:
+                skyTab = np.concatenate((_readTable(tabFile),
+                                         _readJournal(journal)))
+            finally:
+                fcntl.flock(journal, fcntl.LOCK_UN)
+    else:
+        skyTab = _readTable(tabFile)
+
+    skyTab = _mergeRows(skyTab)
+    _skyTableCache[tabFile] = (stamp, skyTab)
+
+    return skyTab
+
+
+def skyTableCompact(tabFile):
+    """
+    Merge the journal into the FITS table.
+
+    Return:
+        nRow : number of measurements in the table
+    """
+    journalFile = _journalName(tabFile)
+    if not os.path.isfile(journalFile):
+        return len(_readTable(tabFile))
+
+    with open(journalFile, 'r+') as journal:
+        fcntl.flock(journal, fcntl.LOCK_EX)
+        try:
+            skyTab = _mergeRows(np.concatenate((_readTable(tabFile),
+                                                _readJournal(journal))))
+            tabTemp = tabFile + '.%d' % os.getpid()
+            fits.BinTableHDU(skyTab).writeto(tabTemp, overwrite=True)
+            os.rename(tabTemp, tabFile)
+            journal.seek(0)
+            journal.truncate()
+        finally:
+            fcntl.flock(journal, fcntl.LOCK_UN)
+    _skyTableCache.pop(tabFile, None)
+
+    return len(skyTab)
+
+
+def skyLookup(skyTab, prefix=None, galID=None, filter=None, rebin=6,
+              rerun=None):
+    """
+    Find the sky of many cutouts with one vectorised join.
+
+    The cutouts are identified either by their prefixes, or by the galaxy
+    IDs together with the filter(s).  Only the measurements of the given
+    rerun are used; without a rerun, a cutout that has been measured in
+    more than one rerun is ambiguous and is reported as missing.
+
+    Return:
+        skyOut : structured array with one row per input; the sky values
+                 of the missing cutouts are NaN
+        found  : boolean array, whether the cutout is in the table
+    """
+    if isinstance(skyTab, str):
+        skyTab = skyTableRead(skyTab)
+
+    if prefix is not None:
+        keyIn = np.atleast_1d(np.asarray(prefix, dtype='S80'))
+        keyTab = skyTab['prefix']
+    elif galID is not None:
+        galID = np.atleast_1d(np.asarray(galID).astype('S40'))
+        filter = np.broadcast_to(np.asarray(filter, dtype='S10'),
+                                 galID.shape)
+        keyIn = np.char.add(np.char.add(galID, b':'), filter)
+        keyTab = np.char.add(np.char.add(skyTab['galID'], b':'),
+                             skyTab['filter'])
+    else:
+        raise Exception("### Need either the prefix or the galaxy ID !")
+
+    # Only the measurements with the right binning (and rerun)
+    use = (skyTab['rebin'] == int(rebin))
+    if rerun is not None:
+        use &= (skyTab['rerun'] == str(rerun).strip().encode())
+    use = np.nonzero(use)[0]
+    order = use[np.argsort(keyTab[use], kind='mergesort')]
+    keySort = keyTab[order]
+    if len(keySort):
+        pos = np.clip(np.searchsorted(keySort, keyIn, side='left'), 0,
+                      len(keySort) - 1)
+        nMatch = (np.searchsorted(keySort, keyIn, side='right') -
+                  np.searchsorted(keySort, keyIn, side='left'))
+        found = (nMatch == 1)
+        if np.any(nMatch > 1):
+            warnings.warn("### %d cutouts are in more than one rerun of " %
+                          np.sum(nMatch > 1) + "the sky table, give the rerun")
+    else:
+        pos = np.zeros(len(keyIn), dtype=int)
+        found = np.zeros(len(keyIn), dtype=bool)
+
+    skyOut = np.zeros(len(keyIn), dtype=SKY_DTYPE)
+    for col in ('skyMed', 'skyAvg', 'skyStd', 'skySkw', 'sbExpt', 'skyRms'):
+        skyOut[col] = np.nan
+    if np.any(found):
+        skyOut[found] = skyTab[order[pos[found]]]
+
+    return skyOut, found
@@ -22,6 +22,16 @@ Collection of codes used by Song Huang for his HSC-related projects.
     * fitsMag2Flux.py:
         - Script to convert HSC magnitudes into fluxes in FITS table.
 
+    * hscStats.py:
+        - Fast sigma-clipped statistics with partition-based medians.
+
+    * hscRerun.py:
+        - Virtual rerun folders: resolve the inherited cutout files through
+          a small manifest instead of symbolic links.
+
+    * hscPool.py:
+        - Process pool for the batch scripts that survives crashed workers.
+
 """
 
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""A process pool that survives crashed workers."""
+
+from __future__ import (division, print_function)
+
+import time
+import traceback
+import collections
+import multiprocessing
+
+"""
+multiprocessing.Pool loses the task of a worker that is killed (segfault,
+out of memory, os._exit...), and imap()/apply_async() then wait forever
+for its result.  Here every worker talks to the main process through its
+own pipe, so the main process always knows which task a worker is running:
+when a worker dies, its task is reported as failed and a new worker takes
+its place.  A task that runs longer than the timeout is treated the same
+way.
+"""
+
+
+def _workerLoop(conn, func, initializer, initargs):
+    """Run the tasks received from the pipe, and send back the results."""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+        index, task = job
+        try:
+            output = (index, True, func(task))
+        except Exception:
+            output = (index, False, traceback.format_exc())
+        try:
+            conn.send(output)
+        except Exception:
+            # e.g. the result can not be pickled
+            conn.send((index, False, traceback.format_exc()))
+    conn.close()
+
+
+def _spawn(func, initializer, initargs):
+    parentConn, childConn = multiprocessing.Pipe()
+    proc = multiprocessing.Process(target=_workerLoop,
+                                   args=(childConn, func, initializer,
+                                         initargs))
+    proc.daemon = True
+    proc.start()
+    childConn.close()
+    return {'proc': proc, 'conn': parentConn, 'job': None, 'start': None,
+            'nDone': 0}
+
+
+def _kill(worker):
+    try:
+        worker['proc'].terminate()
+        worker['proc'].join(5.0)
+        worker['conn'].close()
+    except Exception:
+        pass
+
+
+def imapSafe(func, tasks, nProc=2, initializer=None, initargs=(),
+             maxTasks=None, timeout=None, pollTime=0.05):
+    """
+    Run func(task) for every task in nProc worker processes.
+
+    Parameters:
+        func        : function of one argument; must be picklable
+        initializer : called with initargs when a worker starts
+        maxTasks    : number of tasks before a worker is replaced
+        timeout     : maximum run time of one task in seconds
+
+    Yield:
+        (index, ok, result) in the order the tasks are finished; index is
+        the position of the task in the input list; when ok is False,
+        result is the error message (traceback, crash or time-out)
+    """
+    queue = collections.deque(enumerate(tasks))
+    nProc = max(1, min(int(nProc), len(queue)))
+    workers = [_spawn(func, initializer, initargs) for _ in range(nProc)]
+    try:
+        while True:
+            # Send the tasks to the idle workers
+            for ii, worker in enumerate(workers):
+                if not queue:
+                    break
+                if worker['job'] is None:
+                    if ((not worker['proc'].is_alive()) or
+                            (maxTasks and worker['nDone'] >= maxTasks)):
+                        _kill(worker)
+                        worker = workers[ii] = _spawn(func, initializer,
+                                                      initargs)
+                    worker['job'] = queue.popleft()
+                    worker['start'] = time.time()
+                    worker['conn'].send(worker['job'])
+
+            running = [w for w in workers if w['job'] is not None]
+            if not running:
+                break
+
+            finished = []
+            for ii, worker in enumerate(workers):
+                if worker['job'] is None:
+                    continue
+                index = worker['job'][0]
+                output = None
+                try:
+                    if worker['conn'].poll():
+                        output = worker['conn'].recv()
+                except (EOFError, IOError, OSError):
+                    pass
+                if output is None and not worker['proc'].is_alive():
+                    output = (index, False, '### Worker crashed (exit ' +
+                              'code %s)' % worker['proc'].exitcode)
+                    _kill(worker)
+                elif output is None and timeout is not None and (
+                        time.time() - worker['start']) > timeout:
+                    output = (index, False, '### Task timed out after ' +
+                              '%d sec' % timeout)
+                    _kill(worker)
+                if output is not None:
+                    worker['job'], worker['start'] = None, None
+                    worker['nDone'] += 1
+                    finished.append(output)
+
+            for output in finished:
+                yield output
+            if not finished:
+                time.sleep(pollTime)
+    finally:
+        for worker in workers:
+            try:
+                worker['conn'].send(None)
+            except Exception:
+                pass
+        for worker in workers:
+            worker['proc'].join(5.0)
+            if worker['proc'].is_alive():
+                worker['proc'].terminate()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Virtual rerun folders for the HSC cutouts."""
+
+from __future__ import (division, print_function)
+
+import os
+import glob
+import json
+
+"""
+Each rerun folder (<galaxy>/<filter>/<rerun>/) used to hold one symbolic
+link for every FITS file of the cutout.  Instead, a small manifest file
+records which base products the rerun inherits, and the paths are
+resolved in memory.  Only the products that are actually different for a
+rerun (masks, sky-subtracted images, ellipse outputs...) are written into
+the rerun folder.
+"""
+MANIFEST = '.rerun.json'
+
+# Manifests that have been read in this process: {rerunDir: manifest}
+_manifestCache = {}
+
+
+def rerunSetup(root, rerun, fileList=None, pattern='*.fits', link=False):
+    """
+    Set up a rerun folder that inherits the base products in root.
+
+    Parameters:
+        root     : folder of the base products, e.g. <galaxy>/<filter>
+        rerun    : name of the rerun
+        fileList : list of base products; will glob the root folder
+                   if not provided
+        link     : make the old symbolic links instead of a manifest,
+                   for external programs that need real files
+
+    Return:
+        rerunDir : path to the rerun folder
+    """
+    root = root if root else '.'
+    rerunDir = os.path.join(root, rerun.strip())
+    if not os.path.isdir(rerunDir):
+        os.makedirs(rerunDir)
+
+    if fileList is None:
+        fileList = glob.glob(os.path.join(root, pattern))
+    fileNames = sorted(os.path.basename(f) for f in fileList)
+
+    if link:
+        for fitsFile in fileList:
+            lnk = os.path.join(rerunDir, os.path.basename(fitsFile))
+            if (not os.path.islink(lnk)) and (not os.path.isfile(lnk)):
+                os.symlink(fitsFile, lnk)
+        return rerunDir
+
+    manifest = {'base': os.path.relpath(root, rerunDir),
+                'files': fileNames}
+    # Only rewrite the manifest when the base products have changed
+    if readManifest(rerunDir) != manifest:
+        manFile = os.path.join(rerunDir, MANIFEST)
+        manTemp = manFile + '.%d' % os.getpid()
+        with open(manTemp, 'w') as manOut:
+            json.dump(manifest, manOut)
+        os.rename(manTemp, manFile)
+        _manifestCache[os.path.normpath(rerunDir)] = manifest
+
+    return rerunDir
+
+
+def readManifest(rerunDir):
+    """
+    Read the manifest of a rerun folder.
+
+    Return None if the folder is not a virtual rerun.
+    """
+    key = os.path.normpath(rerunDir)
+    if key in _manifestCache:
+        return _manifestCache[key]
+
+    manFile = os.path.join(rerunDir, MANIFEST)
+    if not os.path.isfile(manFile):
+        return None
+    with open(manFile, 'r') as manIn:
+        manifest = json.load(manIn)
+    _manifestCache[key] = manifest
+
+    return manifest
+
+
+def resolvePath(path):
+    """
+    Find the real file behind a path inside a rerun folder.
+
+    Order of preference:
+        1. A file that is actually written in the rerun folder
+        2. The target of an old-style symbolic link
+        3. The base product recorded in the manifest
+
+    The path is returned unchanged if it can not be resolved, so the
+    caller can still report the missing file.
+    """
+    if path is None:
+        return None
+    if os.path.islink(path):
+        return os.readlink(path)
+    if os.path.isfile(path):
+        return path
+
+    rerunDir, fileName = os.path.split(path)
+    manifest = readManifest(rerunDir if rerunDir else '.')
+    if (manifest is not None) and (fileName in manifest['files']):
+        return os.path.normpath(os.path.join(rerunDir, manifest['base'],
+                                             fileName))
+
+    return path
+
+
+def pathExists(path):
+    """
+    Whether a path exists, either as a real file or through the rerun.
+    """
+    return os.path.isfile(resolvePath(path))
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Fast sigma-clipped statistics of pixel samples.
+
+ * Medians from np.partition (introselect) instead of full sorting
+ * Incremental clipping: the moments are updated only with the pixels
+   that are removed by the new clipping boundaries, and after the first
+   pass only the pixels near the boundaries are checked again
+ * Batched version for many annuli or sky boxes at once
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+import numpy as np
+
+"""
+Structure of the returned statistics
+"""
+CLIP_DTYPE = [('mean', float), ('median', float), ('std', float),
+              ('mad', float), ('nClip', int), ('nUse', int),
+              ('low', float), ('upp', float)]
+
+
+def fastMedian(data):
+    """
+    Median of a 1-D array using np.partition.
+
+    The input array is partially reordered in place.
+    """
+    num = len(data)
+    if num == 0:
+        return np.nan
+    half = num // 2
+    if num % 2:
+        return float(np.partition(data, half)[half])
+    part = np.partition(data, [half - 1, half])
+    return 0.5 * (part[half - 1] + part[half])
+
+
+def sigmaClipStats(data, low=3.0, upp=3.0, maxIter=None, cenFunc='mean',
+                   returnData=False):
+    """
+    Sigma-clipped statistics of a 1-D pixel sample in a single call.
+
+    Follows scipy.stats.sigmaclip: iterate until no more pixels are
+    clipped (or maxIter is reached), using center +/- (low, upp) * std as
+    the boundaries.
+
+    Parameters:
+        cenFunc    : 'mean' (same as sigmaclip) or 'median' for the center
+        returnData : also return the clipped sample
+
+    Return:
+        stats : record with mean, median, std, mad, nClip, nUse, low, upp
+        (clip): the clipped sample if returnData is True; the pixels are
+                not in their input order
+    """
+    pix = np.asarray(data, dtype=float).ravel()
+    pix = pix[np.isfinite(pix)]
+    nOri = len(pix)
+
+    # Running moments around a shift; only the removed pixels are used to
+    # update them.  They are computed again when most of the variance has
+    # been removed, before the round-off of the subtractions matters
+    num = nOri
+    shift = np.mean(pix) if nOri > 0 else 0.0
+    sum1 = np.sum(pix - shift)
+    sum2 = np.sum((pix - shift) ** 2)
+    sum2Ref = sum2
+    lowBound, uppBound = -np.inf, np.inf
+
+    # The pixels well inside the boundaries (the core) are set aside after
+    # the first pass; later passes only check the pixels near the edges,
+    # unless the new boundaries cut into the core
+    core = pix[:0]
+    coreLow, coreUpp = np.inf, -np.inf
+
+    nIter = 0
+    while num > 0:
+        if sum2 < sum2Ref * 1e-3:
+            rest = np.concatenate((core, pix))
+            shift = np.mean(rest)
+            sum1 = np.sum(rest - shift)
+            sum2 = sum2Ref = np.sum((rest - shift) ** 2)
+        mean = sum1 / num
+        std = np.sqrt(max(sum2 / num - mean * mean, 0.0))
+        mean += shift
+        if cenFunc == 'mean':
+            center = mean
+        else:
+            center = fastMedian(np.concatenate((core, pix)))
+        newLow = center - std * low
+        newUpp = center + std * upp
+        if (newLow > coreLow) or (newUpp < coreUpp):
+            pix = np.concatenate((core, pix))
+            core = pix[:0]
+            coreLow, coreUpp = np.inf, -np.inf
+        out = (pix < newLow) | (pix > newUpp)
+        nOut = np.count_nonzero(out)
+        lowBound, uppBound = newLow, newUpp
+        if nOut == 0 or ((maxIter is not None) and (nIter >= maxIter)):
+            break
+        removed = pix[out] - shift
+        num -= nOut
+        sum1 -= np.sum(removed)
+        sum2 -= np.sum(removed * removed)
+        pix = pix[~out]
+        if len(core) == 0:
+            coreLow = center - 0.5 * std * low
+            coreUpp = center + 0.5 * std * upp
+            inCore = (pix >= coreLow) & (pix <= coreUpp)
+            core, pix = pix[inCore], pix[~inCore]
+        nIter += 1
+    pix = np.concatenate((core, pix))
+
+    stats = np.zeros(1, dtype=CLIP_DTYPE)[0]
+    if num > 0:
+        # Recompute the moments of the final sample to avoid round-off
+        stats['mean'] = np.mean(pix)
+        stats['std'] = np.std(pix)
+        med = fastMedian(pix.copy())
+        stats['median'] = med
+        stats['mad'] = fastMedian(np.abs(pix - med))
+    else:
+        stats['mean'] = stats['median'] = np.nan
+        stats['std'] = stats['mad'] = np.nan
+    stats['nClip'] = nOri - num
+    stats['nUse'] = num
+    stats['low'], stats['upp'] = lowBound, uppBound
+
+    if returnData:
+        return stats, pix
+    return stats
+
+
+def sigmaClipBatch(data, labels, nLabel=None, low=3.0, upp=3.0,
+                   maxIter=None, cenFunc='mean'):
+    """
+    Sigma-clipped statistics for many groups of pixels at once.
+
+    The pixels are sorted by (label, value) only once.  After that the
+    clipped sample of each group is always a contiguous range of the
+    sorted array, so every iteration only needs prefix sums and binary
+    searches for all groups together.
+
+    Parameters:
+        data   : pixel values
+        labels : integer group index (e.g. annulus or sky box) of each
+                 pixel; negative labels are ignored
+        nLabel : number of groups
+
+    Return:
+        stats  : array of records (one per group) with the same fields
+                 as sigmaClipStats()
+    """
+    val = np.asarray(data, dtype=float).ravel()
+    lab = np.asarray(labels).ravel().astype(int)
+    use = np.isfinite(val) & (lab >= 0)
+    val, lab = val[use], lab[use]
+    if nLabel is None:
+        nLabel = (np.max(lab) + 1) if len(lab) else 0
+
+    stats = np.zeros(nLabel, dtype=CLIP_DTYPE)
+    stats['mean'] = stats['median'] = np.nan
+    stats['std'] = stats['mad'] = np.nan
+    if len(val) == 0:
+        return stats
+
+    order = np.lexsort((val, lab))
+    val, lab = val[order], lab[order]
+    count = np.bincount(lab, minlength=nLabel)
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    # The prefix sums run over all the groups, so they are taken around
+    # the middle value of each group, to keep the round-off of a group
+    # small compared with its own variance
+    ref = np.where(count > 0, val[np.clip(start + count // 2, 0,
+                                          len(val) - 1)], 0.0)
+    shifted = val - ref[lab]
+    cum1 = np.concatenate(([0.0], np.cumsum(shifted)))
+    cum2 = np.concatenate(([0.0], np.cumsum(shifted * shifted)))
+
+    def _moments(lo, hi):
+        num = (hi - lo).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (cum1[hi] - cum1[lo]) / num
+            std = np.sqrt(np.clip((cum2[hi] - cum2[lo]) / num - mean ** 2,
+                                  0.0, None))
+        return ref + mean, std
+
+    # Monotonic key over the whole sorted array to search all groups
+    vMin, vMax = np.min(val), np.max(val)
+    scale = 0.5 / (vMax - vMin) if vMax > vMin else 0.0
+
+    def _key(group, value):
+        return group + np.clip((value - vMin) * scale, 0.0, 0.5)
+
+    key = _key(lab, val)
+    lo, hi = start.copy(), start + count
+    group = np.arange(nLabel)
+
+    def _median(lo, hi):
+        num = hi - lo
+        mid1 = np.clip(lo + (num - 1) // 2, 0, len(val) - 1)
+        mid2 = np.clip(lo + num // 2, 0, len(val) - 1)
+        return np.where(num > 0, 0.5 * (val[mid1] + val[mid2]), np.nan)
+
+    nIter = 0
+    active = count > 0
+    while np.any(active):
+        if (maxIter is not None) and (nIter >= maxIter):
+            break
+        mean, std = _moments(lo, hi)
+        center = mean if cenFunc == 'mean' else _median(lo, hi)
+        newLo = np.searchsorted(key, _key(group, center - std * low),
+                                side='left')
+        newHi = np.searchsorted(key, _key(group, center + std * upp),
+                                side='right')
+        newLo = np.where(active, np.maximum(newLo, lo), lo)
+        newHi = np.where(active, np.minimum(newHi, hi), hi)
+        stats['low'] = np.where(active, center - std * low, stats['low'])
+        stats['upp'] = np.where(active, center + std * upp, stats['upp'])
+        changed = (newLo != lo) | (newHi != hi)
+        lo, hi = newLo, np.maximum(newHi, newLo)
+        active = active & changed & (hi > lo)
+        nIter += 1
+
+    num = hi - lo
+    good = num > 0
+    # The final moments are summed within each group, in two passes
+    mean, std = np.zeros(nLabel), np.zeros(nLabel)
+    if np.any(good):
+        bounds = np.ravel(np.column_stack((lo[good], hi[good])))
+        mean[good] = np.add.reduceat(np.append(shifted, 0.0),
+                                     bounds)[::2] / num[good]
+        resid = np.append((shifted - mean[lab]) ** 2, 0.0)
+        std[good] = np.sqrt(np.add.reduceat(resid, bounds)[::2] /
+                            num[good])
+    med = _median(lo, hi)
+    stats['mean'] = np.where(good, ref + mean, np.nan)
+    stats['std'] = np.where(good, std, np.nan)
+    stats['median'] = med
+    stats['nUse'] = num
+    stats['nClip'] = count - num
+
+    # MAD: one more sort of the absolute deviations of the kept pixels
+    if np.any(good):
+        inRange = np.zeros(len(val) + 1, dtype=int)
+        np.add.at(inRange, lo[good], 1)
+        np.add.at(inRange, hi[good], -1)
+        kept = np.cumsum(inRange)[:-1] > 0
+        devLab = lab[kept]
+        dev = np.abs(val[kept] - med[devLab])
+        devOrder = np.lexsort((dev, devLab))
+        dev = dev[devOrder]
+        devCount = np.bincount(devLab, minlength=nLabel)
+        devStart = np.concatenate(([0], np.cumsum(devCount)[:-1]))
+        mid1 = np.clip(devStart + (devCount - 1) // 2, 0, len(dev) - 1)
+        mid2 = np.clip(devStart + devCount // 2, 0, len(dev) - 1)
+        stats['mad'] = np.where(good, 0.5 * (dev[mid1] + dev[mid2]), np.nan)
+
+    return stats
@@ -436,6 +436,118 @@ def congrid(a, newdims, method='linear', centre=False, minusone=False):
         return None
 
 
+def blockFactor(factor, tol=0.01):
+    """
+    Return the integer binning factor, or None if it is not near-integer.
+    """
+    nearest = int(round(factor))
+    if nearest >= 1 and abs(factor - nearest) <= tol:
+        return nearest
+    return None
+
+
+def blockReduce(a, factor, mask=None, func='mean', edge='partial',
+                minFrac=0.0):
+    """
+    Rebin a 2-D image by an integer factor using block reduction.
+
+    The image is reshaped into (ny, factor, nx, factor) blocks and reduced
+    with np.nanmean or np.nanmedian, which avoids the Python loops of the
+    1-D interpolations in congrid().
+
+    Parameters:
+        factor  : integer binning factor (near-integer values are rounded)
+        mask    : pixels with mask > 0 do not contribute to the blocks
+        func    : 'mean' or 'median'
+        edge    : 'partial' keeps the incomplete blocks at the upper edges;
+                  'trim' drops them
+        minFrac : blocks with a smaller fraction of useful pixels are NaN
+
+    Return:
+        newa    : the binned image
+        frac    : fraction of useful pixels in each block, which can be
+                  used as the weight of the block
+    """
+    nBin = blockFactor(factor)
+    if nBin is None:
+        raise ValueError("Block reduction needs a near-integer factor: "
+                         "%s" % factor)
+    if func not in ['mean', 'median']:
+        raise ValueError("Unrecognized block function: %s" % func)
+
+    data = np.array(a, dtype=float)
+    good = np.isfinite(data)
+    if mask is not None:
+        good &= ~(np.asarray(mask) > 0)
+    data[~good] = np.nan
+
+    dimY, dimX = data.shape
+    if edge == 'trim':
+        newY, newX = dimY // nBin, dimX // nBin
+        data = data[:newY * nBin, :newX * nBin]
+        good = good[:newY * nBin, :newX * nBin]
+    else:
+        newY, newX = -(-dimY // nBin), -(-dimX // nBin)
+        padY, padX = (newY * nBin - dimY), (newX * nBin - dimX)
+        if padY > 0 or padX > 0:
+            data = np.pad(data, ((0, padY), (0, padX)), mode='constant',
+                          constant_values=np.nan)
+            good = np.pad(good, ((0, padY), (0, padX)), mode='constant',
+                          constant_values=False)
+            # Partial blocks are weighted by their real size
+            area = np.pad(np.ones((dimY, dimX)), ((0, padY), (0, padX)),
+                          mode='constant', constant_values=0.0)
+        else:
+            area = None
+
+    blocks = data.reshape(newY, nBin, newX, nBin).swapaxes(1, 2)
+    blocks = blocks.reshape(newY, newX, nBin * nBin)
+    nGood = good.reshape(newY, nBin, newX, nBin).sum(axis=(1, 3))
+    if edge != 'trim' and area is not None:
+        nArea = area.reshape(newY, nBin, newX, nBin).sum(axis=(1, 3))
+    else:
+        nArea = np.full((newY, newX), nBin * nBin, dtype=float)
+    frac = nGood / nArea
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if func == 'mean':
+            newa = np.nanmean(blocks, axis=2)
+        else:
+            newa = np.nanmedian(blocks, axis=2)
+    newa[frac <= minFrac] = np.nan
+
+    return newa, frac
+
+
+def rebinImage(a, factor, mask=None, func='mean', minFrac=0.5,
+               method='nearest'):
+    """
+    Rebin an image and its mask by a factor.
+
+    Use blockReduce() for near-integer factors, and fall back to
+    congrid() for the others.
+
+    Return:
+        imgBin  : the binned image
+        mskBin  : the binned mask (1 for useless bins)
+    """
+    if blockFactor(factor) is not None:
+        imgBin, frac = blockReduce(a, factor, mask=mask, func=func,
+                                   edge='partial', minFrac=minFrac)
+        mskBin = ((frac < minFrac) | ~np.isfinite(imgBin)).astype('uint8')
+    else:
+        dimY, dimX = a.shape
+        newdims = (int((dimY - 1) / factor), int((dimX - 1) / factor))
+        imgBin = congrid(a, newdims, method=method)
+        if mask is not None:
+            mskBin = congrid(mask, newdims, method='neighbour')
+        else:
+            mskBin = np.zeros(newdims, dtype='uint8')
+
+    return imgBin, mskBin
+
+
 """
 File Manipulation
 
@@ -0,0 +1,683 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Run imfit on a sample of HSC cutouts, with the inputs on tmpfs."""
+
+from __future__ import (division, print_function)
+
+import os
+import re
+import time
+import shutil
+import argparse
+import warnings
+import multiprocessing
+from distutils import spawn
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.table import Table
+
+import hscRerun as hRerun
+import galWorkspace as gWork
+import galfitModel as gMod
+import galfitHarvest as gHar
+import coaddGalfitRunner as gRun
+import coaddGalfitRegion as gReg
+import coaddCutoutGalfitSimple as cGalfit
+
+SEP = '-' * 100
+
+"""
+run_imfit.sh was a single hand-written imfit call.  For a sample, the
+driver:
+    * builds the imfit config files from the same geometry that
+      coaddCutoutGalfitSimple() uses for GALFIT: GAL_CENX, GAL_CENY, GAL_Q,
+      GAL_PA and GAL_R50 from the header of the mask;
+    * copies the image, mask, sigma image and PSF of a group of galaxies
+      into a galWorkspace on tmpfs (/dev/shm), so imfit reads and writes
+      memory instead of the shared file system;
+    * runs the fits through coaddGalfitRunner, nJobs at the same time,
+      each with nThreads threads (imfit --max-threads); the wall-clock,
+      CPU and memory limits work the same way as for GALFIT.  The CPU
+      limit counts the time of all the threads of a fit;
+    * copies the products back into the rerun folder, and parses all the
+      best-fit parameter files into one table, one row per function.
+
+The galaxies are staged nJobs * CHUNK at a time, to limit the memory used
+on tmpfs.
+
+The conventions of imfit and GALFIT are close: both use 1-indexed pixel
+centers, and the PA is counted from +Y towards -X in both.  imfit uses
+the ellipticity (1 - b/a) and the surface brightness at r_e (I_e, in
+counts per pixel) instead of the magnitude.  The magnitude of a Sersic
+function is computed back from I_e for the table.
+
+The files follow run_imfit.sh, e.g. for the 2-Sersic model:
+    <prefix>_2ser.imfit           : config file
+    <prefix>_2ser.out             : best-fit parameters (--save-params)
+    <prefix>_2ser_imfit_res.fits  : residual image (--save-residual)
+    <prefix>_2ser_imfit_boot.dat  : bootstrap resampling (--save-bootstrap)
+    <prefix>_2ser.imfit.log       : output of imfit
+"""
+MODELS = ('1ser', '2ser')
+CHUNK = 4
+KEEP_SUFFIX = ['.imfit', '.out', '_imfit_res.fits', '_imfit_boot.dat',
+               '.imfit.log']
+SOLVERS = {'lm': [], 'nm': ['--nm'], 'de': ['--de']}
+
+STAT_RES = [('chi2', re.compile(r'(?<!reduced )chi\^2\)?\s*=\s*' +
+                                r'([-+\d.eE]+|nan|inf)', re.IGNORECASE)),
+            ('chi2nu', re.compile(r'reduced[^=]*=\s*([-+\d.eE]+|nan|inf)',
+                                  re.IGNORECASE)),
+            ('aic', re.compile(r'AIC\s*=\s*([-+\d.eE]+|nan|inf)')),
+            ('bic', re.compile(r'BIC\s*=\s*([-+\d.eE]+|nan|inf)'))]
+ERROR_RE = re.compile(r'\+/-\s*([-+\d.eE]+|nan|inf)', re.IGNORECASE)
+LABEL_RE = re.compile(r'LABEL\s+(\S+)')
+BOOT_SUFFIX_RE = re.compile(r'_\d+$')
+
+
+def findImfit(imfit=None):
+    """Path to the imfit executable."""
+    if imfit is None:
+        imfit = spawn.find_executable('imfit')
+        if imfit is None:
+            raise Exception("XXX Can not find the imfit executable")
+    return imfit
+
+
+def defaultThreads(nJobs):
+    """Share the cores of the node between the fits."""
+    return max(multiprocessing.cpu_count() // max(int(nJobs), 1), 1)
+
+
+def imfitGeometry(mskHead, qMax=0.95):
+    """
+    Geometry of the galaxy from the header of the mask.
+
+    Return:
+        dict with x, y, q, pa (GALFIT convention), r50 and r90
+    """
+    geom = {'x': float(mskHead['GAL_CENX']),
+            'y': float(mskHead['GAL_CENY']),
+            'q': min(float(mskHead['GAL_Q']), qMax),
+            'pa': float(mskHead['GAL_PA']) % 180.0,
+            'r50': float(mskHead['GAL_R50'])}
+    if 'GAL_R90' in mskHead:
+        geom['r90'] = float(mskHead['GAL_R90'])
+    else:
+        geom['r90'] = geom['r50'] * 2.5
+    return geom
+
+
+def imageSection(fileName, region=None):
+    """File name with an IRAF image section: file.fits[x0:x1,y0:y1]."""
+    if region is None:
+        return fileName
+    return '%s[%d:%d,%d:%d]' % ((fileName,) + tuple(region))
+
+
+def _paramLine(name, value, limits=None, fixed=False):
+    """One parameter of the imfit config file."""
+    if fixed:
+        return '%-8s %12.4f   fixed' % (name, value)
+    if limits is None:
+        return '%-8s %12.4f' % (name, value)
+    return '%-8s %12.4f   %.4f,%.4f' % ((name, value) + tuple(limits))
+
+
+def sersicFunction(geom, flux, fre=1.0, nser=2.0, label=None):
+    """Lines of one Sersic function, with the flux turned into I_e."""
+    rad = max(geom['r50'] * fre, 0.5)
+    ie = gMod.sersicIe(flux, rad, nser, geom['q'])
+    ell = 1.0 - geom['q']
+    line = 'FUNCTION Sersic'
+    if label is not None:
+        line += '   # LABEL %s' % label
+    return [line,
+            _paramLine('PA', geom['pa'],
+                       (geom['pa'] - 90.0, geom['pa'] + 90.0)),
+            _paramLine('ell', ell, (0.0, 0.95)),
+            _paramLine('n', nser, (0.2, 8.0)),
+            _paramLine('I_e', ie, (ie * 1.0E-3, ie * 1.0E3)),
+            _paramLine('r_e', rad, (0.2, max(rad * 20.0, 10.0)))]
+
+
+def imfitConfig(geom, model='1ser', mag=18.5, zp=27.0, nser=2.0, sky=0.0,
+                useSky=True, dCen=5.0):
+    """
+    Lines of the imfit config file of a model.
+
+    All the Sersic functions share the same center, like the constrained
+    centers of the GALFIT models.
+
+    Parameters:
+        geom  : from imfitGeometry()
+        model : '1ser' or '2ser'
+        mag   : initial total magnitude
+        sky   : initial value of the flat sky
+        dCen  : the center is allowed to move by dCen pixels
+    """
+    flux = gMod.totalFlux(mag, zp=zp)
+    lines = ['# imfit config: %s model' % model, '',
+             _paramLine('X0', geom['x'],
+                        (geom['x'] - dCen, geom['x'] + dCen)),
+             _paramLine('Y0', geom['y'],
+                        (geom['y'] - dCen, geom['y'] + dCen))]
+    if model == '1ser':
+        lines += sersicFunction(geom, flux, nser=nser, label='ser1')
+    elif model == '2ser':
+        """ Same split as the warm start of the 2-Sersic GALFIT model """
+        inner, outer = cGalfit.SPLIT_INNER, cGalfit.SPLIT_OUTER
+        lines += sersicFunction(geom, flux * inner[0], fre=inner[1],
+                                nser=cGalfit.splitNser(nser), label='inner')
+        lines += sersicFunction(geom, flux * outer[0], fre=outer[1],
+                                nser=cGalfit.SPLIT_NSER_OUT, label='outer')
+    else:
+        raise Exception("### Unknown imfit model : %s" % model)
+    if useSky:
+        lines += ['FUNCTION FlatSky   # LABEL sky', _paramLine('I_sky', sky)]
+
+    return lines
+
+
+def writeImfitConfig(configFile, lines):
+    """Write the lines of a config file."""
+    with open(configFile, 'w') as cfgOut:
+        cfgOut.write('\n'.join(lines) + '\n')
+    return configFile
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def readBootstrap(bootFile):
+    """
+    Scatter of the parameters in a bootstrap file (--save-bootstrap).
+
+    The columns are named like X0_1, PA_1, I_sky_2.  The parameters with
+    the same name are kept in the order of the columns, which is the order
+    of the free parameters in the parameter file.
+
+    Return:
+        dict of {name: [scatter, ...]}, number of bootstrap samples
+    """
+    names = None
+    with open(bootFile, 'r') as bootIn:
+        for line in bootIn:
+            if line.startswith('#'):
+                names = line.lstrip('#').split()
+            elif line.strip():
+                break
+    data = np.loadtxt(bootFile, comments='#', ndmin=2)
+    if (names is None) or (data.shape[0] < 2) or \
+            (data.shape[1] != len(names)):
+        warnings.warn("### Can not use the bootstrap file : %s" % bootFile)
+        return {}, 0
+    scatter = {}
+    for col, name in enumerate(names):
+        key = BOOT_SUFFIX_RE.sub('', name).lower()
+        scatter.setdefault(key, []).append(float(np.std(data[:, col],
+                                                        ddof=1)))
+    return scatter, data.shape[0]
+
+
+def parseImfitParams(paramFile, bootFile=None):
+    """
+    Parse a best-fit parameter file of imfit (--save-params).
+
+    Parameters:
+        bootFile : bootstrap file of the same fit; the errors are replaced
+                   by the scatter of the bootstrap samples
+
+    Return:
+        fit   : dict of the fit statistics
+        comps : list of dict, one for each function; the center of the
+                function block (X0, Y0) is copied to all its functions
+    """
+    fit = dict((name, np.nan) for name, regex in STAT_RES)
+    if bootFile is not None:
+        scatter, fit['nboot'] = readBootstrap(bootFile)
+    else:
+        scatter, fit['nboot'] = {}, 0
+    nFree = {}
+    comps = []
+    block = {}
+    with open(paramFile, 'r') as parIn:
+        lines = parIn.readlines()
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            for name, regex in STAT_RES:
+                match = regex.search(line)
+                if match is not None:
+                    fit[name] = _number(match.group(1))
+            continue
+        text, _, comment = line.partition('#')
+        tokens = text.split()
+        if tokens[0] == 'FUNCTION':
+            label = LABEL_RE.search(comment)
+            comp = {'comp': len(comps) + 1, 'type': tokens[1],
+                    'label': label.group(1) if label else '', 'good': True}
+            comp.update(block)
+            comps.append(comp)
+            continue
+        if len(tokens) < 2:
+            continue
+        name = tokens[0].lower()
+        if name == 'x0':
+            """ X0 starts a new function block """
+            block = {}
+        value = _number(tokens[1])
+        if 'fixed' in tokens[2:]:
+            error, flag = np.nan, gHar.FLAG_FIXED
+        else:
+            index = nFree.get(name, 0)
+            nFree[name] = index + 1
+            match = ERROR_RE.search(comment)
+            error = _number(match.group(1)) if match else np.nan
+            if index < len(scatter.get(name, [])):
+                error = scatter[name][index]
+            flag = 0 if np.isfinite(value) else gHar.FLAG_BAD
+        if name in ('x0', 'y0'):
+            block.update({name: value, name + '_err': error,
+                          name + '_flag': flag})
+            continue
+        if not comps:
+            continue
+        comps[-1].update({name: value, name + '_err': error,
+                          name + '_flag': flag})
+        if flag == gHar.FLAG_BAD:
+            comps[-1]['good'] = False
+    if not comps:
+        raise Exception("### This is not an imfit parameter file : %s" %
+                        paramFile)
+
+    return fit, comps
+
+
+def sersicMag(comp, zp=27.0):
+    """Total magnitude of a Sersic function of imfit."""
+    try:
+        ar = 1.0 - comp['ell']
+        flux = comp['i_e'] / gMod.sersicIe(1.0, comp['r_e'], comp['n'], ar)
+    except (KeyError, ZeroDivisionError):
+        return np.nan
+    if not (np.isfinite(flux) and flux > 0):
+        return np.nan
+    return zp - 2.5 * np.log10(flux)
+
+
+def galaxyFiles(prefix, galRoot, rerun='default', maskType='mskfin',
+                imgSub=False, usePsf=True, useSig=True):
+    """
+    Input files of one galaxy.
+
+    Each file is looked for in the rerun folder first (written there,
+    linked, or inherited through the manifest of hscRerun), then in the
+    folder of the galaxy.
+    """
+    names = {'img': prefix + ('_imgsub.fits' if imgSub else '_img.fits'),
+             'msk': prefix + '_' + maskType + '.fits'}
+    if usePsf:
+        names['psf'] = prefix + '_psf.fits'
+    if useSig:
+        names['sig'] = prefix + '_sig.fits'
+    files = {}
+    for key, name in names.items():
+        path = hRerun.resolvePath(os.path.join(galRoot, rerun, name))
+        if not os.path.isfile(path):
+            path = os.path.join(galRoot, name)
+        if not os.path.isfile(path):
+            raise Exception("### Can not find the input file : %s" % name)
+        files[key] = path
+    return files
+
+
+def imfitJobs(prefix, files, space, outDir, models=MODELS, zp=27.0,
+              mag=18.5, nser=2.0, useSky=True, nThreads=1, solver='lm',
+              nBoot=0, autoRegion=False, verbose=False):
+    """
+    Stage the inputs of one galaxy, and prepare its imfit jobs.
+
+    Parameters:
+        files   : from galaxyFiles()
+        space   : galWorkspace.Workspace where imfit runs
+        outDir  : where the products are copied back
+        nThreads: number of threads of each imfit run
+        solver  : 'lm' (Levenberg-Marquardt), 'nm' or 'de'
+        nBoot   : number of bootstrap iterations, 0 for none
+
+    Return:
+        list of coaddGalfitRunner jobs
+    """
+    if solver not in SOLVERS:
+        raise Exception("### Unknown imfit solver : %s" % solver)
+    staged = {}
+    for key, path in files.items():
+        staged[key] = os.path.basename(path)
+        """ Copy, not link: imfit should only read from the workspace """
+        shutil.copyfile(path, space.path(path))
+
+    mskHead = fits.getheader(space.path(staged['msk']))
+    geom = imfitGeometry(mskHead)
+    if autoRegion:
+        mskArr = fits.getdata(space.path(staged['msk']))
+        if 'psf' in staged:
+            psfHead = fits.getheader(space.path(staged['psf']))
+            psfShape = (psfHead['NAXIS2'], psfHead['NAXIS1'])
+        else:
+            psfShape = None
+        plan = gReg.planFitRegion(mskArr.shape, geom['x'], geom['y'],
+                                  geom['r90'], q=geom['q'], pa=geom['pa'],
+                                  psfShape=psfShape, mskArr=mskArr)
+        region = (plan['x0'], plan['x1'], plan['y0'], plan['y1'])
+        if verbose:
+            print("###    Fitting region of %s : [%d:%d, %d:%d]" %
+                  ((prefix,) + region))
+        del mskArr
+    else:
+        region = None
+
+    jobs = []
+    for model in models:
+        name = prefix + '_' + model
+        cfgFile = writeImfitConfig(space.path(name + '.imfit'),
+                                   imfitConfig(geom, model=model, mag=mag,
+                                               zp=zp, nser=nser,
+                                               useSky=useSky))
+        products = [name + '.imfit', name + '.out', name + '_imfit_res.fits',
+                    name + '.imfit.log']
+        options = ['-c', os.path.basename(cfgFile),
+                   '--mask', imageSection(staged['msk'], region),
+                   '--save-params', name + '.out',
+                   '--save-residual', name + '_imfit_res.fits',
+                   '--max-threads', str(int(nThreads))]
+        if 'psf' in staged:
+            options += ['--psf', staged['psf']]
+        if 'sig' in staged:
+            options += ['--noise', imageSection(staged['sig'], region)]
+        if nBoot > 0:
+            options += ['--bootstrap', str(int(nBoot)),
+                        '--save-bootstrap', name + '_imfit_boot.dat']
+            products.append(name + '_imfit_boot.dat')
+        options += SOLVERS[solver]
+        job = gRun.galfitJob(name, imageSection(staged['img'], region),
+                             root=space.dir, imax=None,
+                             expect=space.path(name + '.out'),
+                             logFile=space.path(name + '.imfit.log'),
+                             options=options)
+        job.update({'model': model, 'outDir': outDir, 'products': products,
+                    'nThreads': int(nThreads)})
+        jobs.append(job)
+
+    return jobs
+
+
+def collectJob(job, result, space, zp=27.0):
+    """
+    Copy the products of a job back, and parse its parameter file.
+
+    Return:
+        list of rows, one for each function; one empty row when the fit
+        failed
+    """
+    for name in job['products']:
+        if os.path.isfile(space.path(name)):
+            space.copyOut(name, outDir=job['outDir'])
+    row = {'model': job['model'], 'status': result['status'],
+           'runtime': result['runtime'], 'attempts': result['attempts'],
+           'nthreads': job['nThreads'],
+           'file': os.path.join(job['outDir'], job['name'] + '.out')}
+    if result['status'] != gRun.DONE:
+        return [row]
+
+    bootFile = space.path(job['name'] + '_imfit_boot.dat')
+    try:
+        fit, comps = parseImfitParams(job['expect'],
+                                      bootFile=(bootFile if
+                                                os.path.isfile(bootFile)
+                                                else None))
+    except Exception as errMsg:
+        warnings.warn(str(errMsg))
+        row['status'] = gRun.FAIL
+        return [row]
+    row.update(fit)
+    rows = []
+    for comp in comps:
+        compRow = dict(row)
+        compRow.update(comp)
+        if comp['type'] == 'Sersic':
+            compRow['mag'] = sersicMag(comp, zp=zp)
+            compRow['ar'] = 1.0 - comp.get('ell', np.nan)
+        rows.append(compRow)
+
+    return rows
+
+
+def imfitTable(rows):
+    """Organize the rows into a table; missing parameters are NaN."""
+    first = [('galaxy', ''), ('filter', ''), ('model', ''), ('comp', 0),
+             ('type', ''), ('label', ''), ('good', False), ('status', ''),
+             ('runtime', np.nan), ('attempts', 0), ('nthreads', 0),
+             ('chi2', np.nan), ('chi2nu', np.nan), ('aic', np.nan),
+             ('bic', np.nan), ('nboot', 0), ('file', '')]
+    firstNames = [name for name, default in first]
+    params = sorted(set(key for row in rows for key in row) -
+                    set(firstNames))
+    columns = []
+    for name, default in first:
+        columns.append([row.get(name, default) for row in rows])
+    for name in params:
+        if name.endswith('_flag'):
+            columns.append(np.array([row.get(name, -1)
+                                     for row in rows], dtype=np.int16))
+        else:
+            columns.append(np.array([row.get(name, np.nan)
+                                     for row in rows], dtype=np.float64))
+    table = Table(columns, names=(firstNames + params))
+    if len(table) > 0:
+        table.sort(['galaxy', 'model', 'comp'])
+    table.meta['INDEX'] = 'galaxy,model,comp'
+
+    return table
+
+
+def imfitBatch(galaxies, prefix, root=None, filterUse='HSC-I',
+               rerun='default', models=MODELS, nJobs=1, nThreads=None,
+               timeout=None, maxCpu=None, maxMem=None, scratch=None,
+               imfit=None, output=None, maskType='mskfin', imgSub=False,
+               usePsf=True, useSig=True, useSky=True, zp=27.0, mag=18.5,
+               nser=2.0, solver='lm', nBoot=0, autoRegion=False,
+               verbose=False):
+    """
+    Fit a list of galaxies with imfit.
+
+    Parameters:
+        galaxies : list of galaxy IDs; the files of a galaxy are in
+                   <root>/<ID>/<filter>/ and named
+                   <prefix>_<ID>_<filter>_full_*.fits
+        nJobs    : number of imfit runs at the same time
+        nThreads : threads of each imfit run; the cores of the node are
+                   shared between the nJobs runs by default
+        scratch  : tmpfs for the inputs, default /dev/shm
+        output   : FITS (or .parquet) file for the results
+
+    Return:
+        the table of the results, one row for each function of each model
+    """
+    nThreads = defaultThreads(nJobs) if nThreads is None else nThreads
+    scratch = gWork.SCRATCH_ROOT if scratch is None else scratch
+    runner = gRun.GalfitRunner(nJobs=nJobs, timeout=timeout, maxCpu=maxCpu,
+                               maxMem=maxMem, maxRetry=0,
+                               galfit=findImfit(imfit))
+    chunk = max(nJobs, 1) * CHUNK
+    rows = []
+    t0 = time.time()
+    if verbose:
+        print(SEP)
+        print("###    %d galaxies, %d imfit runs at the same time, " %
+              (len(galaxies), nJobs) + "%d threads each" % nThreads)
+
+    for start in range(0, len(galaxies), chunk):
+        space = gWork.Workspace(root if root else '.', root=scratch,
+                                keep=KEEP_SUFFIX).start()
+        try:
+            jobs = []
+            for galID in galaxies[start:(start + chunk)]:
+                galID = str(galID).strip()
+                galPrefix = prefix + '_' + galID + '_' + filterUse + '_full'
+                galRoot = os.path.join(galID, filterUse)
+                if root is not None:
+                    galRoot = os.path.join(root, galRoot)
+                outDir = os.path.join(galRoot, rerun)
+                try:
+                    files = galaxyFiles(galPrefix, galRoot, rerun=rerun,
+                                        maskType=maskType, imgSub=imgSub,
+                                        usePsf=usePsf, useSig=useSig)
+                    if not os.path.isdir(outDir):
+                        os.makedirs(outDir)
+                    galJobs = imfitJobs(galPrefix, files, space, outDir,
+                                        models=models, zp=zp, mag=mag,
+                                        nser=nser, useSky=useSky,
+                                        nThreads=nThreads, solver=solver,
+                                        nBoot=nBoot, autoRegion=autoRegion,
+                                        verbose=verbose)
+                except Exception as errMsg:
+                    warnings.warn("### Can not prepare %s : %s" %
+                                  (galPrefix, str(errMsg)))
+                    rows.append({'galaxy': galID, 'filter': filterUse,
+                                 'status': gRun.FAIL})
+                    continue
+                for job in galJobs:
+                    job['galaxy'] = galID
+                jobs += galJobs
+
+            results = runner.run(jobs) if jobs else {}
+            for job in jobs:
+                for row in collectJob(job, results[job['name']], space,
+                                      zp=zp):
+                    row.update({'galaxy': job['galaxy'],
+                                'filter': filterUse})
+                    rows.append(row)
+        finally:
+            space.discard()
+        if verbose:
+            print("###    %d / %d galaxies done in %.1f sec" %
+                  (min(start + chunk, len(galaxies)), len(galaxies),
+                   time.time() - t0))
+
+    table = imfitTable(rows)
+    if output is not None:
+        gHar.saveHarvest(table, output)
+    if verbose:
+        summary = runner.report()
+        print("###    DONE: %d  FAIL: %d  TIMEOUT: %d" %
+              (summary[gRun.DONE], summary[gRun.FAIL],
+               summary[gRun.TIMEOUT]))
+        if output is not None:
+            print("###    Saved to %s" % output)
+        print(SEP)
+
+    return table
+
+
+def run(args):
+    """Run imfit on all the galaxies of a catalog."""
+    if not os.path.isfile(args.incat):
+        raise Exception("### Can not find the input catalog: %s" % args.incat)
+    data = fits.open(args.incat)[1].data
+    filterUse = (args.filterUse).strip().upper()
+    if args.output is None:
+        output = args.prefix + '_imfit_' + filterUse + '.fits'
+    else:
+        output = args.output
+    models = [model.strip() for model in args.models.split(',')]
+
+    imfitBatch(data[args.idCol], args.prefix.strip(), root=args.root,
+               filterUse=filterUse, rerun=args.rerun.strip(),
+               models=models, nJobs=args.njobs, nThreads=args.maxThreads,
+               timeout=args.timeout, maxCpu=args.maxCpu,
+               maxMem=args.maxMem, scratch=args.scratch, imfit=args.imfit,
+               output=output, maskType=args.maskType, imgSub=args.imgSub,
+               usePsf=args.usePsf, useSig=args.useSig, useSky=args.useSky,
+               zp=args.zp, mag=args.mag, nser=args.nser, solver=args.solver,
+               nBoot=args.nBoot, autoRegion=args.autoRegion,
+               verbose=args.verbose)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("prefix", help="Prefix of the galaxy image files")
+    parser.add_argument("incat", help="The input catalog")
+    parser.add_argument('-i', '--id', dest='idCol',
+                        help="Name of the column for galaxy ID",
+                        default='index')
+    parser.add_argument('--root', dest='root',
+                        help="Root of data", default=None)
+    parser.add_argument('-f', '--filter', dest='filterUse', help="Filter",
+                        default='HSC-I')
+    parser.add_argument('-mt', '--maskType', dest='maskType',
+                        help='Type of the mask use', default='mskfin')
+    parser.add_argument('-r', '--rerun', dest='rerun',
+                        help="Name of the rerun", default='default')
+    parser.add_argument('-o', '--output', dest='output',
+                        help="Table of the results (.fits or .parquet)",
+                        default=None)
+    parser.add_argument('-j', '--njobs', type=int,
+                        help='Number of imfit runs at the same time',
+                        dest='njobs', default=1)
+    parser.add_argument('--maxThreads', dest='maxThreads', type=int,
+                        help='Number of threads of each imfit run',
+                        default=None)
+    parser.add_argument('--models', dest='models',
+                        help='Models to fit, e.g. 1ser,2ser',
+                        default='1ser,2ser')
+    parser.add_argument('--solver', dest='solver',
+                        help='Solver of imfit: lm, nm or de',
+                        default='lm')
+    parser.add_argument('--bootstrap', dest='nBoot', type=int,
+                        help='Number of bootstrap iterations', default=0)
+    parser.add_argument('--zp', dest='zp', help='Photometric zeropoint',
+                        type=float, default=27.0)
+    parser.add_argument('--mag', dest='mag', help='Total magnitude',
+                        type=float, default=18.50)
+    parser.add_argument('--nser', dest='nser', help='Initial Sersic index',
+                        type=float, default=2.0)
+    parser.add_argument('--noPsf', dest='usePsf', action="store_false",
+                        default=True)
+    parser.add_argument('--noSig', dest='useSig', action="store_false",
+                        default=True)
+    parser.add_argument('--noSky', dest='useSky', action="store_false",
+                        default=True)
+    parser.add_argument('--imgSub', dest='imgSub', action="store_true",
+                        default=False)
+    parser.add_argument('--autoRegion', dest='autoRegion',
+                        action="store_true", default=False)
+    parser.add_argument('--timeout', dest='timeout',
+                        help='Wall-clock limit of one imfit run (sec)',
+                        type=float, default=None)
+    parser.add_argument('--maxCpu', dest='maxCpu',
+                        help='CPU time limit of one imfit run (sec)',
+                        type=int, default=None)
+    parser.add_argument('--maxMem', dest='maxMem',
+                        help='Memory limit of one imfit run (MB)',
+                        type=float, default=None)
+    parser.add_argument('--scratch', dest='scratch',
+                        help='tmpfs folder for the inputs',
+                        default=None)
+    parser.add_argument('--imfit', dest='imfit',
+                        help='Path to the imfit executable', default=None)
+    parser.add_argument('-v', '--verbose', dest='verbose',
+                        action="store_true", default=False)
+
+    args = parser.parse_args()
+
+    run(args)
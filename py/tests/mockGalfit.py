@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Stand-in for the GALFIT executable, for the tests.
+
+    mockGalfit.py [-imax N] [options] <read-in file>
+
+Same as GALFIT, it writes the output model of the B) line, and the
+galfit.NN and fit.log files in the working directory.  Lines of the
+read-in file control it:
+
+    # MOCK sleep <sec> <imax>  : sleep when -imax is larger than <imax>
+    # MOCK fail                : exit without an output model
+"""
+
+from __future__ import (division, print_function)
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from astropy.io import fits
+
+
+def readMenu(readFile):
+    """The A) - K) lines and the MOCK lines of a read-in file."""
+    menu, mock = {}, []
+    for line in open(readFile, 'r'):
+        line = line.strip()
+        if line.startswith('# MOCK'):
+            mock.append(line.split()[2:])
+        elif len(line) > 2 and line[1] == ')' and line[0] in 'ABCDFGHIJ':
+            menu[line[0]] = line[2:].split('#')[0].strip()
+    return menu, mock
+
+
+def nextLog():
+    """Next galfit.NN in the working directory."""
+    num = 1
+    while os.path.isfile('galfit.%02d' % num):
+        num += 1
+    return 'galfit.%02d' % num
+
+
+def main(argv):
+    readFile, imax = argv[-1], 100
+    if '-imax' in argv:
+        imax = int(argv[argv.index('-imax') + 1])
+    menu, mock = readMenu(readFile)
+    print("Mock GALFIT: %s  imax=%d" % (readFile, imax))
+    sys.stdout.flush()
+    for cmd in mock:
+        if cmd[0] == 'sleep' and imax > int(cmd[2]):
+            time.sleep(float(cmd[1]))
+        if cmd[0] == 'fail':
+            print("Mock GALFIT failed")
+            return 1
+
+    """ The galfit.NN is the read-in file with the best-fit parameters """
+    logFile = nextLog()
+    with open(logFile, 'w') as logOut:
+        logOut.write("#  Input menu file: %s\n" % readFile)
+        logOut.write("# Best fit\n")
+        logOut.write(open(readFile, 'r').read())
+    with open('fit.log', 'a') as fitLog:
+        fitLog.write("Init. par. file : %s\nRestart file    : %s\n" %
+                     (readFile, logFile))
+
+    model = np.ones((10, 10))
+    head = fits.Header()
+    head['COMMENT'] = 'Mock GALFIT'
+    head['INITFILE'] = readFile
+    for key, item in [('DATAIN', 'A'), ('SIGMA', 'C'), ('PSF', 'D'),
+                      ('CONSTRNT', 'G'), ('MASK', 'F')]:
+        head[key] = menu.get(item, 'none')
+    head['MAGZPT'] = float(menu.get('J', 27.0))
+    head['FITSECT'] = '[1:10,1:10]'
+    head['CONVBOX'] = '10, 10'
+    head['CHISQ'], head['NDOF'], head['NFREE'] = 100.0, 90, 10
+    head['CHI2NU'] = 1.1
+    head['LOGFILE'] = logFile
+    head['COMP_1'] = 'sersic'
+    head['1_XC'] = '5.0000 +/- 0.0100'
+    head['1_YC'] = '5.0000 +/- 0.0100'
+    head['1_MAG'] = '18.0000 +/- 0.0100'
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(model),
+                  fits.ImageHDU(model, header=head),
+                  fits.ImageHDU(model * 0.0)]).writeto(menu['B'],
+                                                       overwrite=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
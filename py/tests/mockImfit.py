@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Stand-in for the imfit executable, for the tests.
+
+    mockImfit.py -c <config> [options] <image>[x0:x1,y0:y1]
+
+The best fit is the initial guess of the config file.  Same as imfit, it
+writes the parameter file (--save-params), the residual image
+(--save-residual) and the bootstrap samples (--save-bootstrap), and
+prints its command line.  It fails when an input file is not in the
+working directory, or when the name of the image contains the value of
+the MOCK_IMFIT_FAIL environment variable.
+"""
+
+from __future__ import (division, print_function)
+
+import os
+import re
+import sys
+
+import numpy as np
+
+from astropy.io import fits
+
+SECTION_RE = re.compile(r'^(.*)\[(\d+):(\d+),(\d+):(\d+)\]$')
+VALUE_OPTIONS = ['-c', '--mask', '--psf', '--noise', '--save-params',
+                 '--save-residual', '--save-bootstrap', '--bootstrap',
+                 '--max-threads']
+
+
+def parseArgs(argv):
+    """Options with a value, and the image."""
+    options, ii = {}, 0
+    while ii < len(argv) - 1:
+        if argv[ii] in VALUE_OPTIONS:
+            options[argv[ii]] = argv[ii + 1]
+            ii += 2
+        else:
+            options[argv[ii]] = True
+            ii += 1
+    return options, argv[-1]
+
+
+def splitSection(fileName):
+    """File name and (x0, x1, y0, y1), or None without a section."""
+    match = SECTION_RE.match(fileName)
+    if match is None:
+        return fileName, None
+    return match.group(1), tuple(int(val) for val in match.groups()[1:])
+
+
+def readConfig(cfgFile):
+    """Parameter lines of a config file: (name, value, fixed) or FUNCTION."""
+    lines = []
+    for line in open(cfgFile, 'r'):
+        text, _, comment = line.partition('#')
+        tokens = text.split()
+        if not tokens:
+            continue
+        if tokens[0] == 'FUNCTION':
+            lines.append(('FUNCTION', tokens[1], comment.strip()))
+        else:
+            lines.append((tokens[0], float(tokens[1]), 'fixed' in tokens))
+    return lines
+
+
+def main(argv):
+    print("Mock imfit: %s" % ' '.join(argv))
+    sys.stdout.flush()
+    options, image = parseArgs(argv)
+    imgFile, section = splitSection(image)
+    inputs = [imgFile, options['-c']]
+    for key in ['--mask', '--psf', '--noise']:
+        if key in options:
+            inputs.append(splitSection(options[key])[0])
+    for fileName in inputs:
+        if not os.path.isfile(fileName):
+            print("Mock imfit: can not find %s" % fileName)
+            return 1
+    failKey = os.environ.get('MOCK_IMFIT_FAIL', '')
+    if failKey and (failKey in imgFile):
+        print("Mock imfit failed")
+        return 1
+
+    config = readConfig(options['-c'])
+    free = []
+    with open(options['--save-params'], 'w') as parOut:
+        parOut.write('# Best-fit model results for "%s"\n' % image)
+        parOut.write('# Fit statistic: chi^2 = 12345.6789\n')
+        parOut.write('# Reduced value: reduced chi^2 = 1.0234\n')
+        parOut.write('# AIC = 12380.1234\n# BIC = 12500.5678\n\n')
+        for name, value, fixed in config:
+            if name == 'FUNCTION':
+                parOut.write('\nFUNCTION %s   # %s\n' % (value, fixed))
+            elif fixed:
+                parOut.write('%-8s %12.4f   fixed\n' % (name, value))
+            else:
+                parOut.write('%-8s %12.4f   # +/- 0.0100\n' % (name, value))
+                free.append((name, value))
+
+    data = fits.getdata(imgFile)
+    if section is not None:
+        x0, x1, y0, y1 = section
+        data = data[(y0 - 1):y1, (x0 - 1):x1]
+    if '--save-residual' in options:
+        fits.PrimaryHDU(np.zeros_like(data)).writeto(
+            options['--save-residual'], overwrite=True)
+
+    if '--save-bootstrap' in options:
+        nBoot = int(options['--bootstrap'])
+        count = {}
+        names = []
+        for name, value in free:
+            count[name] = count.get(name, 0) + 1
+            names.append('%s_%d' % (name, count[name]))
+        """ The scatter of the samples is 0.1 for every parameter """
+        samples = np.array([value for name, value in free]) + 0.1 * \
+            np.tile([[-1.0], [1.0]], (nBoot // 2, len(free)))
+        np.savetxt(options['--save-bootstrap'], samples, fmt='%.6f',
+                   header=' '.join(names))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Put the script folders on the path, the same way as the batch runs."""
+
+import os
+import sys
+
+PY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+for folder in ['hscUtils', 'hscCoadd', 'galsbp', 'galfit', 'imfit']:
+    path = os.path.join(PY_DIR, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Forced photometry in annuli with a twisted and off-centre geometry."""
+
+from __future__ import (division, print_function)
+
+import unittest
+
+import numpy as np
+
+from astropy.table import Table
+
+import setupPath  # noqa
+import galSBP as gSBP
+import galIsophote as gIso
+import galAnnulus as gAnn
+
+SHAPE = (400, 400)
+SMA = 5.0 * (1.1 ** np.arange(35))
+SMA = SMA[SMA < 160.0]
+
+
+def twistGeom(sma):
+    """
+    Geometry of the model: the PA turns by 60 deg and the center moves
+    by 6 pixels from the inside to the outside (0-indexed, radians).
+    """
+    frac = np.clip(np.log(sma / 5.0) / np.log(160.0 / 5.0), 0.0, 1.0)
+    return (200.0 + 6.0 * frac, 190.0 + 3.0 * frac, 0.35,
+            np.radians(20.0 + 60.0 * frac))
+
+
+def ellRadius(xx, yy, sma):
+    x0, y0, eps, pa = twistGeom(sma)
+    dx, dy = xx - x0, yy - y0
+    xr = dx * np.cos(pa) + dy * np.sin(pa)
+    yr = (-dx * np.sin(pa) + dy * np.cos(pa)) / (1.0 - eps)
+    return np.hypot(xr, yr)
+
+
+def modelSma(shape):
+    """Semi-major axis of the isophote through every pixel (bisection)."""
+    yy, xx = np.indices(shape).astype(float)
+    low, upp = np.full(shape, 1.0E-3), np.full(shape, 1000.0)
+    for _ in range(50):
+        mid = 0.5 * (low + upp)
+        outside = ellRadius(xx, yy, mid) > mid
+        low, upp = np.where(outside, mid, low), np.where(outside, upp, mid)
+    return 0.5 * (low + upp)
+
+
+def modelTable():
+    x0, y0, eps, pa = twistGeom(SMA)
+    return Table({'sma': SMA, 'x0': x0 + 1.0, 'y0': y0 + 1.0,
+                  'ell': np.full(len(SMA), eps),
+                  'pa': np.degrees(pa) - 90.0})
+
+
+class AnnulusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.smaMap = modelSma(SHAPE)
+        self.isoIn = modelTable()
+        self.ellipConfig = gSBP.defaultEllipse(201.0, 191.0, 160.0,
+                                               integrmode='mean', nclip=0,
+                                               step=0.1)
+
+    def testRingArea(self):
+        """Every annulus has the area between its own ellipses."""
+        geom = gAnn.isoGeometry(self.isoIn)
+        edges = gAnn.annulusEdges(geom['sma'])
+        pix = gAnn.annulusPixels(SHAPE, geom, edges)
+        nPix = np.bincount(pix['label'], minlength=len(geom))
+        area = np.pi * (1.0 - geom['eps']) * (edges[1:] ** 2.0 -
+                                               edges[:-1] ** 2.0)
+        use = geom['sma'] > 30.0
+        self.assertTrue(np.allclose(nPix[use], area[use], rtol=0.03))
+
+    def testTwistedProfile(self):
+        """The mean intensity follows the model along the twist."""
+        img = np.exp(-self.smaMap / 30.0)
+        isoTab = gAnn.annulusProfile(img, self.ellipConfig, self.isoIn)
+        use = isoTab['sma'] > 10.0
+        model = np.exp(-isoTab['sma'][use] / 30.0)
+        self.assertTrue(np.allclose(isoTab['intens'][use], model,
+                                    rtol=0.02))
+
+    def testSameAsIsophote(self):
+        """Same intensities and total fluxes as the force mode of ELLIPSE."""
+        img = np.exp(-self.smaMap / 30.0)
+        ellipConfig = gSBP.defaultEllipse(201.0, 191.0, 160.0,
+                                          integrmode='bi-linear', nclip=0,
+                                          step=0.1)
+        isoAnn = gAnn.annulusProfile(img, self.ellipConfig, self.isoIn)
+        isoRef = gIso.ellipseFit(img, ellipConfig, inEllip=self.isoIn)
+        use = isoAnn['sma'] > 10.0
+        self.assertTrue(np.allclose(isoAnn['intens'][use],
+                                    isoRef['intens'][use], rtol=0.02))
+        for col in ['tflux_e', 'tflux_c', 'npix_e', 'npix_c']:
+            self.assertTrue(np.allclose(isoAnn[col], isoRef[col]))
+
+
+if __name__ == '__main__':
+    unittest.main()
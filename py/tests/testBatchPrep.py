@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Order and failure isolation of the batch preparation."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.table import Table
+
+import setupPath  # noqa
+import batchPrep as bPrep
+
+PREFIX = 'redBCG'
+FILTER = 'HSC-I'
+""" Size of the cutout of each galaxy """
+GALAXIES = {'1': 20, '2': 80, '3': 40, '4': 60, '5': 30}
+""" One galaxy raises an error, the other one kills its worker """
+BAD, CRASH = '4', '3'
+
+
+def fakePrepare(galPrefix, root=None, brightStar=None, **kwargs):
+    """Record the order of the galaxies, fail on the bad ones."""
+    if BAD in galPrefix.split('_'):
+        raise Exception('### Bad galaxy')
+    if CRASH in galPrefix.split('_'):
+        os._exit(3)
+    with open('order.txt', 'a') as orderFile:
+        orderFile.write(galPrefix + '\n')
+
+
+def skipCrash(galPrefix, **kwargs):
+    """Same as fakePrepare, without killing the only process."""
+    if CRASH not in galPrefix.split('_'):
+        fakePrepare(galPrefix, **kwargs)
+
+
+class BatchPrepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.oriDir = os.getcwd()
+        self.workDir = tempfile.mkdtemp()
+        os.chdir(self.workDir)
+        for galID, size in GALAXIES.items():
+            galRoot = os.path.join(galID, FILTER)
+            os.makedirs(galRoot)
+            fits.writeto(os.path.join(galRoot, '%s_%s_%s_full_img.fits' %
+                                      (PREFIX, galID, FILTER)),
+                         np.zeros((size, size), dtype=np.float32))
+        """ A galaxy without its folder """
+        Table({'ID': sorted(GALAXIES) + ['6']}).write('cat.fits',
+                                                      format='fits')
+        self.oriPrepare = bPrep.ccp.coaddCutoutPrepare
+        bPrep.ccp.coaddCutoutPrepare = fakePrepare
+
+    def tearDown(self):
+        bPrep.ccp.coaddCutoutPrepare = self.oriPrepare
+        os.chdir(self.oriDir)
+        shutil.rmtree(self.workDir)
+
+    def testLargestFirst(self):
+        """The failures only lose their own galaxy."""
+        args = bPrep.buildParser().parse_args([PREFIX, 'cat.fits', '-i',
+                                               'ID', '-j', '2'])
+        results = bPrep.run(args)
+        status = dict((res[0].split('_')[1], res[1]) for res in results)
+        self.assertEqual(status, {'1': 'DONE', '2': 'DONE', '3': 'FAIL',
+                                  '4': 'FAIL', '5': 'DONE'})
+        with open('%s_prep_%s.log' % (PREFIX, FILTER)) as logFile:
+            log = logFile.read()
+        for galID, flag in [('3', 'FAIL'), ('4', 'FAIL'), ('6', 'NDIR')]:
+            self.assertIn('%s_%s_%s_full' % (PREFIX, galID, FILTER), log)
+            self.assertIn(flag, log)
+
+        """ One process runs the galaxies from the largest one """
+        args.njobs = 1
+        args.verbose = False
+        os.remove('order.txt')
+        bPrep.ccp.coaddCutoutPrepare = skipCrash
+        bPrep.run(args)
+        with open('order.txt') as orderFile:
+            order = [line.split('_')[1] for line in orderFile]
+        self.assertEqual(order, ['2', '5', '1'])
+
+    def testThreads(self):
+        self.assertIsNone(bPrep.threadsFromArgv([PREFIX, 'cat.fits']))
+        self.assertEqual(bPrep.threadsFromArgv([PREFIX, 'cat.fits', '-j',
+                                                '4']), 1)
+        self.assertEqual(bPrep.threadsFromArgv([PREFIX, 'cat.fits', '-j',
+                                                '4', '--nthreads', '2']), 2)
+        oriEnv = dict(os.environ)
+        try:
+            bPrep.setThreadEnv(3)
+            for key in bPrep.THREAD_VARS:
+                self.assertEqual(os.environ[key], '3')
+        finally:
+            os.environ.clear()
+            os.environ.update(oriEnv)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Detection tree against two separate sep.extract() runs."""
+
+from __future__ import (division, print_function)
+
+import unittest
+
+import numpy as np
+
+import sep
+
+import setupPath  # noqa
+import coaddDetectTree as cdt
+import coaddCutoutPrepare as cPrep
+
+""" (x, y, flux, sigma) of the sources; the first two blend in the Cold run """
+SOURCES = [(60.0, 60.0, 4000.0, 3.0), (68.0, 62.0, 3000.0, 2.5),
+           (150.0, 40.0, 2000.0, 2.0), (40.0, 160.0, 300.0, 4.0),
+           (170.0, 170.0, 1500.0, 1.5)]
+
+
+def synthImage(shape=(200, 200), noise=1.0, seed=3):
+    """Gaussian sources on top of the noise."""
+    yy, xx = np.mgrid[0:shape[0], 0:shape[1]]
+    img = np.random.RandomState(seed).normal(0.0, noise, shape)
+    for x0, y0, flux, sigma in SOURCES:
+        img += (flux / (2.0 * np.pi * sigma ** 2.0) *
+                np.exp(-((xx - x0) ** 2.0 + (yy - y0) ** 2.0) /
+                       (2.0 * sigma ** 2.0)))
+    return img
+
+
+class DetectTreeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.imgC = synthImage()
+        """ The Hot run has its own background """
+        self.imgH = self.imgC - 0.2
+        self.kerC = cPrep.getConvKernel(4)
+        self.kerH = cPrep.getConvKernel(2)
+        self.par = {'thresh': [1.5, 6.0], 'minarea': [8, 4],
+                    'nthresh': [32, 16], 'cont': [1.0, 0.0001]}
+
+    def runSep(self, ii, img, kernel):
+        return sep.extract(img, self.par['thresh'][ii], err=1.0,
+                           minarea=self.par['minarea'][ii],
+                           filter_kernel=kernel, filter_type='matched',
+                           deblend_nthresh=self.par['nthresh'][ii],
+                           deblend_cont=self.par['cont'][ii],
+                           segmentation_map=True)
+
+    def runTree(self):
+        return cdt.detectTree([self.imgC, self.imgH], self.par['thresh'],
+                              minarea=self.par['minarea'], err=1.0,
+                              filter_kernel=[self.kerC, self.kerH],
+                              deblend_nthresh=self.par['nthresh'],
+                              deblend_cont=self.par['cont'])
+
+    def testSameAsSep(self):
+        objTree, segTree = self.runTree()
+        for ii, (img, kernel) in enumerate([(self.imgC, self.kerC),
+                                            (self.imgH, self.kerH)]):
+            objSep, segSep = self.runSep(ii, img, kernel)
+            self.assertEqual(len(objTree[ii]), len(objSep))
+            for col in objSep.dtype.names:
+                self.assertTrue(np.array_equal(objTree[ii][col], objSep[col]),
+                                col)
+            self.assertTrue(np.array_equal(segTree[ii], segSep))
+            self.assertTrue(np.all(objTree[ii]['level'] == ii))
+            self.assertTrue(np.array_equal(objTree[ii]['id'],
+                                           np.arange(len(objSep))))
+
+    def testLinks(self):
+        (objC, objH), (segC, segH) = self.runTree()
+        """ The parent is the Cold segment under the peak """
+        self.assertTrue(np.array_equal(
+            objH['parent'], segC[objH['ycpeak'], objH['xcpeak']] - 1))
+        self.assertTrue(np.array_equal(objH['root'], objH['parent']))
+        self.assertTrue(np.all(objC['parent'] == -1))
+        """ The blended pair is one Cold object, and two Hot ones """
+        blend = segC[60, 60] - 1
+        self.assertEqual(segC[62, 68] - 1, blend)
+        self.assertEqual(np.sum(objH['parent'] == blend), 2)
+
+    def testMerge(self):
+        (objC, objH), _ = self.runTree()
+        objC, objH = cPrep.sepValidObjects(objC), cPrep.sepValidObjects(objH)
+        objComb, objHnew, objCnew = cdt.combTreeCat(objC, objH, keepH=True)
+        """ The Cold objects without a Hot one inside are kept """
+        kept = [cid for cid in objC['id'] if cid not in objH['root']]
+        self.assertEqual(sorted(objCnew['id']), sorted(kept))
+        self.assertEqual(len(objComb), len(objH) + len(kept))
+        self.assertTrue(np.all(objHnew['root'] == -1))
+        """ The faint source is only in the Cold run """
+        faint = np.hypot(objComb['x'] - 40.0, objComb['y'] - 160.0) < 3.0
+        self.assertEqual(np.sum(faint), 1)
+        self.assertEqual(objComb['level'][faint][0], 0)
+        """ Both sources of the blend are there, and not the blend """
+        for x0, y0 in [(60.0, 60.0), (68.0, 62.0)]:
+            near = np.hypot(objComb['x'] - x0, objComb['y'] - y0) < 2.0
+            self.assertEqual(np.sum(near), 1)
+            self.assertEqual(objComb['level'][near][0], 1)
+
+        objComb, objHnew, objCnew = cdt.combTreeCat(objC, objH, keepH=False)
+        self.assertEqual(len(objComb), len(objC) + len(objHnew))
+
+
+if __name__ == '__main__':
+    unittest.main()
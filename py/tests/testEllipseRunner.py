@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Concurrent ELLIPSE jobs with crashed and slow workers."""
+
+from __future__ import (division, print_function)
+
+import os
+import time
+import unittest
+
+import setupPath  # noqa
+import galSBP
+import coaddEllipseRunner as cRunner
+
+
+def fakeGalSBP(image, mode='ok', **kwargs):
+    """Stand-in for galSBP(); the workers are forked, so they use it too."""
+    if mode == 'crash':
+        os._exit(3)
+    if mode == 'slow':
+        time.sleep(60)
+    if mode == 'error':
+        raise Exception('bad isophotes')
+    return (image + '.fits', image + '.bin')
+
+
+class EllipseRunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.oriGalSBP = galSBP.galSBP
+        galSBP.galSBP = fakeGalSBP
+
+    def tearDown(self):
+        galSBP.galSBP = self.oriGalSBP
+
+    def makeJobs(self):
+        return [cRunner.ellipseJob('good', 'img1', mode='ok'),
+                cRunner.ellipseJob('crash', 'img2', mode='crash'),
+                cRunner.ellipseJob('slow', 'img3', mode='slow'),
+                cRunner.ellipseJob('error', 'img4', mode='error'),
+                cRunner.ellipseJob('after', 'img5', after=['crash'],
+                                   mode='ok'),
+                cRunner.ellipseJob('next', 'img6', after=['good'],
+                                   mode='ok')]
+
+    def testFailedWorkers(self):
+        t0 = time.time()
+        results, errors = cRunner.runEllipseJobs(self.makeJobs(), nProc=3,
+                                                 timeout=3.0)
+        self.assertLess(time.time() - t0, 30.0)
+        self.assertEqual(results['good'][0], os.path.abspath('img1') +
+                         '.fits')
+        self.assertEqual(results['next'][1], os.path.abspath('img6') +
+                         '.bin')
+        self.assertEqual(sorted(errors.keys()),
+                         ['after', 'crash', 'error', 'slow'])
+        self.assertIn('crashed', errors['crash'])
+        self.assertIn('timed out', errors['slow'])
+        self.assertIn('bad isophotes', errors['error'])
+        self.assertIn('Skipped', errors['after'])
+        for name in errors:
+            self.assertEqual(results[name], (None, None))
+
+    def testSequential(self):
+        jobs = [job for job in self.makeJobs()
+                if job['name'] in ('good', 'error', 'next')]
+        results, errors = cRunner.runEllipseJobs(jobs, nProc=1)
+        self.assertEqual(sorted(results.keys()), ['error', 'good', 'next'])
+        self.assertEqual(list(errors.keys()), ['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
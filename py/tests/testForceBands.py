@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Forced photometry of many bands read back by the summary."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.io import fits
+
+import setupPath  # noqa
+import galSBP as gSBP
+import galIsophote as gIso
+import coaddForceBands as cForce
+import coaddCutoutSbpSummary as cSummary
+from testIsophote import synthImage
+
+PREFIX = 'redBCG'
+GALID = '1234'
+FILTERS = ['HSC-G', 'HSC-I']
+
+
+class ForceBandsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        img = synthImage(nx=256, ny=256, bkg=0.0, sma=20.0)
+        for ii, band in enumerate(FILTERS):
+            bandDir = os.path.join(self.root, GALID, band)
+            os.makedirs(bandDir)
+            fits.PrimaryHDU(img * (ii + 1.0)).writeto(
+                os.path.join(bandDir, '%s_%s_%s_full_img.fits' %
+                             (PREFIX, GALID, band)))
+        ellipConfig = gSBP.defaultEllipse(129.0, 129.0, 80.0, ellip0=0.2,
+                                          pa0=-45.0, sma0=10.0,
+                                          hcenter=False, hellip=False,
+                                          hpa=False, integrmode='mean')
+        self.inEllip = gIso.saveIsoTable(
+            gIso.ellipseFit(img, ellipConfig),
+            os.path.join(self.root, 'ref_iso.fits'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testSummaryReadsBands(self):
+        ellipOuts, outFile = cForce.coaddForceBands(GALID, PREFIX, FILTERS,
+                                                    self.inEllip,
+                                                    root=self.root)
+        self.assertTrue(os.path.isfile(outFile))
+        for ii, band in enumerate(FILTERS):
+            prof = cSummary.getEllipProfile(GALID, self.root, PREFIX, '4',
+                                            filter=band, imgSub=False)
+            self.assertIsNotNone(prof, band)
+            self.assertTrue(np.allclose(prof['intens'],
+                                        ellipOuts[band]['intens'],
+                                        equal_nan=True))
+        ratio = (ellipOuts['HSC-I']['intens'] /
+                 ellipOuts['HSC-G']['intens'])
+        self.assertTrue(np.allclose(ratio[np.isfinite(ratio)], 2.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
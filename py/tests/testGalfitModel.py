@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Rendered GALFIT components against a stored reference cube."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.io import fits
+
+import setupPath  # noqa
+import galfitHarvest as gHar
+import galfitModel as gMod
+import coaddCutoutGalfitSimple as cGalfit
+
+REF_CUBE = os.path.join(setupPath.DATA_DIR, 'galfit_subcomps_ref.fits')
+REF_PSF = os.path.join(setupPath.DATA_DIR, 'galfit_psf_ref.fits')
+
+
+def writeGalfitOut(outFile, psfFile):
+    """
+    A GALFIT output block (data, model, residual) with the components of
+    the reference cube.
+    """
+    with fits.open(REF_CUBE) as ref:
+        data = ref[1].data.astype(np.float64)
+        head = ref[1].header.copy()
+    head['COMMENT'] = 'GALFIT output block for the tests'
+    head['INITFILE'] = outFile.replace('.fits', '.in')
+    head['LOGFILE'] = 'galfit.01'
+    for key in ['DATAIN', 'SIGMA', 'CONSTRNT', 'MASK']:
+        head[key] = 'none'
+    head['PSF'] = psfFile
+    head['CHISQ'], head['NDOF'], head['NFREE'] = 100.0, 90, 10
+    head['CHI2NU'] = 1.1
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data),
+                  fits.ImageHDU(data, header=head),
+                  fits.ImageHDU(data * 0.0)]).writeto(outFile,
+                                                      overwrite=True)
+    return outFile
+
+
+class GalfitModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        with fits.open(REF_CUBE) as ref:
+            self.refHead = ref[1].header.copy()
+            self.refComps = [hdu.data.astype(np.float64) for hdu in ref[2:]]
+        self.psf = fits.getdata(REF_PSF)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def checkComps(self, subComps):
+        self.assertEqual(len(subComps), len(self.refComps))
+        for image, ref in zip(subComps, self.refComps):
+            self.assertEqual(image.shape, ref.shape)
+            self.assertLess(abs(np.sum(image) / np.sum(ref) - 1.0), 1.0E-3)
+            self.assertLess(np.max(np.abs(image - ref)) / np.max(ref),
+                            1.0E-3)
+
+    def testSameAsReference(self):
+        fit, comps = gHar.parseHeader(self.refHead)
+        model, subComps = gMod.renderModel(
+            comps, self.refComps[0].shape, psf=self.psf, x0=fit['box_x0'],
+            y0=fit['box_y0'], zp=self.refHead['MAGZPT'])
+        self.checkComps(subComps)
+        self.assertTrue(np.allclose(model, np.sum(subComps, axis=0)))
+
+    def testPostRun(self):
+        """The components are saved after the run, next to the read-in."""
+        psfFile = os.path.join(self.tmpDir, 'psf.fits')
+        shutil.copy(REF_PSF, psfFile)
+        readFile = os.path.join(self.tmpDir, 'cutout_2ser.in')
+        expect = writeGalfitOut(readFile.replace('.in', '.fits'), psfFile)
+        done, plot = cGalfit.galfitPostRun(readFile, expect,
+                                           updateRead=False, show=False,
+                                           savePkl=False, subComp=True)
+        self.assertTrue(done)
+        compFiles = [readFile.replace('.in', '_comp%d.fits' % nn)
+                     for nn in range(1, len(self.refComps) + 2)]
+        images = [fits.getdata(compFile).astype(np.float64)
+                  for compFile in compFiles]
+        """ Same as subcomps.fits: the data come first """
+        self.assertTrue(np.allclose(images[0], fits.getdata(expect, 1),
+                                    rtol=1.0E-5))
+        self.checkComps(images[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Fitting region and convolution box of GALFIT."""
+
+from __future__ import (division, print_function)
+
+import unittest
+
+import numpy as np
+
+import setupPath  # noqa
+import coaddGalfitRegion as cRegion
+
+
+def isFftSize(size):
+    """Only factors of 2, 3, 5 and 7."""
+    for prime in cRegion.FFT_PRIMES:
+        while size % prime == 0:
+            size //= prime
+    return size == 1
+
+
+class GalfitRegionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.shape = (1200, 1000)
+        self.mskArr = np.zeros(self.shape, dtype='uint8')
+
+    def checkBox(self, plan):
+        ny, nx = self.shape
+        self.assertGreaterEqual(plan['x0'], 1)
+        self.assertGreaterEqual(plan['y0'], 1)
+        self.assertLessEqual(plan['x1'], nx)
+        self.assertLessEqual(plan['y1'], ny)
+        for width, size in [(plan['x1'] - plan['x0'] + 1, nx),
+                            (plan['y1'] - plan['y0'] + 1, ny)]:
+            """ Only clipped to the size of the cutout """
+            self.assertTrue(isFftSize(width) or width == size, width)
+
+    def testFftSize(self):
+        for size in range(1, 2100):
+            best = cRegion.fftSize(size)
+            self.assertGreaterEqual(best, size)
+            self.assertTrue(isFftSize(best), best)
+            """ The smallest one """
+            for other in range(size, best):
+                self.assertFalse(isFftSize(other), other)
+        self.assertEqual(cRegion.fftSize(11), 12)
+        self.assertEqual(cRegion.fftSize(1031), 1050)
+        self.assertEqual(cRegion.fftSize(12.2), 14)
+        self.assertEqual(cRegion.fftSize(0), 1)
+
+    def testEllipseExtent(self):
+        self.assertTrue(np.allclose(cRegion.ellipseExtent(10.0, 1.0, 33.0),
+                                    (10.0, 10.0)))
+        self.assertTrue(np.allclose(cRegion.ellipseExtent(10.0, 0.5, 0.0),
+                                    (5.0, 10.0)))
+        self.assertTrue(np.allclose(cRegion.ellipseExtent(10.0, 0.5, 90.0),
+                                    (10.0, 5.0)))
+
+    def testCenter(self):
+        plan = cRegion.planFitRegion(self.shape, 500.0, 600.0, 40.0,
+                                     q=0.8, pa=30.0, psfShape=(41, 41),
+                                     mskArr=self.mskArr, minSky=100)
+        self.checkBox(plan)
+        self.assertEqual(plan['grow'], 1.0)
+        """ The region covers nR90 * R90 and half of the PSF """
+        halfX, halfY = cRegion.ellipseExtent(2.5 * 40.0, 0.8, 30.0)
+        self.assertLessEqual(plan['x0'], 500.0 - halfX - 20.5)
+        self.assertGreaterEqual(plan['x1'], 500.0 + halfX + 20.5)
+        self.assertLessEqual(plan['y0'], 600.0 - halfY - 20.5)
+        self.assertGreaterEqual(plan['y1'], 600.0 + halfY + 20.5)
+        self.assertLess(plan['x1'] - plan['x0'] + 1, 400)
+        self.assertTrue(isFftSize(plan['convbox']))
+        self.assertGreaterEqual(plan['convbox'], 2.0 * 1.5 * 40.0 + 41.0)
+
+    def testEdge(self):
+        """The region is shifted and clipped at the edges of the cutout."""
+        plan = cRegion.planFitRegion(self.shape, 10.0, 1190.0, 40.0,
+                                     psfShape=(41, 41), mskArr=self.mskArr,
+                                     minSky=100)
+        self.checkBox(plan)
+        self.assertEqual(plan['x0'], 1)
+        self.assertEqual(plan['y1'], self.shape[0])
+        """ Larger than the cutout """
+        plan = cRegion.planFitRegion(self.shape, 500.0, 600.0, 800.0,
+                                     mskArr=self.mskArr)
+        self.assertEqual((plan['x0'], plan['x1'], plan['y0'], plan['y1']),
+                         (1, self.shape[1], 1, self.shape[0]))
+        self.assertEqual(plan['pixRatio'], 1.0)
+        self.assertLessEqual(plan['convbox'], max(self.shape))
+
+    def testMinSky(self):
+        """The region grows until there are enough sky pixels."""
+        args = (self.shape, 500.0, 600.0, 40.0)
+        small = cRegion.planFitRegion(*args, mskArr=self.mskArr, minSky=100)
+        rad = 2.5 * 40.0
+        plans = {}
+        for minSky in [60000, 150000]:
+            plan = cRegion.planFitRegion(*args, mskArr=self.mskArr,
+                                         minSky=minSky)
+            self.checkBox(plan)
+            self.assertGreater(plan['grow'], 1.0)
+            box = (plan['x0'], plan['x1'], plan['y0'], plan['y1'])
+            nSky = cRegion._skyPixels(self.mskArr, box, 500.0, 600.0, rad,
+                                      1.0, 0.0)
+            self.assertGreaterEqual(nSky, minSky)
+            """ The step before was not enough """
+            half = rad * plan['grow'] / 1.1
+            box = (cRegion._boxAround(500.0, half, self.shape[1]) +
+                   cRegion._boxAround(600.0, half, self.shape[0]))
+            self.assertLess(cRegion._skyPixels(self.mskArr, box, 500.0,
+                                               600.0, rad, 1.0, 0.0), minSky)
+            self.assertGreater(plan['x1'] - plan['x0'],
+                               small['x1'] - small['x0'])
+            plans[minSky] = plan
+        self.assertGreater(plans[150000]['grow'], plans[60000]['grow'])
+        """ The masked pixels are not sky """
+        mskArr = self.mskArr.copy()
+        mskArr[:, :500] = 1
+        masked = cRegion.planFitRegion(*args, mskArr=mskArr, minSky=60000)
+        self.assertGreater(masked['grow'], plans[60000]['grow'])
+        box = (masked['x0'], masked['x1'], masked['y0'], masked['y1'])
+        self.assertGreaterEqual(cRegion._skyPixels(mskArr, box, 500.0, 600.0,
+                                                   rad, 1.0, 0.0), 60000)
+
+    def testRatios(self):
+        plan = cRegion.planFitRegion(self.shape, 500.0, 600.0, 40.0,
+                                     psfShape=(41, 41), mskArr=self.mskArr,
+                                     minSky=100, oldConv=900)
+        width = plan['x1'] - plan['x0'] + 1
+        height = plan['y1'] - plan['y0'] + 1
+        self.assertAlmostEqual(plan['pixRatio'],
+                               1200.0 * 1000.0 / (width * height))
+        self.assertAlmostEqual(plan['fftRatio'],
+                               cRegion.fftCost(900) /
+                               cRegion.fftCost(plan['convbox']))
+        self.assertGreater(plan['pixRatio'], 1.0)
+        self.assertGreater(plan['fftRatio'], 1.0)
+        """ Compared with the whole cutout by default """
+        plan = cRegion.planFitRegion(self.shape, 500.0, 600.0, 40.0,
+                                     psfShape=(41, 41), mskArr=self.mskArr,
+                                     minSky=100)
+        self.assertAlmostEqual(plan['fftRatio'],
+                               cRegion.fftCost(1200) /
+                               cRegion.fftCost(plan['convbox']))
+        self.assertEqual(cRegion.oldConvbox(10.0, 1000), 600)
+        self.assertEqual(cRegion.oldConvbox(25.0, 1000), 800)
+        self.assertEqual(cRegion.oldConvbox(40.0, 1000), 900)
+
+
+if __name__ == '__main__':
+    unittest.main()
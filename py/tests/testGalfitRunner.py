@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Concurrent GALFIT runs with a mock GALFIT executable."""
+
+from __future__ import (division, print_function)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import setupPath  # noqa
+import coaddGalfitRunner as gRun
+import coaddCutoutGalfitSimple as cGalfit
+
+MOCK_GALFIT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'mockGalfit.py')
+
+
+def writeMock(tmpDir):
+    """Executable that runs mockGalfit.py with this python."""
+    galfit = os.path.join(tmpDir, 'galfit')
+    with open(galfit, 'w') as script:
+        script.write('#!/bin/sh\nexec %s %s "$@"\n' % (sys.executable,
+                                                       MOCK_GALFIT))
+    os.chmod(galfit, 0o755)
+    return galfit
+
+
+def writeReadin(readFile, mock=()):
+    """A minimal read-in file with absolute paths."""
+    root = os.path.dirname(readFile)
+    with open(readFile, 'w') as readin:
+        readin.write('A) %s  # Input data image\n' %
+                     os.path.join(root, 'cutout_img.fits'))
+        readin.write('B) %s  # Output data image block\n' %
+                     readFile.replace('.in', '.fits'))
+        readin.write('J) 27.00  # Magnitude photometric zeropoint\n')
+        for line in mock:
+            readin.write('# MOCK %s\n' % line)
+    return readFile
+
+
+class GalfitRunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.galfit = writeMock(self.tmpDir)
+        self.oriDir = os.getcwd()
+        os.chdir(self.tmpDir)
+
+    def tearDown(self):
+        os.chdir(self.oriDir)
+        shutil.rmtree(self.tmpDir)
+
+    def testOwnWorkDir(self):
+        """The models running together do not share galfit.NN or fit.log."""
+        readFiles = [writeReadin(os.path.join(self.tmpDir,
+                                              'cutout_%dser.in' % nn),
+                                 mock=['sleep 0.5 1'])
+                     for nn in (1, 2, 3)]
+        jobs = [cGalfit.galfitReadinJob(
+                    os.path.relpath(readFile),
+                    workDir=cGalfit.galfitWorkDir(readFile))
+                for readFile in readFiles]
+        runner = gRun.GalfitRunner(nJobs=3, galfit=self.galfit,
+                                   pollTime=0.05)
+        results = runner.run(jobs)
+        for job, readFile in zip(jobs, readFiles):
+            self.assertEqual(results[job['name']]['status'], gRun.DONE)
+            self.assertEqual(os.listdir(job['root']).count('galfit.01'), 1)
+            self.assertNotIn('galfit.02', os.listdir(job['root']))
+            fitLog = open(os.path.join(job['root'], 'fit.log')).read()
+            self.assertEqual(fitLog.count('Init. par. file'), 1)
+            self.assertIn(readFile, fitLog)
+            """ The read-in file is updated from its own galfit.NN """
+            done, plot = cGalfit.galfitPostRun(
+                job['name'], job['expect'], result=results[job['name']],
+                show=False, savePkl=False, workDir=job['root'])
+            self.assertTrue(done)
+            self.assertIn('# Best fit', open(readFile).read())
+        self.assertFalse(os.path.isfile(os.path.join(self.tmpDir,
+                                                     'fit.log')))
+
+    def testRetryKeepsLog(self):
+        """The log of the timed-out attempt is kept."""
+        readFile = writeReadin(os.path.join(self.tmpDir, 'cutout_1ser.in'),
+                               mock=['sleep 30 60'])
+        job = cGalfit.galfitReadinJob(readFile, imax=100,
+                                      workDir=cGalfit.galfitWorkDir(
+                                          readFile))
+        runner = gRun.GalfitRunner(galfit=self.galfit, timeout=2.0,
+                                   maxRetry=1, retryImax=0.5,
+                                   pollTime=0.05)
+        result = runner.run([job])[job['name']]
+        self.assertEqual(result['status'], gRun.DONE)
+        self.assertEqual(result['attempts'], 2)
+        logText = open(job['logFile']).read()
+        self.assertIn('imax=100', logText)
+        self.assertIn('imax=50', logText)
+        self.assertIn('# GALFIT TIMEOUT', logText)
+        self.assertIn('# GALFIT DONE', logText)
+
+    def testFailure(self):
+        readFile = writeReadin(os.path.join(self.tmpDir, 'cutout_1ser.in'),
+                               mock=['fail'])
+        result = gRun.GalfitRunner(galfit=self.galfit, pollTime=0.05).run(
+            [cGalfit.galfitReadinJob(readFile)])[readFile]
+        self.assertEqual(result['status'], gRun.FAIL)
+        self.assertNotEqual(result['returncode'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
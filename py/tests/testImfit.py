@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Batch imfit runs with a mock imfit executable."""
+
+from __future__ import (division, print_function)
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.io import fits
+
+import setupPath  # noqa
+import coaddGalfitRunner as gRun
+import coaddCutoutGalfitSimple as cGalfit
+import batchImfit as bImfit
+
+MOCK_IMFIT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'mockImfit.py')
+PREFIX = 'test'
+FILTER = 'HSC-I'
+GEOM = {'GAL_CENX': 61.0, 'GAL_CENY': 58.0, 'GAL_Q': 0.7, 'GAL_PA': 30.0,
+        'GAL_R50': 8.0, 'GAL_R90': 20.0}
+
+
+def writeMock(tmpDir):
+    """Executable that runs mockImfit.py with this python."""
+    imfit = os.path.join(tmpDir, 'imfit')
+    with open(imfit, 'w') as script:
+        script.write('#!/bin/sh\nexec %s %s "$@"\n' % (sys.executable,
+                                                       MOCK_IMFIT))
+    os.chmod(imfit, 0o755)
+    return imfit
+
+
+def writeGalaxy(root, galID, usePsf=True):
+    """Image, mask, sigma image and PSF of one galaxy."""
+    galRoot = os.path.join(root, galID, FILTER)
+    os.makedirs(galRoot)
+    prefix = os.path.join(galRoot, '%s_%s_%s_full' % (PREFIX, galID,
+                                                       FILTER))
+    img = np.ones((120, 120), dtype=np.float32)
+    fits.PrimaryHDU(img).writeto(prefix + '_img.fits')
+    fits.PrimaryHDU(img * 0.1).writeto(prefix + '_sig.fits')
+    mskHead = fits.Header()
+    for key, value in GEOM.items():
+        mskHead[key] = value
+    fits.PrimaryHDU(np.zeros((120, 120), dtype=np.int16),
+                    header=mskHead).writeto(prefix + '_mskfin.fits')
+    if usePsf:
+        fits.PrimaryHDU(np.ones((15, 15), dtype=np.float32)).writeto(
+            prefix + '_psf.fits')
+    return galRoot
+
+
+class ImfitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.imfit = writeMock(self.tmpDir)
+        self.root = os.path.join(self.tmpDir, 'data')
+        self.scratch = os.path.join(self.tmpDir, 'shm')
+        os.makedirs(self.scratch)
+        for galID in ['1', '2', '3']:
+            writeGalaxy(self.root, galID)
+        writeGalaxy(self.root, '4', usePsf=False)
+        os.environ['MOCK_IMFIT_FAIL'] = '_3_'
+
+    def tearDown(self):
+        del os.environ['MOCK_IMFIT_FAIL']
+        shutil.rmtree(self.tmpDir)
+
+    def runBatch(self, **kwargs):
+        output = os.path.join(self.tmpDir, 'imfit.fits')
+        table = bImfit.imfitBatch(['1', '2', '3', '4'], PREFIX,
+                                  root=self.root, filterUse=FILTER,
+                                  nJobs=2, nThreads=1,
+                                  scratch=self.scratch, imfit=self.imfit,
+                                  output=output, **kwargs)
+        return table, output
+
+    def testBatch(self):
+        table, output = self.runBatch(nBoot=4)
+        self.assertTrue(os.path.isfile(output))
+        """ The workspaces are removed """
+        self.assertEqual(os.listdir(self.scratch), [])
+
+        """ No PSF: the galaxy is not fitted """
+        rows = table[table['galaxy'] == '4']
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows['status'][0], gRun.FAIL)
+        """ imfit fails for both models """
+        rows = table[table['galaxy'] == '3']
+        self.assertEqual(sorted(rows['model']), ['1ser', '2ser'])
+        self.assertTrue(np.all(rows['status'] == gRun.FAIL))
+
+        for galID in ['1', '2']:
+            rows = table[table['galaxy'] == galID]
+            self.assertTrue(np.all(rows['status'] == gRun.DONE))
+            self.assertEqual(list(rows['label']),
+                             ['ser1', 'sky', 'inner', 'outer', 'sky'])
+            outDir = os.path.join(self.root, galID, FILTER, 'default')
+            name = os.path.join(outDir, '%s_%s_%s_full_2ser' %
+                                (PREFIX, galID, FILTER))
+            for suffix in bImfit.KEEP_SUFFIX:
+                self.assertTrue(os.path.isfile(name + suffix), suffix)
+            """ The inputs are read from the workspace """
+            logText = open(name + '.imfit.log').read()
+            self.assertIn('--psf %s_%s_%s_full_psf.fits' %
+                          (PREFIX, galID, FILTER), logText)
+            self.assertIn('--max-threads 1', logText)
+
+        """ The best fit is the initial guess of the mock """
+        rows = table[(table['galaxy'] == '1') & (table['type'] == 'Sersic')]
+        ser1, inner, outer = rows
+        self.assertAlmostEqual(ser1['mag'], 18.5, places=3)
+        self.assertAlmostEqual(ser1['r_e'], GEOM['GAL_R50'], places=3)
+        self.assertAlmostEqual(ser1['ar'], GEOM['GAL_Q'], places=3)
+        """ Same split as the warm start of the 2-Sersic GALFIT model """
+        for comp, split in [(inner, cGalfit.SPLIT_INNER),
+                            (outer, cGalfit.SPLIT_OUTER)]:
+            self.assertAlmostEqual(comp['mag'],
+                                   18.5 - 2.5 * np.log10(split[0]),
+                                   places=3)
+            self.assertAlmostEqual(comp['r_e'], GEOM['GAL_R50'] * split[1],
+                                   places=3)
+        self.assertAlmostEqual(inner['n'], 2.0)
+        self.assertAlmostEqual(outer['n'], cGalfit.SPLIT_NSER_OUT)
+        self.assertAlmostEqual(ser1['chi2nu'], 1.0234)
+        """ The errors are the scatter of the bootstrap samples """
+        self.assertEqual(ser1['nboot'], 4)
+        self.assertAlmostEqual(ser1['r_e_err'], 0.1 * np.sqrt(4.0 / 3.0),
+                               places=5)
+
+    def testAutoRegion(self):
+        table, output = self.runBatch(models=['1ser'], autoRegion=True)
+        rows = table[table['galaxy'] == '1']
+        self.assertTrue(np.all(rows['status'] == gRun.DONE))
+        logFile = os.path.join(self.root, '1', FILTER, 'default',
+                               '%s_1_%s_full_1ser.imfit.log' %
+                               (PREFIX, FILTER))
+        logText = open(logFile).read().split()
+        image = logText[logText.index('--mask') + 1]
+        self.assertRegexpMatches(image, r'_mskfin\.fits\[\d+:\d+,\d+:\d+\]$')
+
+
+if __name__ == '__main__':
+    unittest.main()
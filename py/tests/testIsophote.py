@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Isophote fitting of galIsophote against the ELLIPSE output."""
+
+from __future__ import (division, print_function)
+
+import os
+import unittest
+
+import numpy as np
+
+from astropy.table import Table
+
+import setupPath  # noqa
+import galSBP as gSBP
+import galIsophote as gIso
+
+
+def synthImage(nx=512, ny=512, bkg=100.0, i0=100.0, sma=40.0, eps=0.2,
+               pa=45.0):
+    """
+    De Vaucouleurs model with the intensity i0 at sma; same as synth.fits.
+
+    pa is measured from the X-axis in degrees, the center is (nx/2, ny/2).
+    """
+    xc, yc = nx / 2, ny / 2
+    yy, xx = np.mgrid[0:ny, 0:nx].astype(float)
+    rad = np.hypot(xx - xc, yy - yc)
+    theta = (np.arctan2(yy - yc, xx - xc) - np.radians(pa)) % (2.0 * np.pi)
+    radEll = sma * (1.0 - eps) / np.sqrt(((1.0 - eps) *
+                                          np.cos(theta)) ** 2.0 +
+                                         np.sin(theta) ** 2.0)
+    img = i0 * np.exp(-7.669 * ((rad / radEll) ** 0.25 - 1.0)) + bkg
+    ix, iy = int(xc), int(yc)
+    img[ix, iy] = (img[ix - 1, iy] + img[ix + 1, iy] +
+                   img[ix, iy - 1] + img[ix, iy + 1]) / 4.0
+    return img
+
+
+def fitSynth(img, ellip0, pa0):
+    ellipConfig = gSBP.defaultEllipse(257.0, 257.0, 320.0, ellip0=ellip0,
+                                      pa0=pa0, sma0=10.0, minsma=0.5,
+                                      step=0.1, hcenter=False,
+                                      hellip=False, hpa=False,
+                                      integrmode='bi-linear', usclip=3.0,
+                                      nclip=0)
+    return gIso.ellipseFit(img, ellipConfig)
+
+
+class IsophoteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.refTab = Table.read(os.path.join(setupPath.DATA_DIR,
+                                              'ellipse_synth_table.fits'))
+
+    def compareRef(self, isoTab):
+        for ref in self.refTab:
+            sma = ref['SMA']
+            # Inside 2 pixels the isophotes depend on the interpolation
+            if sma < 2.0:
+                continue
+            iso = isoTab[np.argmin(np.abs(isoTab['sma'] - sma))]
+            self.assertAlmostEqual(iso['sma'], sma, places=3)
+            self.assertLess(np.abs(iso['x0'] - ref['X0']), 0.2)
+            self.assertLess(np.abs(iso['y0'] - ref['Y0']), 0.2)
+            dPA = np.abs(gIso.normPA(iso['pa'] - ref['PA']))
+            dEll = np.abs(iso['ell'] / ref['ELLIP'] - 1.0)
+            dInt = np.abs(iso['intens'] / ref['INTENS'] - 1.0)
+            if sma > 5.0:
+                self.assertLess(dInt, 0.01)
+                self.assertLess(dEll, 0.02)
+                self.assertLess(dPA, 1.0)
+            else:
+                self.assertLess(dInt, 0.05)
+                self.assertLess(dEll, 0.2)
+                self.assertLess(dPA, 20.0)
+
+    def testEllipseTable(self):
+        isoTab = fitSynth(synthImage(), 0.2, -45.0)
+        self.compareRef(isoTab)
+
+    def testEllipseTableBadStart(self):
+        """The trial ellipse is 45 deg off, the ellipticity goes < 0."""
+        for ellip0, pa0 in [(0.05, 0.0), (0.05, 45.0), (0.3, -75.0)]:
+            isoTab = fitSynth(synthImage(), ellip0, pa0)
+            self.compareRef(isoTab)
+
+    def testFlatModel(self):
+        """e=0.4 at PA=30, from a round or a wrong trial ellipse."""
+        img = synthImage(eps=0.4, pa=120.0)
+        for ellip0, pa0 in [(0.05, 0.0), (0.3, -60.0)]:
+            isoTab = fitSynth(img, ellip0, pa0)
+            use = (isoTab['sma'] > 5.0) & (isoTab['sma'] < 200.0)
+            self.assertTrue(np.all(isoTab['stop'][use] == 0))
+            self.assertTrue(np.allclose(isoTab['ell'][use], 0.4, atol=0.01))
+            self.assertTrue(np.allclose(isoTab['pa'][use], 30.0, atol=1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Derived columns of one profile and of a batch of profiles."""
+
+from __future__ import (division, print_function)
+
+import copy
+import unittest
+
+import numpy as np
+
+import setupPath  # noqa
+import hscUtils as hUtil
+import galSBP as gSBP
+import galIsophote as gIso
+from testIsophote import synthImage
+
+
+def makeProfiles():
+    """Isophotes of three models with different sizes and shapes."""
+    profiles = []
+    for eps, pa, maxSma in [(0.2, 45.0, 150.0), (0.4, 120.0, 90.0),
+                            (0.1, 10.0, 200.0)]:
+        img = synthImage(eps=eps, pa=pa) - 100.0
+        img += np.random.RandomState(3).normal(0.0, 0.5, img.shape)
+        ellipConfig = gSBP.defaultEllipse(257.0, 257.0, maxSma,
+                                          ellip0=eps, pa0=pa - 90.0,
+                                          sma0=10.0, hcenter=False,
+                                          hellip=False, hpa=False,
+                                          integrmode='mean')
+        profiles.append(gIso.ellipseFit(img, ellipConfig))
+    return profiles
+
+
+class ProfileTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.profiles = makeProfiles()
+        cls.bkg = np.array([0.0, 0.05, -0.02])
+
+    def testBatchSameAsSingle(self):
+        single = [gSBP.readEllipseOut(copy.deepcopy(prof), zp=27.0,
+                                      pix=0.168, bkg=bkg)
+                  for prof, bkg in zip(self.profiles, self.bkg)]
+        batch = gSBP.readEllipseOutBatch(copy.deepcopy(self.profiles),
+                                         zp=27.0, pix=0.168, bkg=self.bkg)
+        for prof1, prof2 in zip(single, batch):
+            self.assertEqual(prof1.colnames, prof2.colnames)
+            for col in prof1.colnames:
+                self.assertTrue(np.allclose(prof1[col], prof2[col],
+                                            equal_nan=True), col)
+
+    def testAvgGeometry(self):
+        """Same as the weighted means of the selected isophotes."""
+        prof = gSBP.readEllipseOut(copy.deepcopy(self.profiles[1]))
+        sma = prof['sma']
+        use = ((sma <= 20.0) & np.isfinite(prof['x0_err']) &
+               np.isfinite(prof['y0_err']))
+        avgX, avgY = gSBP.ellipseGetAvgCen(prof, 20.0)
+        self.assertAlmostEqual(avgX, hUtil.numpy_weighted_mean(
+            prof['x0'][use], weights=prof['intens'][use]))
+        self.assertAlmostEqual(avgY, hUtil.numpy_weighted_mean(
+            prof['y0'][use], weights=prof['intens'][use]))
+
+        ringFlux = np.append(prof['tflux_e'][0], np.diff(prof['tflux_e']))
+        use = ((sma <= 40.0) & (sma >= 8.0) &
+               np.isfinite(prof['ell_err']) & np.isfinite(prof['pa_err']))
+        avgQ, avgPA = gSBP.ellipseGetAvgGeometry(prof, 40.0, minSma=8.0)
+        self.assertAlmostEqual(avgQ, 1.0 - hUtil.numpy_weighted_mean(
+            prof['ell'][use], weights=ringFlux[use]))
+        self.assertAlmostEqual(avgPA, hUtil.numpy_weighted_mean(
+            prof['pa_norm'][use], weights=ringFlux[use]))
+        self.assertAlmostEqual(prof['avg_q'][0], 0.6, places=2)
+
+    def testEarlyStopSameBackground(self):
+        """The sky of the outskirt is measured after the S/N becomes low."""
+        img = synthImage() - 100.0
+        img += np.random.RandomState(5).normal(0.0, 0.5, img.shape)
+        ellipConfig = gSBP.defaultEllipse(257.0, 257.0, 250.0, ellip0=0.2,
+                                          pa0=-45.0, sma0=10.0,
+                                          hcenter=False, hellip=False,
+                                          hpa=False, integrmode='mean')
+        profiles = []
+        for minSnr in [None, 100.0]:
+            isoTab = gIso.ellipseFit(img, ellipConfig, skyRms=0.5,
+                                     minSnr=minSnr)
+            prof = gSBP.readEllipseOut(isoTab, zp=27.0, pix=0.168)
+            profiles.append(gSBP.ellipseUpdateProfile(prof, zp=27.0,
+                                                      pix=0.168))
+        full, stop = profiles
+        smaStop = stop.meta['SMA_STOP']
+        self.assertLess(smaStop, 200.0)
+        self.assertLessEqual(len(stop), len(full))
+        outer = stop['sma'] > smaStop * 1.5
+        self.assertTrue(np.all(stop['stop'][outer] == -1))
+        self.assertTrue(np.all(np.isnan(stop['tflux_e'][outer])))
+        self.assertAlmostEqual(stop['rad_outer'][0], full['rad_outer'][0])
+        self.assertLess(abs(stop['avg_bkg'][0] - full['avg_bkg'][0]), 0.05)
+        self.assertLess(abs(stop['mag_tot'][0] - full['mag_tot'][0]), 0.01)
+
+        """ Only a few sky rings outside a small stopping radius """
+        isoTab = gIso.ellipseFit(img, ellipConfig, skyRms=0.5, minSnr=1000.0)
+        smaStop = isoTab.meta['SMA_STOP']
+        self.assertLess(smaStop, 100.0)
+        self.assertLessEqual(np.sum(isoTab['sma'] > smaStop),
+                             gIso.SKY_RINGS + 3)
+        self.assertLess(len(isoTab), len(full))
+        self.assertAlmostEqual(np.max(isoTab['sma']), np.max(full['sma']))
+
+
+if __name__ == '__main__':
+    unittest.main()
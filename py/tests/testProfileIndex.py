@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Index of the profiles of two samples that share the output tree."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.table import Table
+
+import setupPath  # noqa
+import hscUtils as hUtil
+import galSBP as gSBP
+import galIsophote as gIso
+import profileStore as pStore
+import profileIndex as pIdx
+import coaddCutoutSbpSummary as cSummary
+from testIsophote import synthImage
+
+GALAXIES = ['101', '102', '103', '104', '105']
+FILTER = 'HSC-I'
+""" The nonBCG galaxies are twice as bright """
+SAMPLES = {'redBCG': 1.0, 'nonBCG': 2.0}
+
+
+def makeProfile(scale=1.0):
+    """Profile of a noiseless model, with all the derived columns."""
+    img = synthImage(bkg=0.0) * scale
+    ellipConfig = gSBP.defaultEllipse(257.0, 257.0, 250.0, ellip0=0.2,
+                                      pa0=-45.0, sma0=10.0, hcenter=False,
+                                      hellip=False, hpa=False,
+                                      integrmode='mean')
+    prof = gSBP.readEllipseOut(gIso.ellipseFit(img, ellipConfig), zp=27.0,
+                               pix=0.168)
+    return gSBP.ellipseUpdateProfile(prof, zp=27.0, pix=0.168)
+
+
+def writeProfiles(root, prefix, prof):
+    """The pickles of the summary for every galaxy of a sample."""
+    for galaxy in GALAXIES:
+        rerunDir = os.path.join(root, galaxy, FILTER, 'default')
+        if not os.path.isdir(rerunDir):
+            os.makedirs(rerunDir)
+        for imgType, model in [('img', 'default_3'), ('img', 'default_2'),
+                               ('psf', '3')]:
+            name = '%s_%s_%s_full_%s_ellip_%s.pkl' % (prefix, galaxy, FILTER,
+                                                      imgType, model)
+            hUtil.saveToPickle(prof, os.path.join(rerunDir, name))
+
+
+def writeCatalog(catFile):
+    """Catalog of the galaxies, with their redshift and extinction."""
+    nGal = len(GALAXIES)
+    cat = Table([GALAXIES, np.linspace(0.3, 0.5, nGal)], names=['ID', 'Z'])
+    for band in ['g', 'r', 'i', 'z', 'y']:
+        cat['a_' + band] = np.full(nGal, 0.02)
+    cat.write(catFile, format='fits', overwrite=True)
+    return catFile
+
+
+class ProfileIndexTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.profiles = dict((prefix, makeProfile(scale))
+                            for prefix, scale in SAMPLES.items())
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for prefix, prof in self.profiles.items():
+            writeProfiles(self.root, prefix, prof)
+        """ A prefix that starts with the one of a sample """
+        writeProfiles(self.root, 'redBCG_old', self.profiles['nonBCG'])
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def testPrefix(self):
+        """Every sample only sees its own profiles."""
+        for prefix in SAMPLES:
+            index = pIdx.ProfileIndex.scan(self.root, prefix=prefix)
+            self.assertEqual(len(index), len(GALAXIES) * 3)
+            prof = index.get('103', FILTER, 'default_3', imgType='img')
+            self.assertTrue(np.allclose(prof['intens'],
+                                        self.profiles[prefix]['intens']))
+            """ The prefix is kept by the manifest and the subsets """
+            manifest = index.save(pIdx.manifestName(self.root, prefix))
+            self.assertEqual(pIdx.ProfileIndex.load(manifest).prefix, prefix)
+            self.assertEqual(index.subset(['101']).prefix, prefix)
+
+        """ The manifest of another prefix is not used """
+        os.rename(pIdx.manifestName(self.root, 'nonBCG'),
+                  os.path.join(self.root, 'other.fits'))
+        index = pIdx.buildIndex(self.root, prefix='redBCG', rescan=False,
+                                manifest=os.path.join(self.root,
+                                                      'other.fits'))
+        self.assertEqual(index.prefix, 'redBCG')
+        prof = index.get('101', FILTER, 'default_3', imgType='img')
+        self.assertTrue(np.allclose(prof['intens'],
+                                    self.profiles['redBCG']['intens']))
+
+        """ Nor the profile of another prefix in the store """
+        storeDir = os.path.join(self.root, 'store')
+        pStore.appendProfile(storeDir, os.path.join(
+            self.root, '101', FILTER, 'default',
+            'nonBCG_101_%s_full_img_ellip_default_3' % FILTER),
+            self.profiles['nonBCG'])
+        for prefix in SAMPLES:
+            index = pIdx.ProfileIndex.scan(self.root, prefix=prefix,
+                                           store=storeDir)
+            prof = index.get('101', FILTER, 'default_3', imgType='img')
+            self.assertTrue(np.allclose(prof['intens'],
+                                        self.profiles[prefix]['intens']))
+            other = [name for name in SAMPLES if name != prefix][0]
+            self.assertIsNone(index.get('101', FILTER, 'default_3',
+                                        imgType='img', prefix=other))
+
+    def runSummary(self, prefix, nProc, store=None):
+        catFile = writeCatalog(os.path.join(self.root, '%s_%d.fits' %
+                                            (prefix, nProc)))
+        outCat = cSummary.coaddCutoutSbpSummary(catFile, prefix,
+                                                root=self.root, plot=False,
+                                                nProc=nProc, store=store)
+        return Table.read(outCat, format='fits')
+
+    def testSequentialSameAsParallel(self):
+        for prefix in SAMPLES:
+            sumSeq = self.runSummary(prefix, 1)
+            sumPar = self.runSummary(prefix, 3)
+            self.assertEqual(sumSeq.colnames, sumPar.colnames)
+            for col in sumSeq.colnames:
+                if sumSeq[col].dtype.kind == 'f':
+                    self.assertTrue(np.allclose(sumSeq[col], sumPar[col],
+                                                equal_nan=True), col)
+                else:
+                    self.assertTrue(np.all(sumSeq[col] == sumPar[col]), col)
+            self.assertTrue(np.all(sumSeq['lum_max'] > 0.0))
+        """ The two samples are summarized from their own profiles """
+        diff = (self.runSummary('nonBCG', 1)['lum_max'] -
+                self.runSummary('redBCG', 1)['lum_max'])
+        self.assertTrue(np.allclose(diff, np.log10(2.0), atol=0.01))
+
+    def testStore(self):
+        """The workers read their profiles from the store."""
+        storeDir = os.path.join(self.root, 'store')
+        pStore.importPickles(storeDir, self.root)
+        """ Only the store has the profiles """
+        for name in GALAXIES:
+            shutil.rmtree(os.path.join(self.root, name))
+        for nProc, useIndex in [(1, True), (3, True), (3, False)]:
+            catFile = writeCatalog(os.path.join(self.root, 'store.fits'))
+            outCat = cSummary.coaddCutoutSbpSummary(
+                catFile, 'nonBCG', root=self.root, plot=False,
+                nProc=nProc, store=storeDir, useIndex=useIndex)
+            summary = Table.read(outCat, format='fits')
+            self.assertTrue(np.all(summary['sum_tab'] != 'None'))
+            self.assertTrue(np.all(summary['lum_max'] > 0.0))
+
+    def testWorkerCrash(self):
+        """A worker that dies only loses its own shard."""
+        oriSummary = cSummary.sbpSummaryGalaxy
+
+        def crashSummary(galaxy, **kwargs):
+            if galaxy['id'] == '103':
+                os._exit(3)
+            return oriSummary(galaxy, **kwargs)
+
+        cSummary.sbpSummaryGalaxy = crashSummary
+        try:
+            summary = self.runSummary('redBCG', 5)
+        finally:
+            cSummary.sbpSummaryGalaxy = oriSummary
+        lost = summary['ID'] == '103'
+        self.assertEqual(list(summary['sum_tab'][lost]), ['None'])
+        self.assertTrue(np.all(summary['lum_max'][~lost] > 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Merge of the shards of a profile store."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.table import Table
+
+import setupPath  # noqa
+import profileStore as pStore
+
+
+def makeProfile(nRow, niter=True):
+    prof = Table({'sma': np.arange(nRow, dtype=float) + 1.0,
+                  'intens': np.linspace(10.0, 1.0, nRow)})
+    if niter:
+        prof['niter'] = np.arange(nRow, dtype='i4') + 3
+    return prof
+
+
+class ProfileStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.storeDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storeDir)
+
+    def testMissingIntColumn(self):
+        """A missing integer column is INT_FILL, not a float NaN."""
+        writer = pStore.ProfileWriter(self.storeDir)
+        writer.append(makeProfile(5), {'galaxy': '1', 'filter': 'HSC-I',
+                                       'model': 'default_3'})
+        writer.append(makeProfile(4, niter=False),
+                      {'galaxy': '2', 'filter': 'HSC-I',
+                       'model': 'default_3'})
+        pStore.mergeStore(self.storeDir)
+
+        store = pStore.ProfileStore(self.storeDir)
+        self.assertEqual(len(store.shardFiles()), 0)
+        prof1 = store.get('1', 'HSC-I', 'default_3', imgType='',
+                          rerun='')
+        prof2 = store.get('2', 'HSC-I', 'default_3', imgType='',
+                          rerun='')
+        self.assertEqual(prof1['niter'].dtype.kind, 'i')
+        self.assertTrue(np.all(prof1['niter'] == np.arange(5) + 3))
+        self.assertTrue(np.all(prof2['niter'] == pStore.INT_FILL))
+        self.assertTrue(np.allclose(prof2['intens'],
+                                    np.linspace(10.0, 1.0, 4)))
+        self.assertEqual(store.data.columns['niter'].null, pStore.INT_FILL)
+
+    def testTwoPrefixes(self):
+        """Two samples with the same galaxy keep their own profiles."""
+        galDir = os.path.join(self.storeDir, 'data', '1', 'HSC-I', 'default')
+        for prefix, nRow in [('redBCG', 5), ('nonBCG', 7)]:
+            pStore.appendProfile(self.storeDir, os.path.join(
+                galDir, '%s_1_HSC-I_full_img_ellip_default_3' % prefix),
+                makeProfile(nRow))
+        store = pStore.ProfileStore(self.storeDir)
+        self.assertEqual(len(store), 2)
+        pStore.mergeStore(self.storeDir)
+
+        store = pStore.ProfileStore(self.storeDir)
+        self.assertEqual(len(store.shardFiles()), 0)
+        self.assertEqual(len(store), 2)
+        for prefix, nRow in [('redBCG', 5), ('nonBCG', 7)]:
+            prof = store.get('1', 'HSC-I', 'default_3', imgType='img',
+                             prefix=prefix)
+            self.assertEqual(len(prof), nRow)
+        """ The latest one without a prefix """
+        self.assertEqual(len(store.get('1', 'HSC-I', 'default_3',
+                                       imgType='img')), 7)
+        index, arrays = store.readAll(['sma'], prefix='nonBCG')
+        self.assertEqual(list(index['prefix']), ['nonBCG'])
+        self.assertEqual(index['length'][0], 7)
+
+    def testPreload(self):
+        """The preloaded profiles are the same as the ones from get()."""
+        for galaxy, nRow in [('1', 5), ('2', 6), ('3', 7)]:
+            pStore.appendProfile(self.storeDir, os.path.join(
+                self.storeDir, 'data', galaxy, 'HSC-I', 'default',
+                'redBCG_%s_HSC-I_full_img_ellip_default_3' % galaxy),
+                makeProfile(nRow))
+        for merge in [False, True]:
+            if merge:
+                pStore.mergeStore(self.storeDir)
+            store = pStore.ProfileStore(self.storeDir)
+            before = dict((galaxy, store.get(galaxy, 'HSC-I', 'default_3',
+                                             imgType='img'))
+                          for galaxy in ['1', '2', '3'])
+            self.assertEqual(store.preload(galaxy=['1', '3'],
+                                           prefix='redBCG'), 2)
+            self.assertEqual(sorted(store._cache),
+                             ['redBCG_%s_HSC-I_full_img_ellip_default_3' % gg
+                              for gg in ['1', '3']])
+            for galaxy, prof in before.items():
+                after = store.get(galaxy, 'HSC-I', 'default_3',
+                                  imgType='img')
+                self.assertEqual(after.colnames, prof.colnames)
+                for col in prof.colnames:
+                    self.assertEqual(after[col].dtype, prof[col].dtype)
+                    self.assertTrue(np.all(after[col] == prof[col]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Reuse of the cached PSF profiles."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.io import fits
+from astropy.table import Table
+
+import setupPath  # noqa
+import coaddPsfCache as cPsf
+
+
+class PsfCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        yy, xx = np.mgrid[0:41, 0:41]
+        psfArr = np.exp(-((xx - 20.0) ** 2 + (yy - 20.0) ** 2) / 8.0)
+        self.psfFiles = []
+        for name in ['a', 'b']:
+            psfFile = os.path.join(self.tmpDir, '%s_psf.fits' % name)
+            fits.PrimaryHDU(psfArr).writeto(psfFile)
+            self.psfFiles.append(psfFile)
+        self.psfOut = Table({'sma': np.arange(1.0, 6.0),
+                             'intens': np.arange(5.0, 0.0, -1.0)})
+        self.outBin = os.path.join(self.tmpDir, 'a_psf_ellip_3.bin')
+        with open(self.outBin, 'wb') as binOut:
+            binOut.write(b'isophotes of a')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def checkReuse(self, cache):
+        key = cache.key(self.psfFiles[1], stage=3)
+        psfOut = cache.get(key)
+        self.assertIsNotNone(psfOut)
+        outPre = self.psfFiles[1].replace('.fits', '_ellip_3')
+        outBin = cache.reuse(psfOut, outPre, key=key)
+        self.assertEqual(outBin, outPre + '.bin')
+        with open(outBin, 'rb') as binIn:
+            self.assertEqual(binIn.read(), b'isophotes of a')
+        self.assertTrue(os.path.isfile(outPre + '.pkl'))
+
+    def testMemory(self):
+        cache = cPsf.PsfCache()
+        key = cache.key(self.psfFiles[0], stage=3)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, self.psfOut, outBin=self.outBin)
+        self.checkReuse(cache)
+
+    def testDisk(self):
+        cacheDir = os.path.join(self.tmpDir, 'cache')
+        cache = cPsf.PsfCache(cacheDir)
+        cache.put(cache.key(self.psfFiles[0], stage=3), self.psfOut,
+                  outBin=self.outBin)
+        os.remove(self.outBin)
+        """ Another process only sees the files in the cache """
+        self.checkReuse(cPsf.PsfCache(cacheDir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Block and congrid rebinning of the global sky."""
+
+from __future__ import (division, print_function)
+
+import unittest
+
+import numpy as np
+
+import setupPath  # noqa
+import hscUtils as hUtil
+import coaddCutoutSky as cSky
+
+
+class SkyRebinTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.skyStd = 0.05
+        self.imgArr = rng.normal(0.01, self.skyStd, (601, 601))
+        self.mskAll = np.zeros(self.imgArr.shape, dtype='uint8')
+        # A few bright masked objects
+        yy, xx = np.indices(self.imgArr.shape)
+        for xc, yc in [(100, 120), (300, 300), (480, 410)]:
+            obj = np.hypot(xx - xc, yy - yc) < 25
+            self.imgArr[obj] += 5.0
+            self.mskAll[obj] = 1
+
+    def testBlockReduce(self):
+        img = self.imgArr[:600, :600]
+        blocks, frac = hUtil.blockReduce(img, 6)
+        self.assertEqual(blocks.shape, (100, 100))
+        self.assertTrue(np.allclose(frac, 1.0))
+        self.assertTrue(np.allclose(
+            blocks, img.reshape(100, 6, 100, 6).mean(axis=(1, 3))))
+
+    def testBlockMatchesCongrid(self):
+        outBlock = cSky.measureGlobalSky(self.imgArr, self.mskAll, rebin=6,
+                                         binMethod='block', visual=False)
+        outCongrid = cSky.measureGlobalSky(self.imgArr, self.mskAll, rebin=6,
+                                           binMethod='congrid', visual=False)
+        numBlock, medBlock, avgBlock, stdBlock, skwBlock = outBlock[:5]
+        numCongrid, medCongrid, avgCongrid, stdCongrid, skwCongrid = \
+            outCongrid[:5]
+
+        # The sky level agrees within the noise of the congrid sample
+        errCongrid = stdCongrid / np.sqrt(numCongrid)
+        self.assertLess(abs(avgBlock - avgCongrid), 5.0 * errCongrid)
+        self.assertLess(abs(medBlock - medCongrid), 5.0 * errCongrid)
+        # SKYSTD is the scatter of the pixels for both methods, not the
+        # scatter of the 6x6 block means
+        self.assertLess(abs(stdBlock / stdCongrid - 1.0), 0.05)
+        self.assertLess(abs(stdBlock / self.skyStd - 1.0), 0.05)
+        self.assertLess(abs(skwBlock - skwCongrid), 0.2)
+
+    def testSkyRms(self):
+        """The sky RMS of one pixel does not depend on the binning."""
+        for binMethod in ['block', 'congrid']:
+            skyRms = cSky.measureGlobalSky(self.imgArr, self.mskAll, rebin=6,
+                                           binMethod=binMethod,
+                                           visual=False)[5]
+            self.assertLess(abs(skyRms / self.skyStd - 1.0), 0.02)
+        # Correlated noise: the 6x6 block means are not 6 times quieter
+        rng = np.random.RandomState(7)
+        imgCor = np.repeat(np.repeat(rng.normal(0.0, self.skyStd,
+                                                (301, 301)), 2, axis=0),
+                           2, axis=1)
+        mskCor = np.zeros(imgCor.shape, dtype='uint8')
+        skyOut = cSky.getGlobalSky(imgCor, mskCor, rebin=6, visual=False,
+                                   verbose=False, saveDat=False)
+        self.assertLess(abs(skyOut[6] / self.skyStd - 1.0), 0.03)
+
+
+if __name__ == '__main__':
+    unittest.main()
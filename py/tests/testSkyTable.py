@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Sky table of a run."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import setupPath  # noqa
+import coaddSkyTable as cSkyTab
+
+
+class SkyTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.tabFile = os.path.join(self.tmpDir, 'sky_HSC-I.fits')
+        prefix = 'redBCG_10_HSC-I_full'
+        cSkyTab.skyTableAppend(self.tabFile, prefix,
+                               (100, 0.01, 0.02, 0.05, 0.1, 28.0),
+                               galID='10', filter='HSC-I', rerun='default')
+        cSkyTab.skyTableAppend(self.tabFile, prefix,
+                               (100, 0.03, 0.04, 0.06, 0.2, 27.5),
+                               galID='10', filter='HSC-I', rerun='smallR1')
+        # A newer measurement of the default rerun
+        cSkyTab.skyTableAppend(self.tabFile, prefix,
+                               (100, 0.02, 0.02, 0.05, 0.1, 28.0),
+                               galID='10', filter='HSC-I', rerun='default')
+        self.prefix = prefix
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def testRerunsAreKept(self):
+        for compact in [False, True]:
+            if compact:
+                self.assertEqual(cSkyTab.skyTableCompact(self.tabFile), 2)
+            skyTab = cSkyTab.skyTableRead(self.tabFile)
+            self.assertEqual(len(skyTab), 2)
+            skyOut, found = cSkyTab.skyLookup(skyTab, prefix=self.prefix,
+                                              rerun='default')
+            self.assertTrue(found[0])
+            self.assertAlmostEqual(skyOut['skyMed'][0], 0.02)
+            skyOut, found = cSkyTab.skyLookup(skyTab, prefix=self.prefix,
+                                              rerun='smallR1')
+            self.assertTrue(found[0])
+            self.assertAlmostEqual(skyOut['skyMed'][0], 0.03)
+
+    def testSkyRms(self):
+        """The older measurements have no sky RMS."""
+        cSkyTab.skyTableAppend(self.tabFile, 'redBCG_11_HSC-I_full',
+                               (100, 0.01, 0.02, 0.05, 0.1, 28.0, 0.3),
+                               galID='11', filter='HSC-I', rerun='default')
+        for compact in [False, True]:
+            if compact:
+                cSkyTab.skyTableCompact(self.tabFile)
+            skyOut, found = cSkyTab.skyLookup(
+                self.tabFile, prefix=[self.prefix, 'redBCG_11_HSC-I_full'],
+                rerun='default')
+            self.assertTrue(np.all(found))
+            self.assertTrue(np.isnan(skyOut['skyRms'][0]))
+            self.assertAlmostEqual(skyOut['skyRms'][1], 0.3)
+
+    def testAmbiguousWithoutRerun(self):
+        skyOut, found = cSkyTab.skyLookup(self.tabFile, galID=['10', '11'],
+                                          filter='HSC-I')
+        self.assertFalse(np.any(found))
+        self.assertTrue(np.all(np.isnan(skyOut['skyMed'])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Sigma-clipped statistics against scipy.stats.sigmaclip."""
+
+from __future__ import (division, print_function)
+
+import unittest
+
+import numpy as np
+
+from scipy.stats import sigmaclip
+
+import setupPath  # noqa
+import hscStats as hStats
+
+N_TRIAL = 300
+
+
+def randomSample(rng, num):
+    """Gaussian sky with a few bright and faint outliers."""
+    pix = rng.normal(rng.uniform(-1.0, 1.0), rng.uniform(0.1, 5.0), num)
+    nOut = rng.randint(0, max(num // 10, 1) + 1)
+    pix[:nOut] += rng.uniform(-30.0, 100.0, nOut)
+    return pix
+
+
+class StatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(2016)
+
+    def compare(self, stats, pix, low, upp, msg):
+        clip, lower, upper = sigmaclip(pix, low=low, high=upp)
+        self.assertEqual(stats['nUse'], len(clip), msg)
+        self.assertEqual(stats['nClip'], len(pix) - len(clip), msg)
+        self.assertTrue(np.allclose(
+            [stats['mean'], stats['std'], stats['median'], stats['low'],
+             stats['upp']],
+            [np.mean(clip), np.std(clip), np.median(clip), lower, upper],
+            rtol=1e-9, atol=1e-9), msg)
+        self.assertTrue(np.allclose(
+            stats['mad'], np.median(np.abs(clip - np.median(clip))),
+            rtol=1e-9, atol=1e-9), msg)
+        return clip
+
+    def testSigmaClipStats(self):
+        for trial in range(N_TRIAL):
+            pix = randomSample(self.rng, self.rng.randint(1, 3000))
+            low, upp = self.rng.uniform(1.5, 4.0, 2)
+            stats, kept = hStats.sigmaClipStats(pix, low=low, upp=upp,
+                                                returnData=True)
+            clip = self.compare(stats, pix, low, upp, 'trial %d' % trial)
+            self.assertTrue(np.array_equal(np.sort(kept), np.sort(clip)))
+
+    def testNonFinite(self):
+        pix = randomSample(self.rng, 500)
+        bad = pix.copy()
+        bad[::7] = np.nan
+        bad[::11] = np.inf
+        stats = hStats.sigmaClipStats(bad)
+        self.compare(stats, bad[np.isfinite(bad)], 3.0, 3.0, 'NaN')
+
+        stats = hStats.sigmaClipStats([np.nan, np.nan])
+        self.assertEqual(stats['nUse'], 0)
+        self.assertTrue(np.isnan(stats['mean']))
+
+    def testOnePixel(self):
+        """A group of one pixel after a noisy group keeps its pixel."""
+        noisy = randomSample(self.rng, 5000) * 1000.0
+        pix = np.concatenate((noisy, [1234.5678], np.full(20, 0.1)))
+        labels = np.concatenate((np.zeros(5000, dtype=int), [1],
+                                 np.full(20, 2, dtype=int)))
+        stats = hStats.sigmaClipBatch(pix, labels)
+        self.assertEqual(list(stats['nUse'][1:]), [1, 20])
+        self.assertEqual(list(stats['std'][1:]), [0.0, 0.0])
+        self.assertEqual(list(stats['mean'][1:]), [1234.5678, 0.1])
+
+    def testSigmaClipBatch(self):
+        for trial in range(N_TRIAL // 10):
+            nLabel = self.rng.randint(1, 40)
+            """ Some of the groups are empty or have one pixel """
+            sizes = self.rng.randint(0, 800, nLabel)
+            sizes[self.rng.rand(nLabel) < 0.1] = 1
+            sizes[self.rng.rand(nLabel) < 0.1] = 0
+            groups = [randomSample(self.rng, size) for size in sizes]
+            pix = np.concatenate(groups + [self.rng.normal(0.0, 1.0, 50)])
+            labels = np.concatenate([np.full(size, ii, dtype=int) for
+                                     (ii, size) in enumerate(sizes)] +
+                                    [np.full(50, -1, dtype=int)])
+            """ The order of the pixels does not matter """
+            order = self.rng.permutation(len(pix))
+            low, upp = self.rng.uniform(1.5, 4.0, 2)
+            stats = hStats.sigmaClipBatch(pix[order], labels[order],
+                                          nLabel=nLabel, low=low, upp=upp)
+            self.assertEqual(len(stats), nLabel)
+            for ii, group in enumerate(groups):
+                msg = 'trial %d, group %d' % (trial, ii)
+                if len(group) == 0:
+                    self.assertEqual(stats[ii]['nUse'], 0, msg)
+                    self.assertTrue(np.isnan(stats[ii]['mean']), msg)
+                    continue
+                self.compare(stats[ii], group, low, upp, msg)
+                single = hStats.sigmaClipStats(group, low=low, upp=upp)
+                self.assertEqual(single['nUse'], stats[ii]['nUse'], msg)
+
+
+if __name__ == '__main__':
+    unittest.main()
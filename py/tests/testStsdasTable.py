@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Reader of the STSDAS binary tables."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from astropy.table import Table
+
+import setupPath  # noqa
+import stsdasTable as stsTab
+import galSBP as gSBP
+
+# Columns of the ELLIPSE output that are integers
+INT_COLUMNS = ['NDATA', 'NFLAG', 'NITER', 'STOP']
+
+
+def writeStsdasTable(tabFile, refTab, order='<', tabType=stsTab.TBL_TYPE_ROW,
+                     extraRows=7, extraPar=3, extraCols=2, extraLen=6):
+    """
+    Write a table with the layout of tbtables: the parameter, column and
+    row spaces are larger than what is used, same as the tables that are
+    created and then filled by ELLIPSE.
+    """
+    names = refTab.colnames
+    nrows, ncols = len(refTab), len(names)
+    allrows, maxcols = nrows + extraRows, ncols + extraCols
+    dtypes = [stsTab.TY_INT if name in INT_COLUMNS else stsTab.TY_REAL
+              for name in names]
+    # Length of every column in SZ_CHAR (2 bytes)
+    colLen = [2] * ncols
+    offsets = np.concatenate(([0], np.cumsum(colLen)[:-1]))
+    colUsed = int(np.sum(colLen))
+    rowLen = colUsed + extraLen
+
+    size = np.zeros(stsTab.LEN_SIZINFO, dtype=order + 'i4')
+    size[:9] = [1, 1 + extraPar, nrows, allrows, ncols, maxcols, colUsed,
+                rowLen, tabType]
+    parSpace = np.zeros((1 + extraPar) * stsTab.LEN_PARREC, dtype='u1')
+    parSpace[:12] = np.frombuffer(b'IMAGE   t  x', dtype='u1')
+    colSpace = np.zeros((maxcols, stsTab.LEN_COLSTRUCT), dtype='u1')
+    for ii, name in enumerate(names):
+        desc = np.array([ii + 1, offsets[ii], colLen[ii], dtypes[ii]],
+                        dtype=order + 'i4')
+        colSpace[ii, :16] = np.frombuffer(desc.tobytes(), dtype='u1')
+        colSpace[ii, 16:16 + len(name)] = np.frombuffer(
+            name.encode('ascii'), dtype='u1')
+
+    values = []
+    for name, dtype in zip(names, dtypes):
+        col = refTab[name]
+        mask = np.ma.getmaskarray(col) | ~np.isfinite(
+            np.ma.filled(col, 0.0).astype(float))
+        if dtype == stsTab.TY_INT:
+            value = np.where(mask, stsTab.INDEFI,
+                             np.ma.filled(col, 0).astype(int))
+            values.append(value.astype(order + 'i4'))
+        else:
+            value = np.where(mask, stsTab.INDEFR,
+                             np.ma.filled(col, 0.0).astype(float))
+            values.append(value.astype(order + 'f4'))
+
+    if tabType == stsTab.TBL_TYPE_ROW:
+        data = np.zeros((allrows, rowLen * stsTab.SZ_CHAR), dtype='u1')
+        for ii, value in enumerate(values):
+            start = offsets[ii] * stsTab.SZ_CHAR
+            data[:nrows, start:start + 4] = np.frombuffer(
+                value.tobytes(), dtype='u1').reshape(nrows, 4)
+    else:
+        data = np.zeros((colUsed * allrows * stsTab.SZ_CHAR), dtype='u1')
+        for ii, value in enumerate(values):
+            start = offsets[ii] * stsTab.SZ_CHAR * allrows
+            data[start:start + nrows * 4] = np.frombuffer(value.tobytes(),
+                                                          dtype='u1')
+
+    with open(tabFile, 'wb') as tab:
+        for part in (size, parSpace, colSpace, data):
+            tab.write(part.tobytes())
+    return tabFile
+
+
+class StsdasTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.refTab = Table.read(os.path.join(setupPath.DATA_DIR,
+                                              'ellipse_synth_table.fits'))
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def checkTable(self, data):
+        self.assertEqual(list(data.dtype.names), self.refTab.colnames)
+        self.assertEqual(len(data), len(self.refTab))
+        for name in self.refTab.colnames:
+            col = self.refTab[name]
+            ref = np.where(np.ma.getmaskarray(col), np.nan,
+                           np.ma.filled(col, 0).astype(float))
+            self.assertTrue(np.allclose(data[name].astype(float),
+                                        ref.astype('f4'), equal_nan=True,
+                                        rtol=1.0E-6), name)
+        # INDEF of the integer columns in the first row
+        self.assertTrue(np.isnan(data['NITER'][0]))
+
+    def testRowTable(self):
+        for order in ('<', '>'):
+            tabFile = writeStsdasTable(
+                os.path.join(self.tmpDir, 'row%s.tab' % order),
+                self.refTab, order=order)
+            self.checkTable(stsTab.readStsdasTable(tabFile))
+
+    def testColumnTable(self):
+        for order in ('<', '>'):
+            tabFile = writeStsdasTable(
+                os.path.join(self.tmpDir, 'col%s.tab' % order),
+                self.refTab, order=order, tabType=stsTab.TBL_TYPE_COLUMN)
+            self.checkTable(stsTab.readStsdasTable(tabFile))
+
+    def testColumnInfo(self):
+        tabFile = writeStsdasTable(os.path.join(self.tmpDir, 'row.tab'),
+                                   self.refTab)
+        columns, size, order = stsTab.readColumnInfo(tabFile)
+        self.assertEqual(order, '<')
+        self.assertEqual([col[0] for col in columns], self.refTab.colnames)
+        self.assertEqual(size[7] - size[6], 6)
+
+    def corrupt(self, tabFile, index, value, order='<'):
+        """Change one value of the size record."""
+        with open(tabFile, 'r+b') as tab:
+            tab.seek(index * 4)
+            tab.write(np.array([value], dtype=order + 'i4').tobytes())
+        return tabFile
+
+    def testEllipseBin(self):
+        """A table that does not agree with its header is not used."""
+        tabFile = writeStsdasTable(os.path.join(self.tmpDir, 'good.bin'),
+                                   self.refTab)
+        ellipOut = gSBP.readEllipseBin(tabFile)
+        self.assertEqual(ellipOut.colnames[:5],
+                         ['sma', 'intens', 'int_err', 'pix_var', 'rms'])
+        self.assertTrue(np.allclose(ellipOut['ell'], self.refTab['ELLIP'],
+                                    equal_nan=True))
+
+        """ More rows than the file has """
+        badFile = os.path.join(self.tmpDir, 'bad.bin')
+        shutil.copy(tabFile, badFile)
+        self.corrupt(badFile, 3, len(self.refTab) + 100)
+        self.assertIsNone(gSBP.readEllipseBin(badFile))
+        """ Columns that do not fit in the rows """
+        shutil.copy(tabFile, badFile)
+        self.corrupt(badFile, 7, 20)
+        self.assertIsNone(gSBP.readEllipseBin(badFile))
+        """ Not the columns of ELLIPSE """
+        refTab = self.refTab.copy()
+        refTab.rename_column('INTENS', 'FLUX')
+        writeStsdasTable(badFile, refTab)
+        self.assertIsNone(gSBP.readEllipseBin(badFile))
+        """ Truncated file """
+        with open(tabFile, 'rb') as tab:
+            data = tab.read()
+        with open(badFile, 'wb') as tab:
+            tab.write(data[:-(len(data) // 3)])
+        self.assertIsNone(gSBP.readEllipseBin(badFile))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Scratch workspaces of galSBP()."""
+
+from __future__ import (division, print_function)
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import setupPath  # noqa
+import galWorkspace as gWork
+
+
+def deadPid():
+    """PID of a process that has already exited."""
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    return pid
+
+
+def writeFile(path, text):
+    with open(path, 'w') as out:
+        out.write(text)
+
+
+def readFile(path):
+    with open(path) as inp:
+        return inp.read()
+
+
+class WorkspaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.outDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.outDir)
+
+    def testCleanStale(self):
+        """Only the workspaces of the dead processes are removed."""
+        dead = '%s%d_abc' % (gWork.PREFIX, deadPid())
+        live = '%s%d_abc' % (gWork.PREFIX, os.getpid())
+        parent = '%s%d_abc' % (gWork.PREFIX, os.getppid())
+        others = ['%sname_abc' % gWork.PREFIX, 'other_1_abc']
+        for name in [dead, live, parent] + others:
+            os.mkdir(os.path.join(self.root, name))
+        writeFile(os.path.join(self.root, dead, 'temp.fits'), 'x')
+
+        self.assertEqual(gWork.cleanStale(self.root), 1)
+        self.assertEqual(sorted(os.listdir(self.root)),
+                         sorted([live, parent] + others))
+        self.assertEqual(gWork.cleanStale(self.root), 0)
+        self.assertEqual(gWork.cleanStale(os.path.join(self.root, 'no')), 0)
+
+        """ A new workspace cleans the root first """
+        os.mkdir(os.path.join(self.root, dead))
+        space = gWork.Workspace(self.outDir, root=self.root).start()
+        self.assertFalse(os.path.isdir(os.path.join(self.root, dead)))
+        self.assertTrue(os.path.basename(space.dir).startswith(
+            '%s%d_' % (gWork.PREFIX, os.getpid())))
+        """ and the one left open by an earlier run """
+        second = gWork.Workspace(self.outDir, root=self.root).start()
+        self.assertIsNone(space.dir)
+        second.discard()
+
+    def testCopyOut(self):
+        """The output is never seen half-written."""
+        space = gWork.Workspace(self.outDir, root=self.root).start()
+        writeFile(space.path('prof.pkl'), 'new')
+        target = space.outPath('prof.pkl')
+        writeFile(target, 'old')
+
+        oriCopy = shutil.copyfile
+
+        def checkCopy(src, dst):
+            self.assertNotEqual(dst, target)
+            self.assertEqual(os.path.dirname(dst), self.outDir)
+            oriCopy(src, dst)
+            self.assertEqual(readFile(target), 'old')
+
+        def brokenCopy(src, dst):
+            writeFile(dst, 'ne')
+            raise IOError('No space left on device')
+
+        try:
+            shutil.copyfile = brokenCopy
+            self.assertRaises(IOError, space.copyOut, 'prof.pkl')
+            self.assertEqual(readFile(target), 'old')
+            self.assertEqual(os.listdir(self.outDir), ['prof.pkl'])
+            shutil.copyfile = checkCopy
+            self.assertEqual(space.copyOut('prof.pkl'), target)
+        finally:
+            shutil.copyfile = oriCopy
+        self.assertEqual(readFile(target), 'new')
+        self.assertEqual(os.listdir(self.outDir), ['prof.pkl'])
+        space.discard()
+
+    def testKeepSuffix(self):
+        """Only the products are copied back."""
+        files = {'a_ellip_3.pkl': 'pkl', 'a_ellip_3.png': 'png',
+                 'a_ellip_3.bin': 'bin', 'a_ellip_3.csv': 'csv',
+                 'a_ellip_3_iso.fits': 'iso', 'temp_abc.fits': 'temp',
+                 'a_ellip_3.tab': 'tab', 'a_mskiso.fits': 'msk',
+                 'uparm.par': 'par', 'a.pkl.cdf': 'cdf'}
+        before = dict(gWork.TOTALS)
+        with gWork.Workspace(self.outDir, root=self.root) as space:
+            for name, text in files.items():
+                writeFile(space.path(name), text)
+            os.mkdir(space.path('sub.pkl'))
+            spaceDir = space.dir
+        kept = ['a_ellip_3.bin', 'a_ellip_3.csv', 'a_ellip_3.pkl',
+                'a_ellip_3.png', 'a_ellip_3_iso.fits']
+        self.assertEqual(sorted(os.listdir(self.outDir)), kept)
+        for name in kept:
+            self.assertEqual(readFile(os.path.join(self.outDir, name)),
+                             files[name])
+        self.assertFalse(os.path.isdir(spaceDir))
+        totals = gWork.totalsSince(before)
+        self.assertEqual((totals['nCopy'], totals['nFile']), (5, 5))
+        self.assertEqual(totals['nByteCopy'],
+                         sum(len(files[name]) for name in kept))
+
+        """ Own suffixes; nothing is copied back after an error """
+        space = gWork.Workspace(self.outDir, root=self.root, keep=['.tab'])
+        stats = space.start().finish()
+        self.assertEqual(stats['nCopy'], 0)
+        try:
+            with gWork.Workspace(self.outDir, root=self.root,
+                                 keep=['.tab']) as space:
+                writeFile(space.path('b.tab'), 'tab')
+                self.assertEqual(space.keep, ['.tab'])
+                raise ValueError('ELLIPSE failed')
+        except ValueError:
+            pass
+        self.assertFalse(os.path.isfile(os.path.join(self.outDir, 'b.tab')))
+        with gWork.Workspace(self.outDir, root=self.root,
+                             keep=['.tab']) as space:
+            writeFile(space.path('b.tab'), 'tab')
+            writeFile(space.path('b.pkl'), 'pkl')
+        self.assertTrue(os.path.isfile(os.path.join(self.outDir, 'b.tab')))
+        self.assertFalse(os.path.isfile(os.path.join(self.outDir, 'b.pkl')))
+
+
+if __name__ == '__main__':
+    unittest.main()